@@ -12,10 +12,14 @@ API:
             WHICH_SERVO - the servo to control (0 - 7)
             degrees - angle to go to (0 - 180)
             period - pulse length to output in uSec (500 - 2500)    
+        servos[WHICH_SERVO].setLimits(minPeriod, maxPeriod): Narrows the pulse range, 0 and 180 degrees
+            map to these periods.
         
     motors[] - array of 4 motors
         motors[WHICH_MOTOR].on(direction, speed): Turns the motor on at a speed in the direction.
         motors[WHICH_MOTOR].off(): Turns the motor off.
+        motors[WHICH_MOTOR].setTables(frequencies, duties): Replaces the built-in speed to PWM mapping
+            with lookup tables of 101 entries (speed 0 - 100): frequency in Hz and duty (0 - 65535).
             where:
             WHICH_MOTOR - the motor to control (0 - 3)
             direction - either forwards or reverse ("f" or "r")
@@ -30,12 +34,52 @@ API:
         
         Note: stepper 0 should be connected to motors 0 and 1,
               stepper 1 should be connected to motors 3 and 4
+
+    servos.release(WHICH_SERVO), motors.release(WHICH_MOTOR), steppers.release(WHICH_STEPPER):
+        Stops the channel and hands its PWM outputs back to the pool. Indexing it again rebuilds it.
+        Release a stepper before the motors it uses.
 '''
 
 from machine import Pin, PWM, ADC, time_pulse_us
 from rp2 import PIO, StateMachine, asm_pio
 from time import sleep, sleep_ms, sleep_us, ticks_us
 
+'''
+Pool of the RP2040 PWM slices.
+GPIO n is driven by slice (n >> 1) & 7, so several pins can share a slice (and its frequency).
+PWM.deinit() stops the whole slice, so an output is only deinitialised once nothing else is using its slice.
+
+pwmSliceFreq is the frequency each slice was last set to, so a slice is only reprogrammed when that changes.
+pwmSliceHolds counts the outputs that need their slice to keep its frequency: a registered servo, or a
+motor while it is running. A motor only retunes a slice that nothing else holds.
+'''
+pwmSliceUsers = [0, 0, 0, 0, 0, 0, 0, 0]
+pwmSliceFreq = [0, 0, 0, 0, 0, 0, 0, 0]
+pwmSliceHolds = [0, 0, 0, 0, 0, 0, 0, 0]
+
+def claimPWM(pin):
+    pwm = PWM(Pin(pin))
+    pwmSliceUsers[(pin >> 1) & 7] += 1
+    return pwm
+
+def releasePWM(pwm, pin):
+    pwm.duty_u16(0)
+    slice = (pin >> 1) & 7
+    pwmSliceUsers[slice] -= 1
+    if pwmSliceUsers[slice] == 0:
+        pwm.deinit()
+        pwmSliceFreq[slice] = 0
+
+def setSliceFreq(pwm, pin, freq):
+    slice = (pin >> 1) & 7
+    if pwmSliceFreq[slice] != freq:
+        pwm.freq(freq)
+        pwmSliceFreq[slice] = freq
+
+def holdSlices(slices, hold):
+    for slice in slices:
+        pwmSliceHolds[slice] += 1 if hold else -1
+
 '''
 a class which can encapsulate a stepper motor state machine
 It makes no assumptions about steps per rev - that is upto the higher level code to do
@@ -104,14 +148,53 @@ class StepperMotor:
         for i in range(2):
             self.coils[i].on(self.halfStepSequence[self.state][i], 100)
 
+    # The coils belong to the board's motors, so only de-energise them
+    def release(self):
+        for coil in self.coils:
+            coil.off()
+
 # This class provides a simple wrapper to the micropython PWM pins to hold them in a set for each motor
 class SimplePWMMotor:
     def __init__(self, forwardPin, reversePin, startfreq = 100):
-        self.forwardPin = PWM(Pin(forwardPin))
-        self.reversePin = PWM(Pin(reversePin))
-        self.forwardPin.freq(startfreq)
-        self.reversePin.freq(startfreq)
+        self.pins = (forwardPin, reversePin)
+        self.forwardPin = claimPWM(forwardPin)
+        self.reversePin = claimPWM(reversePin)
+        # The distinct slices behind the two pins (one if they share a slice), and an output on each
+        forwardSlice = (forwardPin >> 1) & 7
+        reverseSlice = (reversePin >> 1) & 7
+        if forwardSlice == reverseSlice:
+            self.slices = (forwardSlice,)
+            self.slicePins = (self.forwardPin,)
+        else:
+            self.slices = (forwardSlice, reverseSlice)
+            self.slicePins = (self.forwardPin, self.reversePin)
+        self.running = False
+        self.frequencies = None
+        self.duties = None
+        self.tune(startfreq)
         self.off()
+
+    # Lookup tables indexed by whole speed percentage, e.g. from a calibration profile
+    def setTables(self, frequencies, duties):
+        self.frequencies = frequencies
+        self.duties = duties
+
+    # Set the motor's slices to frequency, skipping any slice another running motor or a servo holds.
+    # The motor then runs at that slice's frequency until it is free again.
+    # Returns True if both pins now run at frequency
+    def tune(self, frequency):
+        tuned = True
+        # A running motor holds its own slices once
+        held = 1 if self.running else 0
+        for i in range(len(self.slices)):
+            slice = self.slices[i]
+            if pwmSliceFreq[slice] != frequency:
+                if pwmSliceHolds[slice] > held:
+                    tuned = False
+                else:
+                    self.slicePins[i].freq(frequency)
+                    pwmSliceFreq[slice] = frequency
+        return tuned
     
     # Directions are "f" - forwards, "r" - reverse and "-" - off. The inclusion of off makes stepper code simpler
     def on(self, direction, speed = 0):
@@ -122,20 +205,38 @@ class SimplePWMMotor:
         elif speed > 100:
             speed = 100
             
-        # Do something better here for adaptive frequency vs speed.
-        frequency = 100
-        
-        if speed < 15:
-            frequency = 20
-            
-        elif speed < 20:
-            frequency = 50
+        duties = self.duties
+        if duties is not None:
+            # No float maths: on MicroPython that allocates on every call
+            index = int(speed)
+            frequency = self.frequencies[index]
+            pwmVal = duties[index]
+
+        else:
+            # Without tables: the board's fixed bands and no deadband compensation
+            frequency = 100
             
-        self.forwardPin.freq(frequency)
-        self.reversePin.freq(frequency)
-  
-        # Convert 0-100 to 0-65535
-        pwmVal = int(speed * 655.35)
+            if speed < 15:
+                frequency = 20
+                
+            elif speed < 20:
+                frequency = 50
+
+            # Convert 0-100 to 0-65535
+            pwmVal = int(speed * 655.35)
+
+        # Slices are only reprogrammed when the band changes, and left alone while stopped
+        if pwmVal and direction != "-":
+            if not self.running:
+                self.running = True
+                holdSlices(self.slices, True)
+            slices = self.slices
+            if pwmSliceFreq[slices[0]] != frequency or pwmSliceFreq[slices[-1]] != frequency:
+                self.tune(frequency)
+
+        elif self.running:
+            self.running = False
+            holdSlices(self.slices, False)
         
         if direction == "f":
             self.forwardPin.duty_u16(pwmVal)
@@ -152,10 +253,19 @@ class SimplePWMMotor:
         else:
             # Harsh, but at least you'll know
             raise Exception("INVALID DIRECTION")
+
+        # Remember the last command so it can be read back (telemetry, odometry)
+        self.direction = direction
+        self.speed = speed
        
     def off(self):
         self.on("-", 0)
 
+    def release(self):
+        self.off()
+        releasePWM(self.forwardPin, self.pins[0])
+        releasePWM(self.reversePin, self.pins[1])
+
 '''
 Class that controls Serovs using the RP2040 PIO to generate the pulses.
 
@@ -169,12 +279,21 @@ class PWMServo:
     # Doesnt actually register/unregister, just stops and starts the servo PIO
     # A side effect of this is that the PIO is not available to anyone else when running this code as written.
     def registerServo(self):
-        self.servo = PWM(Pin(self.servoPin))
-        self.servo.freq(50)
+        if self.servo is None:
+            self.servo = claimPWM(self.servoPin)
+            # A servo needs 50Hz, so it wins its slice from any motor sharing it and holds it
+            setSliceFreq(self.servo, self.servoPin, 50)
+            holdSlices(((self.servoPin >> 1) & 7,), True)
         self.goToPosition(90)
             
     def deregisterServo(self):
-        self.servo.deinit()
+        if self.servo is not None:
+            holdSlices(((self.servoPin >> 1) & 7,), False)
+            releasePWM(self.servo, self.servoPin)
+            self.servo = None
+
+    def release(self):
+        self.deregisterServo()
 
     def scale(self, value, fromMin, fromMax, toMin, toMax):
         return toMin + ((value - fromMin) * ((toMax - toMin) / (fromMax - fromMin)))
@@ -188,23 +307,72 @@ class PWMServo:
             degrees = 0
         if degrees > 180:
             degrees = 180
-        scaledValue = self.scale(degrees, 0, 180, 1638, 8192)
+        scaledValue = self.scale(degrees, 0, 180, self.minDuty, self.maxDuty)
         self.servo.duty_u16(int(scaledValue))
     
     # goToPeriod takes a uS period to send to the servo.
     # It expects a range of 500 - 2500 uS
     def goToPeriod(self, period):
-        if period < 500:
-            period = 500
-        if period > 2500:
-            period = 2500
+        if period < self.minPeriod:
+            period = self.minPeriod
+        if period > self.maxPeriod:
+            period = self.maxPeriod
         scaledValue = self.scale(period, 500, 2500, 1638, 8192)
         self.servo.duty_u16(int(scaledValue))
         
+    # setLimits narrows the pulse range for servos that bind before 500 or 2500 uS.
+    # goToPosition then spreads 0-180 degrees over the narrower range.
+    def setLimits(self, minPeriod, maxPeriod):
+        self.minPeriod = minPeriod
+        self.maxPeriod = maxPeriod
+        self.minDuty = int(self.scale(minPeriod, 500, 2500, 1638, 8192))
+        self.maxDuty = int(self.scale(maxPeriod, 500, 2500, 1638, 8192))
+
     def __init__(self, servoPin):
         self.servoPin = servoPin
+        self.servo = None
+        self.minPeriod = 500
+        self.maxPeriod = 2500
+        self.minDuty = 1638
+        self.maxDuty = 8192
         self.registerServo()
 
+'''
+A list-like holder that only builds each channel the first time it is indexed.
+Channels the program never touches never claim their pins.
+The factory is called with the channel index and must return the constructed channel.
+Channels must provide release(), which stops them and gives back their hardware.
+'''
+class LazyChannels:
+    def __init__(self, factory, count):
+        self.factory = factory
+        self.channels = [None] * count
+
+    def __getitem__(self, index):
+        channel = self.channels[index]
+        if channel is None:
+            channel = self.factory(index)
+            self.channels[index] = channel
+        return channel
+
+    def __len__(self):
+        return len(self.channels)
+
+    # Iterating builds every channel, same as the eager lists
+    def __iter__(self):
+        for i in range(len(self.channels)):
+            yield self[i]
+
+    # Has this channel been built yet?
+    def isBuilt(self, index):
+        return self.channels[index] is not None
+
+    def release(self, index):
+        channel = self.channels[index]
+        if channel is not None:
+            channel.release()
+            self.channels[index] = None
+
 '''
 A class to provide the functionality of the Kitronik 5348 Simply Robotics board.
 www.kitronik.co.uk/5348
@@ -216,12 +384,41 @@ The motors are connected as
     Motor 4 GP8 + GP7 -
 The servo pins are 15,14,13,12,19,18,17,16 for servo 0 -> servo 7
 The numbers look strange but it makes the tracking on the PCB simpler and is hidden inside this lib
+
+The motors, steppers and servos are LazyChannels. Normally every channel is built in the constructor.
+Passing lazy = True leaves each one unbuilt until it is first indexed, so a program that only
+uses two motors never claims the other outputs. Note that servos 4-7 (GP19-GP16) share PWM
+slices with motors 1 and 2, so the board cannot use all of them at once anyway.
+
+Motors 1 and 2 share slices 1 and 2, and motors 3 and 4 share slices 3 and 4, so each pair runs at
+one PWM frequency. The first of a pair to start picks it; the other runs at that frequency (with its
+own duty) until the slice is free again. A registered servo keeps its slice at 50Hz.
 '''
 class KitronikSimplyRobotics:  
-    def __init__ (self, centreServos = True):
-        self.motors = [SimplePWMMotor(2, 5, 100), SimplePWMMotor(4, 3, 100), SimplePWMMotor(6, 9, 100), SimplePWMMotor(8, 7, 100)]
-        self.steppers = [StepperMotor(self.motors[0], self.motors[1]), StepperMotor(self.motors[2], self.motors[3])]
-        self.servos = [PWMServo(15), PWMServo(14), PWMServo(13), PWMServo(12), PWMServo(19), PWMServo(18), PWMServo(17), PWMServo(16)]
+    motorPins = [(2, 5), (4, 3), (6, 9), (8, 7)]
+    servoPins = [15, 14, 13, 12, 19, 18, 17, 16]
+
+    # motorPins, servoPins, motorTables ((frequencies, duties) per motor, see setTables) and
+    # servoLimits ((minPeriod, maxPeriod) per servo) override the board defaults, e.g. from a profile
+    def __init__ (self, centreServos = True, lazy = False, motorPins = None, servoPins = None,
+                  motorTables = None, servoLimits = None):
+        if motorPins is not None:
+            self.motorPins = motorPins
+        if servoPins is not None:
+            self.servoPins = servoPins
+        self.motorTables = motorTables
+        self.servoLimits = servoLimits
+        self.motors = LazyChannels(self._buildMotor, 4)
+        self.steppers = LazyChannels(self._buildStepper, 2)
+        # PWMServo centres itself when it registers
+        self.servos = LazyChannels(self._buildServo, 8)
+        if lazy:
+            return
+
+        for i in range(4):
+            self.motors[i]
+        for i in range(2):
+            self.steppers[i]
         
         # Connect the servos by default on construction - advanced uses can disconnect them if required.
         for i in range(8):
@@ -229,3 +426,21 @@ class KitronikSimplyRobotics:
             if centreServos:
                 # Set the servo outputs to middle of the range.
                 self.servos[i].goToPosition(90)
+
+    def _buildMotor(self, index):
+        forwardPin, reversePin = self.motorPins[index]
+        motor = SimplePWMMotor(forwardPin, reversePin, 100)
+        if self.motorTables is not None:
+            motor.setTables(*self.motorTables[index])
+        return motor
+
+    # Stepper 0 uses motors 0 and 1, stepper 1 uses motors 2 and 3
+    def _buildStepper(self, index):
+        return StepperMotor(self.motors[index * 2], self.motors[index * 2 + 1])
+
+    def _buildServo(self, index):
+        servo = PWMServo(self.servoPins[index])
+        if self.servoLimits is not None:
+            servo.setLimits(*self.servoLimits[index])
+            servo.goToPosition(90)
+        return servo
@@ -0,0 +1,8 @@
+# Draait voor main.py: een onderbroken update afmaken, een nieuwe versie op proef
+# starten of een mislukte terugdraaien (zie ota.py)
+import ota
+
+try:
+    ota.startup()
+except Exception as e:
+    print("OTA:", e)
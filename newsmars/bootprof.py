@@ -0,0 +1,51 @@
+import time
+
+class BootProfiler:
+    """
+    Timestamps the startup phases of the robot firmware.
+    Construct it as early as possible; on the Pico ticks_ms() counts from
+    reset, so the first phase covers firmware boot and module imports.
+    """
+    def __init__(self, name="boot"):
+        """
+        Initialize the profiler.
+
+        Args:
+            name (str): Name of the phase that ends at construction
+        """
+        self.phases = []
+        self.last = 0
+        self.mark(name)
+
+    def mark(self, phase):
+        """
+        Close the current phase.
+
+        Args:
+            phase (str): Name of the phase that just finished
+        """
+        now = time.ticks_ms()
+        self.phases.append((phase, time.ticks_diff(now, self.last)))
+        self.last = now
+
+    def total_ms(self):
+        """
+        Time from reset to the most recent mark.
+
+        Returns:
+            int: Milliseconds since reset
+        """
+        return self.last
+
+    def report(self):
+        """
+        Format the recorded phases as a small table.
+
+        Returns:
+            str: One line per phase plus the total
+        """
+        lines = ["Startup phases:"]
+        for phase, duration in self.phases:
+            lines.append("  {:<16}{:>7} ms".format(phase, duration))
+        lines.append("  {:<16}{:>7} ms".format("total", self.total_ms()))
+        return "\n".join(lines)
@@ -0,0 +1,136 @@
+import errno
+
+# Server-sent events: status frames pushed to browsers that keep a GET /events
+# connection open (EventSource in JavaScript).
+
+HEADERS = b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\nConnection: keep-alive\r\n\r\nretry: 2000\n\n"
+
+MAX_SUBSCRIBERS = 4
+# Frames a subscriber may miss in a row because it is still busy with an older one
+MAX_SKIPPED = 10
+
+_WOULD_BLOCK = (errno.EAGAIN, getattr(errno, "EWOULDBLOCK", errno.EAGAIN))
+
+def _send(sock, data):
+    """Bytes of data a non-blocking socket took, 0 if its buffer is full."""
+    try:
+        try:
+            sent = sock.write(data)
+        except AttributeError:
+            sent = sock.send(data)
+    except OSError as e:
+        if e.args[0] in _WOULD_BLOCK:
+            return 0
+        raise
+    # MicroPython returns None when nothing could be written
+    return sent or 0
+
+class EventStream:
+    """
+    Fans one status frame out to every subscriber. publish() takes the frame
+    as bytes, formatted once per tick, and every subscriber keeps a reference
+    to the frame it is sending plus how far it got, so nothing is formatted
+    or copied per client. Sockets are non-blocking: a client that can't take
+    the whole frame gets the rest on the next pump(). A subscriber still
+    busy when a new frame is published skips it and gets the newest one
+    when it is done; one that skips more than max_skipped frames in a row,
+    or whose socket fails, is closed.
+    """
+    def __init__(self, max_subscribers=MAX_SUBSCRIBERS, max_skipped=MAX_SKIPPED):
+        self.socks = [None] * max_subscribers
+        self.frames = [None] * max_subscribers
+        self.offsets = [0] * max_subscribers
+        self.skipped = [0] * max_subscribers
+        self.max_skipped = max_skipped
+        self.frame = None
+        self.count = 0
+        self.published = 0
+        self.sent = 0
+        self.dropped = 0
+        self.closed_slow = 0
+
+    def add(self, sock):
+        """
+        Take over a client that asked for /events and send it the stream headers.
+
+        Returns:
+            bool: False if all slots are taken; the caller answers and closes it
+        """
+        for i in range(len(self.socks)):
+            if self.socks[i] is None:
+                try:
+                    sock.write(HEADERS)
+                except AttributeError:
+                    sock.sendall(HEADERS)
+                sock.setblocking(False)
+                self.socks[i] = sock
+                self.frames[i] = None
+                self.skipped[i] = 0
+                self.count += 1
+                if self.frame is not None:
+                    self._start(i)
+                return True
+        return False
+
+    def publish(self, frame):
+        """
+        Send frame (bytes, "data: ...\\n\\n") to every subscriber.
+
+        Args:
+            frame (bytes): The complete event, shared by all subscribers
+        """
+        self.frame = frame
+        self.published += 1
+        for i in range(len(self.socks)):
+            if self.socks[i] is None:
+                continue
+            if self.frames[i] is None:
+                self._start(i)
+            else:
+                self.dropped += 1
+                self.skipped[i] += 1
+                if self.skipped[i] > self.max_skipped:
+                    self.closed_slow += 1
+                    self.remove(i)
+        self.pump()
+
+    def pump(self):
+        """Write what the sockets take of every unfinished frame; never blocks."""
+        for i in range(len(self.socks)):
+            frame = self.frames[i]
+            if frame is None:
+                continue
+            offset = self.offsets[i]
+            try:
+                sent = _send(self.socks[i], memoryview(frame)[offset:] if offset else frame)
+            except OSError:
+                self.remove(i)
+                continue
+            offset += sent
+            if offset < len(frame):
+                self.offsets[i] = offset
+                continue
+            self.sent += 1
+            self.frames[i] = None
+            # Frames published meanwhile were skipped; go straight to the newest
+            if self.skipped[i]:
+                self._start(i)
+
+    def _start(self, i):
+        self.frames[i] = self.frame
+        self.offsets[i] = 0
+        self.skipped[i] = 0
+
+    def remove(self, i):
+        try:
+            self.socks[i].close()
+        except OSError:
+            pass
+        self.socks[i] = None
+        self.frames[i] = None
+        self.count -= 1
+
+    def close(self):
+        for i in range(len(self.socks)):
+            if self.socks[i] is not None:
+                self.remove(i)
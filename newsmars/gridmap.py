@@ -0,0 +1,241 @@
+import math
+import struct
+from array import array
+
+# Saved map: a header followed by width * height cell bytes, row by row
+# starting at the cell with the lowest x and y
+#   magic      2s   MAGIC
+#   version    uint8
+#   reserved   uint8
+#   width      uint16  cells
+#   height     uint16  cells
+#   cell_mm    uint16
+#   origin_x   int32   mm, world position of the lower-left corner
+#   origin_y   int32   mm
+MAGIC = b"OG"
+VERSION = 1
+HEADER_FORMAT = "<2sBBHHHii"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+# Cells hold log-odds as a byte: UNKNOWN is p = 0.5, LOGODDS_SCALE steps
+# are one unit of log-odds. HIT and MISS are the updates for the end point
+# and the free cells along a reading; the clamps keep cells able to change
+# their mind when something moves.
+UNKNOWN = 128
+LOGODDS_SCALE = 32
+HIT = 28
+MISS = 6
+CLAMP_LOW = 16
+CLAMP_HIGH = 240
+# Cells at or above this value block the planner cell over them. A cell
+# that crosses it is recorded in dirty, so planner.sync() only looks at
+# those; after more than DIRTY_SIZE crossings, or when every cell was
+# replaced, dirty_all asks for a full rescan instead
+BLOCKED = 160
+DIRTY_SIZE = 64
+
+# sin/cos per whole degree in 1/TRIG_ONE units, so rays need no floats
+TRIG_SHIFT = 12
+TRIG_ONE = 1 << TRIG_SHIFT
+SIN = array("h", [int(round(math.sin(math.radians(d)) * TRIG_ONE)) for d in range(360)])
+COS = array("h", [int(round(math.cos(math.radians(d)) * TRIG_ONE)) for d in range(360)])
+
+class OccupancyGrid:
+    """
+    Log-odds occupancy grid built from HC-SR04 readings.
+    One byte per cell in a single bytearray; a reading updates the cells
+    along the sensor beam with an integer Bresenham walk.
+    World coordinates are in mm with heading in degrees, 0 along +x and
+    counter-clockwise positive, like the odometry.
+    """
+    def __init__(self, width=100, height=100, cell_mm=50, max_range_cm=200):
+        """
+        Create an empty map centred on the world origin.
+
+        Args:
+            width (int): Cells along x (default: 100, 5 m at 50 mm)
+            height (int): Cells along y (default: 100)
+            cell_mm (int): Cell size in mm (default: 50)
+            max_range_cm (int): Readings beyond this only clear cells (default: 200)
+        """
+        self.width = width
+        self.height = height
+        self.cell_mm = cell_mm
+        self.max_range_mm = max_range_cm * 10
+        self.origin_x = -(width * cell_mm) // 2
+        self.origin_y = -(height * cell_mm) // 2
+        self.cells = bytearray(width * height)
+        self.dirty = array("I", [0] * DIRTY_SIZE)
+        self.dirty_count = 0
+        self.dirty_all = True
+        self.clear()
+
+    def clear(self):
+        cells = self.cells
+        for i in range(len(cells)):
+            cells[i] = UNKNOWN
+        self.dirty_all = True
+
+    def mark(self, i):
+        """Record that cell i crossed BLOCKED."""
+        n = self.dirty_count
+        if n < DIRTY_SIZE:
+            self.dirty[n] = i
+            self.dirty_count = n + 1
+        else:
+            self.dirty_all = True
+
+    def take_dirty(self):
+        """
+        Forget the recorded crossings, after the caller read dirty[:dirty_count].
+
+        Returns:
+            bool: True if every cell has to be looked at instead
+        """
+        everything = self.dirty_all
+        self.dirty_count = 0
+        self.dirty_all = False
+        return everything
+
+    def bytes_per_m2(self):
+        return 1000000 // (self.cell_mm * self.cell_mm)
+
+    def cell_of(self, x_mm, y_mm):
+        """
+        Cell coordinates containing a world position.
+
+        Returns:
+            tuple: (cx, cy), which may lie outside the grid
+        """
+        return (x_mm - self.origin_x) // self.cell_mm, (y_mm - self.origin_y) // self.cell_mm
+
+    def update_cell(self, cx, cy, delta):
+        """Add delta to one cell's log-odds; cells outside the grid are ignored."""
+        if 0 <= cx < self.width and 0 <= cy < self.height:
+            i = cy * self.width + cx
+            old = self.cells[i]
+            v = old + delta
+            if v < CLAMP_LOW:
+                v = CLAMP_LOW
+            elif v > CLAMP_HIGH:
+                v = CLAMP_HIGH
+            self.cells[i] = v
+            if (old >= BLOCKED) != (v >= BLOCKED):
+                self.mark(i)
+
+    def value(self, cx, cy):
+        """Raw cell byte, UNKNOWN outside the grid."""
+        if 0 <= cx < self.width and 0 <= cy < self.height:
+            return self.cells[cy * self.width + cx]
+        return UNKNOWN
+
+    def probability(self, cx, cy):
+        """Occupancy probability of a cell (0.0 - 1.0)."""
+        return 1 - 1 / (1 + math.exp((self.value(cx, cy) - UNKNOWN) / LOGODDS_SCALE))
+
+    def ray(self, x0, y0, x1, y1, hit):
+        """
+        Mark the cells from (x0, y0) up to (x1, y1) free and, if hit, the
+        end cell occupied. Stops where the ray leaves the grid.
+
+        Returns:
+            int: Number of cells updated
+        """
+        cells = self.cells
+        width = self.width
+        height = self.height
+        dx = x1 - x0 if x1 > x0 else x0 - x1
+        dy = y0 - y1 if y1 > y0 else y1 - y0
+        sx = 1 if x0 < x1 else -1
+        sy = 1 if y0 < y1 else -1
+        err = dx + dy
+        count = 0
+        while x0 != x1 or y0 != y1:
+            if x0 < 0 or x0 >= width or y0 < 0 or y0 >= height:
+                return count
+            i = y0 * width + x0
+            old = cells[i]
+            v = old - MISS
+            cells[i] = v if v > CLAMP_LOW else CLAMP_LOW
+            if old >= BLOCKED > v:
+                self.mark(i)
+            count += 1
+            e2 = err + err
+            if e2 >= dy:
+                err += dy
+                x0 += sx
+            if e2 <= dx:
+                err += dx
+                y0 += sy
+        if 0 <= x0 < width and 0 <= y0 < height:
+            i = y0 * width + x0
+            old = cells[i]
+            if hit:
+                v = old + HIT
+                cells[i] = v if v < CLAMP_HIGH else CLAMP_HIGH
+                if old < BLOCKED <= v:
+                    self.mark(i)
+            else:
+                v = old - MISS
+                cells[i] = v if v > CLAMP_LOW else CLAMP_LOW
+                if old >= BLOCKED > v:
+                    self.mark(i)
+            count += 1
+        return count
+
+    def add_reading(self, x_mm, y_mm, heading, distance_cm):
+        """
+        Fuse one range reading taken from a known sensor pose.
+
+        Args:
+            x_mm (int): Sensor position
+            y_mm (int): Sensor position
+            heading (int): Beam direction in degrees
+            distance_cm (float): Measured distance, None if there was no echo
+
+        Returns:
+            int: Number of cells updated
+        """
+        if distance_cm is None:
+            reach = self.max_range_mm
+            hit = False
+        else:
+            reach = int(distance_cm * 10)
+            hit = reach <= self.max_range_mm
+            if not hit:
+                reach = self.max_range_mm
+        heading = int(heading) % 360
+        x1 = x_mm + ((reach * COS[heading]) >> TRIG_SHIFT)
+        y1 = y_mm + ((reach * SIN[heading]) >> TRIG_SHIFT)
+        cell = self.cell_mm
+        return self.ray((x_mm - self.origin_x) // cell, (y_mm - self.origin_y) // cell,
+                        (x1 - self.origin_x) // cell, (y1 - self.origin_y) // cell, hit)
+
+    def header(self):
+        return struct.pack(HEADER_FORMAT, MAGIC, VERSION, 0, self.width, self.height,
+                           self.cell_mm, self.origin_x, self.origin_y)
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            f.write(self.header())
+            f.write(self.cells)
+
+def load(data):
+    """
+    Parse a saved map (from save() or /map).
+
+    Args:
+        data (bytes): Header and cells
+
+    Returns:
+        OccupancyGrid: Map with the saved cells
+    """
+    magic, version, _, width, height, cell_mm, origin_x, origin_y = struct.unpack_from(HEADER_FORMAT, data, 0)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("Not an occupancy grid")
+    grid = OccupancyGrid(width, height, cell_mm)
+    grid.origin_x = origin_x
+    grid.origin_y = origin_y
+    grid.cells[:] = data[HEADER_SIZE:HEADER_SIZE + width * height]
+    grid.dirty_all = True
+    return grid
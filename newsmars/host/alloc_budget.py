@@ -0,0 +1,101 @@
+"""
+Per-request heap allocation check for the main.py request path.
+
+Drives main.serve_client() with in-memory sockets under tracemalloc and
+fails (exit status 1) when a request allocates more than the budget. The
+first pass over every request is a warm-up that fills the one-off caches
+(number strings, lazily built motors, the rendered page).
+
+    python3 host/alloc_budget.py [--budget BYTES] [--requests N]
+"""
+import argparse
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import standins
+
+REQUESTS = [
+    b"GET / HTTP/1.1\r\nHost: robot\r\n\r\n",
+    b"GET /?action=forward HTTP/1.1\r\nHost: robot\r\n\r\n",
+    b"GET /?action=left HTTP/1.1\r\nHost: robot\r\n\r\n",
+    b"GET /?action=right HTTP/1.1\r\nHost: robot\r\n\r\n",
+    b"GET /?action=reverse HTTP/1.1\r\nHost: robot\r\n\r\n",
+    b"GET /?action=stop HTTP/1.1\r\nHost: robot\r\n\r\n",
+    b"GET /?action=speed_up HTTP/1.1\r\nHost: robot\r\n\r\n",
+    b"GET /?action=speed_down HTTP/1.1\r\nHost: robot\r\n\r\n",
+    b"GET /?action=toggle_safety HTTP/1.1\r\nHost: robot\r\n\r\n",
+    b"GET /joy?t=80&s=-35 HTTP/1.1\r\nHost: robot\r\n\r\n",
+    b"GET /joy?t=-100&s=100 HTTP/1.1\r\nHost: robot\r\n\r\n",
+    b"GET /joy?t=0&s=0 HTTP/1.1\r\nHost: robot\r\n\r\n",
+]
+
+
+class NullWriter:
+    def write(self, text):
+        return len(text)
+
+    def flush(self):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--budget", type=int, default=512, help="allowed bytes per request")
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+
+    standins.install()
+    import main as firmware
+    from SimplyRobotics import KitronikSimplyRobotics
+    from joystick import Joystick
+
+    firmware.robot = KitronikSimplyRobotics(lazy=True)
+    firmware.joystick = Joystick()
+    firmware.safety_enabled = False
+    firmware.GC_STATS = True
+    server = standins.FakeServer()
+
+    real_stdout = sys.stdout
+    sys.stdout = NullWriter()
+    try:
+        # Warm-up: every speed and safety state once
+        for _ in range(12):
+            for request in REQUESTS:
+                server.queue(request)
+                firmware.serve_client(server)
+
+        tracemalloc.start()
+        worst = {}
+        total = 0
+        start_current = tracemalloc.get_traced_memory()[0]
+        for i in range(args.requests):
+            request = REQUESTS[i % len(REQUESTS)]
+            server.queue(request)
+            before = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            firmware.serve_client(server)
+            allocated = tracemalloc.get_traced_memory()[1] - before
+            total += allocated
+            worst[request] = max(worst.get(request, 0), allocated)
+        retained = tracemalloc.get_traced_memory()[0] - start_current
+        tracemalloc.stop()
+    finally:
+        sys.stdout = real_stdout
+
+    print("%-34s %10s" % ("request", "max B"))
+    for request in REQUESTS:
+        print("%-34s %10d" % (request.split(b" ")[1].decode(), worst[request]))
+    print("mean %.1f B/request, %d B retained after %d requests" % (total / args.requests, retained, args.requests))
+    print(firmware.gc_report())
+
+    over = [r for r in REQUESTS if worst[r] > args.budget]
+    if over:
+        print("FAIL: %d request types over the %d B budget" % (len(over), args.budget))
+        sys.exit(1)
+    print("OK: every request within the %d B budget" % args.budget)
+
+
+if __name__ == "__main__":
+    main()
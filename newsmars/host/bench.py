@@ -0,0 +1,612 @@
+"""
+Benchmark suite for the newsmars firmware on host stand-ins.
+
+Imports the real firmware modules against host/standins.py, runs every
+registered benchmark and writes the results to bench_results/<commit>.json.
+With --compare (or --compare-latest) the results are checked against an
+earlier run and every benchmark that got worse by more than --threshold is
+flagged; the exit status is 1 if there is any regression.
+
+    python3 host/bench.py [--only NAME ...] [--compare FILE | --compare-latest] [--threshold 0.10]
+"""
+import argparse
+import atexit
+import glob
+import io
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import time
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+NEWSMARS_DIR = os.path.dirname(HERE)
+RESULTS_DIR = os.path.join(NEWSMARS_DIR, "bench_results")
+
+sys.path.insert(0, HERE)
+import standins
+
+BENCHMARKS = []
+
+
+def benchmark(name, unit, better):
+    """Register a benchmark. The function returns a single number in `unit`."""
+    def decorator(fn):
+        BENCHMARKS.append((name, unit, better, fn))
+        return fn
+    return decorator
+
+
+def rate(fn, min_time=0.1, repeats=5):
+    """Best calls per second of fn over several timed batches."""
+    n = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(n):
+            fn()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time / 10:
+            break
+        n *= 2
+    per_batch = max(1, int(n * min_time / max(elapsed, 1e-9)))
+    best = 0.0
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for _ in range(per_batch):
+            fn()
+        best = max(best, per_batch / (time.perf_counter() - start))
+    return best
+
+
+def allocated_per_call(fn, calls=500):
+    """Mean bytes allocated per call (tracemalloc peak above the starting point)."""
+    fn()
+    tracemalloc.start()
+    total = 0
+    for _ in range(calls):
+        before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        fn()
+        total += tracemalloc.get_traced_memory()[1] - before
+    tracemalloc.stop()
+    return total / calls
+
+
+class Quiet:
+    """Swallows console output from the firmware."""
+
+    def write(self, text):
+        return len(text)
+
+    def flush(self):
+        pass
+
+
+def firmware():
+    import main
+    return main
+
+
+def board():
+    from SimplyRobotics import KitronikSimplyRobotics
+    return KitronikSimplyRobotics(lazy=True)
+
+
+_http = {}
+_SERVER_CODE = """
+import io, sys
+sys.path.insert(0, %r)
+import standins
+standins.install()
+import main
+main.HTTP_PORT = %d
+main.STORE_FILE = None
+sys.stdout = io.StringIO()
+main.main()
+"""
+
+
+def http_server():
+    """Start main.main() once in a separate process and return its port."""
+    if "port" not in _http:
+        s = socket.socket()
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+        s.close()
+        proc = subprocess.Popen([sys.executable, "-c", _SERVER_CODE % (HERE, port)])
+        atexit.register(proc.kill)
+        deadline = time.time() + 10
+        while True:
+            try:
+                socket.create_connection(("127.0.0.1", port)).close()
+                break
+            except OSError:
+                if time.time() > deadline:
+                    raise
+                time.sleep(0.01)
+        _http["port"] = port
+    return _http["port"]
+
+
+def http_get(port, path):
+    conn = socket.create_connection(("127.0.0.1", port))
+    conn.sendall(b"GET " + path + b" HTTP/1.1\r\nHost: robot\r\n\r\n")
+    size = 0
+    while True:
+        data = conn.recv(8192)
+        if not data:
+            break
+        size += len(data)
+    conn.close()
+    return size
+
+
+def http_latencies(requests=300):
+    port = http_server()
+    paths = [b"/?action=stop", b"/", b"/?action=speed_up", b"/?action=speed_down"]
+    samples = []
+    for i in range(requests):
+        start = time.perf_counter()
+        http_get(port, paths[i % len(paths)])
+        samples.append(time.perf_counter() - start)
+    samples.sort()
+    return samples
+
+
+@benchmark("http_requests_per_s", "req/s", "higher")
+def bench_http_rate():
+    return max(len(samples) / sum(samples) for samples in (http_latencies() for _ in range(3)))
+
+
+@benchmark("http_latency_p99", "us", "lower")
+def bench_http_p99():
+    return min(samples[int(len(samples) * 0.99)] * 1e6 for samples in (http_latencies() for _ in range(3)))
+
+
+@benchmark("create_html", "calls/s", "higher")
+def bench_create_html():
+    main = firmware()
+    return rate(lambda: main.create_html(50, True))
+
+
+@benchmark("render_page_changed", "calls/s", "higher")
+def bench_render_page():
+    main = firmware()
+    state = [False]
+
+    def render():
+        state[0] = not state[0]
+        main.render_page(50, state[0])
+    return rate(render)
+
+
+@benchmark("request_alloc", "B/request", "lower")
+def bench_request_alloc():
+    main = firmware()
+    main.robot = board()
+    main.safety_enabled = False
+    server = standins.FakeServer()
+    requests = [b"GET /?action=forward HTTP/1.1\r\n\r\n", b"GET /?action=stop HTTP/1.1\r\n\r\n"]
+    state = [0]
+
+    def serve():
+        state[0] += 1
+        server.queue(requests[state[0] % 2])
+        main.serve_client(server)
+    for _ in range(4):
+        serve()
+    return allocated_per_call(serve)
+
+
+def _udp_command():
+    """One UDP drive command sent on loopback and handled by main.serve_drive()."""
+    import udpdrive
+    main = firmware()
+    main.robot = board()
+    main.safety_enabled = False
+    # What main() does with DRIVE_UDP_PORT set
+    main.udpdrive = udpdrive
+    main.drive_server = udpdrive.DriveServer(0)
+    main.drive_server.start("127.0.0.1")
+    addr = main.drive_server.sock.getsockname()
+    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    buf = bytearray(udpdrive.COMMAND_SIZE)
+    state = [0]
+
+    def command():
+        state[0] += 1
+        udpdrive.pack_command(buf, state[0], state[0] % 100, -(state[0] % 100), 300)
+        client.sendto(buf, addr)
+        main.serve_drive()
+    return command
+
+
+@benchmark("udp_commands", "cmd/s", "higher")
+def bench_udp_commands():
+    return rate(_udp_command())
+
+
+@benchmark("udp_command_alloc", "B/cmd", "lower")
+def bench_udp_command_alloc():
+    return allocated_per_call(_udp_command())
+
+
+def _joystick_command():
+    """One /joy request through main.serve_client(), then the control tick that applies it."""
+    from joystick import Joystick
+    main = firmware()
+    main.robot = board()
+    main.safety_enabled = False
+    main.joystick = Joystick()
+    server = standins.FakeServer()
+    requests = [b"GET /joy?t=%d&s=%d HTTP/1.1\r\nHost: robot\r\n\r\n" % (t, -t) for t in range(-100, 101, 10)]
+    state = [0]
+
+    def command():
+        state[0] += 1
+        server.queue(requests[state[0] % len(requests)])
+        main.serve_client(server)
+        main.next_joystick_ms = 0
+        main.control_tick(0)
+    return command
+
+
+@benchmark("joystick_commands", "cmd/s", "higher")
+def bench_joystick_commands():
+    return rate(_joystick_command())
+
+
+@benchmark("joystick_command_alloc", "B/cmd", "lower")
+def bench_joystick_command_alloc():
+    return allocated_per_call(_joystick_command())
+
+
+def _api_request(method, path, body=b""):
+    """One JSON API request through main.serve_client()."""
+    import scheduler
+    main = firmware()
+    main.robot = board()
+    main.safety_enabled = False
+    main.batch = scheduler.Batch()
+    server = standins.FakeServer()
+    request = b"%s %s HTTP/1.1\r\nHost: robot\r\nContent-Length: %d\r\n\r\n%s" % (method, path, len(body), body)
+
+    def call():
+        server.queue(request)
+        main.serve_client(server)
+    return call
+
+
+@benchmark("api_drive_requests", "req/s", "higher")
+def bench_api_drive():
+    return rate(_api_request(b"POST", b"/api/drive", b'{"left":60,"right":-60}'))
+
+
+@benchmark("api_batch_loads", "req/s", "higher")
+def bench_api_batch():
+    steps = ",".join('[%d,"drive",%d,%d]' % (i * 100, i * 5, -i * 5) for i in range(20))
+    return rate(_api_request(b"POST", b"/api/batch", b'{"steps":[' + steps.encode() + b']}'))
+
+
+@benchmark("events_publish", "frames/s", "higher")
+def bench_events_publish():
+    from events import EventStream
+    main = firmware()
+    main.robot = board()
+    main.events = EventStream(4)
+    for _ in range(4):
+        main.events.add(standins.FakeClient())
+
+    def publish():
+        main.events.publish(main.event_frame())
+    return rate(publish)
+
+
+class _BrokerSocket:
+    """Connected MQTT socket that takes every write and never has anything to read."""
+
+    def readinto(self, buf):
+        return None
+
+    def write(self, data):
+        return len(data)
+
+    def close(self):
+        pass
+
+
+@benchmark("mqtt_publish", "msgs/s", "higher")
+def bench_mqtt_publish():
+    """One telemetry batch (520 B) through publish() and poll() onto a connected socket."""
+    firmware()
+    import mqtt
+    client = mqtt.MQTTClient("bench", "127.0.0.1", keepalive_s=3600)
+    client.sock = _BrokerSocket()
+    client.state = mqtt.CONNECTED
+    client.last_in = time.ticks_ms()
+    payload = bytes(520)
+
+    def publish():
+        client.publish("smars/bench/telemetry", payload)
+        client.poll(time.ticks_ms())
+    return rate(publish)
+
+
+@benchmark("motor_commands", "cmd/s", "higher")
+def bench_motor_commands():
+    main = firmware()
+    main.robot = board()
+    main.safety_enabled = False
+    actions = ["forward", "left", "right", "reverse", "stop"]
+    state = [0]
+
+    def command():
+        state[0] += 1
+        main.control_motors(actions[state[0] % 5])
+    return rate(command)
+
+
+@benchmark("motor_commands_profiled", "cmd/s", "higher")
+def bench_motor_commands_profiled():
+    """control_motors() the way the firmware boots: with the profile lookup tables."""
+    import profiles
+    from SimplyRobotics import KitronikSimplyRobotics
+    main = firmware()
+    profile = profiles.Profile(profiles.DEFAULT)
+    main.apply_profile(profile)
+    main.robot = KitronikSimplyRobotics(lazy=True, motorTables=profile.motor_tables(),
+                                        servoLimits=profile.servo_limits)
+    main.safety_enabled = False
+    actions = ["forward", "left", "right", "reverse", "stop"]
+    state = [0]
+
+    def command():
+        state[0] += 1
+        main.control_motors(actions[state[0] % 5])
+    return rate(command)
+
+
+@benchmark("pwm_reprograms", "writes/cmd", "lower")
+def bench_pwm_reprograms():
+    """Slice frequency writes per motor command while driving at changing speeds."""
+    import profiles
+    import SimplyRobotics
+    PWM = sys.modules["machine"].PWM
+    # Boards from earlier benchmarks are never released: start from a fresh slice pool as at boot
+    for pool in (SimplyRobotics.pwmSliceUsers, SimplyRobotics.pwmSliceFreq, SimplyRobotics.pwmSliceHolds):
+        pool[:] = [0] * 8
+    main = firmware()
+    profile = profiles.Profile(profiles.DEFAULT)
+    main.apply_profile(profile)
+    main.robot = SimplyRobotics.KitronikSimplyRobotics(lazy=True, motorTables=profile.motor_tables())
+    main.safety_enabled = False
+    actions = ["forward", "left", "forward", "right", "reverse", "stop"]
+    commands = 0
+    start = PWM.freq_writes
+    for speed in (10, 30, 60, 100, 60, 30, 10, 50):
+        main.current_speed = speed
+        for action in actions:
+            main.control_motors(action)
+            commands += 1
+    return (PWM.freq_writes - start) / commands
+
+
+@benchmark("stepper_steps", "steps/s", "higher")
+def bench_stepper():
+    stepper = board().steppers[0]
+    return rate(lambda: stepper.step("f"))
+
+
+@benchmark("stepper_half_steps", "steps/s", "higher")
+def bench_stepper_half():
+    stepper = board().steppers[1]
+    return rate(lambda: stepper.halfStep("r"))
+
+
+@benchmark("servo_updates", "updates/s", "higher")
+def bench_servo():
+    servo = board().servos[0]
+    state = [0]
+
+    def update():
+        state[0] = (state[0] + 7) % 181
+        servo.goToPosition(state[0])
+    return rate(update)
+
+
+@benchmark("rangefinder_reads", "reads/s", "higher")
+def bench_rangefinder():
+    from rangefinder import HCSR04
+    sensor = HCSR04()
+    # The stand-in echo returns immediately, so this is the driver's own cost
+    sleep_us = time.sleep_us
+    time.sleep_us = lambda us: None
+    try:
+        return rate(sensor.measure_distance)
+    finally:
+        time.sleep_us = sleep_us
+
+
+@benchmark("rangefinder_alloc", "B/read", "lower")
+def bench_rangefinder_alloc():
+    from rangefinder import HCSR04
+    sensor = HCSR04()
+    sleep_us = time.sleep_us
+    time.sleep_us = lambda us: None
+    try:
+        return allocated_per_call(sensor.check_obstacle)
+    finally:
+        time.sleep_us = sleep_us
+
+
+def _map_readings():
+    """Cycle through simulated readings of the stand-in room from the centre."""
+    import gridmap
+    room = standins.Room()
+    grid = gridmap.OccupancyGrid()
+    readings = [(h, room.distance(0, 0, h)) for h in range(0, 360, 7)]
+    state = [0]
+
+    def update():
+        heading, distance = readings[state[0]]
+        state[0] = (state[0] + 1) % len(readings)
+        grid.add_reading(0, 0, heading, distance)
+    return update
+
+
+@benchmark("map_update", "readings/s", "higher")
+def bench_map_update():
+    return rate(_map_readings())
+
+
+@benchmark("map_update_alloc", "B/reading", "lower")
+def bench_map_update_alloc():
+    return allocated_per_call(_map_readings())
+
+
+@benchmark("map_memory", "B/m2", "lower")
+def bench_map_memory():
+    import gridmap
+    grid = gridmap.OccupancyGrid()
+    area_m2 = grid.width * grid.height * grid.cell_mm * grid.cell_mm / 1e6
+    return len(grid.cells) / area_m2
+
+
+@benchmark("odometry_updates", "updates/s", "higher")
+def bench_odometry():
+    import odometry
+    robot = board()
+    left, right = robot.motors[0], robot.motors[3]
+    left.on("r", 60)
+    right.on("r", 40)
+    odom = odometry.Odometry()
+    state = [0]
+
+    def update():
+        state[0] += 20
+        odom.update(left, right, state[0])
+    return rate(update)
+
+
+def _planner(size=40):
+    """Planner with fixed random obstacles and a path corner to corner."""
+    import random
+    import planner
+    rng = random.Random(1)
+    p = planner.Planner(size, size)
+    for i in range(size * size):
+        if rng.random() < 0.2:
+            p.blocked[i] = 1
+    start, goal = p.cell(0, 0), p.cell(size - 1, size - 1)
+    p.blocked[start] = p.blocked[goal] = 0
+    return p, start, goal
+
+
+@benchmark("planner_astar", "plans/s", "higher")
+def bench_planner_astar():
+    p, start, goal = _planner()
+    return rate(lambda: p.plan(start, goal), repeats=3)
+
+
+@benchmark("planner_repair", "repairs/s", "higher")
+def bench_planner_repair():
+    p, start, goal = _planner()
+    p.start_incremental(start, goal)
+    cell = p.path[p.path_length // 2]
+    state = [0]
+
+    def repair():
+        # An obstacle appears on the path and disappears again
+        state[0] ^= 1
+        p.set_blocked(cell, state[0])
+        p.replan(start)
+    return rate(repair, repeats=3)
+
+
+def git_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=NEWSMARS_DIR,
+                             capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=NEWSMARS_DIR,
+                               capture_output=True, text=True).stdout.strip()
+        return out + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(results, baseline, threshold):
+    """Print a comparison table and return the names of regressed benchmarks."""
+    regressions = []
+    print("\n%-24s %14s %14s %9s" % ("benchmark", "baseline", "now", "change"))
+    for name, entry in results.items():
+        old = baseline.get("results", {}).get(name)
+        if not old or not old["value"]:
+            print("%-24s %14s %14.1f %9s" % (name, "-", entry["value"], "new"))
+            continue
+        change = (entry["value"] - old["value"]) / old["value"]
+        worse = -change if entry["better"] == "higher" else change
+        flag = ""
+        if worse > threshold:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        print("%-24s %14.1f %14.1f %+8.1f%%%s" % (name, old["value"], entry["value"], change * 100, flag))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--only", nargs="+", help="run only these benchmarks")
+    parser.add_argument("--out", help="results file (default bench_results/<commit>.json)")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    parser.add_argument("--compare-latest", action="store_true", help="compare against the newest earlier results file")
+    parser.add_argument("--threshold", type=float, default=0.10, help="relative change counted as a regression")
+    parser.add_argument("--list", action="store_true", help="list the benchmarks and exit")
+    args = parser.parse_args()
+
+    if args.list:
+        for name, unit, better, fn in BENCHMARKS:
+            print("%-24s %-12s %s is better" % (name, unit, better))
+        return
+
+    standins.install()
+    real_stdout = sys.stdout
+    results = {}
+    for name, unit, better, fn in BENCHMARKS:
+        if args.only and name not in args.only:
+            continue
+        sys.stdout = Quiet()
+        try:
+            value = fn()
+        finally:
+            sys.stdout = real_stdout
+        results[name] = {"value": value, "unit": unit, "better": better}
+        print("%-24s %14.1f %s" % (name, value, unit))
+
+    commit = git_commit()
+    out = args.out or os.path.join(RESULTS_DIR, commit + ".json")
+    previous = sorted(glob.glob(os.path.join(RESULTS_DIR, "*.json")), key=os.path.getmtime)
+    previous = [p for p in previous if os.path.abspath(p) != os.path.abspath(out)]
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w") as f:
+        json.dump({"commit": commit, "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                   "python": platform.python_version(), "machine": platform.machine(),
+                   "results": results}, f, indent=2)
+    print("\nResults written to %s" % out)
+
+    baseline_path = args.compare or (previous[-1] if args.compare_latest and previous else None)
+    if baseline_path:
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+        print("Comparing with %s (%s)" % (baseline_path, baseline.get("commit")))
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print("\n%d regression(s) beyond %.0f%%: %s" % (len(regressions), args.threshold * 100, ", ".join(regressions)))
+            sys.exit(1)
+        print("\nNo regressions beyond %.0f%%" % (args.threshold * 100))
+
+
+if __name__ == "__main__":
+    main()
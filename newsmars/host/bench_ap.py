@@ -0,0 +1,205 @@
+"""
+Time from power-on to a controllable robot, on Wi-Fi and in access point mode.
+
+Every scenario boots main.main() in a fresh interpreter in its own empty
+directory (the flash), with the simulated networks in range set in
+standins.NETWORKS, and measures how long it takes until GET /?action=stop
+is answered:
+
+- station: the configured network is there;
+- no credentials: nothing stored and no secrets.py, so straight to the AP;
+- wrong password: one attempt, then the AP;
+- unknown network: WIFI_ATTEMPTS attempts, then the AP.
+
+Then the field setup: in AP mode a DNS query must resolve to the robot, a
+phone's captive portal check must be redirected to /setup and the form must
+store the credentials and restart the robot, which must come up on Wi-Fi
+with them on the next boot.
+
+    python3 host/bench_ap.py [--wifi-ms 1500] [--ap-ms 300] [--attempts 2]
+"""
+import argparse
+import json
+import os
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+NETWORK = ("FieldNet", "fieldpass1")
+
+
+def _free_port(kind=socket.SOCK_STREAM):
+    s = socket.socket(socket.AF_INET, kind)
+    s.bind(("127.0.0.1", 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+
+def _get(port, path, body=None):
+    conn = socket.create_connection(("127.0.0.1", port), timeout=5)
+    if body is None:
+        conn.sendall(b"GET %s HTTP/1.1\r\nHost: robot\r\n\r\n" % path)
+    else:
+        conn.sendall(b"POST %s HTTP/1.1\r\nHost: robot\r\nContent-Type: application/x-www-form-urlencoded\r\n"
+                     b"Content-Length: %d\r\n\r\n%s" % (path, len(body), body))
+    chunks = []
+    while True:
+        chunk = conn.recv(4096)
+        if not chunk:
+            break
+        chunks.append(chunk)
+    conn.close()
+    return b"".join(chunks)
+
+
+def dns_query(port, name):
+    """The A record the robot gives for name, as a dotted string, or None."""
+    query = struct.pack(">HHHHHH", 0x1234, 0x0100, 1, 0, 0, 0)
+    for label in name.split("."):
+        query += bytes((len(label),)) + label.encode()
+    query += b"\x00\x00\x01\x00\x01"
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    s.settimeout(2)
+    s.sendto(query, ("127.0.0.1", port))
+    reply = s.recv(512)
+    s.close()
+    if reply[:2] != b"\x12\x34" or struct.unpack(">H", reply[6:8])[0] != 1:
+        return None
+    return ".".join(str(b) for b in reply[-4:])
+
+
+def run_child(config):
+    """One power-on: boot main.main() and time the first control response."""
+    import io
+    import threading
+
+    power_on = time.perf_counter()
+    sys.path.insert(0, HERE)
+    import standins
+    standins.COSTS.update(config["costs"])
+    standins.NETWORKS.update(config["networks"])
+    standins.install()
+
+    real_stdout = sys.stdout
+    sys.stdout = io.StringIO()
+
+    import main
+    if not config["secrets"]:
+        main.WIFI_SSID = main.WIFI_PASSWORD = None
+    main.WIFI_ATTEMPTS = config["attempts"]
+    main.WIFI_TIMEOUT_MS = config["timeout_ms"]
+    main.HTTP_PORT = _free_port()
+    main.DNS_PORT = _free_port(socket.SOCK_DGRAM)
+    result = {}
+
+    def boot():
+        try:
+            main.main()
+        except standins.ResetCalled:
+            result["reset"] = True
+
+    threading.Thread(target=boot, daemon=True).start()
+    deadline = time.time() + 60
+    while True:
+        try:
+            page = _get(main.HTTP_PORT, b"/?action=stop")
+            break
+        except OSError:
+            if time.time() > deadline:
+                raise
+            time.sleep(0.001)
+    result["controllable_ms"] = (time.perf_counter() - power_on) * 1000
+    result["page"] = page.startswith(b"HTTP/1.1 200")
+    result["mode"] = "ap" if main.dns else "station"
+    result["phases"] = main.boot.phases
+
+    if config.get("setup") and main.dns:
+        result["dns"] = dns_query(main.DNS_PORT, "connectivitycheck.gstatic.com")
+        probe = _get(main.HTTP_PORT, b"/generate_204")
+        result["probe"] = probe.split(b"\r\n")[0].decode()
+        result["redirect"] = any(line.startswith(b"Location:") and line.endswith(b"/setup")
+                                 for line in probe.split(b"\r\n"))
+        form = _get(main.HTTP_PORT, b"/setup").split(b"\r\n\r\n", 1)[1]
+        result["form"] = b'name="ssid"' in form and NETWORK[0].encode() in form
+        start = time.perf_counter()
+        saved = _get(main.HTTP_PORT, b"/setup", b"ssid=%s&password=%s" % (NETWORK[0].encode(), NETWORK[1].encode()))
+        result["saved"] = b"Opgeslagen" in saved
+        while "reset" not in result and time.perf_counter() - start < 5:
+            time.sleep(0.01)
+        result["reset_ms"] = (time.perf_counter() - start) * 1000
+        # Read back from flash, as the next boot will
+        from store import Store
+        result["stored"] = Store(main.STORE_FILE).get("wifi")
+    real_stdout.write(json.dumps(result) + "\n")
+
+
+def power_on(config, flash):
+    out = subprocess.run([sys.executable, __file__, "--child", json.dumps(config)], cwd=flash,
+                         check=True, capture_output=True, text=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--wifi-ms", type=int, default=1500, help="simulated association (or failure) time")
+    parser.add_argument("--ap-ms", type=int, default=300, help="simulated access point start time")
+    parser.add_argument("--attempts", type=int, default=2, help="WIFI_ATTEMPTS")
+    parser.add_argument("--timeout-ms", type=int, default=20000, help="WIFI_TIMEOUT_MS")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(json.loads(args.child))
+        return
+
+    costs = {"pwm_init_us": 300, "pwm_freq_us": 50, "wifi_assoc_ms": args.wifi_ms, "ap_start_ms": args.ap_ms}
+    base = {"costs": costs, "attempts": args.attempts, "timeout_ms": args.timeout_ms, "secrets": False}
+    here = {NETWORK[0]: NETWORK[1]}
+    scenarios = [
+        ("station", {"networks": here}, {"ssid": NETWORK[0], "password": NETWORK[1]}, "station"),
+        ("no credentials", {"networks": here}, None, "ap"),
+        ("wrong password", {"networks": here}, {"ssid": NETWORK[0], "password": "wrongpass"}, "ap"),
+        ("unknown network", {"networks": here}, {"ssid": "HomeNet", "password": "homepass1"}, "ap"),
+    ]
+    print("Simulated costs: %s, WIFI_ATTEMPTS %d" % (costs, args.attempts))
+    print("%-16s %-8s %14s  %s" % ("scenario", "mode", "controllable", "phases (ms)"))
+    ok = True
+    for label, extra, stored, expected in scenarios:
+        with tempfile.TemporaryDirectory() as flash:
+            if stored:
+                # As an older version left them; the boot moves them into the store
+                with open(os.path.join(flash, "wifi.json"), "w") as f:
+                    json.dump(stored, f)
+            result = power_on(dict(base, **extra), flash)
+        ok = ok and result["mode"] == expected and result["page"]
+        print("%-16s %-8s %11.0f ms  %s" % (label, result["mode"], result["controllable_ms"],
+                                            " ".join("%s %d" % tuple(p) for p in result["phases"])))
+
+    print()
+    with tempfile.TemporaryDirectory() as flash:
+        first = power_on(dict(base, networks=here, setup=True), flash)
+        second = power_on(dict(base, networks=here), flash)
+    print("field setup, starting without credentials:")
+    print("  AP up and controllable after %.0f ms" % first["controllable_ms"])
+    print("  DNS for connectivitycheck.gstatic.com -> %s" % first.get("dns"))
+    print("  GET /generate_204 -> %s%s" % (first.get("probe"), ", to /setup" if first.get("redirect") else ""))
+    print("  setup form lists the networks in range: %s" % first.get("form"))
+    print("  POST /setup saved %s and the robot restarted after %.0f ms"
+          % (first.get("stored"), first.get("reset_ms", 0)))
+    print("  next power-on: %s, controllable after %.0f ms" % (second["mode"], second["controllable_ms"]))
+    ok = (ok and first.get("dns") == "127.0.0.1" and first.get("redirect") and first.get("form")
+          and first.get("saved") and first.get("stored") == {"ssid": NETWORK[0], "password": NETWORK[1]}
+          and second["mode"] == "station")
+    if not ok:
+        print("FAILED")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
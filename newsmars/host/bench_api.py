@@ -0,0 +1,213 @@
+"""
+Load test of the JSON API against the HTML page, on loopback.
+
+Starts main.main() in a separate process on the stand-ins (safety off) and
+hammers it from --clients parallel connections with:
+
+- the HTML path: GET /?action=forward and GET / (a full page per request);
+- the API: POST /api/drive {"action": "forward"} and GET /api/state.
+
+For each it reports requests/s, latency and bytes on the wire per request.
+Then it drives one scripted manoeuvre of --steps timed commands twice:
+as one HTML request per command, sent by the client at the right moment,
+and as a single POST /api/batch run by the robot's scheduler, and
+compares requests, bytes and timing error.
+
+    python3 host/bench_api.py [--clients 1 4 16] [--seconds 2] [--steps 20]
+"""
+import argparse
+import atexit
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+_FIRMWARE_CODE = """
+import io, sys
+sys.path.insert(0, %r)
+import standins
+standins.install()
+import main
+main.HTTP_PORT = %d
+main.STORE_FILE = None
+main.safety_enabled = False
+sys.stdout = io.StringIO()
+main.main()
+"""
+
+
+def start_firmware():
+    """main.main() in a separate process; returns its port once it serves."""
+    s = socket.socket()
+    s.bind(("127.0.0.1", 0))
+    port = s.getsockname()[1]
+    s.close()
+    proc = subprocess.Popen([sys.executable, "-c", _FIRMWARE_CODE % (HERE, port)])
+    atexit.register(proc.kill)
+    deadline = time.time() + 10
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1", port)).close()
+            return port
+        except OSError:
+            if time.time() > deadline:
+                raise
+            time.sleep(0.01)
+
+
+def request(port, method, path, body=None):
+    """One request on a new connection; returns (status, response body, bytes sent, bytes received)."""
+    data = b"" if body is None else json.dumps(body, separators=(",", ":")).encode()
+    head = b"%s %s HTTP/1.1\r\nHost: robot\r\n" % (method, path)
+    if body is not None:
+        head += b"Content-Type: application/json\r\nContent-Length: %d\r\n" % len(data)
+    sent = head + b"\r\n" + data
+    conn = socket.create_connection(("127.0.0.1", port))
+    conn.sendall(sent)
+    chunks = []
+    while True:
+        chunk = conn.recv(8192)
+        if not chunk:
+            break
+        chunks.append(chunk)
+    conn.close()
+    response = b"".join(chunks)
+    status = int(response.split(b" ", 2)[1])
+    return status, response.split(b"\r\n\r\n", 1)[1], len(sent), len(response)
+
+
+SCENARIOS = [
+    ("HTML ?action=forward", b"GET", b"/?action=forward", None),
+    ("HTML page", b"GET", b"/", None),
+    ("API drive", b"POST", b"/api/drive", {"action": "forward"}),
+    ("API state", b"GET", b"/api/state", None),
+]
+
+
+def load(port, method, path, body, clients, seconds):
+    """clients threads sending back to back for seconds; returns (req/s, p50 us, p99 us, bytes/request)."""
+    latencies = []
+    wire = [0]
+    errors = [0]
+    lock = threading.Lock()
+    end = time.perf_counter() + seconds
+
+    def run():
+        mine = []
+        size = 0
+        while time.perf_counter() < end:
+            start = time.perf_counter()
+            try:
+                status, _, sent, received = request(port, method, path, body)
+            except OSError:
+                with lock:
+                    errors[0] += 1
+                continue
+            mine.append(time.perf_counter() - start)
+            size += sent + received
+            if status != 200:
+                with lock:
+                    errors[0] += 1
+        with lock:
+            latencies.extend(mine)
+            wire[0] += size
+
+    threads = [threading.Thread(target=run) for _ in range(clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    n = len(latencies)
+    return (n / elapsed, latencies[n // 2] * 1e6, latencies[min(n - 1, int(n * 0.99))] * 1e6,
+            wire[0] / max(n, 1), errors[0])
+
+
+def manoeuvre(steps, step_ms):
+    """Alternating drive commands, then a stop: as batch steps and as HTML actions."""
+    actions = ["forward", "left", "forward", "right", "reverse"]
+    speeds = {"forward": (60, 60), "left": (-60, 60), "right": (60, -60), "reverse": (-60, -60)}
+    batch = []
+    html = []
+    for i in range(steps - 1):
+        action = actions[i % len(actions)]
+        batch.append([i * step_ms, "drive", speeds[action][0], speeds[action][1]])
+        html.append((i * step_ms, action))
+    batch.append([(steps - 1) * step_ms, "drive", 0, 0])
+    html.append(((steps - 1) * step_ms, "stop"))
+    return batch, html
+
+
+def scripted(port, steps, step_ms):
+    batch, html = manoeuvre(steps, step_ms)
+    request(port, b"POST", b"/api/drive", {"action": "stop"})
+
+    # One request per command, each sent when it is due
+    wire = 0
+    late = []
+    start = time.perf_counter()
+    for at_ms, action in html:
+        delay = start + at_ms / 1000 - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        sent_at = time.perf_counter()
+        _, _, sent, received = request(port, b"GET", b"/?action=" + action.encode())
+        late.append((time.perf_counter() - start) * 1000 - at_ms)
+        wire += sent + received
+    html_ms = (time.perf_counter() - start) * 1000
+
+    # The whole manoeuvre in one request; poll until the scheduler is done
+    start = time.perf_counter()
+    status, reply, sent, received = request(port, b"POST", b"/api/batch", {"steps": batch})
+    if status != 200:
+        raise SystemExit("batch rejected: %d %s" % (status, reply.decode()))
+    batch_wire = sent + received
+    polls = 0
+    while True:
+        time.sleep(0.01)
+        polls += 1
+        status, reply, _, _ = request(port, b"GET", b"/api/batch")
+        if not json.loads(reply)["running"]:
+            break
+    batch_ms = (time.perf_counter() - start) * 1000
+    state = json.loads(request(port, b"GET", b"/api/state")[1])
+
+    print("%d timed commands, %d ms apart:" % (steps, step_ms))
+    print("  %-24s %4d requests %7d B on the wire, done after %6.0f ms, p50 %4.1f ms / max %4.1f ms late"
+          % ("HTML, one per command", len(html), wire, html_ms, sorted(late)[len(late) // 2], max(late)))
+    print("  %-24s %4d request  %7d B on the wire (%d B body), done after %6.0f ms (%d status polls)"
+          % ("API /api/batch", 1, batch_wire, len(json.dumps({"steps": batch}, separators=(",", ":"))),
+             batch_ms, polls))
+    print("  after the batch: tracks %d/%d" % (state["left"], state["right"]))
+    return state["left"] == 0 and state["right"] == 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--seconds", type=float, default=2.0)
+    parser.add_argument("--steps", type=int, default=20)
+    parser.add_argument("--step-ms", type=int, default=100)
+    args = parser.parse_args()
+
+    port = start_firmware()
+    print("%-22s %7s %9s %9s %9s %9s %6s" % ("", "clients", "req/s", "p50 us", "p99 us", "B/request", "errors"))
+    for name, method, path, body in SCENARIOS:
+        for clients in args.clients:
+            print("%-22s %7d %9.0f %9.0f %9.0f %9.0f %6d"
+                  % ((name, clients) + load(port, method, path, body, clients, args.seconds)))
+    print()
+    if not scripted(port, args.steps, args.step_ms):
+        print("FAILED: the robot did not stop at the end of the batch")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Cold-boot-to-first-response timings for main.py on host stand-ins.
+
+Each configuration runs in a fresh interpreter, which stands in for a
+power cycle: main.main() boots in a background thread, the benchmark waits
+for the HTTP server and fetches the first page, then the per-phase timings
+recorded by main.boot are reported.
+
+    python3 host/bench_boot.py [--pwm-init-us N] [--wifi-ms N]
+"""
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+CONFIGS = [
+    ("eager, wifi after hardware", False, False),
+    ("lazy, wifi after hardware", True, False),
+    ("eager, wifi concurrent", False, True),
+    ("lazy, wifi concurrent", True, True),
+]
+
+
+def _free_port():
+    s = socket.socket()
+    s.bind(("127.0.0.1", 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+
+def run_child(config):
+    import io
+    import threading
+
+    sys.path.insert(0, HERE)
+    import standins
+    standins.COSTS.update(config["costs"])
+    standins.install()
+
+    real_stdout = sys.stdout
+    sys.stdout = io.StringIO()
+
+    import main
+    main.LAZY_INIT = config["lazy"]
+    main.WIFI_CONCURRENT = config["concurrent"]
+    main.HTTP_PORT = _free_port()
+    main.STORE_FILE = None
+    threading.Thread(target=main.main, daemon=True).start()
+
+    deadline = time.time() + 30
+    while True:
+        try:
+            conn = socket.create_connection(("127.0.0.1", main.HTTP_PORT), timeout=5)
+            break
+        except OSError:
+            if time.time() > deadline:
+                raise
+            time.sleep(0.001)
+    conn.sendall(b"GET / HTTP/1.1\r\nHost: robot\r\n\r\n")
+    while conn.recv(4096):
+        pass
+    conn.close()
+
+    # Wait for the server loop to record the first response
+    while main.boot.phases[-1][0] != "first_response":
+        time.sleep(0.001)
+    real_stdout.write(json.dumps({"phases": main.boot.phases, "total": main.boot.total_ms()}) + "\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--pwm-init-us", type=int, default=300, help="simulated cost of one PWM output")
+    parser.add_argument("--pwm-freq-us", type=int, default=50, help="simulated cost of setting a PWM frequency")
+    parser.add_argument("--wifi-ms", type=int, default=1500, help="simulated Wi-Fi association time")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(json.loads(args.child))
+        return
+
+    costs = {"pwm_init_us": args.pwm_init_us, "pwm_freq_us": args.pwm_freq_us, "wifi_assoc_ms": args.wifi_ms}
+    print("Simulated costs: %s" % costs)
+    for label, lazy, concurrent in CONFIGS:
+        config = {"costs": costs, "lazy": lazy, "concurrent": concurrent}
+        out = subprocess.run([sys.executable, __file__, "--child", json.dumps(config)],
+                             check=True, capture_output=True, text=True).stdout
+        result = json.loads(out.strip().splitlines()[-1])
+        print("\n%s" % label)
+        for phase, duration in result["phases"]:
+            print("  %-16s %7d ms" % (phase, duration))
+        print("  %-16s %7d ms" % ("total", result["total"]))
+
+
+if __name__ == "__main__":
+    main()
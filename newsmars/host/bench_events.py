@@ -0,0 +1,301 @@
+"""
+Server-sent events on /events with many subscribers, fast, slow and stuck.
+
+Part one runs main.control_tick() on a virtual clock with an EventStream of
+simulated subscriber sockets: fast ones take every byte, slow ones a few
+bytes per call, stalled ones stop taking anything and gone ones fail. It
+reports the control tick cost against the number of subscribers, what each
+kind received, and compares the shared frame with formatting one per client.
+
+Part two starts the firmware in a separate process and opens real /events
+connections on loopback, half of which never read, and checks that readers
+keep getting frames, that the stalled ones are closed and that /api/state
+stays fast meanwhile.
+
+    python3 host/bench_events.py [--subscribers 1 8 64 256] [--seconds 5] [--no-loopback]
+"""
+import argparse
+import atexit
+import errno
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+import standins
+
+KINDS = ("fast", "slow", "stalled", "gone")
+
+
+class NullWriter:
+    def write(self, text):
+        return len(text)
+
+    def flush(self):
+        pass
+
+
+class Subscriber:
+    """Non-blocking socket stand-in; kind decides how much of each write it takes."""
+
+    def __init__(self, kind, slow_bytes=8, stall_after=600, fail_after=5):
+        self.kind = kind
+        self.slow_bytes = slow_bytes
+        self.stall_after = stall_after
+        self.fail_after = fail_after
+        self.received = 0
+        self.frames = 0
+        self.writes = 0
+        self.closed = False
+        self.tail = b""
+
+    def setblocking(self, flag):
+        pass
+
+    def write(self, data):
+        self.writes += 1
+        if self.kind == "gone" and self.frames >= self.fail_after:
+            raise OSError(errno.ECONNRESET)
+        take = len(data)
+        if self.kind == "slow":
+            take = min(take, self.slow_bytes)
+        elif self.kind == "stalled" and self.received + take > self.stall_after:
+            take = max(0, self.stall_after - self.received)
+            if take == 0:
+                raise OSError(errno.EAGAIN)
+        self.received += take
+        # A frame's closing blank line may be split over two writes
+        text = self.tail + bytes(data[:take])
+        self.frames += text.count(b"\n\n")
+        self.tail = text[-1:]
+        return take
+
+    def close(self):
+        self.closed = True
+
+
+def simulate(firmware, clock, count, seconds):
+    """count subscribers, a quarter of each kind; returns tick cost and per-kind results."""
+    from events import EventStream
+    firmware.events = EventStream(count)
+    firmware.next_event_ms = 0
+    subscribers = [Subscriber(KINDS[i % len(KINDS)]) for i in range(count)]
+    for sub in subscribers:
+        firmware.events.add(sub)
+    # The headers are not frames
+    for sub in subscribers:
+        sub.frames = 0
+        sub.tail = b""
+
+    ticks = []
+    now_ms = 0
+    end_ms = int(seconds * 1000)
+    while now_ms < end_ms:
+        clock.set_ms(now_ms)
+        firmware.loop_us = now_ms % 997
+        start = time.perf_counter()
+        firmware.control_tick(now_ms)
+        ticks.append((time.perf_counter() - start) * 1e6)
+        now_ms += firmware.CONTROL_TICK_MS
+
+    results = {}
+    for kind in KINDS:
+        mine = [s for s in subscribers if s.kind == kind]
+        if mine:
+            results[kind] = (sum(s.frames for s in mine) / len(mine), sum(s.closed for s in mine), len(mine))
+    ticks.sort()
+    return (sum(ticks) / len(ticks), ticks[int(len(ticks) * 0.99)], firmware.events.published, results)
+
+
+def formatting_cost(firmware, count, calls=200):
+    """us to build one shared frame versus one frame per subscriber."""
+    start = time.perf_counter()
+    for _ in range(calls):
+        firmware.event_frame()
+    shared = (time.perf_counter() - start) / calls * 1e6
+    start = time.perf_counter()
+    for _ in range(calls):
+        for _ in range(count):
+            firmware.event_frame()
+    return shared, (time.perf_counter() - start) / calls * 1e6
+
+
+_FIRMWARE_CODE = """
+import io, sys
+sys.path.insert(0, %r)
+import standins
+standins.install()
+import socket
+# lwIP on the Pico W buffers about 2.9 KB per connection; a small send buffer stands in for it
+_accept = socket.socket.accept
+def accept(self):
+    conn, addr = _accept(self)
+    conn.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4096)
+    return conn, addr
+socket.socket.accept = accept
+import main
+main.HTTP_PORT = %d
+main.STORE_FILE = None
+main.EVENTS_INTERVAL_MS = %d
+main.EVENTS_MAX_CLIENTS = %d
+main.safety_enabled = False
+sys.stdout = io.StringIO()
+main.main()
+"""
+
+
+def start_firmware(interval_ms, max_clients):
+    s = socket.socket()
+    s.bind(("127.0.0.1", 0))
+    port = s.getsockname()[1]
+    s.close()
+    proc = subprocess.Popen([sys.executable, "-c", _FIRMWARE_CODE % (HERE, port, interval_ms, max_clients)])
+    atexit.register(proc.kill)
+    deadline = time.time() + 10
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1", port)).close()
+            return port
+        except OSError:
+            if time.time() > deadline:
+                raise
+            time.sleep(0.01)
+
+
+def subscribe(port, rcvbuf=None):
+    conn = socket.socket()
+    if rcvbuf:
+        conn.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+    conn.connect(("127.0.0.1", port))
+    conn.sendall(b"GET /events HTTP/1.1\r\nHost: robot\r\nAccept: text/event-stream\r\n\r\n")
+    return conn
+
+
+def state_latencies(port, seconds):
+    samples = []
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        start = time.perf_counter()
+        conn = socket.create_connection(("127.0.0.1", port))
+        conn.sendall(b"GET /api/state HTTP/1.1\r\nHost: robot\r\n\r\n")
+        while conn.recv(4096):
+            pass
+        conn.close()
+        samples.append((time.perf_counter() - start) * 1e6)
+        time.sleep(0.005)
+    samples.sort()
+    return samples[len(samples) // 2], samples[int(len(samples) * 0.99)]
+
+
+def loopback(seconds, interval_ms=20, readers=4, stalled=4):
+    port = start_firmware(interval_ms, readers + stalled + 1)
+    base = state_latencies(port, 1.0)
+
+    frames = [0] * readers
+    spans = [None] * readers
+    stop = threading.Event()
+
+    def read(i, conn):
+        conn.settimeout(0.5)
+        data = b""
+        while not stop.is_set():
+            try:
+                chunk = conn.recv(4096)
+            except socket.timeout:
+                continue
+            if not chunk:
+                break
+            data += chunk
+            now = time.perf_counter()
+            # What queued up before the thread started reading does not count
+            if spans[i]:
+                frames[i] += data.count(b"data: ")
+                spans[i] = (spans[i][0], now)
+            else:
+                spans[i] = (now, now)
+            data = data[data.rfind(b"\n\n") + 2:] if b"\n\n" in data else data
+        conn.close()
+
+    stuck = [subscribe(port, rcvbuf=2048) for _ in range(stalled)]
+    threads = [threading.Thread(target=read, args=(i, subscribe(port))) for i in range(readers)]
+    for thread in threads:
+        thread.start()
+    loaded = state_latencies(port, seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    # A closed stalled connection ends with EOF once its buffered frames are read
+    closed = 0
+    for conn in stuck:
+        conn.settimeout(0.5)
+        deadline = time.perf_counter() + 2
+        try:
+            while time.perf_counter() < deadline:
+                chunk = conn.recv(65536)
+                if not chunk:
+                    closed += 1
+                    break
+        except socket.timeout:
+            pass
+        conn.close()
+
+    # Connections beyond the listen backlog of 1 wait for a SYN retry, so readers start at different times
+    rates = [frames[i] / (spans[i][1] - spans[i][0]) if spans[i] and frames[i] else 0
+             for i in range(readers)]
+    expected = 1000 / interval_ms
+    print("loopback, %d readers and %d stalled subscribers, a frame every %d ms for %.0f s:"
+          % (readers, stalled, interval_ms, seconds))
+    print("  frames/s per reader: %s (one per %d ms is %.0f)" % (", ".join("%.1f" % r for r in rates),
+                                                              interval_ms, expected))
+    print("  stalled subscribers closed: %d of %d" % (closed, stalled))
+    print("  /api/state p50/p99: %.0f/%.0f us alone, %.0f/%.0f us with the subscribers"
+          % (base + loaded))
+    return closed == stalled and min(rates) >= expected * 0.8
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--subscribers", type=int, nargs="+", default=[1, 8, 64, 256])
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--no-loopback", action="store_true")
+    args = parser.parse_args()
+
+    standins.install()
+    import main as firmware
+    from SimplyRobotics import KitronikSimplyRobotics
+    firmware.robot = KitronikSimplyRobotics(lazy=True)
+    firmware.last_distance = 42.5
+    clock = standins.use_virtual_clock()
+
+    print("simulated subscribers, a frame every %d ms for %.0f s (%d ms ticks):"
+          % (firmware.EVENTS_INTERVAL_MS, args.seconds, firmware.CONTROL_TICK_MS))
+    print("%12s %10s %10s %10s  %s" % ("subscribers", "tick us", "p99 us", "frames",
+                                      "frames received / closed, per kind"))
+    real_stdout = sys.stdout
+    for count in args.subscribers:
+        sys.stdout = NullWriter()
+        try:
+            mean, p99, published, results = simulate(firmware, clock, count, args.seconds)
+        finally:
+            sys.stdout = real_stdout
+        print("%12d %10.1f %10.1f %10d  %s" % (count, mean, p99, published, ", ".join(
+            "%s %.0f/%d of %d" % (kind, r[0], r[1], r[2]) for kind, r in results.items())))
+    frame = firmware.event_frame()
+    count = max(args.subscribers)
+    shared, per_client = formatting_cost(firmware, count)
+    print("frame: %d B; building it: %.1f us once per tick, %.1f us for one per subscriber (%d)"
+          % (len(frame), shared, per_client, count))
+    print()
+
+    if not args.no_loopback and not loopback(args.seconds):
+        print("FAILED")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
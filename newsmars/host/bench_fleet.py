@@ -0,0 +1,349 @@
+"""
+The fleet controller against many simulated robots on localhost.
+
+A separate process runs --robots simulated robot servers (one port each)
+that answer like the firmware: /api/state with their own ticks_ms() clock,
+/api/drive, /api/batch with "at", and /events. Each one has its own clock
+offset, network delay and jitter, and serves one request at a time. This
+process drives them with host/fleet.py and reports:
+
+- scan: time to find the robots among as many closed ports;
+- clocks: time to sync and the error of every offset against the truth;
+- fan-out: time until every robot answered a broadcast, against one
+  robot after another;
+- start spread: the spread of the moments the robots actually changed
+  their tracks, for a plain broadcast and for a synchronised command;
+- status: frames per second over the /events streams, and how fast a
+  dropped stream comes back.
+
+With --firmware N it also runs N copies of main.main() and checks that
+they are found, synced and started together.
+
+    python3 host/bench_fleet.py [--robots 8 32 64] [--rounds 10] [--firmware 2]
+"""
+import argparse
+import asyncio
+import atexit
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+from fleet import TICKS_PERIOD, Fleet, now_ms, ticks_diff
+
+
+class SimRobot:
+    """
+    A robot's HTTP server on a virtual Wi-Fi link. A request takes latency_ms
+    plus up to jitter_ms each way and service_ms on the robot; batch steps run
+    when the robot's own clock reaches them, as the firmware does.
+    """
+
+    def __init__(self, offset_ms, latency_ms, jitter_ms, service_ms, frame_ms=200):
+        self.offset_ms = offset_ms
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.service_ms = service_ms
+        self.frame_ms = frame_ms
+        self.left = 0
+        self.right = 0
+        self.executed = []      # (now_ms(), left, right)
+        self.streams = []
+        self.busy = asyncio.Lock()
+        self.pending = None
+
+    def ticks(self):
+        return int(now_ms() + self.offset_ms) % TICKS_PERIOD
+
+    def delay(self):
+        return (self.latency_ms + random.random() * self.jitter_ms) / 1000
+
+    def set_tracks(self, left, right):
+        self.left = left
+        self.right = right
+        self.executed.append((now_ms(), left, right))
+
+    def state(self):
+        return {"speed": 50, "safety": False, "left": self.left, "right": self.right, "distance": 42.5,
+                "pose": [0, 0, 0], "batch": self.pending is not None, "ms": self.ticks()}
+
+    async def handle(self, reader, writer):
+        data = await reader.read(2048)
+        await asyncio.sleep(self.delay())
+        if data.startswith(b"GET /events"):
+            await self.stream(writer)
+            return
+        async with self.busy:
+            await asyncio.sleep(self.service_ms / 1000)
+            status, reply = self.route(data)
+        await asyncio.sleep(self.delay())
+        body = json.dumps(reply).encode()
+        writer.write(b"HTTP/1.1 %d X\r\nContent-Type: application/json\r\nConnection: close\r\n\r\n"
+                     % status + body)
+        await writer.drain()
+        writer.close()
+
+    def route(self, data):
+        head, _, body = data.partition(b"\r\n\r\n")
+        line = head.split(b"\r\n", 1)[0]
+        if line.startswith(b"GET /api/state"):
+            return 200, self.state()
+        if line.startswith(b"GET /sim/log"):
+            return 200, {"offset": self.offset_ms, "executed": self.executed}
+        if line.startswith(b"POST /sim/drop"):
+            for stream in self.streams:
+                stream.transport.abort()
+            return 200, {}
+        request = json.loads(body)
+        if line.startswith(b"POST /api/drive"):
+            self.cancel()
+            if request.get("action") == "stop":
+                self.set_tracks(0, 0)
+            else:
+                self.set_tracks(request["left"], request["right"])
+            return 200, self.state()
+        if line.startswith(b"POST /api/batch"):
+            self.cancel()
+            at = request.get("at", self.ticks())
+            _, kind, left, right = request["steps"][0]
+            due = max(0, ticks_diff(at, self.ticks()))
+            self.pending = asyncio.get_running_loop().call_later(due / 1000, self.run_step, left, right)
+            return 200, {"running": True, "next": 0, "steps": 1, "ms": 0}
+        return 404, {"error": "unknown"}
+
+    def run_step(self, left, right):
+        self.pending = None
+        self.set_tracks(left, right)
+
+    def cancel(self):
+        if self.pending:
+            self.pending.cancel()
+            self.pending = None
+
+    async def stream(self, writer):
+        self.streams.append(writer)
+        try:
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n\r\nretry: 2000\n\n")
+            while not writer.is_closing():
+                writer.write(b"data: %s\n\n" % json.dumps({
+                    "speed": 50, "safety": False, "left": self.left, "right": self.right,
+                    "distance": 42.5, "loop_us": 300, "command_us": 120, "pose": [0, 0, 0]}).encode())
+                await writer.drain()
+                await asyncio.sleep(self.frame_ms / 1000)
+        except (OSError, ConnectionError):
+            pass
+        finally:
+            self.streams.remove(writer)
+            writer.close()
+
+
+async def serve(count, seed, latency_ms, jitter_ms, service_ms):
+    """count simulated robots; prints their ports as one JSON line, then serves forever."""
+    random.seed(seed)
+    ports = []
+    for _ in range(count):
+        robot = SimRobot(random.randrange(TICKS_PERIOD), latency_ms * random.uniform(0.5, 1.5),
+                         jitter_ms, service_ms)
+        server = await asyncio.start_server(robot.handle, "127.0.0.1", 0)
+        ports.append(server.sockets[0].getsockname()[1])
+    print(json.dumps(ports), flush=True)
+    await asyncio.Event().wait()
+
+
+def start_sims(count, args):
+    proc = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--serve", str(count),
+                             "--latency-ms", str(args.latency_ms), "--jitter-ms", str(args.jitter_ms),
+                             "--service-ms", str(args.service_ms)], stdout=subprocess.PIPE)
+    atexit.register(proc.kill)
+    return proc, json.loads(proc.stdout.readline())
+
+
+def closed_ports(count):
+    """Ports nothing listens on, for the scan to skip."""
+    socks = []
+    for _ in range(count):
+        s = socket.socket()
+        s.bind(("127.0.0.1", 0))
+        socks.append(s)
+    ports = [s.getsockname()[1] for s in socks]
+    for s in socks:
+        s.close()
+    return ports
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+async def start_times(fleet, since):
+    """now_ms() of the first track change after since, per robot."""
+    results = await fleet.broadcast("/sim/log", method="GET")
+    times = []
+    for _, _, reply, _ in results:
+        later = [t for t, _, _ in reply["executed"] if t >= since]
+        times.append(later[0] if later else None)
+    return times
+
+
+async def bench(count, args):
+    proc, ports = start_sims(count, args)
+    fleet = Fleet(timeout=5.0)
+    try:
+        start = now_ms()
+        found = await fleet.scan(["127.0.0.1"], sorted(ports + closed_ports(count)), timeout=1.0)
+        scan_ms = now_ms() - start
+
+        start = now_ms()
+        await fleet.sync_clocks()
+        sync_ms = now_ms() - start
+        logs = await fleet.broadcast("/sim/log", method="GET")
+        errors = []
+        for robot, _, reply, _ in logs:
+            # Offsets are compared modulo the tick period
+            error = (robot.offset_ms - reply["offset"] + TICKS_PERIOD / 2) % TICKS_PERIOD - TICKS_PERIOD / 2
+            errors.append(abs(error))
+
+        fan_out = []
+        per_robot = []
+        for i in range(args.rounds):
+            results = await fleet.drive(40 * (i % 2), 40 * (i % 2))
+            fan_out.append(max(r[3] for r in results))
+            per_robot.extend(r[3] for r in results)
+        start = now_ms()
+        for robot in fleet.robots:
+            fleet.robots, everyone = [robot], fleet.robots
+            await fleet.drive(0, 0)
+            fleet.robots = everyone
+        sequential = now_ms() - start
+
+        plain = []
+        synced = []
+        late = 0
+        for i in range(args.rounds):
+            speed = 30 + i
+            since = now_ms()
+            await fleet.drive(speed, speed)
+            times = await start_times(fleet, since)
+            plain.append(max(times) - min(times))
+
+            since = now_ms()
+            results = await fleet.drive(-speed, -speed, sync=True, lead_ms=args.lead_ms)
+            late += sum(1 for r in results if r[3] > args.lead_ms)
+            await asyncio.sleep((args.lead_ms + 50) / 1000)
+            times = await start_times(fleet, since)
+            if None in times:
+                raise SystemExit("a robot did not run the synchronised step")
+            synced.append(max(times) - min(times))
+
+        fleet.watch()
+        await asyncio.sleep(2)
+        frames = sum(r.frames for r in fleet.robots)
+        summary = fleet.summary()
+        await asyncio.sleep(1)
+        frames_per_s = (sum(r.frames for r in fleet.robots) - frames) / 1.0
+        await fleet.broadcast("/sim/drop", method="POST")
+        dropped = now_ms()
+        await asyncio.sleep(0.05)
+        while not all(r.online for r in fleet.robots) and now_ms() - dropped < 10000:
+            await asyncio.sleep(0.01)
+        back_ms = now_ms() - dropped
+        await fleet.close()
+    finally:
+        proc.kill()
+        proc.wait()
+
+    print("%d robots:" % count)
+    print("  scan: %d of %d found among %d ports in %.0f ms" % (len(found), count, 2 * count, scan_ms))
+    print("  clocks: synced in %.0f ms, offset error p50 %.2f ms, max %.2f ms"
+          % (sync_ms, percentile(errors, 0.5), max(errors)))
+    print("  fan-out: all answered after p50 %.1f ms, max %.1f ms (per robot p50 %.1f ms); "
+          "one after another %.0f ms" % (percentile(fan_out, 0.5), max(fan_out), percentile(per_robot, 0.5),
+                                         sequential))
+    print("  start spread: plain broadcast p50 %.1f ms, max %.1f ms; synchronised p50 %.1f ms, max %.1f ms"
+          " (%d answers later than the %d ms lead)"
+          % (percentile(plain, 0.5), max(plain), percentile(synced, 0.5), max(synced), late, args.lead_ms))
+    print("  status: %d online, %d fresh, %.0f frames/s; dropped streams all back after %.0f ms"
+          % (summary["online"], summary["fresh"], frames_per_s, back_ms))
+    return (len(found) == count and summary["fresh"] == count and max(synced) < max(plain)
+            and back_ms < 10000)
+
+
+_FIRMWARE_CODE = """
+import io, sys
+sys.path.insert(0, %r)
+import standins
+standins.install()
+import main
+main.HTTP_PORT = %d
+main.STORE_FILE = None
+main.safety_enabled = False
+sys.stdout = io.StringIO()
+main.main()
+"""
+
+
+async def firmware(count, lead_ms):
+    """The fleet against count copies of the real firmware."""
+    ports = closed_ports(count)
+    procs = []
+    for port in ports:
+        proc = subprocess.Popen([sys.executable, "-c", _FIRMWARE_CODE % (HERE, port)])
+        atexit.register(proc.kill)
+        procs.append(proc)
+    fleet = Fleet(timeout=5.0)
+    deadline = now_ms() + 15000
+    while len(fleet.robots) < count and now_ms() < deadline:
+        await fleet.scan(["127.0.0.1"], ports, timeout=1.0)
+        await asyncio.sleep(0.1)
+    await fleet.sync_clocks()
+    fleet.watch()
+    results = await fleet.drive(50, -50, sync=True, lead_ms=lead_ms)
+    await asyncio.sleep((lead_ms + 500) / 1000)
+    states = await fleet.broadcast("/api/state", method="GET")
+    summary = fleet.summary()
+    await fleet.stop()
+    await fleet.close()
+    for proc in procs:
+        proc.kill()
+    turned = sum(1 for _, status, reply, _ in states if status == 200 and (reply["left"], reply["right"]) == (50, -50))
+    print("firmware: %d of %d found, batch accepted by %d, turning on %d, %d fresh on /events"
+          % (len(fleet.robots), count, sum(1 for r in results if r[1] == 200), turned, summary["fresh"]))
+    return turned == count
+
+
+async def run(args):
+    ok = True
+    for count in args.robots:
+        ok = await bench(count, args) and ok
+    if args.firmware:
+        ok = await firmware(args.firmware, args.lead_ms) and ok
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--robots", type=int, nargs="+", default=[8, 32, 64])
+    parser.add_argument("--rounds", type=int, default=10)
+    parser.add_argument("--latency-ms", type=float, default=3.0, help="one-way delay per robot, varied 0.5-1.5x")
+    parser.add_argument("--jitter-ms", type=float, default=4.0)
+    parser.add_argument("--service-ms", type=float, default=2.0)
+    parser.add_argument("--lead-ms", type=int, default=200)
+    parser.add_argument("--firmware", type=int, default=2)
+    parser.add_argument("--serve", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.serve:
+        asyncio.run(serve(args.serve, args.serve, args.latency_ms, args.jitter_ms, args.service_ms))
+        return
+    if not asyncio.run(run(args)):
+        print("FAILED")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
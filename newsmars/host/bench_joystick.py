@@ -0,0 +1,247 @@
+"""
+Joystick mode: CPU cost per command and the command rate a Wi-Fi link sustains.
+
+The web page sends the stick position to /joy at JOYSTICK_RATE_HZ with at
+most one request in flight; the firmware stores it and control_tick()
+drives the tracks with the newest position once per CONTROL_TICK_MS.
+
+Part one times the real request path on this host: a /joy request through
+main.serve_client(), applying it in control_tick(), and a full-page
+?action= request for comparison.
+
+Part two runs the firmware on a virtual clock behind simulated Wi-Fi links
+(round trip, jitter and packet loss with a TCP retransmit) and a browser
+that moves the stick for --seconds. Every request really goes through
+serve_client() and control_tick(); the robot's CPU time per request is the
+host time from part one times --cpu-scale. Reported per link and send rate:
+commands sent, commands the motors received, how many the control tick
+coalesced away, and the age of the stick position when it reached the motors.
+
+    python3 host/bench_joystick.py [--rates 10 20 50 100] [--seconds 10] [--cpu-scale 40]
+"""
+import argparse
+import math
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import standins
+
+# name, round trip ms, jitter ms (uniform, one way), packet loss
+LINKS = [
+    ("good", 4, 1, 0.0),
+    ("busy", 15, 8, 0.01),
+    ("poor", 40, 25, 0.03),
+]
+# TCP resends a lost packet after its initial retransmission timeout
+RETRANSMIT_MS = 200
+STEP_US = 100
+
+
+class NullWriter:
+    def write(self, text):
+        return len(text)
+
+    def flush(self):
+        pass
+
+
+def joy_request(throttle, steer):
+    return b"GET /joy?t=%d&s=%d HTTP/1.1\r\nHost: robot\r\n\r\n" % (throttle, steer)
+
+
+def per_call_us(fn, calls=2000):
+    fn()
+    start = time.perf_counter()
+    for _ in range(calls):
+        fn()
+    return (time.perf_counter() - start) / calls * 1e6
+
+
+def cpu_costs(firmware, server):
+    """Host us per /joy request, per applied command, per control tick and per ?action= request."""
+    joystick = firmware.joystick
+    state = [0]
+
+    def request():
+        state[0] += 1
+        server.queue(joy_request(state[0] % 100, -(state[0] % 100)))
+        firmware.serve_client(server)
+
+    def apply():
+        state[0] += 1
+        joystick.command(state[0] % 100, 50, 0)
+        joystick.take(0, 50)
+        firmware.drive_tracks(joystick.left, joystick.right)
+
+    def tick():
+        firmware.control_tick(0)
+
+    def action():
+        server.queue(b"GET /?action=forward HTTP/1.1\r\nHost: robot\r\n\r\n")
+        firmware.serve_client(server)
+
+    costs = {
+        "request": per_call_us(request),
+        "apply": per_call_us(apply),
+        "tick": per_call_us(tick),
+        "action": per_call_us(action),
+    }
+    server.queue(joy_request(50, 0))
+    firmware.serve_client(server)
+    joy_bytes = server.client.sent
+    server.queue(b"GET /?action=forward HTTP/1.1\r\nHost: robot\r\n\r\n")
+    firmware.serve_client(server)
+    return costs, joy_bytes, server.client.sent
+
+
+def one_way_us(link, rng):
+    _, rtt_ms, jitter_ms, loss = link
+    delay = rtt_ms * 500 + rng.uniform(0, jitter_ms * 1000)
+    while rng.random() < loss:
+        delay += RETRANSMIT_MS * 1000
+    return int(delay)
+
+
+def simulate(firmware, server, clock, link, rate_hz, seconds, request_us, apply_us, tick_us, seed=1):
+    """Browser, link and robot on one virtual timeline; returns a dict of counts and ages."""
+    rng = random.Random(seed)
+    joystick = firmware.joystick
+    joystick.release()
+    joystick.applied = joystick.received = 0
+    firmware.next_joystick_ms = 0
+    tick_ms = firmware.CONTROL_TICK_MS
+
+    interval_us = int(1e6 / rate_hz)
+    end_us = int(seconds * 1e6)
+    next_send = 0
+    in_flight = False
+    reply_at = None
+    arrivals = []          # (arrive_us, sample_us, throttle, steer), in arrival order
+    robot_free = 0
+    next_tick = 0
+    served_sample = None
+    sent = skipped = 0
+    ages = []
+    busy_us = 0
+
+    now = 0
+    while now < end_us:
+        if reply_at is not None and now >= reply_at:
+            in_flight = False
+            reply_at = None
+
+        # The page's setInterval: skipped while the previous request is in flight
+        if now >= next_send:
+            next_send += interval_us
+            if in_flight:
+                skipped += 1
+            else:
+                t = now / 1e6
+                throttle = int(80 * math.sin(2 * math.pi * 0.5 * t))
+                steer = int(60 * math.sin(2 * math.pi * 0.3 * t))
+                # Connect (SYN, SYN-ACK), then the request
+                arrive = now + one_way_us(link, rng) + one_way_us(link, rng) + one_way_us(link, rng)
+                arrivals.append((arrive, now, throttle, steer))
+                in_flight = True
+                sent += 1
+
+        # One robot CPU: a queued request first, otherwise the control tick when it is due
+        if now >= robot_free:
+            clock.us = now
+            if arrivals and arrivals[0][0] <= now:
+                _, sample, throttle, steer = arrivals.pop(0)
+                server.queue(joy_request(throttle, steer))
+                firmware.serve_client(server)
+                served_sample = sample
+                robot_free = now + request_us
+                busy_us += request_us
+                reply_at = robot_free + one_way_us(link, rng)
+            elif now >= next_tick:
+                next_tick = now + tick_ms * 1000
+                applied = joystick.applied
+                firmware.control_tick(now // 1000)
+                cost = tick_us
+                if joystick.applied != applied:
+                    ages.append((now - served_sample) / 1000)
+                    cost += apply_us
+                robot_free = now + cost
+                busy_us += cost
+        now += STEP_US
+
+    ages.sort()
+    pick = lambda q: ages[min(len(ages) - 1, int(len(ages) * q))] if ages else float("nan")
+    return {
+        "sent": sent / seconds,
+        "served": joystick.received / seconds,
+        "applied": joystick.applied / seconds,
+        "skipped": skipped / seconds,
+        "age_p50": pick(0.5),
+        "age_p90": pick(0.9),
+        "cpu": busy_us / end_us * 100,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rates", type=float, nargs="+", default=[10, 20, 50, 100],
+                        help="browser send rates in Hz")
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--cpu-scale", type=float, default=40.0,
+                        help="how many times slower the Pico W runs this code than the host")
+    args = parser.parse_args()
+
+    standins.install()
+    import main as firmware
+    from joystick import Joystick
+    from SimplyRobotics import KitronikSimplyRobotics
+
+    firmware.robot = KitronikSimplyRobotics(lazy=True)
+    firmware.safety_enabled = False
+    firmware.joystick = Joystick(firmware.JOYSTICK_TIMEOUT_MS)
+    server = standins.FakeServer()
+
+    real_stdout = sys.stdout
+    sys.stdout = NullWriter()
+    try:
+        costs, joy_bytes, action_bytes = cpu_costs(firmware, server)
+    finally:
+        sys.stdout = real_stdout
+
+    print("CPU per command on this host:")
+    print("  /joy request        %7.1f us, %5d B response" % (costs["request"], joy_bytes))
+    print("  apply in the tick   %7.1f us" % costs["apply"])
+    print("  idle control tick   %7.1f us" % costs["tick"])
+    print("  ?action= request    %7.1f us, %5d B response" % (costs["action"], action_bytes))
+    request_us = int(costs["request"] * args.cpu_scale)
+    apply_us = int(costs["apply"] * args.cpu_scale)
+    tick_us = int(costs["tick"] * args.cpu_scale)
+    print("Pico W estimate (x%g): %d us per /joy request, at most %d requests/s"
+          % (args.cpu_scale, request_us, 1e6 // max(request_us, 1)))
+    print()
+
+    clock = standins.use_virtual_clock()
+    print("%-5s %7s %8s %8s %8s %8s %9s %9s %6s" % ("link", "rate Hz", "sent/s", "served/s", "motor/s",
+                                                   "skipped", "age p50", "age p90", "CPU %"))
+    sys.stdout = NullWriter()
+    rows = []
+    try:
+        for link in LINKS:
+            for rate_hz in args.rates:
+                rows.append((link[0], rate_hz, simulate(firmware, server, clock, link, rate_hz, args.seconds,
+                                                        request_us, apply_us, tick_us)))
+    finally:
+        sys.stdout = real_stdout
+    for name, rate_hz, r in rows:
+        print("%-5s %7g %8.1f %8.1f %8.1f %8.1f %7.1fms %7.1fms %6.1f"
+              % (name, rate_hz, r["sent"], r["served"], r["applied"], r["skipped"],
+                 r["age_p50"], r["age_p90"], r["cpu"]))
+    print()
+    print("motor/s is capped at 1000 / CONTROL_TICK_MS = %d; skipped counts send slots lost to"
+          " the one-request-in-flight rule" % (1000 // firmware.CONTROL_TICK_MS))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Memory and time comparison of the eager and lazy KitronikSimplyRobotics constructors.
+
+    python3 host/bench_lazy.py [--rounds N] [--pwm-init-us N]
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import standins
+
+
+def measure(build, rounds):
+    """Best-of-rounds wall time and the tracemalloc footprint of one build."""
+    import SimplyRobotics
+    best = None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        board = build()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+        release_all(board)
+
+    del standins.PWM.instances[:]
+    tracemalloc.start()
+    board = build()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    outputs = sum(1 for pwm in standins.PWM.instances if pwm.active)
+    slices = sum(1 for users in SimplyRobotics.pwmSliceUsers if users)
+    release_all(board)
+    return best, current, peak, outputs, slices
+
+
+def release_all(board):
+    for channels in (board.steppers, board.servos, board.motors):
+        for i in range(len(channels)):
+            channels.release(i)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rounds", type=int, default=200)
+    parser.add_argument("--pwm-init-us", type=int, default=0, help="simulated cost of one PWM output")
+    args = parser.parse_args()
+
+    standins.COSTS["pwm_init_us"] = args.pwm_init_us
+    standins.install()
+    from SimplyRobotics import KitronikSimplyRobotics
+
+    def smars():
+        # What main.py actually touches
+        board = KitronikSimplyRobotics(lazy=True)
+        board.motors[0]
+        board.motors[3]
+        return board
+
+    cases = [
+        ("eager", lambda: KitronikSimplyRobotics()),
+        ("lazy", lambda: KitronikSimplyRobotics(lazy=True)),
+        ("lazy + motors 0,3", smars),
+    ]
+    print("%-20s %10s %12s %12s %8s %7s" % ("constructor", "time us", "retained B", "peak B", "outputs", "slices"))
+    for label, build in cases:
+        best, current, peak, outputs, slices = measure(build, args.rounds)
+        print("%-20s %10.1f %12d %12d %8d %7d" % (label, best * 1e6, current, peak, outputs, slices))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Request latency of main.serve_client() at different logging settings.
+
+Console output goes to a stand-in for the Pico's USB serial port that costs
+a fixed time per byte, like a CDC port that blocks while a host is attached.
+
+    python3 host/bench_logging.py [--requests N] [--serial-us-per-byte N]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import standins
+
+REQUESTS = [
+    b"GET /?action=forward HTTP/1.1\r\n\r\n",
+    b"GET /?action=stop HTTP/1.1\r\n\r\n",
+    b"GET / HTTP/1.1\r\n\r\n",
+    b"GET /?action=speed_up HTTP/1.1\r\n\r\n",
+    b"GET /?action=speed_down HTTP/1.1\r\n\r\n",
+]
+
+
+class SerialStandIn:
+    def __init__(self, us_per_byte):
+        self.us_per_byte = us_per_byte
+
+    def write(self, text):
+        standins._spend_us(len(text) * self.us_per_byte)
+        return len(text)
+
+    def flush(self):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--serial-us-per-byte", type=float, default=1.0)
+    args = parser.parse_args()
+
+    standins.install()
+    import log
+    import main as firmware
+    from SimplyRobotics import KitronikSimplyRobotics
+
+    firmware.robot = KitronikSimplyRobotics(lazy=True)
+    firmware.safety_enabled = False
+    server = standins.FakeServer()
+    logger = log.logger
+
+    configs = [
+        ("everything printed", log.DEBUG, log.DEBUG),
+        ("DEBUG stored", log.DEBUG, log.OFF),
+        ("INFO stored+printed", log.INFO, log.INFO),
+        ("WARNING", log.WARNING, log.WARNING),
+        ("off", log.OFF, log.OFF),
+    ]
+
+    real_stdout = sys.stdout
+    sys.stdout = SerialStandIn(args.serial_us_per_byte)
+    results = []
+    try:
+        for label, level, echo_level in configs:
+            logger.level = level
+            logger.echo_level = echo_level
+            logger.clear()
+            samples = []
+            for i in range(args.requests):
+                server.queue(REQUESTS[i % len(REQUESTS)])
+                start = time.perf_counter()
+                firmware.serve_client(server)
+                samples.append(time.perf_counter() - start)
+            samples.sort()
+            results.append((label, sum(samples) / len(samples), samples[len(samples) // 2],
+                            samples[int(len(samples) * 0.99)]))
+    finally:
+        sys.stdout = real_stdout
+
+    print("serial stand-in: %.1f us/byte" % args.serial_us_per_byte)
+    print("%-22s %10s %10s %10s" % ("logging", "mean us", "p50 us", "p99 us"))
+    for label, mean, p50, p99 in results:
+        print("%-22s %10.1f %10.1f %10.1f" % (label, mean * 1e6, p50 * 1e6, p99 * 1e6))
+
+
+if __name__ == "__main__":
+    main()
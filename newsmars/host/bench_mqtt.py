@@ -0,0 +1,239 @@
+"""
+MQTT client throughput, broker outages and the robot end to end, on loopback.
+
+Runs host/mqtt_broker.py in this process and the firmware's mqtt.py client
+against it:
+
+- throughput: messages/s for QoS 0 and 1 at a few payload sizes, with
+  poll() called flat out and once per control tick, plus the cost of a poll;
+- outage: the broker is stopped while the loop keeps publishing; poll()
+  must stay fast, the queue must keep the newest messages, reconnects
+  must back off and the queue must drain once the broker is back;
+- robot: main.main() in a separate process with MQTT_BROKER set; counts
+  telemetry batches and measures command round trips over smars/<id>/cmd.
+
+    python3 host/bench_mqtt.py [--seconds 2] [--sizes 16 128 520] [--no-robot]
+"""
+import argparse
+import atexit
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+import standins
+from mqtt_broker import Broker
+
+TICK_MS = 20
+
+
+def wait(condition, seconds, client=None):
+    """Poll client (if any) until condition() holds; returns whether it did."""
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        if client:
+            client.poll(time.ticks_ms())
+        if condition():
+            return True
+        time.sleep(0.0005)
+    return False
+
+
+def connected_client(port, **kwargs):
+    from mqtt import MQTTClient
+    client = MQTTClient("bench", "127.0.0.1", port, **kwargs)
+    if not wait(client.connected, 5, client):
+        raise SystemExit("no connection to the broker")
+    return client
+
+
+def throughput(port, broker, size, qos, seconds, tick_ms=0):
+    """Publish for seconds; returns (messages/s delivered to the broker, mean poll us, max poll us)."""
+    client = connected_client(port, queue_size=64, out_size=4096)
+    payload = bytes(size)
+    start_count = broker.published
+    polls = []
+    end = time.perf_counter() + seconds
+    start = time.perf_counter()
+    while time.perf_counter() < end:
+        # Keep the queue topped up; per tick only what one tick could send
+        while client.q_len < len(client.q_topic):
+            client.publish("bench/throughput", payload, qos)
+        t = time.perf_counter()
+        client.poll(time.ticks_ms())
+        polls.append((time.perf_counter() - t) * 1e6)
+        if tick_ms:
+            time.sleep(tick_ms / 1000)
+    elapsed = time.perf_counter() - start
+    time.sleep(0.05)
+    delivered = broker.published - start_count
+    client.disconnect()
+    return delivered / elapsed, sum(polls) / len(polls), max(polls)
+
+
+def outage(broker, seconds):
+    """Stop the broker under a publishing loop, then bring it back."""
+    client = connected_client(broker.port, queue_size=16, min_backoff_ms=100, max_backoff_ms=1600)
+    received = []
+    broker.on_publish = lambda topic, payload, qos: received.append(int(payload))
+    broker.stop()
+
+    attempts = []
+    polls = []
+    failures = client.failures
+    sent = 0
+    next_publish = time.perf_counter()
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        if time.perf_counter() >= next_publish:
+            client.publish("bench/outage", str(sent), 1)
+            sent += 1
+            next_publish += 0.05
+        t = time.perf_counter()
+        client.poll(time.ticks_ms())
+        polls.append((time.perf_counter() - t) * 1e6)
+        if client.failures != failures:
+            failures = client.failures
+            attempts.append(time.perf_counter())
+        time.sleep(TICK_MS / 1000)
+
+    broker.start()
+    back = time.perf_counter()
+    drained = wait(lambda: client.connected() and not client.q_len and not client.inflight_id, 10, client)
+    recovered = time.perf_counter() - back
+    client.disconnect()
+    broker.on_publish = None
+
+    gaps = ["%.0f" % ((b - a) * 1000) for a, b in zip(attempts, attempts[1:])]
+    newest = list(range(sent - len(client.q_topic), sent))
+    print("broker down for %.1f s while publishing a QoS 1 message every 50 ms (queue of %d):"
+          % (seconds, len(client.q_topic)))
+    print("  poll(): mean %.1f us, max %.0f us over %d ticks" % (sum(polls) / len(polls), max(polls), len(polls)))
+    print("  failed connects %d, ms between them: %s" % (len(attempts), " ".join(gaps)))
+    print("  published %d, dropped oldest %d; after the broker came back: connected and drained in %.0f ms"
+          % (sent, client.dropped, recovered * 1000))
+    print("  delivered: %s (the newest %d were %s)"
+          % (received, len(newest), "kept" if received[-len(newest):] == newest else "NOT kept"))
+    return drained and received[-len(newest):] == newest and max(polls) < 5000
+
+
+_FIRMWARE_CODE = """
+import io, sys
+sys.path.insert(0, %r)
+import standins
+standins.install()
+import main
+main.HTTP_PORT = %d
+main.STORE_FILE = None
+main.MQTT_BROKER = "127.0.0.1"
+main.MQTT_PORT = %d
+main.MQTT_ROBOT_ID = "bench"
+main.safety_enabled = False
+sys.stdout = io.StringIO()
+main.main()
+"""
+
+
+def start_firmware(broker_port):
+    s = socket.socket()
+    s.bind(("127.0.0.1", 0))
+    port = s.getsockname()[1]
+    s.close()
+    proc = subprocess.Popen([sys.executable, "-c", _FIRMWARE_CODE % (HERE, port, broker_port)])
+    atexit.register(proc.kill)
+    return proc
+
+
+def robot(broker, seconds, commands=50):
+    """The firmware against the broker: telemetry rate and command round trips."""
+    from telemetry import decode
+    batches = []
+    replies = {}
+    status = []
+    lock = threading.Lock()
+
+    def on_publish(topic, payload, qos):
+        with lock:
+            if topic == "smars/bench/telemetry":
+                batches.append((time.perf_counter(), decode(payload)))
+            elif topic == "smars/bench/state":
+                reply = json.loads(payload)
+                replies[reply.get("id")] = (time.perf_counter(), reply)
+            elif topic == "smars/bench/status":
+                status.append(payload.decode())
+
+    broker.on_publish = on_publish
+    proc = start_firmware(broker.port)
+    if not wait(lambda: status, 15):
+        raise SystemExit("the robot did not come online")
+    time.sleep(seconds)
+
+    latencies = []
+    for i in range(commands):
+        action = ("forward", "stop")[i % 2]
+        start = time.perf_counter()
+        broker.publish("smars/bench/cmd", json.dumps({"action": action, "id": i}).encode(), 1)
+        if not wait(lambda: i in replies, 2):
+            break
+        latencies.append((replies[i][0] - start) * 1000)
+    broker.publish("smars/all/cmd", b'{"left": 40, "right": -40, "id": "all"}', 1)
+    wait(lambda: "all" in replies, 2)
+    broker.publish("smars/bench/cmd", b'{"action": "jump", "id": "bad"}', 1)
+    wait(lambda: "bad" in replies, 2)
+    proc.kill()
+    proc.wait()
+    wait(lambda: len(status) > 1, 5)
+    broker.on_publish = None
+
+    span = batches[-1][0] - batches[0][0] if len(batches) > 1 else 0
+    records = sum(len(b[1][2]) for b in batches)
+    latencies.sort()
+    print("robot over MQTT (main.main() in its own process):")
+    print("  telemetry: %d batches, %d records, %.1f records/s, dropped %d"
+          % (len(batches), records, records / span if span else 0, batches[-1][1][1] if batches else 0))
+    if latencies:
+        print("  command round trip over %d commands: p50 %.1f ms, max %.1f ms"
+              % (len(latencies), latencies[len(latencies) // 2], latencies[-1]))
+    print("  smars/all/cmd -> tracks %s; bad command -> %s" % (
+        "%d/%d" % (replies["all"][1]["left"], replies["all"][1]["right"]) if "all" in replies else "no reply",
+        replies["bad"][1] if "bad" in replies else "no reply"))
+    print("  status: %s" % " -> ".join(status))
+    return (len(latencies) == commands and "all" in replies and "error" in replies.get("bad", (0, {}))[1]
+            and status[-1:] == ["offline"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--seconds", type=float, default=2.0)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[16, 128, 520])
+    parser.add_argument("--no-robot", action="store_true")
+    args = parser.parse_args()
+
+    standins.install()
+    broker = Broker()
+    port = broker.start()
+
+    print("%6s %4s %18s %12s %12s %18s" % ("bytes", "qos", "msgs/s flat out", "poll us", "max us",
+                                           "msgs/s per %d ms" % TICK_MS))
+    for size in args.sizes:
+        for qos in (0, 1):
+            rate, mean, worst = throughput(port, broker, size, qos, args.seconds)
+            ticked, _, _ = throughput(port, broker, size, qos, args.seconds, TICK_MS)
+            print("%6d %4d %18.0f %12.1f %12.0f %18.0f" % (size, qos, rate, mean, worst, ticked))
+    print()
+    ok = outage(broker, args.seconds)
+    print()
+    if not args.no_robot:
+        ok = robot(broker, args.seconds) and ok
+    if not ok:
+        print("FAILED")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+Plan and replan time of planner.Planner versus grid size.
+
+Every grid gets random obstacles (--density) and a path from one corner
+to the opposite one. For each size the table shows the planner memory, a
+fresh A* search, the initial D* Lite search, and the D* Lite repair after
+the robot moves one cell and --changes cells near the path get blocked,
+next to a fresh A* search of the same changed grid.
+
+A second table times Planner.sync() on an occupancy map of each size (in
+map cells, planner scale 2) while the robot drives through the stand-in
+room and adds --readings readings between syncs, as main.py does every
+PLAN_INTERVAL_MS: a full rescan of the map next to the sync that only
+visits the cells the map recorded as crossing BLOCKED. Every sync is
+checked against a full rescan.
+
+    python3 host/bench_planner.py [--sizes 20 40 60 80 100] [--density 0.2] [--changes 2]
+                                  [--map-sizes 50 100 200] [--readings 20]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import standins
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, (time.perf_counter() - start) * 1000
+
+
+def build(planner_module, size, density, rng):
+    tracemalloc.start()
+    planner = planner_module.Planner(size, size)
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    for i in range(size * size):
+        if rng.random() < density:
+            planner.blocked[i] = 1
+    start = planner.cell(0, 0)
+    goal = planner.cell(size - 1, size - 1)
+    planner.blocked[start] = 0
+    planner.blocked[goal] = 0
+    return planner, start, goal, memory
+
+
+def sync_times(planner_module, gridmap, size, readings, rounds, rng):
+    """
+    Returns:
+        tuple: (ms of a full rescan, ms of a sync, planner cells changed per sync, mismatches)
+    """
+    room = standins.Room()
+    grid = gridmap.OccupancyGrid(size, size)
+    planner = planner_module.Planner.for_grid(grid, 2)
+    reference = planner_module.Planner.for_grid(grid, 2)
+    full = []
+    synced = []
+    changed = 0
+    mismatches = 0
+    for n in range(rounds):
+        x = -1200 + 2400 * n // rounds
+        y = -600 + 1200 * (n % 4) // 4
+        for _ in range(readings):
+            heading = rng.randrange(360)
+            grid.add_reading(x, y, heading, room.distance(x, y, heading))
+        result, ms = timed(planner.sync)
+        synced.append(ms)
+        changed += result
+        grid.dirty_all = True
+        _, ms = timed(reference.sync)
+        full.append(ms)
+        mismatches += planner.blocked != reference.blocked
+    return sum(full) / rounds, sum(synced) / rounds, changed / rounds, mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[20, 40, 60, 80, 100])
+    parser.add_argument("--density", type=float, default=0.2)
+    parser.add_argument("--changes", type=int, default=2)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--map-sizes", type=int, nargs="+", default=[50, 100, 200], help="map cells per side")
+    parser.add_argument("--readings", type=int, default=20, help="map readings between syncs")
+    args = parser.parse_args()
+
+    standins.install()
+    import gridmap
+    import planner as planner_module
+
+    print("%-9s %9s %9s %9s %9s %9s %9s %9s"
+          % ("grid", "KB", "path", "A* ms", "D* ms", "moves", "repair ms", "A* ms"))
+    for size in args.sizes:
+        rng = random.Random(args.seed)
+        planner, start, goal, memory = build(planner_module, size, args.density, rng)
+        # Retry with other obstacles until there is a path
+        while planner.plan(start, goal) == 0:
+            planner, start, goal, memory = build(planner_module, size, args.density, rng)
+
+        length, astar_ms = timed(planner.plan, start, goal)
+        _, dstar_ms = timed(planner.start_incremental, start, goal)
+
+        repairs = []
+        fresh = []
+        moves = 0
+        while planner.path_length > 2 and moves < 10:
+            start = planner.path[1]
+            ahead = [planner.path[i] for i in range(2, min(planner.path_length - 1, 12))]
+            for cell in rng.sample(ahead, min(args.changes, len(ahead))):
+                planner.set_blocked(cell, 1)
+            _, ms = timed(planner.replan, start)
+            repairs.append(ms)
+
+            reference = planner_module.Planner(size, size)
+            reference.blocked[:] = planner.blocked
+            _, ms = timed(reference.plan, start, goal)
+            fresh.append(ms)
+            moves += 1
+
+        print("%-9s %9.1f %9d %9.2f %9.2f %9d %9.2f %9.2f"
+              % ("%dx%d" % (size, size), memory / 1024, length, astar_ms, dstar_ms, moves,
+                 sum(repairs) / max(1, len(repairs)), sum(fresh) / max(1, len(fresh))))
+
+    print()
+    print("%-9s %9s %9s %9s %9s" % ("map", "cells", "full ms", "sync ms", "changed"))
+    failed = False
+    for size in args.map_sizes:
+        rng = random.Random(args.seed)
+        full_ms, sync_ms, changed, mismatches = sync_times(planner_module, gridmap, size, args.readings, 40, rng)
+        print("%-9s %9d %9.2f %9.3f %9.1f" % ("%dx%d" % (size, size), size * size, full_ms, sync_ms, changed))
+        if mismatches:
+            print("FAIL: %dx%d: %d syncs differ from a full rescan" % (size, size, mismatches))
+            failed = True
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
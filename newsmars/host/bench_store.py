@@ -0,0 +1,226 @@
+"""
+Flash wear of the persistent state store (store.py) against simpler ways to save state.
+
+A simulated driving session changes the speed in bursts of button presses
+and toggles the safety now and then, while the calibration and Wi-Fi
+credentials sit in the store as well. Every strategy runs the same session
+on a fake flash that charges each operation what littlefs would do with it:
+
+- a new or rewritten file: its data, rounded up to prog units, in a freshly
+  erased block, plus a metadata commit; files up to INLINE bytes live in the
+  metadata log instead of a block of their own;
+- appending to a file: littlefs copies the used part of the last block to a
+  new block before adding the new bytes, plus a metadata commit;
+- rename and remove: a metadata commit. Metadata erases are counted as the
+  share of a block the commits fill.
+
+Write amplification is bytes programmed per byte the firmware wrote. The
+lifetime assumes littlefs spreads the erases over --free-blocks blocks.
+
+The session runs twice: with a short calibration, and with a full one (points
+every 5 speeds for both tracks, from calibrate_odometry.py) plus an OTA key,
+whose values alone are larger than the default 512 B log. The second table
+also shows the log compacting at a fixed max_bytes, which then rewrites every
+value at every flush.
+
+    python3 host/bench_store.py [--minutes 60] [--cycles 100000] [--free-blocks 150]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+import standins
+
+# MicroPython's littlefs on the rp2: prog size 32, cache 128, which also bounds inline files
+PROG = 32
+INLINE = 128
+METADATA_COMMIT = 64
+TICK_MS = 20
+
+CALIBRATION = {"points": [[0, 0], [40, 180], [70, 330], [100, 460]], "track_mm": 118, "forward": "r",
+               "left_points": [[0, 0], [40, 176], [70, 326], [100, 455]]}
+WIFI = {"ssid": "FieldNet", "password": "fieldpass1"}
+FULL_CALIBRATION = {"points": [[s, s * 46 // 10 - 4 * (s > 0)] for s in range(0, 101, 5)],
+                    "left_points": [[s, s * 455 // 100 - 5 * (s > 0)] for s in range(0, 101, 5)],
+                    "track_mm": 118, "forward": ["r", "r"]}
+OTA_KEY = "3f9c2a7e51d84b06a9e7c1d2f4b85e3a"
+
+
+def _progs(size):
+    return (size + PROG - 1) // PROG * PROG
+
+
+class LittleFsFlash(standins.FakeFlash):
+    """FakeFlash that adds up what littlefs would program and erase."""
+
+    def __init__(self):
+        super().__init__()
+        self.written = 0
+        self.programmed = 0
+        self.data_erases = 0
+        self.metadata = 0
+
+    def _commit(self, size=0):
+        self.metadata += METADATA_COMMIT + _progs(size)
+        self.programmed += METADATA_COMMIT + _progs(size)
+
+    def closed(self, file):
+        size = len(self.files[file.path])
+        added = size - file.start
+        self.written += added
+        if size <= INLINE:
+            # The whole inline file goes into the commit again
+            self._commit(size)
+            return
+        if file.start <= INLINE:
+            copied, new = 0, size
+        else:
+            copied, new = file.start % self.BLOCK, added
+        programmed = _progs(copied + new)
+        self.programmed += programmed
+        self.data_erases += (programmed + self.BLOCK - 1) // self.BLOCK
+        self._commit()
+
+    def rename(self, old, new):
+        super().rename(old, new)
+        self._commit()
+
+    def remove(self, path):
+        super().remove(path)
+        self._commit()
+
+    def erases(self):
+        return self.data_erases + self.metadata / self.BLOCK
+
+
+def session(minutes, seed=1):
+    """[(ms, key, value)] of a drive: bursts of speed presses, the safety toggled now and then."""
+    rng = random.Random(seed)
+    events = []
+    now = 0
+    speed = 50
+    safety = True
+    end = minutes * 60000
+    while now < end:
+        now += rng.randint(3000, 40000)
+        if rng.random() < 0.1:
+            safety = not safety
+            events.append((now, "safety", safety))
+            continue
+        step = rng.choice((-10, 10))
+        for _ in range(rng.randint(1, 6)):
+            speed = max(0, min(100, speed + step))
+            now += rng.randint(120, 400)
+            events.append((now, "speed", speed))
+    return events
+
+
+class JsonFile:
+    """Every change rewrites one JSON file through a temporary file and a rename."""
+
+    def __init__(self, store_module, path):
+        self.os = store_module.os
+        self.open = store_module.open
+        self.path = path
+        self.values = {}
+
+    def set(self, key, value):
+        if self.values.get(key) == value:
+            return
+        self.values[key] = value
+        tmp = self.path + ".tmp"
+        with self.open(tmp, "w") as f:
+            f.write(json.dumps(self.values))
+        self.os.rename(tmp, self.path)
+
+    def flush(self, now=None):
+        return False
+
+
+def run(make, events, store_module, stored):
+    flash = LittleFsFlash()
+    flash.attach(store_module)
+    target = make()
+    for key, value in stored.items():
+        target.set(key, value)
+    target.flush()
+    flash.written = flash.programmed = flash.data_erases = flash.metadata = 0
+
+    changes = 0
+    i = 0
+    end = events[-1][0] + 10000
+    for now in range(0, end, TICK_MS):
+        while i < len(events) and events[i][0] <= now:
+            _, key, value = events[i]
+            changes += target.values.get(key) != value
+            target.set(key, value)
+            i += 1
+        target.flush(now)
+    target.flush()
+    return flash, changes, target
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--minutes", type=int, default=60, help="length of the simulated session")
+    parser.add_argument("--cycles", type=int, default=100000, help="erase cycles a flash block lasts")
+    parser.add_argument("--free-blocks", type=int, default=150, help="blocks littlefs levels the wear over")
+    args = parser.parse_args()
+
+    standins.install()
+    import store as store_module
+    events = session(args.minutes)
+
+    class FixedLimit(store_module.Store):
+        """The log compacting whenever it would pass max_bytes, however large the values are."""
+
+        def compact(self):
+            super().compact()
+            self.compacted = 0
+
+    small = {"speed": 50, "safety": True, "odometry": CALIBRATION, "wifi": WIFI}
+    full = dict(small, odometry=FULL_CALIBRATION, ota_key=OTA_KEY)
+    full_strategies = [
+        ("log 512 B, 2 s batches", lambda: store_module.Store("state.log", 512, 2000)),
+        ("fixed 512 B, 2 s batches", lambda: FixedLimit("state.log", 512, 2000)),
+        ("log 2048 B, 2 s batches", lambda: store_module.Store("state.log", 2048, 2000)),
+    ]
+
+    strategies = [("json file per change", lambda: JsonFile(store_module, "state.json"))]
+    strategies.append(("log, flush per change", lambda: store_module.Store("state.log", 1024, 0)))
+    for max_bytes in (256, 512, 1024, 2048, 4096):
+        strategies.append(("log %d B, 2 s batches" % max_bytes,
+                           lambda m=max_bytes: store_module.Store("state.log", m, 2000)))
+    for flush_ms in (500, 5000):
+        strategies.append(("log 512 B, %.1f s batches" % (flush_ms / 1000),
+                           lambda f=flush_ms: store_module.Store("state.log", 512, f)))
+
+    print("%d button presses in %d minutes; prog %d B, inline up to %d B, block %d B"
+          % (len(events), args.minutes, PROG, INLINE, LittleFsFlash.BLOCK))
+    for stored, table in ((small, strategies), (full, full_strategies)):
+        rows = []
+        for label, make in table:
+            flash, changes, target = run(make, events, store_module, stored)
+            writes = target.appends + target.compactions if hasattr(target, "appends") else changes
+            rows.append((label, writes, flash))
+        print()
+        print("%d B of stored values, %d changes" % (len(json.dumps(stored)), changes))
+        print("%-26s %7s %9s %10s %6s %9s %10s" % ("strategy", "writes", "written", "programmed", "ampl.",
+                                                    "erases", "lifetime"))
+        for label, writes, flash in rows:
+            erases = flash.erases()
+            hours = args.minutes / 60
+            years = args.cycles * args.free_blocks / erases * hours / 24 / 365 if erases else float("inf")
+            print("%-26s %7d %7d B %8d B %5.1fx %9.1f %5.0f years"
+                  % (label, writes, flash.written, flash.programmed, flash.programmed / max(flash.written, 1),
+                     erases, years))
+    print()
+    print("lifetime: driving around the clock, %d cycles over %d blocks" % (args.cycles, args.free_blocks))
+
+
+if __name__ == "__main__":
+    main()
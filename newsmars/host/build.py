@@ -0,0 +1,175 @@
+"""
+Build the newsmars deployment set for the Pico.
+
+Every firmware module is stripped of print() calls, cross-compiled to .mpy
+with mpy-cross and written to build/deploy/ together with a tiny main.py
+that imports the compiled application. With --manifest the stripped sources
+are written to build/frozen/ with a manifest.py for freezing them into a
+custom MicroPython firmware instead. A per-module size and import time
+report is printed at the end.
+
+    pip install mpy-cross
+    python3 host/build.py [--manifest] [--keep-prints] [--out DIR]
+
+Copy the contents of build/deploy/ to the Pico (for example with
+`mpremote cp -r build/deploy/* :`).
+"""
+import argparse
+import ast
+import os
+import re
+import shutil
+import subprocess
+import sys
+import zipfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+NEWSMARS_DIR = os.path.dirname(HERE)
+
+# Standalone test programs and stale copies are not part of the firmware
+EXCLUDE = {"main_2.py"}
+# Edited on the device, or run by MicroPython only as a .py file, so shipped as source
+KEEP_SOURCE = {"secrets.py", "boot.py"}
+# main.py has to stay a .py file, so the application is compiled under this name
+APP_MODULE = "app"
+MAIN_STUB = "from %s import main\nmain()\n" % APP_MODULE
+# RP2040 is a Cortex-M0+
+MPY_ARCH = "armv6m"
+
+
+def firmware_modules():
+    names = []
+    for name in sorted(os.listdir(NEWSMARS_DIR)):
+        if not name.endswith(".py") or name in EXCLUDE or name.startswith("test_"):
+            continue
+        names.append(name)
+    return names
+
+
+def strip_prints(source):
+    """
+    Replace every statement that is a bare print(...) call with pass.
+
+    Lines are blanked rather than removed so tracebacks from the device still
+    point at the right line of the original file. pass compiles to nothing.
+    """
+    tree = ast.parse(source)
+    lines = source.splitlines(True)
+    spans = []
+    for node in ast.walk(tree):
+        if (isinstance(node, ast.Expr) and isinstance(node.value, ast.Call)
+                and isinstance(node.value.func, ast.Name) and node.value.func.id == "print"):
+            spans.append((node.lineno, node.col_offset, node.end_lineno, node.end_col_offset))
+
+    for start, col, end, end_col in sorted(spans, reverse=True):
+        first, last = lines[start - 1], lines[end - 1]
+        # Only strip statements that own their lines
+        if first[:col].strip() or last[end_col:].strip() not in ("", "\\"):
+            continue
+        if last[end_col:].strip().startswith("#"):
+            continue
+        newline = "\r\n" if last.endswith("\r\n") else "\n"
+        lines[start - 1] = first[:col] + "pass" + newline
+        for i in range(start, end):
+            lines[i] = newline
+    return "".join(lines)
+
+
+def find_mpy_cross():
+    exe = shutil.which("mpy-cross")
+    if exe:
+        return [exe]
+    try:
+        import mpy_cross
+        return [mpy_cross.mpy_cross]
+    except (ImportError, SystemExit):
+        return None
+
+
+def import_times(staging, modules):
+    """Host import time (compile + run) of each stripped module, in microseconds."""
+    names = [m[:-3] for m in modules if m != "main.py"] + ["main"]
+    code = ("import sys; sys.path.insert(0, %r); import standins; standins.install(); "
+            "sys.path.insert(0, %r)\n" % (HERE, staging))
+    code += "".join("import %s\n" % name for name in names)
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE="1")
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                          capture_output=True, text=True, env=env)
+    times = {}
+    for line in proc.stderr.splitlines():
+        match = re.match(r"import time:\s+(\d+) \|\s+\d+ \|\s*(\S+)$", line)
+        if match and match.group(2) in names:
+            times[match.group(2)] = int(match.group(1))
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--out", default=os.path.join(NEWSMARS_DIR, "build"), help="output directory")
+    parser.add_argument("--manifest", action="store_true", help="write a frozen-module manifest instead of .mpy files")
+    parser.add_argument("--keep-prints", action="store_true", help="do not strip print() calls")
+    args = parser.parse_args()
+
+    mpy_cross = None
+    if not args.manifest:
+        mpy_cross = find_mpy_cross()
+        if mpy_cross is None:
+            sys.exit("mpy-cross not found: pip install mpy-cross, or use --manifest")
+
+    staging = os.path.join(args.out, "stripped")
+    target = os.path.join(args.out, "frozen" if args.manifest else "deploy")
+    for path in (staging, target):
+        shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path)
+
+    modules = firmware_modules()
+    report = []
+    for name in modules:
+        with open(os.path.join(NEWSMARS_DIR, name), newline="") as f:
+            source = f.read()
+        stripped = source if args.keep_prints else strip_prints(source)
+        with open(os.path.join(staging, name), "w", newline="") as f:
+            f.write(stripped)
+
+        out_name = APP_MODULE + ".py" if name == "main.py" else name
+        if args.manifest or name in KEEP_SOURCE:
+            shutil.copy(os.path.join(staging, name), os.path.join(target, out_name))
+            built = os.path.join(target, out_name)
+        else:
+            built = os.path.join(target, out_name[:-3] + ".mpy")
+            subprocess.run(mpy_cross + ["-march=" + MPY_ARCH, "-s", name, "-o", built,
+                                        os.path.join(staging, name)], check=True)
+        report.append((name, len(source.encode()), len(stripped.encode()), os.path.getsize(built)))
+
+    if args.manifest:
+        with open(os.path.join(target, "manifest.py"), "w") as f:
+            f.write("# Frozen newsmars modules, include from your board manifest\n")
+            for name in modules:
+                if name in KEEP_SOURCE:
+                    continue
+                out_name = APP_MODULE + ".py" if name == "main.py" else name
+                f.write('module("%s", base_path="%s", opt=3)\n' % (out_name, os.path.abspath(target)))
+        # The stub is copied to the Pico, the rest lives in firmware
+        with open(os.path.join(target, "main.py"), "w") as f:
+            f.write(MAIN_STUB)
+    else:
+        with open(os.path.join(target, "main.py"), "w") as f:
+            f.write(MAIN_STUB)
+        archive = os.path.join(args.out, "newsmars-deploy.zip")
+        with zipfile.ZipFile(archive, "w", zipfile.ZIP_DEFLATED) as z:
+            for name in sorted(os.listdir(target)):
+                z.write(os.path.join(target, name), name)
+
+    times = import_times(staging, modules)
+    print("%-20s %10s %10s %10s %12s" % ("module", "source B", "stripped B", "output B", "host import us"))
+    totals = [0, 0, 0]
+    for name, source_size, stripped_size, built_size in report:
+        print("%-20s %10d %10d %10d %12s" % (name, source_size, stripped_size, built_size,
+                                             times.get(name[:-3], "-")))
+        totals = [totals[0] + source_size, totals[1] + stripped_size, totals[2] + built_size]
+    print("%-20s %10d %10d %10d" % ("total", totals[0], totals[1], totals[2]))
+    print("\nOutput in %s" % target)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+"""
+Fit the odometry speed-to-velocity table from recorded runs.
+
+Record sessions (RECORD_FILE in main.py) in which the robot drives
+straight towards or away from a wall at a few different speeds. Every
+stretch in which both motors run in the same direction at the same speed
+gives one velocity: the slope of the measured wall distance over time,
+fitted by least squares. Runs measured by hand can be added as a CSV file
+of "speed,mm,seconds" lines.
+
+    python3 host/calibrate_odometry.py session1.bin session2.bin [--runs runs.csv] [--out odometry.json]
+    python3 host/calibrate_odometry.py session.bin --profile profile.json
+    python3 host/calibrate_odometry.py --simulate
+
+With --profile the drive motors, their forward directions and the PWM
+bands come from the robot profile the sessions were recorded with.
+
+Copy the result to the robot with `mpremote cp odometry.json :`.
+--simulate records simulated runs with known motor velocities and fits
+them, to check the fitting.
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import standins
+
+# Readings this long after a speed change are skipped while the robot accelerates
+SETTLE_MS = 300
+# Fits with fewer readings or a worse straight-line fit are dropped
+MIN_READINGS = 5
+MIN_R2 = 0.9
+
+
+def fit_line(points):
+    """Least-squares slope and r^2 of (x, y) points."""
+    n = len(points)
+    mean_x = sum(x for x, _ in points) / n
+    mean_y = sum(y for _, y in points) / n
+    sxx = sum((x - mean_x) ** 2 for x, _ in points)
+    sxy = sum((x - mean_x) * (y - mean_y) for x, y in points)
+    syy = sum((y - mean_y) ** 2 for _, y in points)
+    if sxx == 0 or syy == 0:
+        return 0.0, 0.0
+    return sxy / sxx, sxy * sxy / (sxx * syy)
+
+
+def segments(records, recorder, left, right, forward):
+    """
+    Yield ("forward" or "reverse", speed, [(t_ms, mm), ...]) for every
+    straight stretch: both motors at one speed, in the (left, right)
+    directions of forward or the opposite ones.
+    """
+    reverse = tuple("f" if d == "r" else "r" for d in forward)
+    motors = {}
+    current = None
+    start_ms = 0
+    readings = []
+    for t_ms, kind, arg8, arg16 in records:
+        if kind == recorder.REC_MOTOR:
+            motors[arg8] = (recorder.DIRECTIONS[arg16 >> 8], arg16 & 0xFF)
+            l, r = motors.get(left), motors.get(right)
+            straight = None
+            if l and r and l[1] == r[1] and (l[0], r[0]) in (forward, reverse):
+                straight = ("forward" if (l[0], r[0]) == forward else "reverse", l[1])
+            if straight != current:
+                if current:
+                    yield current[0], current[1], readings
+                current = straight
+                start_ms = t_ms
+                readings = []
+        elif kind == recorder.REC_DISTANCE and current and arg16 != recorder.NO_DISTANCE:
+            if t_ms - start_ms >= SETTLE_MS:
+                readings.append((t_ms, arg16))
+    if current:
+        yield current[0], current[1], readings
+
+
+def fit_logs(paths, left, right, forward):
+    """Velocity samples per speed from session logs; forward is the (left, right) directions."""
+    import recorder
+
+    samples = {}
+    for path in paths:
+        with open(path, "rb") as f:
+            records = recorder.read_log(f.read())
+        for direction, speed, readings in segments(records, recorder, left, right, forward):
+            if len(readings) < MIN_READINGS:
+                continue
+            slope, r2 = fit_line(readings)
+            # Driving forward closes in on the wall ahead
+            velocity = -slope * 1000 if direction == "forward" else slope * 1000
+            if r2 < MIN_R2 or velocity <= 0:
+                print("  %s: skipped %s %d%%: r2 %.2f, %.0f mm/s" % (path, direction, speed, r2, velocity))
+                continue
+            samples.setdefault(speed, []).append(velocity)
+    return samples
+
+
+def read_runs(path, samples):
+    with open(path) as f:
+        for line in f:
+            line = line.split("#")[0].strip()
+            if not line:
+                continue
+            speed, mm, seconds = (float(v) for v in line.split(","))
+            samples.setdefault(int(speed), []).append(mm / seconds)
+
+
+def simulate(path, true_points, seed):
+    """Record runs towards a wall with motors following true_points."""
+    standins.install()
+    clock = standins.use_virtual_clock()
+    import main as firmware
+    import odometry
+    import recorder
+    from sonar import SonarArray
+    from SimplyRobotics import KitronikSimplyRobotics
+
+    rng = random.Random(seed)
+    truth = odometry.build_table(true_points)
+    firmware.robot = KitronikSimplyRobotics(lazy=True)
+    firmware.sonar = SonarArray([("sensor", firmware.SENSOR_TRIGGER_PIN, firmware.SENSOR_ECHO_PIN, 90, 0)],
+                                firmware.SONAR_MAX_CM, firmware.SENSOR_INTERVAL_MS)
+    standins.answer_pings(firmware.sonar, clock)
+    firmware.safety_enabled = False
+    firmware.recorder = recorder.Recorder(path)
+    left = firmware.robot.motors[firmware.MOTOR_LEFT]
+    wall = [0.0]
+
+    def echo(pin):
+        return standins.echo_for_distance(max(2.0, wall[0] + rng.gauss(0, 3)) / 10)
+    sys.modules["machine"].echo_model = echo
+
+    now = 0
+    for speed in (10, 12, 14, 15, 17, 19, 20, 30, 50, 70, 100):
+        firmware.current_speed = speed
+        for action in ("forward", "reverse"):
+            wall[0] = 300.0 if action == "forward" else 100.0
+            firmware.apply_action(action)
+            # Slow runs need longer to travel well beyond the sensor noise
+            run_ms = 1500 if speed >= 15 else 4000
+            for tick in range(run_ms // firmware.CONTROL_TICK_MS):
+                # Motors spin up over 100 ms
+                spin_up = min(1.0, tick * firmware.CONTROL_TICK_MS / 100)
+                moving = truth[int(left.speed)] * spin_up
+                wall[0] += (-moving if action == "forward" else moving) * firmware.CONTROL_TICK_MS / 1000
+                now += firmware.CONTROL_TICK_MS
+                clock.set_ms(now)
+                firmware.control_tick(now)
+            firmware.apply_action("stop")
+            now += 500
+            clock.set_ms(now)
+    firmware.save_log()
+    return truth
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("logs", nargs="*", help="session logs from recorder.py")
+    parser.add_argument("--runs", help="CSV of speed,mm,seconds runs measured by hand")
+    parser.add_argument("--left", type=int, default=0, help="left motor number (MOTOR_LEFT)")
+    parser.add_argument("--right", type=int, default=3, help="right motor number (MOTOR_RIGHT)")
+    parser.add_argument("--forward", default="r", help="motor direction that drives forward")
+    parser.add_argument("--profile", help="robot profile; replaces --left, --right and --forward")
+    parser.add_argument("--track-mm", type=int, default=80)
+    parser.add_argument("--out", default="odometry.json")
+    parser.add_argument("--simulate", action="store_true", help="fit simulated runs")
+    args = parser.parse_args()
+
+    standins.install()
+    import odometry
+    import profiles
+
+    left, right, forward = args.left, args.right, (args.forward, args.forward)
+    tables = None
+    if args.profile:
+        profile, errors = profiles.load(args.profile)
+        if errors:
+            parser.error("%s: %s" % (args.profile, "; ".join(errors)))
+        left, right, forward = profile.left, profile.right, profile.forward
+        tables = profile.motor_tables()[left]
+
+    truth = None
+    logs = list(args.logs)
+    if args.simulate:
+        true_points = [(0, 0), (10, 12), (14, 22), (15, 33), (19, 50), (20, 44), (60, 130), (100, 190)]
+        path = os.path.join(tempfile.mkdtemp(), "simulated_runs.bin")
+        truth = simulate(path, true_points, 1)
+        logs.append(path)
+
+    samples = fit_logs(logs, left, right, forward)
+    if args.runs:
+        read_runs(args.runs, samples)
+    if not samples:
+        parser.error("no usable straight runs")
+
+    points = [(0, 0)] + [(speed, round(statistics.median(v))) for speed, v in sorted(samples.items())]
+    table = odometry.build_table(points, tables)
+    print("%6s %6s %8s %8s" % ("speed", "Hz", "runs", "mm/s") + ("   true" if truth else ""))
+    for speed, velocities in sorted(samples.items()):
+        hz = tables[0][speed] if tables else odometry.BANDS[odometry.band_of(speed)][1]
+        line = "%6d %6d %8d %8d" % (speed, hz, len(velocities), table[speed])
+        if truth:
+            line += " %6d" % truth[speed]
+        print(line)
+
+    with open(args.out, "w") as f:
+        json.dump({"points": points, "track_mm": args.track_mm, "forward": list(forward)}, f)
+    print("wrote", args.out)
+
+
+if __name__ == "__main__":
+    main()
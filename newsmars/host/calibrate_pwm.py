@@ -0,0 +1,362 @@
+"""
+Pick a PWM frequency and deadband per speed band for each motor.
+
+A small brushed gear motor driven by PWM trades two things off against
+the frequency. At a low frequency every pulse lets the current rise all
+the way, so even short pulses kick the motor through its static friction:
+lots of torque at low speeds, but the current (and the copper loss) ripples
+hard. At a high frequency the current is smooth and the motor efficient,
+but it barely rises during short pulses, so the motor needs a larger duty
+before it moves at all.
+
+This tool simulates a motor (an RL circuit with back-EMF, coasting between
+pulses, static and rolling friction) at every candidate frequency and
+duty. For every speed 1-100 it picks the most efficient frequency that
+still leaves --margin times the static friction as stall torque, merges
+the result into [first speed, Hz, deadband] bands and writes them into the
+motors of a robot profile. Start duties measured on the real robot can be
+given as a CSV file of "motor,hz,start_duty" lines; they replace the
+simulated deadband for that motor and limit it to the measured
+frequencies. The comparison table shows the simulated speed, efficiency and
+stall torque of the board's fixed bands next to the calibrated bands.
+
+    python3 host/calibrate_pwm.py [--profile profile.json] [--measured starts.csv] [--motors 0 3]
+
+Copy the result to the robot with `mpremote cp profile.json :`.
+"""
+import argparse
+import json
+import math
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import standins
+
+CANDIDATE_HZ = [20, 50, 100, 200, 500, 1000, 2000, 5000, 10000]
+SWEEP_DUTIES = list(range(0, 101, 5))
+# A motor turning slower than this (fraction of full speed) counts as stalled
+MOVING = 0.01
+# Efficiency (0-1) another frequency must add before it gets a band of its own
+MIN_GAIN = 0.03
+# Longest step over which the motor speed is held constant
+MAX_STEP_S = 0.001
+
+
+class MotorModel:
+    """
+    A brushed DC motor on one H-bridge output, seen at the motor shaft. The
+    bridge drives the supply voltage during a pulse and coasts (fast decay,
+    the current returning to the supply) between pulses. The friction of
+    gears and tracks is the load.
+    """
+
+    def __init__(self, volts=6.0, ohms=8.0, henry=0.002, kt=0.0028, inertia=1e-7,
+                 static_nm=0.0006, rolling_nm=0.0004, viscous=2e-7):
+        self.volts = volts
+        self.ohms = ohms
+        self.tau = henry / ohms
+        self.kt = kt
+        self.inertia = inertia
+        self.static_nm = static_nm
+        self.rolling_nm = rolling_nm
+        self.viscous = viscous
+
+    def _current(self, i, omega, volts, t):
+        """Current after t seconds and its mean, with the speed held at omega."""
+        target = (volts - self.kt * omega) / self.ohms
+        decay = math.exp(-t / self.tau)
+        mean = target + (i - target) * (1 - decay) * self.tau / t
+        return target + (i - target) * decay, mean
+
+    def _phase(self, i, omega, on, t):
+        """One pulse or gap. Returns (current, mean current, supply energy)."""
+        if on:
+            i, mean = self._current(i, omega, self.volts, t)
+            return i, mean, self.volts * mean * t
+        if i <= 0:
+            return 0.0, 0.0, 0.0
+        # Coasting: the current runs back into the supply until it reaches zero
+        target = (-self.volts - self.kt * omega) / self.ohms
+        zero_at = self.tau * math.log((i - target) / -target)
+        if zero_at >= t:
+            i, mean = self._current(i, omega, -self.volts, t)
+            return i, mean, -self.volts * mean * t
+        _, mean = self._current(i, omega, -self.volts, zero_at)
+        return 0.0, mean * zero_at / t, -self.volts * mean * zero_at
+
+    def _turn(self, omega, current, t):
+        torque = self.kt * current
+        if omega == 0 and torque <= self.static_nm:
+            return 0.0
+        omega += (torque - self.rolling_nm - self.viscous * omega) / self.inertia * t
+        return max(0.0, omega)
+
+    def run(self, hz, duty, settle_s=0.5, measure_s=0.5):
+        """
+        Drive from rest at hz and duty (0-100).
+
+        Returns:
+            tuple: (mean speed in rad/s, efficiency 0-1, speed ripple as
+                a fraction of the mean speed) once settled
+        """
+        period = 1.0 / hz
+        phases = [(True, period * duty / 100), (False, period * (1 - duty / 100))]
+        i = omega = 0.0
+        t = measured = energy_in = work = distance = 0.0
+        slowest = fastest = None
+        while t < settle_s + measure_s:
+            for on, length in phases:
+                steps = max(1, int(math.ceil(length / MAX_STEP_S)))
+                for _ in range(steps if length > 0 else 0):
+                    dt = length / steps
+                    i, mean, energy = self._phase(i, omega, on, dt)
+                    before = omega
+                    omega = self._turn(omega, mean, dt)
+                    if t >= settle_s:
+                        energy_in += energy
+                        # The friction the motor overcomes is the useful work
+                        speed = (before + omega) / 2
+                        work += (self.rolling_nm + self.viscous * speed) * speed * dt
+                        distance += speed * dt
+                        measured += dt
+                        slowest = omega if slowest is None else min(slowest, omega)
+                        fastest = omega if fastest is None else max(fastest, omega)
+            t += period
+        if energy_in <= 0 or distance <= 0:
+            return 0.0, 0.0, 0.0
+        mean = distance / measured
+        return mean, min(1.0, work / energy_in), (fastest - slowest) / mean
+
+    def stall_torque(self, hz, duty, periods=20):
+        """Peak torque with the shaft held still: what breaks it free of static friction."""
+        off_s = (1 - duty / 100) / hz
+        i = peak = 0.0
+        for _ in range(periods if duty else 0):
+            i, _, _ = self._phase(i, 0.0, True, duty / 100 / hz)
+            peak = i
+            if off_s > 0:
+                i, _, _ = self._phase(i, 0.0, False, off_s)
+        return self.kt * peak
+
+    def free_speed(self):
+        return self.run(max(CANDIDATE_HZ), 100)[0]
+
+
+def deadband(model, hz):
+    """Smallest whole duty at which the motor starts from rest."""
+    top = model.free_speed()
+    low, high = 0, 100
+    while low < high:
+        mid = (low + high) // 2
+        if model.run(hz, mid)[0] > MOVING * top:
+            high = mid
+        else:
+            low = mid + 1
+    return low
+
+
+def curves(model, frequencies):
+    """Per frequency: deadband and (duty, speed, efficiency) sweep points."""
+    result = {}
+    for hz in frequencies:
+        start = deadband(model, hz)
+        duties = sorted(set([start] + [d for d in SWEEP_DUTIES if d > start]))
+        result[hz] = (start, [(d,) + model.run(hz, d) for d in duties])
+    return result
+
+
+def at_speed(points, speed):
+    """Interpolated (duty, efficiency, ripple) that reaches speed (rad/s), or None."""
+    for (d0, s0, e0, r0), (d1, s1, e1, r1) in zip(points, points[1:]):
+        if s0 <= speed <= s1 and s1 > s0:
+            f = (speed - s0) / (s1 - s0)
+            return d0 + f * (d1 - d0), e0 + f * (e1 - e0), r0 + f * (r1 - r0)
+    return None
+
+
+def fit_deadband(points, top, speeds):
+    """
+    The deadband whose straight duty line (deadband at speed 0, 100% at
+    speed 100) best matches the duties the speeds need, so the speed
+    follows the command across band changes.
+    """
+    num = den = 0.0
+    for speed in speeds:
+        point = at_speed(points, top * speed / 100)
+        if point is not None:
+            weight = 1 - speed / 100
+            num += weight * (point[0] - speed)
+            den += weight * weight
+    return max(0, min(99, int(round(num / den)))) if den else points[0][0]
+
+
+def choose_bands(model, sweeps, margin, deadbands=None):
+    """
+    Pick a frequency per speed 1-100 and merge equal neighbours into bands.
+
+    Speed n is n% of full speed. Of the frequencies whose peak stall torque
+    is at least margin times the static friction at the duty that speed
+    needs, the most efficient wins (by at least MIN_GAIN, so near-equal
+    frequencies don't add bands); if none is, the strongest. Frequencies
+    only go up with speed, so a speed ramp crosses each band once.
+
+    Returns:
+        list: [first speed, Hz, deadband] bands; measured deadbands are
+            kept, the others fitted with fit_deadband()
+    """
+    top = max(points[-1][1] for _, points in sweeps.values())
+    deadbands = deadbands or {}
+    chosen = []
+    floor = min(sweeps)
+    for speed in range(1, 101):
+        scores = {}
+        for hz, (start, points) in sweeps.items():
+            point = at_speed(points, top * speed / 100) if hz >= floor else None
+            if point is not None:
+                torque = model.stall_torque(hz, point[0])
+                strong = torque >= margin * model.static_nm
+                scores[hz] = (strong, point[1] if strong else torque)
+        if scores:
+            best = max(scores, key=lambda hz: (scores[hz], -hz))
+            current = scores.get(floor)
+            if (current is None or not current[0] or not scores[best][0]
+                    or scores[best][1] > current[1] + MIN_GAIN):
+                floor = best
+        chosen.append(floor)
+
+    bands = []
+    for speed in range(1, 101):
+        hz = chosen[speed - 1]
+        if not bands or bands[-1][1] != hz:
+            bands.append([speed if bands else 0, hz, []])
+        bands[-1][2].append(speed)
+    for band in bands:
+        hz = band[1]
+        band[2] = deadbands[hz] if hz in deadbands else fit_deadband(sweeps[hz][1], top, band[2])
+    return bands
+
+
+def evaluate(model, hz_for, duty_for, speeds):
+    """Simulated (speed, Hz, duty, % of full speed, efficiency %, ripple %, stall torque) rows."""
+    top = model.free_speed()
+    rows = []
+    for speed in speeds:
+        hz = hz_for(speed)
+        duty = duty_for(speed)
+        moving, efficiency, ripple = model.run(hz, duty)
+        rows.append((speed, hz, duty, 100 * moving / top, 100 * efficiency, 100 * ripple,
+                     model.stall_torque(hz, duty) / model.static_nm))
+    return rows
+
+
+def read_measured(path):
+    """{motor: {hz: start duty}} from "motor,hz,start_duty" lines."""
+    measured = {}
+    with open(path) as f:
+        for line in f:
+            line = line.split("#")[0].strip()
+            if not line:
+                continue
+            motor, hz, start = (int(float(v)) for v in line.split(","))
+            measured.setdefault(motor, {})[hz] = start
+    return measured
+
+
+def count_reprograms(profile, motor):
+    """Commands in a ramp 0-100-0 and the slice frequency writes they cause."""
+    from SimplyRobotics import KitronikSimplyRobotics
+    PWM = sys.modules["machine"].PWM
+    ramp = list(range(0, 101, 2)) + list(range(100, -1, -2))
+    board = KitronikSimplyRobotics(lazy=True, motorTables=profile.motor_tables())
+    board.motors[motor]
+    start = PWM.freq_writes
+    for speed in ramp:
+        board.motors[motor].on("f", speed)
+    writes = PWM.freq_writes - start
+    board.motors.release(motor)
+    return len(ramp), writes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--profile", default="profile.json",
+                        help="profile to update (created from the default if missing)")
+    parser.add_argument("--out", help="where to write the profile (default: --profile)")
+    parser.add_argument("--measured", help="CSV of motor,hz,start_duty measured on the robot")
+    parser.add_argument("--motors", type=int, nargs="+", default=[0, 1, 2, 3])
+    parser.add_argument("--margin", type=float, default=1.5,
+                        help="stall torque needed, in multiples of the static friction")
+    parser.add_argument("--volts", type=float, default=6.0)
+    parser.add_argument("--ohms", type=float, default=8.0)
+    parser.add_argument("--mh", type=float, default=2.0, help="motor inductance in mH")
+    args = parser.parse_args()
+
+    standins.install()
+    import profiles
+
+    model = MotorModel(volts=args.volts, ohms=args.ohms, henry=args.mh / 1000)
+    measured = read_measured(args.measured) if args.measured else {}
+    data = {}
+    if os.path.exists(args.profile):
+        with open(args.profile) as f:
+            data = json.load(f)
+    merged = profiles.merge(data)
+    motors = [dict(m) for m in merged["motors"]]
+
+    print("simulated motor: %.1f V, %.1f ohm, %.1f mH (tau %.2f ms)"
+          % (model.volts, model.ohms, args.mh, model.tau * 1000))
+    sweeps_all = curves(model, CANDIDATE_HZ)
+    print("%8s %9s %12s" % ("Hz", "deadband", "eff. at 100"))
+    for hz, (start, points) in sorted(sweeps_all.items()):
+        print("%8d %8d%% %11.0f%%" % (hz, start, 100 * points[-1][2]))
+
+    for motor in args.motors:
+        starts = measured.get(motor, {})
+        sweeps = {hz: sweeps_all[hz] for hz in sweeps_all if not starts or hz in starts}
+        if not sweeps:
+            parser.error("motor %d: no measured frequency is a candidate (%s)" % (motor, CANDIDATE_HZ))
+        bands = choose_bands(model, sweeps, args.margin, starts)
+        motors[motor]["bands"] = bands
+        print("\nmotor %d bands: %s" % (motor, bands))
+
+    data["motors"] = motors
+    merged = profiles.merge(data)
+    errors = profiles.validate(merged)
+    if errors:
+        for error in errors:
+            print("error:", error)
+        sys.exit(1)
+    profile = profiles.Profile(merged)
+
+    # Fixed bands as the board shipped them against the first calibrated motor
+    motor = args.motors[0]
+    bands = motors[motor]["bands"]
+    speeds = [5, 10, 15, 20, 30, 50, 75, 100]
+    fixed = evaluate(model, lambda s: 20 if s < 15 else 50 if s < 20 else 100, lambda s: s, speeds)
+    calibrated = evaluate(model, lambda s: profile.frequencies[motor][s],
+                          lambda s: profile.duties[motor][s] / 655.35, speeds)
+    print("\nmotor %d: %-33s | %s" % (motor, "fixed bands, no deadband", "calibrated bands"))
+    header = "%5s %5s %4s %5s %4s %6s %5s" % ("Hz", "duty", "spd%", "eff%", "rip%", "stall", "")
+    print("%5s %s| %s" % ("speed", header[:-5], header[:-5]))
+    for old, new in zip(fixed, calibrated):
+        print("%5d %5d %4.0f %4.0f %4.0f %4.0f %6.1f | %5d %4.0f %4.0f %4.0f %4.0f %6.1f" % (old + new[1:]))
+    for name, rows in (("fixed", fixed), ("calibrated", calibrated)):
+        moving = [row for row in rows if row[3] > 100 * MOVING]
+        print("%-10s lowest moving speed %s, mean efficiency %.0f%%"
+              % (name, moving[0][0] if moving else "none",
+                 sum(row[4] for row in rows) / len(rows)))
+
+    # The engine used to set both pins' frequency on every command
+    commands, writes = count_reprograms(profile, motor)
+    print("slice reprograms over a %d-command ramp: %d (%d bands; %d when every command set both pins)"
+          % (commands, writes, len(bands), 2 * commands))
+
+    out = args.out or args.profile
+    with open(out, "w") as f:
+        json.dump(data, f, indent=2)
+    print("wrote", out)
+
+
+if __name__ == "__main__":
+    main()
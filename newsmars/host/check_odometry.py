@@ -0,0 +1,127 @@
+"""
+Checks that the odometry follows the robot profile the motors are driven with.
+
+- drive: the firmware boots with the default profile and with a mirrored
+  one (tracks on the other motors, the left motor wired the other way
+  round) and drives forward, in reverse and turns with the buttons; the
+  pose must move the same way with both, along x and turning on the spot;
+- bands: calibration points are interpolated only within the PWM bands of
+  the motor's profile tables, and by the duty the profile gives a speed,
+  so a deadband is followed.
+
+Exits with status 1 if any check fails.
+
+    python3 host/check_odometry.py
+"""
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import standins
+
+MIRRORED = {"name": "mirrored", "drive": {"left": 3, "right": 0, "left_forward": "f", "right_forward": "r"}}
+BANDED = {"name": "banded", "motors": [{"bands": [[0, 30, 20], [40, 200, 40]]}] * 4}
+
+failures = []
+
+
+def check(condition, message):
+    if not condition:
+        failures.append(message)
+        print("FAIL: " + message)
+
+
+def boot(firmware, odometry, profile):
+    """init_hardware() with profile written to the profile file; None for no file."""
+    path = os.path.join(tempfile.mkdtemp(), "profile.json")
+    if profile is not None:
+        with open(path, "w") as f:
+            json.dump(profile, f)
+    firmware.ROBOT_PROFILE_FILE = path
+    firmware.SENSOR_ENABLED = False
+    with contextlib.redirect_stdout(io.StringIO()):
+        firmware.init_hardware()
+    firmware.odom = odometry.from_config(None, firmware.robot_profile)
+    firmware.safety_enabled = False
+    firmware.current_speed = 50
+
+
+def drive(firmware, clock, action, ms):
+    """Pose (x, y, heading) after driving action for ms from the origin."""
+    firmware.odom.reset()
+    with contextlib.redirect_stdout(io.StringIO()):
+        firmware.apply_action(action)
+        for _ in range(ms // firmware.CONTROL_TICK_MS + 1):
+            firmware.control_tick(clock.ticks_ms())
+            clock.sleep_ms(firmware.CONTROL_TICK_MS)
+        firmware.apply_action("stop")
+        firmware.control_tick(clock.ticks_ms())
+    return firmware.pose_x, firmware.pose_y, firmware.pose_heading
+
+
+def check_drive(firmware, odometry, clock):
+    poses = {}
+    for label, profile in (("default", None), ("mirrored", MIRRORED)):
+        boot(firmware, odometry, profile)
+        left = firmware.robot.motors[firmware.MOTOR_LEFT]
+        poses[label] = {action: drive(firmware, clock, action, 1000)
+                        for action in ("forward", "reverse", "left", "right")}
+        forward, reverse, turn_left, turn_right = (poses[label][a] for a in ("forward", "reverse", "left", "right"))
+        check(forward[0] > 50 and abs(forward[1]) <= 1 and forward[2] == 0,
+              "%s: forward drives along +x, not %s" % (label, forward))
+        check(reverse[0] < -50 and abs(reverse[1]) <= 1 and reverse[2] == 0,
+              "%s: reverse drives along -x, not %s" % (label, reverse))
+        # Opposite headings, give or take a degree of rounding
+        mirrored = abs((turn_left[2] + turn_right[2] + 180) % 360 - 180) <= 1
+        check(turn_left[2] and mirrored and turn_left[:2] == turn_right[:2] == (0, 0),
+              "%s: left and right turn the opposite ways on the spot, not %s and %s" % (label, turn_left, turn_right))
+        print("%-9s left motor %d forward %s: forward %s, reverse %s, left %s, right %s"
+              % (label, firmware.MOTOR_LEFT, firmware.robot_profile.forward[0], forward, reverse,
+                 turn_left, turn_right))
+        check(left is firmware.robot.motors[firmware.robot_profile.left], "%s: left motor from the profile" % label)
+    check(poses["default"] == poses["mirrored"], "mirrored profile moves like the default one")
+
+
+def check_bands(odometry, profiles):
+    profile = profiles.Profile(profiles.merge(BANDED))
+    frequencies, duties = profile.motor_tables()[0]
+    # Measured velocities proportional to the duty above each band's deadband
+    start = {30: 20, 200: 40}
+
+    def truth(speed):
+        hz = frequencies[speed]
+        return max(0, (duties[speed] / 655.35 - start[hz]) * 3)
+
+    points = [(0, 0)] + [(s, round(truth(s))) for s in (10, 30, 45, 70, 100)]
+    table = odometry.build_table(points, (frequencies, duties))
+    off = [s for s in range(1, 101) if abs(table[s] - truth(s)) > 1]
+    check(not off, "banded profile: table follows the duty within each band, off at speeds %s" % off[:10])
+    plain = odometry.build_table(points)
+    off_plain = [s for s in range(1, 101) if abs(plain[s] - truth(s)) > 1]
+    check(off_plain, "the default bands should not fit the banded profile")
+    print("bands: %d of 100 speeds within 1 mm/s with the profile's tables, %d with the default bands"
+          % (100 - len(off), 100 - len(off_plain)))
+
+
+def main():
+    standins.install()
+    clock = standins.use_virtual_clock()
+    import main as firmware
+    import odometry
+    import profiles
+
+    firmware.STORE_FILE = None
+    check_drive(firmware, odometry, clock)
+    check_bands(odometry, profiles)
+    if failures:
+        print("FAILED: %d checks" % len(failures))
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
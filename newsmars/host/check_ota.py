@@ -0,0 +1,574 @@
+"""
+Checks for the over-the-air update (ota.py), on a fake flash and end to end.
+
+Fake flash: ota.py runs against an in-memory file system that can lose
+power at any write, rename or remove, leaving a half-written chunk behind.
+
+- transfer: files arrive in chunks, with connections dropped halfway
+  through a chunk, a power cut while writing, a corrupted file and a wrong
+  offset; every file must end up complete and verified, and no write to
+  flash may be larger than the receive buffer;
+- power cuts: the commit, the boot after it, the confirmation and the
+  rollback are cut at every single flash operation, and cut again while
+  recovering; afterwards the files must be exactly the old or exactly the
+  new version, never a mix, and both a confirmed trial and a failed one
+  must end in a consistent version;
+- signing: ota.sign() is HMAC-SHA256 as ota_push.py computes it, and only
+  a request signed with the key and this boot's nonce is allowed.
+
+End to end: the firmware boots from a copy on disk (boot.py, then main.py)
+on the stand-ins with OTA turned on and a key. Unsigned requests, a wrong
+key, an old nonce and a robot without a key must all get 403. It then gets
+a new main.py and an added module through a proxy
+that drops every third connection halfway, restarts, confirms the new
+version, then gets a main.py that never finishes a loop and must be rolled
+back after the health timeout.
+
+Exits with status 1 if any check fails.
+
+    python3 host/check_ota.py [--cuts-only] [--chunk 2048]
+"""
+import argparse
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+import standins
+
+failures = []
+
+
+def check(condition, message):
+    if not condition:
+        failures.append(message)
+        print("FAIL: " + message)
+
+
+def use(ota, flash):
+    """Point ota.py at flash and forget what the previous boot left in RAM."""
+    flash.attach(ota)
+    ota.trial = False
+    ota.outcome = None
+    if ota._timer:
+        ota._timer.deinit()
+    ota._timer = None
+
+
+def make_files(seed, sizes):
+    out = {}
+    for i, (name, size) in enumerate(sizes):
+        out[name] = bytes((seed * 31 + i * 7 + n * 13) & 0xFF for n in range(size))
+    return out
+
+
+OLD = make_files(1, [("main.py", 9000), ("log.py", 3000)])
+UNTOUCHED = {"planner.py": b"planner stays as it is"}
+NEW = make_files(2, [("main.py", 9500), ("log.py", 2800), ("extra.py", 1200)])
+CHUNK = 700
+RECV = 256
+KEY = "check-ota-key"
+
+
+def manifest(files):
+    import hashlib
+    return {name: {"size": len(data), "sha256": hashlib.sha256(data).hexdigest()}
+            for name, data in files.items()}
+
+
+def send_chunk(updater, name, data, offset, drop_after=None):
+    """Like main.ota_chunk: open, write what arrives RECV bytes at a time, close."""
+    error = updater.open(name, offset)
+    if error:
+        return error
+    piece = data[offset:offset + CHUNK]
+    if drop_after is not None:
+        piece = piece[:drop_after]
+    try:
+        for i in range(0, len(piece), RECV):
+            updater.write(memoryview(piece)[i:i + RECV])
+    finally:
+        reply = updater.close()
+    return reply
+
+
+def version(flash):
+    """"old", "new" or "mixed", from the files outside the update's own directories."""
+    current = {p: bytes(d) for p, d in flash.files.items() if "/" not in p and not p.startswith("ota_")}
+    if current == dict(OLD, **UNTOUCHED):
+        return "old"
+    if current == dict(NEW, **UNTOUCHED):
+        return "new"
+    return "mixed"
+
+
+def fresh_flash():
+    flash = standins.FakeFlash()
+    for name, data in dict(OLD, **UNTOUCHED).items():
+        flash.files[name] = bytearray(data)
+    return flash
+
+
+def staged_flash(ota):
+    """Flash with the old version in place and the new one completely uploaded."""
+    flash = fresh_flash()
+    use(ota, flash)
+    updater = ota.Updater()
+    updater.begin(manifest(NEW))
+    for name, data in NEW.items():
+        offset = 0
+        while offset < len(data):
+            offset = send_chunk(updater, name, data, offset)["received"]
+    return flash
+
+
+def check_transfer(ota):
+    flash = fresh_flash()
+    use(ota, flash)
+    updater = ota.Updater()
+    reply = updater.begin(manifest(NEW))
+    check(isinstance(reply, dict) and not reply["complete"], "begin: %s" % reply)
+    drops = cuts = 0
+    requests = 0
+    for name, data in NEW.items():
+        offset = 0
+        while offset < len(data):
+            requests += 1
+            if requests % 3 == 0:
+                # The connection drops halfway through the chunk
+                drops += 1
+                reply = send_chunk(updater, name, data, offset, drop_after=CHUNK // 2 + 17)
+            elif requests % 7 == 0:
+                # Power cut while writing: the robot restarts and the host begins again
+                cuts += 1
+                flash.cut_at = flash.ops + 2
+                try:
+                    send_chunk(updater, name, data, offset)
+                    check(False, "power cut did not happen")
+                except standins.PowerCut:
+                    pass
+                flash.cut_at = None
+                use(ota, flash)
+                updater = ota.Updater()
+                reply = updater.begin(manifest(NEW))
+                offset = reply["files"][name]["received"]
+                continue
+            else:
+                reply = send_chunk(updater, name, data, offset)
+            check(reply["received"] > offset or reply["received"] == len(data),
+                  "%s made progress at %d" % (name, offset))
+            offset = reply["received"]
+    check(updater.complete(), "all files complete after %d drops and %d power cuts" % (drops, cuts))
+    for name, data in NEW.items():
+        check(bytes(flash.files["ota_new/" + name]) == data, "%s staged intact" % name)
+    check(flash.largest_write <= RECV + 64, "largest flash write %d B" % flash.largest_write)
+    print("transfer: %d requests, %d dropped halfway, %d power cuts, largest flash write %d B"
+          % (requests, drops, cuts, flash.largest_write))
+
+    # A corrupted file is thrown away when its last byte arrives and sent again
+    flash = fresh_flash()
+    use(ota, flash)
+    updater = ota.Updater()
+    updater.begin(manifest({"extra.py": NEW["extra.py"]}))
+    bad = bytearray(NEW["extra.py"])
+    bad[100] ^= 0xFF
+    offset = 0
+    mismatch = False
+    while offset < len(bad):
+        try:
+            offset = send_chunk(updater, "extra.py", bytes(bad), offset)["received"]
+        except ValueError as e:
+            mismatch = "sha256" in str(e)
+            break
+    check(mismatch, "corrupted file rejected")
+    check(updater.status()["files"]["extra.py"]["received"] == 0, "corrupted file removed")
+    check(isinstance(updater.commit(), str), "commit refused while incomplete")
+    check(isinstance(updater.open("extra.py", 5), str), "wrong offset refused")
+
+    for name in ("../main.py", "lib/x.py", "boot.py", "ota.py", "ota_state.json", ".hidden", ""):
+        try:
+            updater.begin({name: {"size": 1, "sha256": "0" * 64}})
+            check(False, "begin accepted %r" % name)
+        except ValueError:
+            pass
+    reply = updater.begin({"huge.py": {"size": standins.FakeFlash.BLOCK * 1000, "sha256": "0" * 64}})
+    check(reply == "not enough space", "space check: %s" % reply)
+
+
+def outcome_after(ota, flash, healthy, cut=None):
+    """
+    Boot on flash until the update is settled: healthy confirms the trial, otherwise
+    the health timer resets the robot. cut is (boot number, op) for a power cut at an
+    operation during that boot. Returns the boots it took.
+    """
+    boots = 0
+    while True:
+        boots += 1
+        use(ota, flash)
+        if cut and cut[0] == boots:
+            flash.cut_at = flash.ops + cut[1]
+        try:
+            result = ota.startup()
+            if result == "trial":
+                if healthy:
+                    ota.confirm()
+                else:
+                    try:
+                        ota._expired(ota._timer)
+                    except standins.ResetCalled:
+                        pass
+                    flash.cut_at = None
+                    continue
+            flash.cut_at = None
+            return boots
+        except standins.PowerCut:
+            flash.cut_at = None
+        if boots > 10:
+            check(False, "update never settled")
+            return boots
+
+
+def check_power_cuts(ota):
+    base = staged_flash(ota)
+    flash = base.snapshot()
+    use(ota, flash)
+    start = flash.ops
+    ota.Updater().commit()
+    commit_ops = flash.ops - start
+
+    # Operations in the trial boot, the confirmation and a rollback boot
+    flash = base.snapshot()
+    use(ota, flash)
+    ota.Updater().commit()
+    start = flash.ops
+    use(ota, flash)
+    ota.startup()
+    trial_ops = flash.ops - start
+    after_trial = flash.snapshot()
+    start = flash.ops
+    ota.confirm()
+    confirm_ops = flash.ops - start
+    use(ota, after_trial)
+    start = after_trial.ops
+    ota.startup()
+    rollback_ops = after_trial.ops - start
+
+    results = {}
+    scenarios = 0
+    for cut_at in range(1, commit_ops + 1):
+        for healthy in (True, False):
+            for later in [None] + [(1, j) for j in range(1, trial_ops + confirm_ops + 1)] + \
+                    [(2, j) for j in range(1, rollback_ops + 1)]:
+                if healthy and later and later[0] == 2:
+                    continue
+                flash = base.snapshot()
+                use(ota, flash)
+                flash.cut_at = flash.ops + cut_at
+                try:
+                    ota.Updater().commit()
+                    committed = True
+                except standins.PowerCut:
+                    committed = False
+                flash.cut_at = None
+                # Before the journal exists the update never happened
+                journaled = committed or "ota_state.json" in flash.files
+                outcome_after(ota, flash, healthy, later)
+                got = version(flash)
+                scenarios += 1
+                check(got != "mixed", "cut %d of commit, %s, then %s: mixed files"
+                      % (cut_at, "healthy" if healthy else "failing", later))
+                check("ota_state.json" not in flash.files, "journal left after cut %d, %s" % (cut_at, later))
+                if not journaled:
+                    check(got == "old", "cut %d before the journal kept the old files" % cut_at)
+                elif not healthy:
+                    check(got == "old", "failing version rolled back after cut %d, %s: %s" % (cut_at, later, got))
+                elif later is None:
+                    check(got == "new", "healthy version kept after cut %d: %s" % (cut_at, got))
+                key = ("journaled" if journaled else "before journal", "healthy" if healthy else "failing")
+                results.setdefault(key, {}).setdefault(got, 0)
+                results[key][got] += 1
+    print("power cuts: commit %d ops, trial boot %d, confirm %d, rollback boot %d; %d scenarios"
+          % (commit_ops, trial_ops, confirm_ops, rollback_ops, scenarios))
+    for key in sorted(results):
+        print("  %-15s %-8s -> %s" % (key[0], key[1], ", ".join("%s %d" % kv for kv in sorted(results[key].items()))))
+
+
+def check_signing(ota):
+    import hashlib
+    import hmac
+    import ota_push
+    for key in ("k", "x" * 64, "y" * 100):
+        check(ota.sign(key, b"begin {}") == hmac.new(key.encode(), b"begin {}", hashlib.sha256).hexdigest(),
+              "sign() is HMAC-SHA256 with a %d byte key" % len(key))
+    use(ota, fresh_flash())
+    updater = ota.Updater()
+    auth = ota_push.sign(KEY, updater.nonce, b"commit")
+    check(updater.allowed(KEY, auth, b"commit"), "signed request allowed")
+    check(not updater.allowed(None, auth, b"commit"), "nothing allowed without a key")
+    check(not updater.allowed(KEY, auth, b"begin") and not updater.allowed(KEY, auth[:-1], b"commit")
+          and not updater.allowed(KEY, None, b"commit") and not updater.allowed("other", auth, b"commit"),
+          "wrong message, signature or key refused")
+    check(not ota.Updater().allowed(KEY, auth, b"commit"), "signature of the previous boot's nonce refused")
+    print("signing: HMAC-SHA256 matches hmac, requests bound to key, message and nonce")
+
+
+# End to end against the firmware
+
+def _free_port():
+    s = socket.socket()
+    s.bind(("127.0.0.1", 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+
+class FlakyProxy:
+    """TCP proxy that cuts every `every`-th connection after forwarding `cut_after` request bytes."""
+
+    def __init__(self, target_port, every=3, cut_after=1500):
+        self.target_port = target_port
+        self.every = every
+        self.cut_after = cut_after
+        self.connections = 0
+        self.cuts = 0
+        self.server = socket.socket()
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind(("127.0.0.1", 0))
+        self.server.listen(8)
+        self.port = self.server.getsockname()[1]
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        while True:
+            client, _ = self.server.accept()
+            self.connections += 1
+            limit = self.cut_after if self.connections % self.every == 0 else None
+            threading.Thread(target=self._serve, args=(client, limit), daemon=True).start()
+
+    def _serve(self, client, limit):
+        upstream = socket.create_connection(("127.0.0.1", self.target_port))
+        done = threading.Event()
+
+        def back():
+            try:
+                while True:
+                    data = upstream.recv(4096)
+                    if not data:
+                        break
+                    client.sendall(data)
+                # The robot closes after answering; pass that on
+                client.shutdown(socket.SHUT_WR)
+            except OSError:
+                pass
+            done.set()
+
+        threading.Thread(target=back, daemon=True).start()
+        sent = 0
+        try:
+            while True:
+                data = client.recv(4096)
+                if not data:
+                    break
+                if limit is not None and sent + len(data) >= limit:
+                    upstream.sendall(data[:limit - sent])
+                    self.cuts += 1
+                    break
+                upstream.sendall(data)
+                sent += len(data)
+            if limit is None:
+                done.wait(10)
+        except OSError:
+            pass
+        for s in (upstream, client):
+            try:
+                s.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            s.close()
+
+
+def run_child(config):
+    """One power-on of the copy in the current directory: boot.py, then main.py."""
+    import io
+    sys.path.insert(0, HERE)
+    standins.install()
+    sys.path.insert(0, os.getcwd())
+    real_stdout = sys.stdout
+    sys.stdout = io.StringIO()
+    result = {}
+
+    import ota
+    ota.HEALTH_TIMEOUT_MS = config["health_ms"]
+    import boot   # noqa: F401, runs ota.startup()
+    result["boot"] = ota.outcome
+    import main
+    main.HTTP_PORT = _free_port()
+    result["enabled"] = main.OTA_ENABLED
+    main.OTA_ENABLED = True
+    main.OTA_KEY = KEY
+
+    def run():
+        try:
+            main.main()
+        except standins.ResetCalled:
+            result["reset"] = True
+
+    threading.Thread(target=run, daemon=True).start()
+    import ota_push
+    deadline = time.time() + 30
+    while True:
+        try:
+            status, reply = ota_push.request("127.0.0.1", main.HTTP_PORT, "GET", "/ota")
+            break
+        except OSError:
+            if time.time() > deadline:
+                raise
+            time.sleep(0.01)
+    result["speed"] = main.DEFAULT_SPEED
+
+    if config.get("push"):
+        files = {}
+        for name, path in config["push"].items():
+            with open(path, "rb") as f:
+                files[name] = f.read()
+        result["refused"] = refused(main, ota_push, reply["nonce"], files)
+        proxy = FlakyProxy(main.HTTP_PORT, cut_after=config["chunk"] // 2)
+        start = time.time()
+        stats = ota_push.push("127.0.0.1", proxy.port, files, KEY, config["chunk"], retries=50, backoff=0.02)
+        result["push_s"] = time.time() - start
+        result["stats"] = stats
+        result["cuts"] = proxy.cuts
+        while "reset" not in result and time.time() - start < 10:
+            time.sleep(0.01)
+    else:
+        # Wait for the first loop to confirm a trial, or for the health timer to give up
+        deadline = time.time() + config["health_ms"] / 1000 + 5
+        while ota.trial and time.time() < deadline:
+            if ota._timer and ota._timer.reset_requested.is_set():
+                result["health_reset"] = True
+                break
+            time.sleep(0.01)
+        result["status"] = ota_push.request("127.0.0.1", main.HTTP_PORT, "GET", "/ota")[1]
+    result["flash"] = sorted(os.listdir("."))
+    real_stdout.write(json.dumps(result) + "\n")
+    sys.stdout.flush()
+    os._exit(0)
+
+
+def refused(main, ota_push, nonce, files):
+    """Statuses of requests the robot must turn away, by what is wrong with them."""
+    body = json.dumps({"files": ota_push.manifest(files)}).encode()
+
+    def post(path, data=None):
+        return ota_push.request("127.0.0.1", main.HTTP_PORT, "POST", path, data)[0]
+
+    signed = "/ota/begin?auth=" + ota_push.sign(KEY, nonce, b"begin " + body)
+    statuses = {
+        "begin unsigned": post("/ota/begin", body),
+        "begin wrong key": post("/ota/begin?auth=" + ota_push.sign("guess", nonce, b"begin " + body), body),
+        "begin old nonce": post("/ota/begin?auth=" + ota_push.sign(KEY, "0" * 16, b"begin " + body), body),
+        "begin other files": post(signed, json.dumps({"files": {}}).encode()),
+        "chunk unsigned": post("/ota/chunk?file=main.py&offset=0", b"x"),
+        "chunk other offset": post("/ota/chunk?file=main.py&offset=0&auth="
+                                   + ota_push.sign(KEY, nonce, b"chunk main.py 1"), b"x"),
+        "commit unsigned": post("/ota/commit"),
+    }
+    main.OTA_KEY = None
+    statuses["no key on the robot"] = post(signed, body)
+    main.OTA_KEY = KEY
+    return statuses
+
+
+def power_on(flash, config):
+    out = subprocess.run([sys.executable, __file__, "--child", json.dumps(config)], cwd=flash,
+                         check=True, capture_output=True, text=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def check_firmware(chunk):
+    source = standins.NEWSMARS_DIR
+    with tempfile.TemporaryDirectory() as flash, tempfile.TemporaryDirectory() as work:
+        for name in os.listdir(source):
+            if name.endswith(".py") and not name.startswith("test_") and name != "main_2.py":
+                shutil.copy(os.path.join(source, name), flash)
+        with open(os.path.join(source, "main.py"), newline="") as f:
+            original = f.read()
+        new_main = original.replace("DEFAULT_SPEED = 50", "DEFAULT_SPEED = 60")
+        # Runs, answers requests, but never completes a loop
+        broken = new_main.replace("            control_tick(time.ticks_ms())\r\n            # De eerste",
+                                  "            control_tik(time.ticks_ms())\r\n            # De eerste")
+        check(new_main != original and broken != new_main, "test versions of main.py differ")
+        paths = {}
+        for name, text in (("main_new.py", new_main), ("main_broken.py", broken),
+                           ("hello.py", "GREETING = 'hallo'\n")):
+            paths[name] = os.path.join(work, name)
+            with open(paths[name], "w", newline="") as f:
+                f.write(text)
+        config = {"chunk": chunk, "health_ms": 1500}
+
+        first = power_on(flash, dict(config, push={"main.py": paths["main_new.py"], "hello.py": paths["hello.py"]}))
+        check(first["enabled"] is False, "OTA_ENABLED is off by default")
+        wrong = {label: status for label, status in first.get("refused", {}).items() if status != 403}
+        check(first.get("refused") and not wrong, "unsigned or wrongly signed requests refused: %s" % wrong)
+        print("firmware: %d unsigned or wrongly signed requests refused with 403" % len(first.get("refused", {})))
+        stats = first.get("stats", {})
+        print("firmware: pushed %d bytes in %d requests over a link that cut %d connections halfway, "
+              "%d retries, %.2f s" % (stats.get("bytes", 0), stats.get("requests", 0), first.get("cuts", 0),
+                                      stats.get("retries", 0), first.get("push_s", 0)))
+        check(first.get("cuts", 0) > 0 and stats.get("retries", 0) > 0, "transfer was interrupted")
+        check(first.get("reset"), "robot restarted after the commit")
+        check(stats.get("bytes", 0) >= len(new_main), "all bytes sent")
+
+        second = power_on(flash, config)
+        print("  next boot: %s, DEFAULT_SPEED %s, update %s"
+              % (second["boot"], second["speed"], second["status"]["update"]))
+        check(second["boot"] == "trial" and second["speed"] == 60, "new main.py on trial")
+        check(second["status"]["update"] == "confirmed", "new version confirmed by its first loop")
+        check("hello.py" in second["flash"] and "ota_state.json" not in second["flash"], "added file kept")
+
+        third = power_on(flash, dict(config, push={"main.py": paths["main_broken.py"]}))
+        check(third.get("reset"), "robot restarted after the second commit")
+        fourth = power_on(flash, config)
+        print("  broken main.py: boot %s, health timer reset: %s" % (fourth["boot"], fourth.get("health_reset")))
+        check(fourth["boot"] == "trial" and fourth.get("health_reset"), "health timer reset the broken version")
+        fifth = power_on(flash, config)
+        print("  next boot: %s, DEFAULT_SPEED %s" % (fifth["boot"], fifth["speed"]))
+        check(fifth["boot"] == "rolled back" and fifth["speed"] == 60, "previous version restored")
+        with open(os.path.join(flash, "main.py"), newline="") as f:
+            check(f.read() == new_main, "main.py is the confirmed version again")
+        check("ota_state.json" not in fifth["flash"], "journal removed after the rollback")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--cuts-only", action="store_true", help="skip the end-to-end firmware check")
+    parser.add_argument("--chunk", type=int, default=2048, help="bytes per chunk in the firmware check")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(json.loads(args.child))
+        return
+
+    standins.install()
+    import ota
+    check_transfer(ota)
+    check_power_cuts(ota)
+    check_signing(ota)
+    if not args.cuts_only:
+        check_firmware(args.chunk)
+    if failures:
+        print("FAILED: %d checks" % len(failures))
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
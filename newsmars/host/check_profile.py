@@ -0,0 +1,92 @@
+"""
+Validate a robot profile before copying it to the Pico.
+
+Prints every problem (the robot would fall back to the default profile)
+or, for a valid profile, the tables it turns into and the outputs that
+share a PWM slice.
+
+    python3 host/check_profile.py profile.json
+    python3 host/check_profile.py --write-default profile.json
+"""
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import standins
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("profile")
+    parser.add_argument("--write-default", action="store_true",
+                        help="write the default profile as a starting point")
+    args = parser.parse_args()
+
+    standins.install()
+    import profiles
+
+    if args.write_default:
+        with open(args.profile, "w") as f:
+            json.dump(profiles.DEFAULT, f, indent=2)
+        print("wrote", args.profile)
+        return
+
+    profile, errors = profiles.load(args.profile)
+    if not os.path.exists(args.profile):
+        errors = ["%s: no such file" % args.profile]
+    if errors:
+        for error in errors:
+            print("error:", error)
+        sys.exit(1)
+
+    print("profile %r" % profile.name)
+    print("drive: left motor %d, right motor %d" % (profile.left, profile.right))
+    for name in ("forward", "reverse", "turn_left", "turn_right"):
+        print("  %-10s left %s, right %s" % ((name,) + getattr(profile, name)))
+    print("%-6s %-8s %8s %8s %8s %8s  %s" % ("motor", "pins", "speed 1", "10", "50", "100", "Hz"))
+    for i in range(profiles.MOTORS):
+        duties = profile.duties[i]
+        bands = sorted(set(profile.frequencies[i]))
+        print("%-6d %-8s %8d %8d %8d %8d  %s" % (i, "GP%d/%d" % profile.motor_pins[i], duties[1],
+                                                duties[10], duties[50], duties[100],
+                                                "/".join(str(hz) for hz in bands)))
+    print("%-6s %-8s %8s %8s" % ("servo", "pin", "min us", "max us"))
+    for i in range(profiles.SERVOS):
+        print("%-6d %-8s %8d %8d" % ((i, "GP%d" % profile.servo_pins[i]) + profile.servo_limits[i]))
+    for note in slice_notes(profile, profiles):
+        print("note:", note)
+
+
+def slice_notes(profile, profiles):
+    """Outputs that share an RP2040 PWM slice (one frequency) or even a channel (one output)."""
+    outputs = []
+    for i in range(profiles.MOTORS):
+        for pin in profile.motor_pins[i]:
+            outputs.append(("motor %d" % i, pin))
+    for i in range(profiles.SERVOS):
+        outputs.append(("servo %d" % i, profile.servo_pins[i]))
+
+    notes = []
+    for slice in range(8):
+        users = []
+        for name, pin in outputs:
+            if (pin >> 1) & 7 == slice and name not in users:
+                users.append(name)
+        # Servos all run at 50Hz, so only slices with a motor matter
+        if len(users) > 1 and any(name.startswith("motor") for name in users):
+            notes.append("slice %d is shared by %s: they run at one PWM frequency"
+                         % (slice, ", ".join(users)))
+    for a in range(len(outputs)):
+        for b in range(a + 1, len(outputs)):
+            (name_a, pin_a), (name_b, pin_b) = outputs[a], outputs[b]
+            # 16 channels for 30 pins: GPn and GPn+16 are the same output
+            if name_a != name_b and pin_a & 15 == pin_b & 15:
+                notes.append("GP%d and GP%d are the same PWM output: %s and %s cannot be used together"
+                             % (pin_a, pin_b, name_a, name_b))
+    return notes
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+"""
+Checks for profiler.py against a fake clock, plus overhead measurements.
+
+Exits with status 1 if any check fails.
+
+    python3 host/check_profiler.py
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import standins
+
+failures = []
+
+
+def check(condition, message):
+    if not condition:
+        failures.append(message)
+        print("FAIL: " + message)
+
+
+class FakeClock:
+    """ticks_us() that only moves when advance() is called."""
+
+    def __init__(self):
+        self.now = 0
+
+    def ticks_us(self):
+        return self.now
+
+    def advance(self, us):
+        self.now = standins.ticks_add(self.now, us)
+
+
+def check_histogram(profiler, clock):
+    durations = [3, 10, 11, 60, 60, 999, 1000, 1001, 250000]
+
+    @profiler.timed("fake")
+    def work(us):
+        clock.advance(us)
+        return us
+
+    for us in durations:
+        check(work(us) == us, "timed() passes the return value through")
+    sid = profiler.section("fake")
+    count, low, high, mean = profiler.stats(sid)
+    check(count == len(durations), "count %d" % count)
+    check(low == 3 and high == 250000, "min/max %d/%d" % (low, high))
+    check(abs(mean - sum(durations) / len(durations)) < 1e-9, "mean %.3f" % mean)
+
+    expected = [0] * (len(profiler.BUCKETS) + 1)
+    for us in durations:
+        bucket = 0
+        while bucket < len(profiler.BUCKETS) and us > profiler.BUCKETS[bucket]:
+            bucket += 1
+        expected[bucket] += 1
+    n = len(expected)
+    check(list(profiler.histogram[sid * n:(sid + 1) * n]) == expected, "histogram buckets")
+
+    # Wrapped ticks and the seconds carry
+    clock.now = standins.TICKS_PERIOD - 5
+    work(20)
+    work(2500000)
+    count, low, high, mean = profiler.stats(sid)
+    check(count == len(durations) + 2, "count after wrap")
+    total = sum(durations) + 20 + 2500000
+    check(profiler.total_s[sid] * 1000000 + profiler.total_us[sid] == total, "total with carry")
+    check(profiler.total_us[sid] < 1000000, "microsecond remainder stays below a second")
+
+    # Exceptions are still timed and propagate
+    @profiler.timed("fails")
+    def fails():
+        clock.advance(7)
+        raise ValueError("boom")
+    try:
+        fails()
+        check(False, "exception propagates")
+    except ValueError:
+        pass
+    check(profiler.stats(profiler.section("fails"))[:3] == (1, 7, 7), "failed call timed")
+
+    timer = profiler.Timer("block")
+    with timer:
+        clock.advance(42)
+    with timer:
+        clock.advance(8)
+    check(profiler.stats(timer.sid) == (2, 8, 42, 25), "Timer stats")
+
+    profiler.enabled = False
+    work(5)
+    with timer:
+        clock.advance(5)
+    profiler.enabled = True
+    check(profiler.counts[sid] == len(durations) + 2, "runtime switch stops timed()")
+    check(profiler.counts[timer.sid] == 2, "runtime switch stops Timer")
+
+
+def check_metrics(profiler):
+    lines = "".join(profiler.metrics()).splitlines()
+    check(lines[0].startswith("# HELP smars_section_duration_us"), "HELP line")
+    check(lines[1] == "# TYPE smars_section_duration_us histogram", "TYPE line")
+    buckets = [l for l in lines if l.startswith('smars_section_duration_us_bucket{section="fake"')]
+    values = [int(l.rsplit(" ", 1)[1]) for l in buckets]
+    check(values == sorted(values), "buckets are cumulative")
+    check(buckets[-1].endswith('le="+Inf"} 11'), "+Inf bucket equals count")
+    check('smars_section_duration_us_count{section="fake"} 11' in lines, "count line")
+    check('smars_section_duration_us_max{section="fake"} 2500000' in lines, "max gauge")
+    for line in lines:
+        if not line.startswith("#"):
+            name, value = line.rsplit(" ", 1)
+            check(value.lstrip("-").isdigit(), "numeric sample: " + line)
+
+
+def measure_overhead(profiler):
+    def plain(a):
+        return a
+
+    timed_fn = profiler.timed("overhead")(plain)
+    timer = profiler.Timer("overhead_block")
+
+    def with_timer(a):
+        with timer:
+            return a
+
+    profiler.ticks_us = time.ticks_us
+    profiler.ticks_diff = time.ticks_diff
+    rounds = 200000
+    results = []
+    for label, fn, switch in (("plain call", plain, True), ("timed()", timed_fn, True),
+                              ("timed(), switched off", timed_fn, False), ("Timer", with_timer, True),
+                              ("Timer, switched off", with_timer, False)):
+        profiler.enabled = switch
+        start = time.perf_counter()
+        for i in range(rounds):
+            fn(i)
+        results.append((label, (time.perf_counter() - start) / rounds * 1e9))
+    profiler.enabled = True
+
+    base = results[0][1]
+    print("\n%-24s %10s %12s" % ("overhead (host)", "ns/call", "added ns"))
+    for label, ns in results:
+        print("%-24s %10.0f %12.0f" % (label, ns, ns - base))
+
+
+def main():
+    standins.install()
+    import profiler
+    clock = FakeClock()
+    profiler.ticks_us = clock.ticks_us
+    profiler.ticks_diff = standins.ticks_diff
+
+    check_histogram(profiler, clock)
+    check_metrics(profiler)
+    measure_overhead(profiler)
+
+    # Compiled out: the function comes back untouched
+    profiler.ENABLED = False
+
+    def untouched():
+        pass
+    check(profiler.timed("off")(untouched) is untouched, "ENABLED = False returns the function")
+
+    if failures:
+        print("\n%d check(s) failed" % len(failures))
+        sys.exit(1)
+    print("\nAll profiler checks passed")
+
+
+if __name__ == "__main__":
+    main()
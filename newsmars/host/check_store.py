@@ -0,0 +1,326 @@
+"""
+Checks for the persistent state store (store.py) on a fake flash.
+
+- batching: a burst of changes within flush_ms becomes one record, a value
+  set to what it already is writes nothing, and every value comes back
+  with its type after a reopen; values larger than max_bytes are compacted
+  once, and later changes appended after them;
+- power cuts: a workload of flushes that appends and compacts is cut at
+  every single flash operation, leaving a torn record behind; the reopened
+  store must hold exactly the values of the last or of the interrupted
+  flush. The boot after that is cut again at every operation of its first
+  flushes, and the workload must still end with the right values;
+- corruption: a flipped byte ends the log at that record, and the next
+  flush compacts it;
+- migration: the files taken into the store at boot are removed only once
+  their contents are in the log, also when power is cut in between;
+- firmware: main.open_store() restores speed, safety, calibration and
+  Wi-Fi credentials with a single read of the log.
+
+Exits with status 1 if any check fails.
+
+    python3 host/check_store.py [--steps 60] [--max-bytes 160]
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+import standins
+
+PATH = "state.log"
+CALIBRATION = {"points": [[0, 0], [40, 180], [70, 330], [100, 460]], "track_mm": 118, "forward": "r"}
+
+failures = []
+
+
+def check(condition, message):
+    if not condition:
+        failures.append(message)
+        print("FAIL: " + message)
+
+
+def workload(steps):
+    """The changes of every flush, mostly speed and safety as the buttons set them."""
+    out = []
+    for i in range(steps):
+        changes = {"speed": 10 + (i * 37) % 91}
+        if i % 3 == 0:
+            changes["safety"] = i % 2 == 0
+        if i % 11 == 5:
+            changes["wifi"] = {"ssid": "Net%d" % i, "password": "pass%04d" % i}
+        if i % 17 == 8:
+            changes["odometry"] = dict(CALIBRATION, track_mm=110 + i)
+        out.append(changes)
+    return out
+
+
+def expected_states(steps):
+    """Values after 0, 1, ... flushes."""
+    states = [{}]
+    for changes in steps:
+        states.append(dict(states[-1], **changes))
+    return states
+
+
+def run(store, flash, steps, start, cut_at=None):
+    """
+    Apply and flush steps[start:] until done or the power is cut.
+
+    Returns:
+        int: Index of the first step that did not finish
+    """
+    flash.ops = 0
+    flash.cut_at = cut_at
+    done = start
+    try:
+        for changes in steps[start:]:
+            for key, value in changes.items():
+                store.set(key, value)
+            store.flush()
+            done += 1
+    except standins.PowerCut:
+        pass
+    flash.cut_at = None
+    return done
+
+
+def reboot(store_module, flash, states, done, max_bytes, label):
+    """
+    Open the store after a cut during step done; its values must be those
+    before or after that step.
+
+    Returns:
+        tuple: (store, index of the step to continue with), or (None, None)
+    """
+    store = store_module.Store(PATH, max_bytes)
+    if store.values == states[done]:
+        return store, done
+    if done + 1 < len(states) and store.values == states[done + 1]:
+        return store, done + 1
+    check(False, "%s: recovered values match no flush" % label)
+    return None, None
+
+
+def check_batching(store_module, flash):
+    store = store_module.Store(PATH, 1024, 2000)
+    now = 1000
+    for speed in range(10, 100, 10):
+        store.set("speed", speed)
+        check(not store.flush(now), "flush within flush_ms writes nothing")
+        now += 100
+    store.set("safety", False)
+    check(store.flush(now + 2000), "flush after flush_ms writes")
+    check(store.appends == 1 and flash.files[PATH], "a burst of changes is one record")
+    store.set("speed", 90)
+    check(not store.dirty and not store.flush(), "setting a value to what it is writes nothing")
+
+    values = {"speed": 90, "safety": False, "odometry": CALIBRATION, "name": "Mars é", "ratio": 0.75,
+              "none": None}
+    for key, value in values.items():
+        store.set(key, value)
+    store.flush()
+    reopened = store_module.Store(PATH)
+    check(reopened.values == values and type(reopened.get("ratio")) is float
+          and reopened.get("safety") is False, "values come back with their types: %s" % reopened.values)
+    check(reopened.records == 2 and not reopened.damaged, "two records, nothing after them")
+
+    ram = store_module.Store(None)
+    ram.set("speed", 50)
+    check(ram.flush() and ram.get("speed") == 50, "store without a path keeps values in RAM")
+    check(list(flash.files) == [PATH], "store without a path writes nothing")
+    print("batching: 9 changes in one record, %d bytes for %d values" % (len(flash.files[PATH]), len(values)))
+
+
+def check_large_values(store_module):
+    flash = standins.FakeFlash()
+    flash.attach(store_module)
+    calibration = dict(CALIBRATION, left_points=[[s, s * 4] for s in range(0, 101, 10)])
+    store = store_module.Store(PATH, 160)
+    store.set("odometry", calibration)
+    store.flush()
+    for speed in range(10, 110, 10):
+        store.set("speed", speed)
+        store.flush()
+    check(store.compacted > 160 and store.compactions == 1 and store.appends == 10,
+          "values past max_bytes: one compaction, then appends, not %d compactions" % store.compactions)
+    reopened = store_module.Store(PATH, 160)
+    check(reopened.values == store.values and reopened.compacted == store.compacted,
+          "compacted record size known after a reopen")
+    print("large values: %d B compacted once, %d changes appended" % (store.compacted, store.appends))
+
+
+def check_power_cuts(store_module, steps_count, max_bytes):
+    steps = workload(steps_count)
+    states = expected_states(steps)
+
+    flash = standins.FakeFlash()
+    flash.attach(store_module)
+    store = store_module.Store(PATH, max_bytes)
+    run(store, flash, steps, 0)
+    total = flash.ops
+    check(store_module.Store(PATH).values == states[-1], "uninterrupted workload")
+
+    scenarios = 0
+    second_cuts = 0
+    for cut in range(1, total + 1):
+        flash = standins.FakeFlash()
+        flash.attach(store_module)
+        done = run(store_module.Store(PATH, max_bytes), flash, steps, 0, cut)
+        if done == len(steps):
+            continue
+        label = "cut at op %d" % cut
+        after_cut = flash.snapshot()
+        store, start = reboot(store_module, flash, states, done, max_bytes, label)
+        if store is None:
+            continue
+        scenarios += 1
+        run(store, flash, steps, start, None)
+        check(store_module.Store(PATH).values == states[-1], "%s: workload finished after the reboot" % label)
+        # Cut again while the next boot writes its first records
+        for second in range(1, 6):
+            flash = after_cut.snapshot()
+            flash.attach(store_module)
+            store, start = reboot(store_module, flash, states, done, max_bytes, label)
+            again = run(store, flash, steps, start, second)
+            if again == len(steps):
+                break
+            second_cuts += 1
+            label2 = "%s, then at op %d after the reboot" % (label, second)
+            store, start = reboot(store_module, flash, states, again, max_bytes, label2)
+            if store is None:
+                continue
+            run(store, flash, steps, start, None)
+            final = store_module.Store(PATH)
+            check(final.values == states[-1] and not final.damaged, "%s: workload finished" % label2)
+    print("power cuts: %d flushes in %d ops (max_bytes %d, largest write %d B); %d cuts, %d cut again"
+          % (len(steps), total, max_bytes, flash.largest_write, scenarios, second_cuts))
+
+
+def check_corruption(store_module):
+    steps = workload(8)
+    states = expected_states(steps)
+    for record in range(len(steps)):
+        flash = standins.FakeFlash()
+        flash.attach(store_module)
+        run(store_module.Store(PATH, 4096), flash, steps, 0)
+        data = flash.files[PATH]
+        pos = 0
+        for _ in range(record):
+            pos += store_module.HEADER_SIZE + data[pos]
+        data[pos + store_module.HEADER_SIZE + 2] ^= 0x20
+        store = store_module.Store(PATH, 4096)
+        check(store.values == states[record] and store.damaged,
+              "flipped byte in record %d: values of the records before it" % record)
+        store.set("speed", 1)
+        store.flush()
+        reopened = store_module.Store(PATH, 4096)
+        check(reopened.records == 1 and not reopened.damaged and reopened.values == dict(states[record], speed=1),
+              "flipped byte in record %d: compacted by the next flush" % record)
+    print("corruption: a flipped byte in each of %d records" % len(steps))
+
+
+def check_migration(store_module):
+    files = {"odometry.json": CALIBRATION, "wifi.json": {"ssid": "FieldNet", "password": "fieldpass1"}}
+
+    def take(flash, cut=None):
+        flash.ops = 0
+        flash.cut_at = cut
+        store = store_module.Store(PATH)
+        try:
+            for name in files:
+                store.take_file(name.split(".")[0], name)
+        except standins.PowerCut:
+            return False
+        finally:
+            flash.cut_at = None
+        return True
+
+    flash = standins.FakeFlash()
+    for name, value in files.items():
+        flash.files[name] = bytearray(json.dumps(value).encode())
+    flash.attach(store_module)
+    base = flash.snapshot()
+    take(flash)
+    total = flash.ops
+    for cut in range(1, total + 1):
+        flash = base.snapshot()
+        flash.attach(store_module)
+        take(flash, cut)
+        store = store_module.Store(PATH)
+        for name, value in files.items():
+            key = name.split(".")[0]
+            check(name in flash.files or store.get(key) == value,
+                  "cut at op %d: %s neither on flash nor in the store" % (cut, name))
+        take(flash)
+        store = store_module.Store(PATH)
+        check(not set(files) & set(flash.files), "cut at op %d: files removed at the next boot" % cut)
+        check(store.values == {name.split(".")[0]: value for name, value in files.items()},
+              "cut at op %d: both files in the store" % cut)
+    print("migration: %d ops, each cut" % total)
+
+
+def check_firmware(store_module):
+    class CountingFlash(standins.FakeFlash):
+        reads = 0
+
+        def open(self, path, mode="r"):
+            if mode[0] == "r" and path == PATH:
+                self.reads += 1
+            return super().open(path, mode)
+
+    flash = CountingFlash()
+    flash.files["odometry.json"] = bytearray(json.dumps(CALIBRATION).encode())
+    flash.files["wifi.json"] = bytearray(b'{"ssid": "FieldNet", "password": "fieldpass1"}')
+    flash.attach(store_module)
+    import main
+    with contextlib.redirect_stdout(io.StringIO()):
+        main.open_store()
+        main.current_speed = 70
+        main.safety_enabled = False
+        # What control_tick does every loop, then the flush save_log does before a reset
+        main.store.set("speed", main.current_speed)
+        main.store.set("safety", main.safety_enabled)
+        main.save_log()
+
+        main.current_speed = 0
+        main.safety_enabled = True
+        flash.reads = 0
+        main.open_store()
+    check(flash.reads == 1, "boot reads the log once, not %d times" % flash.reads)
+    check(main.current_speed == 70 and main.safety_enabled is False, "speed and safety restored")
+    check(main.wifi_credentials() == ("FieldNet", "fieldpass1"), "Wi-Fi credentials from the store")
+    check(main.store.get("odometry") == CALIBRATION, "calibration from the store")
+    check(set(flash.files) == {PATH}, "migrated files removed: %s" % sorted(flash.files))
+    print("firmware: restored speed %d, safety %s from %d bytes" % (main.current_speed, main.safety_enabled,
+                                                                    len(flash.files[PATH])))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--steps", type=int, default=60, help="flushes in the power cut workload")
+    parser.add_argument("--max-bytes", type=int, default=160, help="log size before compacting, small to compact often")
+    args = parser.parse_args()
+
+    standins.install()
+    import store as store_module
+    flash = standins.FakeFlash()
+    flash.attach(store_module)
+    check_batching(store_module, flash)
+    check_large_values(store_module)
+    check_power_cuts(store_module, args.steps, args.max_bytes)
+    check_corruption(store_module)
+    check_migration(store_module)
+    check_firmware(store_module)
+    if failures:
+        print("FAILED: %d checks" % len(failures))
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
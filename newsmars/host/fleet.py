@@ -0,0 +1,317 @@
+"""
+Drive a fleet of robots from one host.
+
+Finds robots by probing GET /api/state, keeps an /events stream open to each
+one for live status, measures every robot's clock offset and sends commands
+to all of them at once. A synchronised command is a one-step /api/batch with
+"at" set per robot from its offset, so every robot starts it at the same
+moment however long its own request took.
+
+    python3 host/fleet.py --scan 192.168.1.0/24 status [--seconds 5]
+    python3 host/fleet.py --robots 192.168.1.50 192.168.1.51 drive 40 40 [--sync] [--lead-ms 200]
+    python3 host/fleet.py --scan 192.168.1.0/24 stop
+
+The robot closes every HTTP connection after one request, so commands use a
+new connection each; the /events streams are the connections that stay open.
+"""
+import argparse
+import asyncio
+import ipaddress
+import json
+import time
+
+# ticks_ms() on the robot wraps at 2**30
+TICKS_PERIOD = 1 << 30
+STALE_MS = 1000
+MIN_BACKOFF_S = 0.5
+MAX_BACKOFF_S = 10.0
+
+
+def now_ms():
+    return time.monotonic() * 1000
+
+
+def ticks_diff(end, start):
+    """MicroPython's time.ticks_diff() for robot ticks."""
+    return (end - start + TICKS_PERIOD // 2) % TICKS_PERIOD - TICKS_PERIOD // 2
+
+
+class Robot:
+    """One robot: where it is, how its clock relates to ours and what it last reported."""
+
+    def __init__(self, host, port=80):
+        self.host = host
+        self.port = port
+        self.name = host if port == 80 else "%s:%d" % (host, port)
+        self.offset_ms = None   # robot ticks_ms() minus now_ms()
+        self.rtt_ms = None      # round trip of the sample the offset came from
+        self.status = None      # last /events frame
+        self.last_seen = None   # now_ms() when it arrived
+        self.online = False
+        self.frames = 0
+        self.reconnects = 0
+        self.errors = 0
+
+    def robot_ms(self, host_ms):
+        """Our time host_ms on the robot's ticks_ms() clock."""
+        return int(round(host_ms + self.offset_ms)) % TICKS_PERIOD
+
+
+async def request(robot, method, path, body=None, timeout=2.0):
+    """
+    One request on a new connection.
+
+    Returns:
+        tuple: (HTTP status, decoded JSON body or None, now_ms() when sent, now_ms() when answered)
+    """
+    reader, writer = await asyncio.wait_for(asyncio.open_connection(robot.host, robot.port), timeout)
+    try:
+        data = b"" if body is None else json.dumps(body, separators=(",", ":")).encode()
+        head = "%s %s HTTP/1.1\r\nHost: %s\r\n" % (method, path, robot.host)
+        if body is not None:
+            head += "Content-Type: application/json\r\nContent-Length: %d\r\n" % len(data)
+        # The robot reads the request with a single recv; send it in one piece
+        writer.write(head.encode() + b"\r\n" + data)
+        sent = now_ms()
+        response = await asyncio.wait_for(reader.read(), timeout)
+        answered = now_ms()
+    finally:
+        writer.close()
+    head, _, content = response.partition(b"\r\n\r\n")
+    status = int(head.split(b" ", 2)[1])
+    try:
+        reply = json.loads(content) if content else None
+    except ValueError:
+        reply = None
+    return status, reply, sent, answered
+
+
+class Fleet:
+    """
+    The robots and what is known about them. All methods are coroutines that
+    talk to every robot at once; one slow or missing robot delays only its
+    own answer.
+    """
+
+    def __init__(self, robots=(), timeout=2.0):
+        self.robots = list(robots)
+        self.timeout = timeout
+        self.watchers = []
+
+    def add(self, host, port=80):
+        robot = Robot(host, port)
+        self.robots.append(robot)
+        return robot
+
+    async def scan(self, hosts, ports=(80,), timeout=0.5, concurrency=64):
+        """
+        Probe GET /api/state on every host and port; adds and returns the robots that answer.
+
+        Args:
+            hosts (iterable): Addresses, for example ipaddress.ip_network("192.168.1.0/24").hosts()
+            ports (iterable): HTTP ports to try on each
+            timeout (float): Seconds per probe
+            concurrency (int): Probes in flight at once
+        """
+        known = set((r.host, r.port) for r in self.robots)
+        limit = asyncio.Semaphore(concurrency)
+
+        async def probe(host, port):
+            async with limit:
+                robot = Robot(host, port)
+                try:
+                    status, reply, _, _ = await request(robot, "GET", "/api/state", timeout=timeout)
+                except (OSError, asyncio.TimeoutError, ValueError, IndexError):
+                    return None
+                if status == 200 and isinstance(reply, dict) and "safety" in reply and "ms" in reply:
+                    return robot
+                return None
+
+        candidates = [(str(h), p) for h in hosts for p in ports if (str(h), p) not in known]
+        found = [r for r in await asyncio.gather(*(probe(h, p) for h, p in candidates)) if r]
+        self.robots.extend(found)
+        return found
+
+    async def sync_clocks(self, samples=8):
+        """
+        Estimate every robot's clock offset from samples GET /api/state round trips.
+        The sample with the shortest round trip wins; its error is at most half of it.
+        """
+        async def sync(robot):
+            best = None
+            for _ in range(samples):
+                try:
+                    status, reply, sent, answered = await request(robot, "GET", "/api/state",
+                                                                   timeout=self.timeout)
+                except (OSError, asyncio.TimeoutError):
+                    robot.errors += 1
+                    continue
+                if status != 200 or not isinstance(reply, dict) or "ms" not in reply:
+                    continue
+                rtt = answered - sent
+                if best is None or rtt < best[0]:
+                    best = (rtt, reply["ms"] - (sent + answered) / 2)
+            if best:
+                robot.rtt_ms, robot.offset_ms = best
+            return best is not None
+
+        return sum(await asyncio.gather(*(sync(r) for r in self.robots)))
+
+    async def broadcast(self, path, body=None, method="POST", bodies=None):
+        """
+        The same request to every robot at once, or bodies[i] to robot i.
+
+        Returns:
+            list: (robot, HTTP status or None, reply, ms from the start until it answered)
+        """
+        start = now_ms()
+
+        async def send(i, robot):
+            try:
+                status, reply, _, answered = await request(robot, method, path,
+                                                           bodies[i] if bodies else body, self.timeout)
+            except (OSError, asyncio.TimeoutError) as e:
+                robot.errors += 1
+                return robot, None, str(e) or type(e).__name__, now_ms() - start
+            return robot, status, reply, answered - start
+
+        return await asyncio.gather(*(send(i, r) for i, r in enumerate(self.robots)))
+
+    async def drive(self, left, right, sync=False, lead_ms=200):
+        """
+        Set the track speeds of every robot.
+
+        Args:
+            left (int): -100..100
+            right (int): -100..100
+            sync (bool): Start at the same moment on every robot, lead_ms from now;
+                needs sync_clocks() first
+            lead_ms (int): Must cover the slowest request, or that robot starts late
+        """
+        if not sync:
+            return await self.broadcast("/api/drive", {"left": left, "right": right})
+        at = now_ms() + lead_ms
+        bodies = [{"steps": [[0, "drive", left, right]], "at": r.robot_ms(at)} for r in self.robots]
+        return await self.broadcast("/api/batch", bodies=bodies)
+
+    async def stop(self):
+        return await self.broadcast("/api/drive", {"action": "stop"})
+
+    def watch(self):
+        """Open an /events stream to every robot and keep it open; close() ends them."""
+        self.watchers = [asyncio.ensure_future(self._watch(r)) for r in self.robots]
+
+    async def close(self):
+        for task in self.watchers:
+            task.cancel()
+        await asyncio.gather(*self.watchers, return_exceptions=True)
+        self.watchers = []
+
+    async def _watch(self, robot):
+        backoff = MIN_BACKOFF_S
+        while True:
+            writer = None
+            try:
+                reader, writer = await asyncio.wait_for(
+                    asyncio.open_connection(robot.host, robot.port), self.timeout)
+                writer.write(("GET /events HTTP/1.1\r\nHost: %s\r\nAccept: text/event-stream\r\n\r\n"
+                              % robot.host).encode())
+                line = await asyncio.wait_for(reader.readline(), self.timeout)
+                if b" 200 " not in line:
+                    raise ConnectionError(line.decode().strip())
+                robot.online = True
+                backoff = MIN_BACKOFF_S
+                while True:
+                    # Silence for longer than the stale limit counts as a dropped stream
+                    line = await asyncio.wait_for(reader.readline(), max(self.timeout, STALE_MS / 1000 * 2))
+                    if not line:
+                        raise ConnectionError("closed")
+                    if line.startswith(b"data: "):
+                        robot.status = json.loads(line[6:])
+                        robot.last_seen = now_ms()
+                        robot.frames += 1
+            except (OSError, asyncio.TimeoutError, ValueError):
+                robot.online = False
+                robot.reconnects += 1
+            finally:
+                if writer:
+                    writer.close()
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, MAX_BACKOFF_S)
+
+    def summary(self):
+        """Fleet-wide status from the last frame of every robot."""
+        now = now_ms()
+        fresh = [r for r in self.robots if r.last_seen is not None and now - r.last_seen < STALE_MS]
+        moving = [r for r in fresh if r.status["left"] or r.status["right"]]
+        distances = [(r.status["distance"], r.name) for r in fresh if r.status["distance"] is not None]
+        return {
+            "robots": len(self.robots),
+            "online": sum(r.online for r in self.robots),
+            "fresh": len(fresh),
+            "stale": [r.name for r in self.robots if r not in fresh],
+            "moving": len(moving),
+            "safety_on": sum(1 for r in fresh if r.status["safety"]),
+            "closest": min(distances) if distances else None,
+            "max_loop_us": max((r.status["loop_us"] for r in fresh), default=None),
+            "max_command_us": max((r.status["command_us"] for r in fresh), default=None),
+        }
+
+
+def print_results(results):
+    for robot, status, reply, ms in sorted(results, key=lambda r: r[3]):
+        print("  %-22s %5s %7.1f ms  %s" % (robot.name, status, ms,
+                                           reply.get("error", "") if isinstance(reply, dict) else reply))
+
+
+async def run(args):
+    fleet = Fleet(timeout=args.timeout)
+    for address in args.robots:
+        host, _, port = address.partition(":")
+        fleet.add(host, int(port or 80))
+    if args.scan:
+        start = now_ms()
+        found = await fleet.scan(ipaddress.ip_network(args.scan, strict=False).hosts(), args.ports)
+        print("scan of %s: %d robots in %.0f ms" % (args.scan, len(found), now_ms() - start))
+    if not fleet.robots:
+        raise SystemExit("no robots")
+
+    if args.command == "status":
+        fleet.watch()
+        await asyncio.sleep(args.seconds)
+        for r in fleet.robots:
+            print("  %-22s %-7s %s" % (r.name, "online" if r.online else "offline", json.dumps(r.status)))
+        print(json.dumps(fleet.summary()))
+        await fleet.close()
+    elif args.command == "stop":
+        print_results(await fleet.stop())
+    elif args.command == "drive":
+        if args.sync:
+            synced = await fleet.sync_clocks()
+            print("clocks of %d of %d robots synced" % (synced, len(fleet.robots)))
+            for r in fleet.robots:
+                if r.offset_ms is None:
+                    raise SystemExit("no clock offset for %s" % r.name)
+        print_results(await fleet.drive(args.left, args.right, args.sync, args.lead_ms))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--robots", nargs="*", default=[], help="host or host:port of each robot")
+    parser.add_argument("--scan", help="network to probe, for example 192.168.1.0/24")
+    parser.add_argument("--ports", type=int, nargs="+", default=[80])
+    parser.add_argument("--timeout", type=float, default=2.0)
+    commands = parser.add_subparsers(dest="command", required=True)
+    status = commands.add_parser("status", help="watch /events of every robot and print a summary")
+    status.add_argument("--seconds", type=float, default=3.0)
+    commands.add_parser("stop", help="stop every robot")
+    drive = commands.add_parser("drive", help="set the track speeds of every robot")
+    drive.add_argument("left", type=int)
+    drive.add_argument("right", type=int)
+    drive.add_argument("--sync", action="store_true", help="start at the same moment on every robot")
+    drive.add_argument("--lead-ms", type=int, default=200)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Show an occupancy grid from the robot (/map) or a file saved with gridmap.save().
+
+Prints the map as text ('#' occupied, '.' free, ' ' unknown, 'R' the world
+origin) and can write it as a greyscale PGM image.
+
+    python3 host/gridview.py map.bin [--pgm map.pgm]
+    python3 host/gridview.py --url http://192.168.1.42/map
+    python3 host/gridview.py --simulate [--readings N]
+
+--simulate maps the stand-in Room from a few poses, as a quick check of the
+mapping code without a robot.
+"""
+import argparse
+import os
+import random
+import sys
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import standins
+
+# Cell bytes above/below these show as occupied/free
+OCCUPIED = 160
+FREE = 96
+
+
+def render_text(grid, columns):
+    """Rows of text, top row is the highest y, scaled down to fit columns."""
+    step = max(1, (grid.width + columns - 1) // columns)
+    origin_cx, origin_cy = grid.cell_of(0, 0)
+    rows = []
+    for cy in range(grid.height - 1, -1, -step):
+        row = []
+        for cx in range(0, grid.width, step):
+            values = [grid.value(cx + i, cy - j) for i in range(step) for j in range(step)]
+            if cx <= origin_cx < cx + step and cy - step < origin_cy <= cy:
+                row.append("R")
+            elif max(values) >= OCCUPIED:
+                row.append("#")
+            elif min(values) <= FREE:
+                row.append(".")
+            else:
+                row.append(" ")
+        rows.append("".join(row))
+    return rows
+
+
+def write_pgm(grid, path):
+    """Occupied cells dark, free cells light, unknown grey."""
+    with open(path, "wb") as f:
+        f.write(b"P5\n%d %d\n255\n" % (grid.width, grid.height))
+        for cy in range(grid.height - 1, -1, -1):
+            row = grid.cells[cy * grid.width:(cy + 1) * grid.width]
+            f.write(bytes(255 - v for v in row))
+
+
+def simulate(readings, seed):
+    import gridmap
+
+    rng = random.Random(seed)
+    room = standins.Room()
+    grid = gridmap.OccupancyGrid(80, 60, 50)
+    poses = [(0, 0), (-800, -500), (-800, 500), (1000, -600)]
+    for i in range(readings):
+        x, y = poses[i % len(poses)]
+        heading = rng.randrange(360)
+        distance = room.distance(x, y, heading)
+        if distance is not None:
+            distance += rng.gauss(0, 1.0)
+        grid.add_reading(x, y, heading, distance)
+    return grid
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("file", nargs="?", help="saved map")
+    parser.add_argument("--url", help="fetch the map from the robot")
+    parser.add_argument("--simulate", action="store_true", help="map the stand-in room")
+    parser.add_argument("--readings", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--pgm", help="also write the map as a PGM image")
+    parser.add_argument("--columns", type=int, default=100)
+    args = parser.parse_args()
+
+    standins.install()
+    import gridmap
+
+    if args.simulate:
+        grid = simulate(args.readings, args.seed)
+    elif args.url:
+        with urllib.request.urlopen(args.url, timeout=10) as response:
+            grid = gridmap.load(response.read())
+    elif args.file:
+        with open(args.file, "rb") as f:
+            grid = gridmap.load(f.read())
+    else:
+        parser.error("give a file, --url or --simulate")
+
+    for row in render_text(grid, args.columns):
+        print(row)
+    known = sum(1 for v in grid.cells if v != gridmap.UNKNOWN)
+    print("%d x %d cells of %d mm, %d bytes (%d B/m2), %d%% observed"
+          % (grid.width, grid.height, grid.cell_mm, len(grid.cells), grid.bytes_per_m2(),
+             100 * known // len(grid.cells)))
+    if args.pgm:
+        write_pgm(grid, args.pgm)
+        print("wrote", args.pgm)
+
+
+if __name__ == "__main__":
+    main()
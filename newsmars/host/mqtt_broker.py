@@ -0,0 +1,312 @@
+"""
+A small MQTT 3.1.1 broker standing in for Mosquitto on the host.
+
+Enough for the robot's client and host tools: CONNECT with a will, QoS 0
+and 1 publishes (delivered at the lower of the publish and subscription
+QoS), retained messages, SUBSCRIBE with + and # wildcards, keepalive and
+DISCONNECT. No QoS 2, no persistent sessions, no authentication.
+
+    python3 host/mqtt_broker.py [--port 1883] [--verbose]
+
+As a module, Broker runs in a background thread so a test can stop it
+(every connection is dropped, as when the broker crashes) and start it again.
+"""
+import argparse
+import asyncio
+import threading
+import time
+
+CONNECT = 1
+CONNACK = 2
+PUBLISH = 3
+PUBACK = 4
+SUBSCRIBE = 8
+SUBACK = 9
+UNSUBSCRIBE = 10
+UNSUBACK = 11
+PINGREQ = 12
+PINGRESP = 13
+DISCONNECT = 14
+
+
+def encode_length(length):
+    out = bytearray()
+    while True:
+        byte = length & 0x7F
+        length >>= 7
+        out.append(byte | (0x80 if length else 0))
+        if not length:
+            return bytes(out)
+
+
+def string(data):
+    if isinstance(data, str):
+        data = data.encode()
+    return len(data).to_bytes(2, "big") + data
+
+
+def packet(kind, flags, body):
+    return bytes(((kind << 4) | flags,)) + encode_length(len(body)) + body
+
+
+def publish_packet(topic, payload, qos=0, retain=False, packet_id=0, dup=False):
+    body = string(topic) + (packet_id.to_bytes(2, "big") if qos else b"") + payload
+    return packet(PUBLISH, (8 if dup else 0) | (qos << 1) | (1 if retain else 0), body)
+
+
+async def read_packet(reader):
+    """(kind, flags, body) of the next packet; raises IncompleteReadError at EOF."""
+    first = (await reader.readexactly(1))[0]
+    length = 0
+    shift = 0
+    while True:
+        byte = (await reader.readexactly(1))[0]
+        length |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            break
+        shift += 7
+        if shift > 21:
+            raise ValueError("bad remaining length")
+    return first >> 4, first & 0x0F, await reader.readexactly(length)
+
+
+def matches(pattern, topic):
+    """True if topic matches a subscription pattern with + and # wildcards."""
+    parts = pattern.split("/")
+    levels = topic.split("/")
+    for i, part in enumerate(parts):
+        if part == "#":
+            return True
+        if i >= len(levels) or (part != "+" and part != levels[i]):
+            return False
+    return len(parts) == len(levels)
+
+
+class Session:
+    def __init__(self, broker, reader, writer):
+        self.broker = broker
+        self.reader = reader
+        self.writer = writer
+        self.client_id = None
+        self.subscriptions = {}
+        self.will = None
+        self.next_id = 0
+        self.received = 0
+
+    def send(self, data):
+        if not self.writer.is_closing():
+            self.writer.write(data)
+
+    def deliver(self, topic, payload, qos, retain=False):
+        if qos:
+            self.next_id = self.next_id % 0xFFFF + 1
+        self.send(publish_packet(topic, payload, qos, retain, self.next_id if qos else 0))
+
+    async def run(self):
+        keepalive = None
+        clean = False
+        try:
+            kind, flags, body = await asyncio.wait_for(read_packet(self.reader), 10)
+            if kind != CONNECT:
+                return
+            keepalive = self.connect(body)
+            while True:
+                timeout = keepalive * 1.5 if keepalive else None
+                kind, flags, body = await asyncio.wait_for(read_packet(self.reader), timeout)
+                if kind == PUBLISH:
+                    self.publish(flags, body)
+                elif kind == SUBSCRIBE:
+                    self.subscribe(body)
+                elif kind == UNSUBSCRIBE:
+                    pos = 2
+                    while pos < len(body):
+                        size = int.from_bytes(body[pos:pos + 2], "big")
+                        self.subscriptions.pop(body[pos + 2:pos + 2 + size].decode(), None)
+                        pos += 2 + size
+                    self.send(packet(UNSUBACK, 0, body[:2]))
+                elif kind == PINGREQ:
+                    self.send(packet(PINGRESP, 0, b""))
+                elif kind == DISCONNECT:
+                    clean = True
+                    return
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError, ValueError):
+            pass
+        finally:
+            self.broker.leave(self, clean)
+            self.writer.close()
+
+    def connect(self, body):
+        pos = 2 + int.from_bytes(body[0:2], "big")
+        flags = body[pos + 1]
+        keepalive = int.from_bytes(body[pos + 2:pos + 4], "big")
+        pos += 4
+        size = int.from_bytes(body[pos:pos + 2], "big")
+        self.client_id = body[pos + 2:pos + 2 + size].decode()
+        pos += 2 + size
+        if flags & 0x04:
+            size = int.from_bytes(body[pos:pos + 2], "big")
+            topic = body[pos + 2:pos + 2 + size].decode()
+            pos += 2 + size
+            size = int.from_bytes(body[pos:pos + 2], "big")
+            self.will = (topic, bytes(body[pos + 2:pos + 2 + size]), (flags >> 3) & 3, bool(flags & 0x20))
+        self.broker.join(self)
+        self.send(packet(CONNACK, 0, b"\x00\x00"))
+        return keepalive
+
+    def publish(self, flags, body):
+        qos = (flags >> 1) & 3
+        size = int.from_bytes(body[0:2], "big")
+        topic = body[2:2 + size].decode()
+        pos = 2 + size
+        if qos:
+            packet_id = body[pos:pos + 2]
+            pos += 2
+            self.send(packet(PUBACK, 0, packet_id))
+        self.received += 1
+        self.broker.route(topic, bytes(body[pos:]), qos, bool(flags & 1), dup=bool(flags & 8))
+
+    def subscribe(self, body):
+        pos = 2
+        granted = bytearray()
+        topics = []
+        while pos < len(body):
+            size = int.from_bytes(body[pos:pos + 2], "big")
+            topic = body[pos + 2:pos + 2 + size].decode()
+            qos = min(body[pos + 2 + size], 1)
+            pos += 3 + size
+            self.subscriptions[topic] = qos
+            granted.append(qos)
+            topics.append((topic, qos))
+        self.send(packet(SUBACK, 0, body[:2] + bytes(granted)))
+        for pattern, qos in topics:
+            for topic, (payload, retained_qos) in self.broker.retained.items():
+                if matches(pattern, topic):
+                    self.deliver(topic, payload, min(qos, retained_qos), retain=True)
+
+
+class Broker:
+    """
+    The broker on its own asyncio loop in a background thread.
+
+    Attributes:
+        published (int): PUBLISH packets received from clients
+        duplicates (int): Of those, resent ones (DUP flag)
+        delivered (int): Messages sent on to subscribers
+        connects (int): Accepted CONNECTs
+        on_publish: Optional callback(topic, payload, qos), called on the broker thread
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, verbose=False):
+        self.host = host
+        self.port = port
+        self.verbose = verbose
+        self.sessions = {}
+        self.retained = {}
+        self.published = 0
+        self.duplicates = 0
+        self.delivered = 0
+        self.connects = 0
+        self.on_publish = None
+        self.loop = None
+        self.server = None
+        self.thread = None
+
+    def start(self):
+        """Listen (again); returns the port."""
+        ready = threading.Event()
+
+        def run():
+            self.loop = asyncio.new_event_loop()
+            self.server = self.loop.run_until_complete(
+                asyncio.start_server(self._accept, self.host, self.port))
+            self.port = self.server.sockets[0].getsockname()[1]
+            ready.set()
+            self.loop.run_forever()
+            self.loop.close()
+
+        self.thread = threading.Thread(target=run, daemon=True)
+        self.thread.start()
+        ready.wait()
+        return self.port
+
+    def stop(self):
+        """Close the listener and drop every connection, like a crash."""
+        async def shutdown():
+            self.server.close()
+            for session in list(self.sessions.values()):
+                session.will = None
+                session.writer.transport.abort()
+            # Aborted connections end their sessions at EOF; let them finish
+            tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+            if tasks:
+                await asyncio.wait(tasks, timeout=1)
+            self.loop.stop()
+
+        asyncio.run_coroutine_threadsafe(shutdown(), self.loop)
+        self.thread.join()
+        self.sessions.clear()
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        """Publish from the host side, as if from a client; thread safe."""
+        self.loop.call_soon_threadsafe(self.route, topic, payload, qos, retain)
+
+    async def _accept(self, reader, writer):
+        await Session(self, reader, writer).run()
+
+    def join(self, session):
+        old = self.sessions.get(session.client_id)
+        if old is not None:
+            old.will = None
+            old.writer.transport.abort()
+        self.sessions[session.client_id] = session
+        self.connects += 1
+        if self.verbose:
+            print("%.3f connect %s" % (time.time(), session.client_id))
+
+    def leave(self, session, clean):
+        if self.sessions.get(session.client_id) is session:
+            del self.sessions[session.client_id]
+        if self.verbose:
+            print("%.3f %s %s" % (time.time(), "disconnect" if clean else "lost", session.client_id))
+        if session.will and not clean:
+            topic, payload, qos, retain = session.will
+            self.route(topic, payload, qos, retain)
+
+    def route(self, topic, payload, qos, retain=False, dup=False):
+        self.published += 1
+        if dup:
+            self.duplicates += 1
+        if retain:
+            if payload:
+                self.retained[topic] = (payload, qos)
+            else:
+                self.retained.pop(topic, None)
+        if self.on_publish:
+            self.on_publish(topic, payload, qos)
+        if self.verbose:
+            print("%.3f %s %d B qos %d" % (time.time(), topic, len(payload), qos))
+        for session in list(self.sessions.values()):
+            for pattern, sub_qos in session.subscriptions.items():
+                if matches(pattern, topic):
+                    session.deliver(topic, payload, min(qos, sub_qos))
+                    self.delivered += 1
+                    break
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=1883)
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+    broker = Broker(args.host, args.port, args.verbose)
+    port = broker.start()
+    print("MQTT broker on %s:%d" % (args.host, port))
+    try:
+        broker.thread.join()
+    except KeyboardInterrupt:
+        broker.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+"""
+Update firmware files on the robot over Wi-Fi.
+
+Announces every file with its size and SHA-256 in POST /ota/begin, sends it
+in fixed-size chunks to POST /ota/chunk and ends with POST /ota/commit, after
+which the robot restarts with the new files on trial. If the new main.py
+does not come up, the robot puts the old files back by itself. A dropped
+connection, or a reset of the robot halfway, continues from where the
+robot's copy ends: --retries does that automatically, or run the same
+command again.
+
+    python3 host/ota_push.py 192.168.1.50 main.py planner.py [--chunk 4096] [--wait]
+    python3 host/ota_push.py 192.168.1.50 --status
+
+--wait polls GET /ota after the commit until the robot reports whether the
+new version was confirmed or rolled back.
+
+Every begin, chunk and commit is signed with the robot's OTA_KEY (from
+secrets.py on the robot), given with --key or in the OTA_KEY environment
+variable, and the nonce the robot draws at every boot. Without the right
+key the robot answers 403.
+"""
+import argparse
+import hashlib
+import hmac
+import json
+import os
+import socket
+import sys
+import time
+import urllib.parse
+
+
+class PushError(Exception):
+    pass
+
+
+def request(host, port, method, path, body=None, timeout=5.0):
+    """
+    One request on a new connection; the robot closes it after answering.
+
+    Returns:
+        tuple: (HTTP status, decoded JSON body or None)
+    """
+    head = "%s %s HTTP/1.1\r\nHost: %s\r\n" % (method, path, host)
+    if body is not None:
+        head += "Content-Length: %d\r\n" % len(body)
+    conn = socket.create_connection((host, port), timeout=timeout)
+    try:
+        # The robot reads the request line and headers with a single recv; send them in one piece
+        conn.sendall(head.encode() + b"\r\n" + (body or b""))
+        chunks = []
+        while True:
+            chunk = conn.recv(4096)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    finally:
+        conn.close()
+    response = b"".join(chunks)
+    head, sep, content = response.partition(b"\r\n\r\n")
+    if not sep:
+        raise ConnectionError("no response")
+    status = int(head.split(b" ", 2)[1])
+    return status, json.loads(content) if content else None
+
+
+def manifest(files):
+    """{name: {"size", "sha256"}} for /ota/begin from {name: bytes}."""
+    return {name: {"size": len(data), "sha256": hashlib.sha256(data).hexdigest()}
+            for name, data in files.items()}
+
+
+def sign(key, nonce, message):
+    """?auth= for a request: HMAC-SHA256 of nonce + " " + message, as ota.sign() computes it."""
+    return hmac.new(key.encode(), nonce.encode() + b" " + message, hashlib.sha256).hexdigest()
+
+
+def _error(reply):
+    return reply.get("error") if isinstance(reply, dict) else reply
+
+
+def push(host, port, files, key, chunk=4096, retries=10, commit=True, timeout=5.0, backoff=0.5, log=None):
+    """
+    Send files and commit them.
+
+    Args:
+        files (dict): {name on the robot: bytes}
+        key (str): The robot's OTA_KEY
+        chunk (int): Bytes per /ota/chunk request
+        retries (int): Dropped connections and resends to tolerate in total
+        commit (bool): Swap the update in and restart the robot at the end
+        backoff (float): Seconds to wait before a retry
+        log: Optional callable for progress lines
+
+    Returns:
+        dict: requests, retries, bytes sent, and the commit reply
+    """
+    log = log or (lambda line: None)
+    stats = {"requests": 0, "retries": 0, "bytes": 0, "commit": None}
+    body = json.dumps({"files": manifest(files)}).encode()
+
+    def call(method, path, data=None):
+        stats["requests"] += 1
+        if data is not None and method == "POST" and path.startswith("/ota/chunk"):
+            stats["bytes"] += len(data)
+        return request(host, port, method, path, data, timeout)
+
+    nonce = None
+    while True:
+        try:
+            fresh = nonce is None
+            if fresh:
+                status, reply = call("GET", "/ota")
+                if status != 200:
+                    raise PushError("status: %s" % _error(reply))
+                nonce = reply["nonce"]
+            # begin is repeatable: with the same files the robot keeps what it already has
+            status, reply = call("POST", "/ota/begin?auth=" + sign(key, nonce, b"begin " + body), body)
+            if status == 403 and not fresh:
+                # The robot reset since the nonce was fetched and drew a new one
+                nonce = None
+                raise ConnectionError("nonce changed")
+            if status != 200:
+                raise PushError("begin: %s" % _error(reply))
+            resync = False
+            for name, data in files.items():
+                offset = reply["files"][name]["received"]
+                if offset:
+                    log("%s: continuing at %d of %d bytes" % (name, offset, len(data)))
+                while offset < len(data) and not resync:
+                    auth = sign(key, nonce, ("chunk %s %d" % (name, offset)).encode())
+                    path = "/ota/chunk?file=%s&offset=%d&auth=%s" % (urllib.parse.quote(name), offset, auth)
+                    status, answer = call("POST", path, data[offset:offset + chunk])
+                    error = str(_error(answer))
+                    if status == 200:
+                        offset = answer["received"]
+                    elif status in (400, 409) and ("offset" in error or "sha256" in error):
+                        # Someone else's chunk, or a corrupted file the robot threw away
+                        log("%s: %s" % (name, error))
+                        resync = True
+                    elif status == 403:
+                        # begin took the key, so the robot reset and drew a new nonce
+                        nonce = None
+                        raise ConnectionError("nonce changed")
+                    else:
+                        raise PushError("chunk %s: %s" % (name, error))
+                if resync:
+                    break
+                log("%s: %d bytes" % (name, len(data)))
+            if resync:
+                raise ConnectionError("resync")
+            if not commit:
+                return stats
+            status, reply = call("POST", "/ota/commit?auth=" + sign(key, nonce, b"commit"))
+            if status == 403:
+                nonce = None
+                raise ConnectionError("nonce changed")
+            if status == 409 and "sha256" in str(_error(reply)):
+                raise ConnectionError(_error(reply))
+            if status != 200:
+                raise PushError("commit: %s" % _error(reply))
+            stats["commit"] = reply
+            return stats
+        except (OSError, ValueError) as e:
+            stats["retries"] += 1
+            if stats["retries"] > retries:
+                raise PushError("giving up after %d retries: %s" % (retries, e))
+            log("retry %d: %s" % (stats["retries"], e or type(e).__name__))
+            time.sleep(backoff)
+
+
+def wait_for_outcome(host, port, timeout=120.0, interval=1.0):
+    """Poll GET /ota until the robot reports "confirmed" or "rolled back"; None on timeout."""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            status, reply = request(host, port, "GET", "/ota", timeout=interval * 2)
+            if status == 200 and reply.get("update") in ("confirmed", "rolled back"):
+                return reply["update"]
+        except (OSError, ValueError):
+            pass
+        time.sleep(interval)
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("host")
+    parser.add_argument("files", nargs="*", help="files to send; stored on the robot under their own name")
+    parser.add_argument("--port", type=int, default=80)
+    parser.add_argument("--key", default=os.environ.get("OTA_KEY"), help="the robot's OTA_KEY, default $OTA_KEY")
+    parser.add_argument("--chunk", type=int, default=4096, help="bytes per request")
+    parser.add_argument("--retries", type=int, default=10)
+    parser.add_argument("--no-commit", action="store_true", help="only upload; commit with a later run")
+    parser.add_argument("--wait", action="store_true", help="wait for the outcome of the trial boot")
+    parser.add_argument("--status", action="store_true", help="show GET /ota and exit")
+    args = parser.parse_args()
+
+    if args.status or not args.files:
+        print(json.dumps(request(args.host, args.port, "GET", "/ota")[1], indent=2))
+        return
+    if not args.key:
+        sys.exit("no key: pass --key or set OTA_KEY")
+    files = {}
+    for path in args.files:
+        with open(path, "rb") as f:
+            files[os.path.basename(path)] = f.read()
+    start = time.time()
+    try:
+        stats = push(args.host, args.port, files, args.key, args.chunk, args.retries, not args.no_commit,
+                     log=print)
+    except PushError as e:
+        sys.exit(str(e))
+    print("%d bytes in %d requests (%d retries), %.1f s" % (stats["bytes"], stats["requests"],
+                                                           stats["retries"], time.time() - start))
+    if stats["commit"]:
+        print("committed %s, the robot restarts" % ", ".join(stats["commit"]["committed"]))
+        if args.wait:
+            outcome = wait_for_outcome(args.host, args.port)
+            print("update %s" % (outcome or "unknown: the robot did not answer"))
+            if outcome != "confirmed":
+                sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
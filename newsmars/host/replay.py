@@ -0,0 +1,158 @@
+"""
+Replay a session recorded by recorder.py through the firmware on the host.
+
+The recorded distances are fed to the sensor's SonarArray through the
+echo stand-in, which answers each ping at once, the recorded actions to
+main.apply_action() and the track commands (from the UDP drive port) to
+main.drive_tracks(), on a virtual clock so the session runs as fast as the
+host allows. The motor outputs of the
+replay are compared with the recorded ones; any difference is listed and
+the exit status is 1.
+
+    python3 host/replay.py session.bin
+    python3 host/replay.py --record demo.bin [--seconds 60] [--seed 1]
+
+--record writes a scripted session with the current firmware, which is
+handy as a reference log before changing the control code.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import standins
+
+# Chance of a button press and of a UDP track command per control tick in a scripted session
+PRESS_CHANCE = 0.05
+DRIVE_CHANCE = 0.02
+
+
+def load_firmware():
+    standins.install()
+    clock = standins.use_virtual_clock()
+    import log
+    import main as firmware
+    from sonar import SonarArray
+    from SimplyRobotics import KitronikSimplyRobotics
+
+    log.logger.echo_level = log.OFF
+    firmware.robot = KitronikSimplyRobotics(lazy=True)
+    # The sensor alone in the array, as init_hardware() sets it up without a scanner
+    firmware.sonar = SonarArray([("sensor", firmware.SENSOR_TRIGGER_PIN, firmware.SENSOR_ECHO_PIN, 90, 0)],
+                                firmware.SONAR_MAX_CM, firmware.SENSOR_INTERVAL_MS)
+    standins.answer_pings(firmware.sonar, clock)
+    return firmware, clock
+
+
+def set_distance(distance_cm):
+    duration = standins.echo_for_distance(distance_cm)
+    sys.modules["machine"].echo_model = lambda pin: duration
+
+
+def record(path, seconds, seed):
+    """Drive the firmware with random presses and a moving obstacle."""
+    firmware, clock = load_firmware()
+    import recorder
+
+    rng = random.Random(seed)
+    firmware.recorder = recorder.Recorder(path)
+    firmware.recorder.state(firmware.current_speed, firmware.safety_enabled)
+    server = standins.FakeServer()
+
+    distance = 80.0
+    end_ms = seconds * 1000
+    now = 0
+    while now < end_ms:
+        distance = min(300.0, max(3.0, distance + rng.uniform(-4.0, 4.0)))
+        set_distance(None if rng.random() < 0.02 else distance)
+        if rng.random() < PRESS_CHANCE:
+            action = rng.choice(recorder.ACTIONS)
+            server.queue(b"GET /?action=" + action.encode() + b" HTTP/1.1\r\n\r\n")
+            firmware.serve_client(server)
+        if rng.random() < DRIVE_CHANCE:
+            firmware.drive_tracks(rng.randint(-100, 100), rng.randint(-100, 100))
+        firmware.control_tick(time.ticks_ms())
+        now += firmware.CONTROL_TICK_MS
+        clock.set_ms(now)
+    firmware.save_log()
+    print("recorded %.0f s, %d bytes, %d records dropped -> %s"
+          % (seconds, firmware.recorder.written, firmware.recorder.dropped, path))
+
+
+def replay(path, verbose):
+    firmware, clock = load_firmware()
+    import recorder
+
+    with open(path, "rb") as f:
+        records = recorder.read_log(f.read())
+    if not records:
+        print("%s: empty session" % path)
+        return 0
+
+    first_ms = records[0][0]
+    mismatches = []
+    counts = [0, 0, 0, 0, 0]
+    start = time.perf_counter()
+    for t_ms, kind, arg8, arg16 in records:
+        clock.set_ms(t_ms)
+        if kind < len(counts):
+            counts[kind] += 1
+        if kind == recorder.REC_STATE:
+            firmware.current_speed = arg16
+            firmware.safety_enabled = bool(arg8)
+        elif kind == recorder.REC_DISTANCE:
+            set_distance(None if arg16 == recorder.NO_DISTANCE else arg16 / 10)
+            # Ping now, so that control_tick() collects this reading
+            firmware.sonar.poll()
+            firmware.control_tick(t_ms)
+        elif kind == recorder.REC_ACTION:
+            if arg8 < len(recorder.ACTIONS):
+                firmware.apply_action(recorder.ACTIONS[arg8])
+            else:
+                firmware.apply_action(firmware._UNKNOWN_ACTION)
+        elif kind == recorder.REC_DRIVE:
+            firmware.drive_tracks(arg8 - recorder.DRIVE_OFFSET, arg16 - recorder.DRIVE_OFFSET)
+        elif kind == recorder.REC_MOTOR:
+            motor = firmware.robot.motors[arg8]
+            expected = (recorder.DIRECTIONS[arg16 >> 8], arg16 & 0xFF)
+            actual = (motor.direction, int(motor.speed))
+            if actual != expected:
+                mismatches.append((t_ms, arg8, expected, actual))
+    elapsed = time.perf_counter() - start
+    duration_s = time.ticks_diff(records[-1][0], first_ms) / 1000
+
+    print("%s: %d records over %.1f s" % (path, len(records), duration_s))
+    print("  %d distances, %d actions, %d track commands, %d motor outputs"
+          % (counts[recorder.REC_DISTANCE], counts[recorder.REC_ACTION], counts[recorder.REC_DRIVE],
+             counts[recorder.REC_MOTOR]))
+    print("  replayed in %.3f s (%.0fx real time)"
+          % (elapsed, duration_s / elapsed if elapsed > 0 else 0))
+    if not mismatches:
+        print("  motor outputs match")
+        return 0
+    print("  %d motor outputs differ:" % len(mismatches))
+    for t_ms, number, expected, actual in mismatches if verbose else mismatches[:10]:
+        print("    t=%d ms motor %d: recorded %s %d, replay %s %d"
+              % (t_ms, number, expected[0], expected[1], actual[0], actual[1]))
+    return 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("log", help="session log")
+    parser.add_argument("--record", action="store_true", help="write a scripted session to LOG")
+    parser.add_argument("--seconds", type=float, default=60)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--verbose", action="store_true", help="list every differing output")
+    args = parser.parse_args()
+
+    if args.record:
+        record(args.log, args.seconds, args.seed)
+        return
+    sys.exit(replay(args.log, args.verbose))
+
+
+if __name__ == "__main__":
+    main()
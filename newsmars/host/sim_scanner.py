@@ -0,0 +1,204 @@
+"""
+Simulated sweeps of scanner.Scanner against a naive move-wait-ping loop.
+
+The servo stand-in turns at a fixed rate towards the last commanded angle
+and the echo stand-in returns the distance to the stand-in Room along the
+direction the servo actually points at the moment of the ping. The naive
+loop waits for it with the blocking driver, taking the time of flight (or
+the 30 ms timeout) on a virtual clock; the scanner's echo pin is driven
+for the SonarArray interrupts. Each loop is scored on time per sweep, on
+the error against the true distance at the commanded angle, on the share
+of pings taken before the servo got there and on the longest a single
+call kept the main loop waiting. Exits with 1 if the pipelined scanner is
+not faster, is less accurate than the naive loop by more than
+--tolerance-cm, or ever blocks.
+
+    python3 host/sim_scanner.py [--sweeps N] [--servo-ms-per-degree 1.7] [--naive-wait-ms 100]
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import standins
+
+# Echo timeout of the HC-SR04 driver
+ECHO_TIMEOUT_US = 30000
+
+
+class ServoModel:
+    """Physical servo position over virtual time; wraps a PWMServo's goToPosition."""
+
+    def __init__(self, servo, clock, ms_per_degree):
+        self.clock = clock
+        self.us_per_degree = ms_per_degree * 1000
+        self.position = 90.0
+        self.target = 90.0
+        self.previous = 90.0
+        self.since = clock.us
+        self.command = servo.goToPosition
+        servo.goToPosition = self.go_to
+
+    def go_to(self, degrees):
+        self.position = self.angle()
+        self.previous = self.target
+        self.since = self.clock.us
+        self.target = float(min(180, max(0, degrees)))
+        self.command(degrees)
+
+    def aimed(self):
+        """Angle the current ping was meant for: a move sent after the trigger doesn't count yet."""
+        return self.previous if self.since == self.clock.us else self.target
+
+    def angle(self):
+        travel = (self.clock.us - self.since) / self.us_per_degree
+        if abs(self.target - self.position) <= travel:
+            return self.target
+        return self.position + travel if self.target > self.position else self.position - travel
+
+
+class World:
+    """Echo stand-in: pings the room from the origin, heading = servo angle - 90."""
+
+    def __init__(self, room, servo, clock):
+        self.room = room
+        self.servo = servo
+        self.clock = clock
+        self.off_angle = 0
+        self.pings = 0
+
+    def echo(self, pin):
+        self.pings += 1
+        angle = self.servo.angle()
+        if abs(angle - self.servo.aimed()) > 1:
+            self.off_angle += 1
+        distance = self.room.distance(0, 0, angle - 90)
+        return standins.echo_for_distance(distance)
+
+    def waited_echo(self, pin):
+        """echo() as time_pulse_us() returns it, after waiting for it."""
+        duration = self.echo(pin)
+        self.clock.sleep_us(duration if duration >= 0 else ECHO_TIMEOUT_US)
+        return duration
+
+
+def error_cm(room, angle, measured):
+    truth = room.distance(0, 0, angle - 90)
+    if truth is None and measured is None:
+        return 0.0
+    if truth is None or measured is None:
+        return room.max_range_cm
+    return abs(truth - measured)
+
+
+def run(label, sweeps, servo_ms_per_degree, scan):
+    """Set up a fresh servo and world, then call scan(...) for the readings."""
+    clock = standins.use_virtual_clock()
+    from SimplyRobotics import PWMServo
+
+    room = standins.Room()
+    servo = PWMServo(15)
+    model = ServoModel(servo, clock, servo_ms_per_degree)
+    world = World(room, model, clock)
+
+    readings, elapsed_ms, stall_ms = scan(world, servo, clock, sweeps)
+    standins.Pin.watcher = None
+    errors = [error_cm(room, angle, distance) for angle, distance in readings]
+    return {
+        "label": label,
+        "sweep_ms": elapsed_ms / sweeps,
+        "mean_error_cm": sum(errors) / len(errors),
+        "max_error_cm": max(errors),
+        "off_angle": world.off_angle / max(1, world.pings),
+        "stall_ms": stall_ms,
+    }
+
+
+def pipelined(settle_ms, ms_per_degree):
+    def scan(world, servo, clock, sweeps):
+        import scanner
+        import sonar
+        sys.modules["machine"].echo_model = world.echo
+        array = sonar.SonarArray([("scan", 17, 16, 90, 0)], world.room.max_range_cm, 0)
+        standins.answer_pings(array, clock)
+        s = scanner.Scanner(array, servo, settle_ms=settle_ms, ms_per_degree=ms_per_degree)
+        s.sweep()
+        start = clock.us
+        readings = []
+        stall = 0
+        while s.sweeps <= sweeps:
+            # The main loop's wait, at most a control tick
+            clock.sleep_ms(max(1, min(20, s.due_in(clock.us // 1000))))
+            before = clock.us
+            if s.step(clock.us // 1000):
+                readings.append((s.last_angle, s.last_distance))
+            stall = max(stall, clock.us - before)
+        return readings, (clock.us - start) / 1000, stall / 1000
+    return scan
+
+
+def naive(wait_ms, min_angle=30, max_angle=150, step=15):
+    def scan(world, servo, clock, sweeps):
+        from rangefinder import HCSR04
+        sys.modules["machine"].echo_model = world.waited_echo
+        sensor = HCSR04()
+        angles = list(range(min_angle, max_angle + 1, step))
+        servo.goToPosition(angles[0])
+        clock.sleep_ms(wait_ms * 3)
+        start = clock.us
+        readings = []
+        stall = 0
+        for i in range(sweeps):
+            for angle in (angles if i % 2 == 0 else angles[::-1]):
+                servo.goToPosition(angle)
+                clock.sleep_ms(wait_ms)
+                before = clock.us
+                readings.append((angle, sensor.measure_distance()))
+                stall = max(stall, clock.us - before)
+        return readings, (clock.us - start) / 1000, stall / 1000
+    return scan
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sweeps", type=int, default=20)
+    parser.add_argument("--servo-ms-per-degree", type=float, default=1.7,
+                        help="simulated servo speed (SG90: about 1.7)")
+    parser.add_argument("--naive-wait-ms", type=int, default=100,
+                        help="wait after every move in the naive loop")
+    parser.add_argument("--tolerance-cm", type=float, default=1.0)
+    args = parser.parse_args()
+
+    standins.install()
+    import scanner
+
+    results = [
+        run("naive move-wait-ping", args.sweeps, args.servo_ms_per_degree, naive(args.naive_wait_ms)),
+        run("pipelined (default model)", args.sweeps, args.servo_ms_per_degree,
+            pipelined(scanner.SETTLE_MS, scanner.MS_PER_DEGREE)),
+        run("pipelined (model too fast)", args.sweeps, args.servo_ms_per_degree,
+            pipelined(0, 1)),
+    ]
+
+    print("servo %.1f ms/degree, %d sweeps of 30-150 degrees in 15 degree steps"
+          % (args.servo_ms_per_degree, args.sweeps))
+    print("%-28s %10s %10s %14s %14s %10s %10s"
+          % ("loop", "ms/sweep", "sweeps/s", "mean err cm", "max err cm", "off-angle", "stall ms"))
+    for r in results:
+        print("%-28s %10.1f %10.2f %14.2f %14.2f %9.0f%% %10.1f"
+              % (r["label"], r["sweep_ms"], 1000 / r["sweep_ms"], r["mean_error_cm"],
+                 r["max_error_cm"], 100 * r["off_angle"], r["stall_ms"]))
+
+    base, piped = results[0], results[1]
+    if piped["sweep_ms"] >= base["sweep_ms"] or \
+            piped["mean_error_cm"] > base["mean_error_cm"] + args.tolerance_cm:
+        print("FAIL: pipelined scanner is not faster at the same accuracy")
+        sys.exit(1)
+    if piped["stall_ms"] > 1:
+        print("FAIL: the scanner kept the loop waiting %.1f ms" % piped["stall_ms"])
+        sys.exit(1)
+    print("pipelined scanner is %.1fx faster" % (base["sweep_ms"] / piped["sweep_ms"]))
+
+
+if __name__ == "__main__":
+    main()
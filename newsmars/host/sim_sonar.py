@@ -0,0 +1,238 @@
+"""
+Simulated throughput and crosstalk of sonar.SonarArray with four HC-SR04s.
+
+The echo model drives the echo pins of the Pin stand-ins on a virtual
+clock. A trigger pulse makes the sensor send its burst and raise its echo
+pin, unless it is still listening to its previous ping. Every burst comes
+back from the nearest wall of the stand-in Room in the sensor's direction,
+and is heard by that sensor and by any sensor pointing within
+--crosstalk-deg of it. It also comes back once more --reverb-ms later from
+the rest of the room, and every sensor hears that. A sensor's echo pin
+falls at the first sound it hears, or after 38 ms. The robot drives back
+and forth and turns slowly, so the distances keep changing.
+
+The main loop waits as main.py does: until SonarArray.due_in(), at most
+CONTROL_TICK_MS. Each schedule is scored on readings per second over all
+sensors, the slowest sensor's rate and the share of readings more than
+--tolerance-cm off the true distance. Exits with 1 if the default, with
+front and back pinging together, reads wrong or is not faster than
+plain round-robin with the 60 ms between pings the HC-SR04 datasheet asks for.
+
+    python3 host/sim_sonar.py [--seconds 60] [--crosstalk-deg 45] [--reverb-ms 25]
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import standins
+
+# name, trigger, echo, angle in servo degrees (90 ahead)
+LAYOUT = [("front", 17, 16, 90), ("front-left", 0, 1, 135), ("back", 27, 26, 270), ("front-right", 21, 20, 45)]
+GROUPINGS = {
+    "all at once": [0, 0, 0, 0],
+    "round-robin": [0, 1, 2, 3],
+    # Front and back never hear each other, neither do front-left and front-right
+    "staggered": [0, 1, 0, 1],
+}
+# The echo pin rises this long after the trigger, and falls after NO_ECHO_US without an echo
+BURST_US = 450
+NO_ECHO_US = 38000
+# Time between the firmware's loop passes when nothing is waiting
+LOOP_US = 300
+# The blocking driver's timeout, for the comparison
+DRIVER_TIMEOUT_US = 30000
+
+
+def angle_apart(a, b):
+    return abs((a - b + 180) % 360 - 180)
+
+
+class World:
+    """Echo stand-in for several HC-SR04s in a room, driven by their trigger pins."""
+
+    def __init__(self, room, clock, sonar, crosstalk_deg, reverb_us):
+        self.room = room
+        self.clock = clock
+        self.sonar = sonar
+        self.crosstalk_deg = crosstalk_deg
+        self.reverb_us = reverb_us
+        count = len(sonar.triggers)
+        self.rise_at = [None] * count
+        self.fall_at = [None] * count
+        self.listening = [None] * count
+        self.triggered = [False] * count
+        self.truth = [None] * count
+        self.arrivals = []
+        self.ignored = 0
+        self.stalls = []
+        self.x = -700.0
+        self.y = -200.0
+        self.heading = 0.0
+        standins.Pin.watcher = self.pin_changed
+
+    def direction(self, i):
+        return self.heading + self.sonar.angles[i] - 90
+
+    def move(self):
+        """Back and forth over 1.4 m every 10 s, turning 12 degrees a second."""
+        t = self.clock.us / 1000000
+        phase = (t / 10) % 1
+        self.x = -700 + 1400 * (phase * 2 if phase < 0.5 else 2 - phase * 2)
+        self.heading = (t * 12) % 360
+
+    def hears(self, j, source, reverb):
+        return reverb or j == source or angle_apart(self.direction(j), self.direction(source)) <= self.crosstalk_deg
+
+    def pin_changed(self, pin):
+        if pin not in self.sonar.triggers:
+            return
+        i = self.sonar.triggers.index(pin)
+        if pin.value():
+            self.triggered[i] = True
+            return
+        if not self.triggered[i]:
+            return
+        self.triggered[i] = False
+        if self.sonar.echoes[i].value() or self.rise_at[i] is not None:
+            self.ignored += 1
+            return
+        start = self.clock.us + BURST_US
+        self.rise_at[i] = start
+        distance = self.room.distance(self.x, self.y, self.direction(i))
+        self.truth[i] = distance
+        echo = standins.echo_for_distance(distance)
+        self.stalls.append(BURST_US + (echo if echo >= 0 else DRIVER_TIMEOUT_US))
+        if echo >= 0:
+            self.arrive(start + echo, i, False)
+        self.arrive(start + self.reverb_us, i, True)
+
+    def arrive(self, at, source, reverb):
+        self.arrivals.append((at, source, reverb))
+        for j in range(len(self.listening)):
+            if (self.listening[j] is not None and self.listening[j] < at < self.fall_at[j]
+                    and self.hears(j, source, reverb)):
+                self.fall_at[j] = at
+
+    def advance(self, until):
+        """Move the clock to until, raising and dropping echo pins on the way."""
+        while True:
+            t, j, rising = None, None, None
+            for i in range(len(self.rise_at)):
+                for at, edge in ((self.rise_at[i], True), (self.fall_at[i], False)):
+                    if at is not None and at <= until and (t is None or at < t):
+                        t, j, rising = at, i, edge
+            if t is None:
+                break
+            self.clock.us = max(self.clock.us, t)
+            if rising:
+                self.rise_at[j] = None
+                self.listening[j] = t
+                fall = t + NO_ECHO_US
+                for at, source, reverb in self.arrivals:
+                    if t < at < fall and self.hears(j, source, reverb):
+                        fall = at
+                self.fall_at[j] = fall
+                self.sonar.echoes[j].drive(1)
+            else:
+                self.fall_at[j] = None
+                self.listening[j] = None
+                self.sonar.echoes[j].drive(0)
+        self.clock.us = max(self.clock.us, until)
+        self.arrivals = [a for a in self.arrivals if a[0] > self.clock.us]
+
+
+def wrong(truth, measured, max_cm, tolerance_cm):
+    """Whether a reading is off; right at max_cm both a distance and no echo count as right."""
+    if truth is None or truth > max_cm + tolerance_cm:
+        return measured is not None
+    if measured is None:
+        return truth < max_cm - tolerance_cm
+    return abs(truth - measured) > tolerance_cm
+
+
+def run(label, groups, guard_ms, seconds, args, tick_ms=None):
+    """
+    One schedule. tick_ms polls on a fixed tick instead of waiting for due_in().
+
+    Returns:
+        dict: label, readings per second, slowest sensor's rate, share off, stall of a blocking read
+    """
+    clock = standins.use_virtual_clock()
+    import main
+    import sonar
+
+    sensors = [LAYOUT[i] + (groups[i],) for i in range(len(LAYOUT))]
+    array = sonar.SonarArray(sensors, args.max_cm, guard_ms)
+    world = World(standins.Room(), clock, array, args.crosstalk_deg, args.reverb_ms * 1000)
+    end = seconds * 1000000
+    readings = off = 0
+    while clock.us < end:
+        wait_ms = tick_ms if tick_ms else min(main.CONTROL_TICK_MS, array.due_in())
+        world.advance(clock.us + max(wait_ms * 1000, LOOP_US))
+        world.move()
+        done = array.poll()
+        for i in done or ():
+            readings += 1
+            off += wrong(world.truth[i], array.distance(i), args.max_cm, args.tolerance_cm)
+    standins.Pin.watcher = None
+    return {
+        "label": label,
+        "rate": readings / seconds,
+        "slowest": min(array.counts) / seconds,
+        "off": off / max(1, readings),
+        "stall_ms": sum(world.stalls) / max(1, len(world.stalls)) / 1000,
+        "ignored": world.ignored,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--seconds", type=int, default=60, help="simulated time per schedule")
+    parser.add_argument("--max-cm", type=int, default=200, help="SonarArray max_cm")
+    parser.add_argument("--crosstalk-deg", type=float, default=45,
+                        help="sensors pointing closer together than this hear each other's echo")
+    parser.add_argument("--reverb-ms", type=float, default=25, help="when the room's late echo comes back")
+    parser.add_argument("--tolerance-cm", type=float, default=2.0)
+    args = parser.parse_args()
+
+    standins.install()
+    import main as firmware
+    import sonar
+    from SimplyRobotics import KitronikSimplyRobotics
+
+    errors = sonar.check_pins([s + (0,) for s in LAYOUT], KitronikSimplyRobotics.motorPins,
+                              KitronikSimplyRobotics.servoPins)
+    for error in errors:
+        print("FAIL: %s" % error)
+
+    guard = firmware.SONAR_GUARD_MS
+    schedules = [
+        ("round-robin, guard 60 ms", GROUPINGS["round-robin"], 60, None),
+        ("round-robin, no guard", GROUPINGS["round-robin"], 0, None),
+        ("round-robin, guard %d ms" % guard, GROUPINGS["round-robin"], guard, None),
+        ("all at once, guard %d ms" % guard, GROUPINGS["all at once"], guard, None),
+        ("staggered, no guard", GROUPINGS["staggered"], 0, None),
+        ("staggered, guard %d ms" % guard, GROUPINGS["staggered"], guard, None),
+        ("staggered, 20 ms ticks", GROUPINGS["staggered"], guard, firmware.CONTROL_TICK_MS),
+    ]
+    results = [run(label, groups, guard_ms, args.seconds, args, tick) for label, groups, guard_ms, tick in schedules]
+
+    print("4 sensors (front, front-left, back, front-right), %d s each, crosstalk within %d degrees, "
+          "room echo after %d ms" % (args.seconds, args.crosstalk_deg, args.reverb_ms))
+    print("%-28s %10s %12s %8s %8s" % ("schedule", "reads/s", "slowest/s", "off", "ignored"))
+    for r in results:
+        print("%-28s %10.1f %12.1f %7.1f%% %8d" % (r["label"], r["rate"], r["slowest"], 100 * r["off"], r["ignored"]))
+    print("a blocking HCSR04.measure_distance() would stall the loop %.1f ms per reading"
+          % results[0]["stall_ms"])
+
+    base, default = results[0], results[5]
+    if errors or default["off"] > 0.01 or default["rate"] <= base["rate"]:
+        print("FAIL: staggered schedule is not faster than a 60 ms guard without crosstalk")
+        sys.exit(1)
+    print("staggered with a %d ms guard: %.1fx the readings of round-robin with 60 ms"
+          % (guard, default["rate"] / base["rate"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,664 @@
+"""
+Host stand-ins for the MicroPython modules used by newsmars.
+
+Lets the firmware modules (main.py, SimplyRobotics.py, rangefinder.py) be
+imported unmodified on a Linux workstation. Call install() before importing
+any of them:
+
+    import standins
+    standins.install()
+    import main
+
+Hardware costs are simulated with busy-waits taken from COSTS so that
+timings measured on the host keep the same shape as on the Pico. All
+costs default to zero.
+"""
+import copy
+import errno
+import gc
+import math
+import os
+import sys
+import threading
+import time
+import tracemalloc
+import types
+
+NEWSMARS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Heap available to Python on a Pico W with the network stack running
+HEAP_BYTES = 192 * 1024
+
+# Simulated hardware costs, tweak before running a benchmark
+COSTS = {
+    "pwm_init_us": 0,      # constructing a PWM output
+    "pwm_freq_us": 0,      # reprogramming a PWM slice frequency
+    "wifi_assoc_ms": 0,    # time between wlan.connect() and isconnected()
+    "ap_start_ms": 0,      # time between ap.active(True) and ap.active()
+}
+
+# Networks in range, ssid: password. Empty means any ssid connects; otherwise
+# an unknown ssid or a wrong password fails after wifi_assoc_ms.
+NETWORKS = {}
+
+_T0 = time.perf_counter()
+TICKS_PERIOD = 1 << 30
+_TICKS_MAX = TICKS_PERIOD - 1
+_TICKS_HALF = TICKS_PERIOD // 2
+
+
+def _spend_us(us):
+    if us <= 0:
+        return
+    end = time.perf_counter() + us / 1000000
+    while time.perf_counter() < end:
+        pass
+
+
+# MicroPython time extensions. Ticks start at zero when this module is
+# imported, which stands in for power-on.
+def ticks_us():
+    return int((time.perf_counter() - _T0) * 1000000) & _TICKS_MAX
+
+
+def ticks_ms():
+    return int((time.perf_counter() - _T0) * 1000) & _TICKS_MAX
+
+
+def ticks_diff(end, start):
+    return ((end - start + _TICKS_HALF) & _TICKS_MAX) - _TICKS_HALF
+
+
+def ticks_add(ticks, delta):
+    return (ticks + delta) & _TICKS_MAX
+
+
+def sleep_ms(ms):
+    time.sleep(ms / 1000)
+
+
+def sleep_us(us):
+    time.sleep(us / 1000000)
+
+
+# MicroPython gc extensions, backed by tracemalloc when it is running
+def mem_alloc():
+    if not tracemalloc.is_tracing():
+        return 0
+    return tracemalloc.get_traced_memory()[0]
+
+
+def mem_free():
+    return HEAP_BYTES - mem_alloc()
+
+
+class VirtualClock:
+    """Ticks that only move when told to, for replays and simulations."""
+
+    def __init__(self, start_ms=0):
+        self.us = start_ms * 1000
+
+    def ticks_us(self):
+        return self.us & _TICKS_MAX
+
+    def ticks_ms(self):
+        return (self.us // 1000) & _TICKS_MAX
+
+    def sleep_us(self, us):
+        self.us += us
+
+    def sleep_ms(self, ms):
+        self.us += ms * 1000
+
+    def set_ms(self, ms):
+        self.us = ms * 1000
+
+
+def use_virtual_clock(start_ms=0):
+    """Route the MicroPython time functions through a new VirtualClock."""
+    clock = VirtualClock(start_ms)
+    for name in ("ticks_us", "ticks_ms", "sleep_us", "sleep_ms"):
+        setattr(time, name, getattr(clock, name))
+    return clock
+
+
+def echo_for_distance(distance_cm):
+    """Echo pulse length the HC-SR04 driver turns back into distance_cm."""
+    if distance_cm is None:
+        return -1
+    return int(round(distance_cm / 0.01715))
+
+
+def answer_pings(sonar, clock):
+    """
+    Answer every ping of a sonar.SonarArray at once with the pulse of
+    echo_model(): its echo pin rises, the clock moves on by the pulse, the
+    pin falls and the clock is put back. Without an echo the pin stays high
+    38 ms, as on an HC-SR04 that hears nothing.
+    """
+    def watcher(pin):
+        if pin.value() or pin not in sonar.triggers:
+            return
+        echo = sonar.echoes[sonar.triggers.index(pin)]
+        pulse = sys.modules["machine"].echo_model(echo)
+        start = clock.us
+        echo.drive(1)
+        clock.us += pulse if pulse >= 0 else 38000
+        echo.drive(0)
+        clock.us = start
+    Pin.watcher = watcher
+
+
+class Room:
+    """
+    Walls as line segments in mm, for simulated range readings. The default
+    is a 3 x 2 m room centred on the origin with a 40 cm box in it.
+    """
+
+    def __init__(self, walls=None, max_range_cm=400):
+        if walls is None:
+            walls = self.box(-1500, -1000, 1500, 1000) + self.box(500, 300, 900, 700)
+        self.walls = walls
+        self.max_range_cm = max_range_cm
+
+    @staticmethod
+    def box(x0, y0, x1, y1):
+        return [(x0, y0, x1, y0), (x1, y0, x1, y1), (x1, y1, x0, y1), (x0, y1, x0, y0)]
+
+    def distance(self, x_mm, y_mm, heading):
+        """Distance in cm to the nearest wall along heading (degrees), None beyond range."""
+        dx = math.cos(math.radians(heading))
+        dy = math.sin(math.radians(heading))
+        best = None
+        for x0, y0, x1, y1 in self.walls:
+            ex, ey = x1 - x0, y1 - y0
+            det = ex * dy - ey * dx
+            if det == 0:
+                continue
+            t = (ex * (y0 - y_mm) - ey * (x0 - x_mm)) / det
+            u = (dx * (y0 - y_mm) - dy * (x0 - x_mm)) / det
+            if t > 0 and 0 <= u <= 1 and (best is None or t < best):
+                best = t
+        if best is None or best / 10 > self.max_range_cm:
+            return None
+        return best / 10
+
+
+# machine
+class Pin:
+    IN = 0
+    OUT = 1
+    OPEN_DRAIN = 2
+    PULL_UP = 1
+    PULL_DOWN = 2
+    IRQ_FALLING = 4
+    IRQ_RISING = 8
+
+    # Called as watcher(pin) when a pin is set from the firmware, for simulated peripherals
+    watcher = None
+
+    def __init__(self, id, mode=-1, pull=-1, value=None):
+        self.id = id
+        self.mode = mode
+        self._value = 0 if value is None else value
+        self.handler = None
+        self.trigger = 0
+
+    def _set(self, v):
+        self._value = 1 if v else 0
+        if Pin.watcher:
+            Pin.watcher(self)
+
+    def value(self, v=None):
+        if v is None:
+            return self._value
+        self._set(v)
+
+    def on(self):
+        self._set(1)
+
+    def off(self):
+        self._set(0)
+
+    def irq(self, handler=None, trigger=IRQ_FALLING | IRQ_RISING, hard=False):
+        self.handler = handler
+        self.trigger = trigger
+
+    def drive(self, v):
+        """Set an input level from a simulation, calling the irq handler on a matching edge."""
+        v = 1 if v else 0
+        if v == self._value:
+            return
+        self._value = v
+        if self.handler and self.trigger & (Pin.IRQ_RISING if v else Pin.IRQ_FALLING):
+            self.handler(self)
+
+    def __repr__(self):
+        return "Pin(%d)" % self.id
+
+
+class PWM:
+    # Every PWM output ever constructed, newest last
+    instances = []
+    # Slice frequency reprograms so far, for benchmarks
+    freq_writes = 0
+
+    def __init__(self, pin, freq=None, duty_u16=None):
+        _spend_us(COSTS["pwm_init_us"])
+        self.pin = pin
+        self._freq = 0
+        self._duty = 0
+        self.active = True
+        PWM.instances.append(self)
+        if freq is not None:
+            self.freq(freq)
+        if duty_u16 is not None:
+            self.duty_u16(duty_u16)
+
+    def freq(self, f=None):
+        if f is None:
+            return self._freq
+        _spend_us(COSTS["pwm_freq_us"])
+        PWM.freq_writes += 1
+        self._freq = f
+
+    def duty_u16(self, d=None):
+        if d is None:
+            return self._duty
+        self._duty = d
+
+    def deinit(self):
+        self.active = False
+
+
+class ADC:
+    def __init__(self, pin):
+        self.pin = pin
+
+    def read_u16(self):
+        return 0
+
+
+class ResetCalled(SystemExit):
+    pass
+
+
+def reset():
+    raise ResetCalled("machine.reset()")
+
+
+def echo_model(pin):
+    """Echo pulse length in us returned by time_pulse_us(), 20 cm by default."""
+    return 1166
+
+
+def time_pulse_us(pin, level, timeout_us=1000000):
+    return sys.modules["machine"].echo_model(pin)
+
+
+def unique_id():
+    return b"\xe6\x61\x41\x04\x03\x2a\x2b\x21"
+
+
+class Timer:
+    """
+    Software timer; the callback runs on a background thread. A callback
+    that calls reset() cannot stop the firmware from there, so the reset is
+    recorded in reset_requested instead.
+    """
+    ONE_SHOT = 0
+    PERIODIC = 1
+
+    def __init__(self, id=-1, mode=PERIODIC, period=-1, callback=None):
+        self.reset_requested = threading.Event()
+        self._thread = None
+        self.init(mode=mode, period=period, callback=callback)
+
+    def init(self, mode=PERIODIC, period=-1, callback=None):
+        self.deinit()
+        self.mode = mode
+        self.period = period
+        self.callback = callback
+        self._stopped = threading.Event()
+        if callback is not None and period >= 0:
+            self._thread = threading.Thread(target=self._run, args=(self._stopped,), daemon=True)
+            self._thread.start()
+
+    def _run(self, stopped):
+        while not stopped.wait(self.period / 1000):
+            try:
+                self.callback(self)
+            except ResetCalled:
+                self.reset_requested.set()
+                return
+            if self.mode == Timer.ONE_SHOT:
+                return
+
+    def deinit(self):
+        if self._thread:
+            self._stopped.set()
+            self._thread = None
+
+
+# Flash
+class PowerCut(BaseException):
+    """The flash lost power; not an OSError, so the firmware cannot catch it."""
+
+
+class FakeFile:
+    def __init__(self, flash, path, mode):
+        self.flash = flash
+        self.path = path
+        self.text = "b" not in mode
+        self.pos = 0
+        self.writable = mode[0] in "wa"
+        # Size when opened, after truncation for "w"
+        self.start = len(flash.files[path])
+
+    def write(self, data):
+        if self.text:
+            data = data.encode()
+        data = bytes(data)
+        self.flash.largest_write = max(self.flash.largest_write, len(data))
+        if self.flash.tick():
+            # Torn write: part of the data reached flash
+            self.flash.files[self.path] += data[:len(data) // 2]
+            raise PowerCut()
+        self.flash.files[self.path] += data
+        return len(data)
+
+    def read(self, size=-1):
+        data = self.flash.files[self.path]
+        end = len(data) if size < 0 else min(len(data), self.pos + size)
+        out = bytes(data[self.pos:end])
+        self.pos = end
+        return out.decode() if self.text else out
+
+    def readinto(self, buf):
+        data = self.read(len(buf))
+        buf[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        if self.writable:
+            self.flash.closed(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class FakeFlash:
+    """
+    Files and directories in memory, with the os functions the firmware
+    uses for files. tick() counts every operation that changes the flash;
+    the one numbered cut_at fails with PowerCut. Point a module at it with
+    attach(module).
+    """
+    BLOCK = 4096
+
+    def __init__(self, blocks=256):
+        self.files = {}
+        self.dirs = set()
+        self.blocks = blocks
+        self.ops = 0
+        self.cut_at = None
+        self.largest_write = 0
+
+    def tick(self):
+        self.ops += 1
+        return self.cut_at is not None and self.ops >= self.cut_at
+
+    def _cut(self):
+        if self.tick():
+            raise PowerCut()
+
+    def _parent_exists(self, path):
+        return "/" not in path or path.rsplit("/", 1)[0] in self.dirs
+
+    def open(self, path, mode="r"):
+        if mode[0] == "r":
+            if path not in self.files:
+                raise OSError(errno.ENOENT, path)
+        else:
+            if not self._parent_exists(path):
+                raise OSError(errno.ENOENT, path)
+            self._cut()
+            if mode[0] == "w" or path not in self.files:
+                self.files[path] = bytearray()
+        return FakeFile(self, path, mode)
+
+    def stat(self, path):
+        if path in self.dirs:
+            return (0x4000, 0, 0, 0, 0, 0, 0, 0, 0, 0)
+        if path not in self.files:
+            raise OSError(errno.ENOENT, path)
+        return (0x8000, 0, 0, 0, 0, 0, len(self.files[path]), 0, 0, 0)
+
+    def listdir(self, path):
+        if path not in self.dirs:
+            raise OSError(errno.ENOENT, path)
+        return [p[len(path) + 1:] for p in self.files if p.startswith(path + "/")]
+
+    def mkdir(self, path):
+        if path in self.dirs or path in self.files:
+            raise OSError(errno.EEXIST, path)
+        self._cut()
+        self.dirs.add(path)
+
+    def remove(self, path):
+        if path not in self.files:
+            raise OSError(errno.ENOENT, path)
+        self._cut()
+        del self.files[path]
+
+    def rename(self, old, new):
+        if old not in self.files or not self._parent_exists(new):
+            raise OSError(errno.ENOENT, old)
+        self._cut()
+        self.files[new] = self.files.pop(old)
+
+    def statvfs(self, path):
+        used = sum((len(d) + self.BLOCK - 1) // self.BLOCK for d in self.files.values())
+        free = self.blocks - used
+        return (self.BLOCK, self.BLOCK, self.blocks, free, free, 0, 0, 0, 0, 255)
+
+    def urandom(self, n):
+        return os.urandom(n)
+
+    def snapshot(self):
+        return copy.deepcopy(self)
+
+    def attach(self, module):
+        """Make module's os functions and open() use this flash."""
+        module.os = self
+        module.open = self.open
+
+    def closed(self, file):
+        """Called when a file opened for writing is closed."""
+
+
+# Sockets
+class FakeClient:
+    """In-memory client socket for driving main.serve_client() without a network."""
+
+    def __init__(self, request=b""):
+        self.request = request
+        self.sent = 0
+        self.closed = False
+
+    def readinto(self, buf):
+        n = len(self.request)
+        buf[:n] = self.request
+        return n
+
+    def write(self, data):
+        self.sent += len(data)
+        return len(data)
+
+    def setblocking(self, flag):
+        pass
+
+    def settimeout(self, timeout):
+        self.timeout = timeout
+
+    def close(self):
+        self.closed = True
+
+
+class FakeServer:
+    """Listening socket whose accept() hands out the same FakeClient every time."""
+
+    def __init__(self):
+        self.client = FakeClient()
+        self.addr = ("192.168.4.2", 50000)
+
+    def queue(self, request):
+        self.client.request = request
+        self.client.sent = 0
+        self.client.closed = False
+
+    def accept(self):
+        return self.client, self.addr
+
+    def close(self):
+        pass
+
+
+# rp2
+class PIO:
+    OUT_LOW = 0
+    OUT_HIGH = 1
+    IN_LOW = 0
+    IN_HIGH = 1
+
+
+class StateMachine:
+    def __init__(self, id, program=None, freq=-1, **kwargs):
+        self.id = id
+        self._active = 0
+        self.fifo = []
+
+    def active(self, value=None):
+        if value is None:
+            return self._active
+        self._active = value
+
+    def put(self, value, shift=0):
+        self.fifo.append(value)
+
+    def exec(self, instr):
+        pass
+
+
+def asm_pio(**kwargs):
+    def decorator(fn):
+        return fn
+    return decorator
+
+
+# network
+STA_IF = 0
+AP_IF = 1
+STAT_IDLE = 0
+STAT_CONNECTING = 1
+STAT_GOT_IP = 3
+STAT_CONNECT_FAIL = -1
+STAT_NO_AP_FOUND = -2
+STAT_WRONG_PASSWORD = -3
+
+
+class WLAN:
+    def __init__(self, interface=STA_IF):
+        self.interface = interface
+        self._active = False
+        self._active_at = None
+        self._connect_at = None
+        self.ssid = None
+        self.key = None
+        self.settings = {}
+
+    def active(self, value=None):
+        if value is None:
+            if self.interface == AP_IF and self._active:
+                return (time.perf_counter() - self._active_at) * 1000 >= COSTS["ap_start_ms"]
+            return self._active
+        self._active = bool(value)
+        self._active_at = time.perf_counter()
+
+    def connect(self, ssid=None, key=None):
+        self.ssid = ssid
+        self.key = key
+        self._connect_at = time.perf_counter()
+
+    def disconnect(self):
+        self._connect_at = None
+
+    def _associated(self):
+        if self._connect_at is None:
+            return False
+        elapsed_ms = (time.perf_counter() - self._connect_at) * 1000
+        return elapsed_ms >= COSTS["wifi_assoc_ms"]
+
+    def isconnected(self):
+        if not NETWORKS:
+            return self._associated()
+        return self._associated() and NETWORKS.get(self.ssid) == self.key
+
+    def status(self):
+        if self._connect_at is None:
+            return STAT_IDLE
+        if not self._associated():
+            return STAT_CONNECTING
+        if self.isconnected():
+            return STAT_GOT_IP
+        return STAT_NO_AP_FOUND if self.ssid not in NETWORKS else STAT_WRONG_PASSWORD
+
+    def ifconfig(self):
+        return ("127.0.0.1", "255.0.0.0", "127.0.0.1", "127.0.0.1")
+
+    def scan(self):
+        return [(ssid.encode(), bytes(6), 6, -50, 3, 0) for ssid in NETWORKS]
+
+    def config(self, *args, **kwargs):
+        self.settings.update(kwargs)
+        if args:
+            return self.settings.get(args[0])
+        return None
+
+
+def _module(name, *attrs, **values):
+    mod = types.ModuleType(name)
+    g = globals()
+    for attr in attrs:
+        setattr(mod, attr, g[attr])
+    for key, value in values.items():
+        setattr(mod, key, value)
+    return mod
+
+
+def install():
+    """Register the stand-ins and put the newsmars modules on sys.path."""
+    for name in ("ticks_us", "ticks_ms", "ticks_diff", "ticks_add", "sleep_ms", "sleep_us"):
+        setattr(time, name, globals()[name])
+
+    gc.mem_alloc = mem_alloc
+    gc.mem_free = mem_free
+
+    sys.modules["machine"] = _module(
+        "machine", "Pin", "PWM", "ADC", "ResetCalled", "reset", "echo_model",
+        "time_pulse_us", "unique_id", "Timer")
+    sys.modules["rp2"] = _module("rp2", "PIO", "StateMachine", "asm_pio")
+    sys.modules["network"] = _module(
+        "network", "WLAN", "STA_IF", "AP_IF", "STAT_IDLE", "STAT_CONNECTING", "STAT_GOT_IP",
+        "STAT_CONNECT_FAIL", "STAT_NO_AP_FOUND", "STAT_WRONG_PASSWORD")
+    sys.modules["micropython"] = _module("micropython", const=lambda x: x)
+
+    # The firmware's secrets.py shadows the stdlib module of the same name
+    if NEWSMARS_DIR not in sys.path:
+        sys.path.insert(0, NEWSMARS_DIR)
+    stdlib_secrets = sys.modules.get("secrets")
+    if stdlib_secrets is not None and not hasattr(stdlib_secrets, "WIFI_SSID"):
+        del sys.modules["secrets"]
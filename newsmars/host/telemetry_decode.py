@@ -0,0 +1,128 @@
+"""
+Collect the robot's telemetry stream and write it to a NumPy .npy file.
+
+Listen for datagrams from a robot running with TELEMETRY_HOST set to this
+machine, stop with Ctrl+C or after --duration seconds:
+
+    python3 host/telemetry_decode.py listen --port 9999 --out run.npy
+
+Or decode a raw capture (each datagram prefixed with its uint16 length, as
+written by `listen --raw`):
+
+    python3 host/telemetry_decode.py decode capture.bin --out run.npy
+
+The .npy file holds a structured array with one field per record field and
+loads with numpy.load(); NumPy itself is not needed to write it.
+"""
+import argparse
+import os
+import socket
+import struct
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import telemetry
+
+# NumPy type for every struct code in telemetry.RECORD_FORMAT
+_NPY_TYPES = {"I": "<u4", "H": "<u2", "b": "|i1", "B": "|u1"}
+
+
+class Collector:
+    """Reassembles records from datagrams, counting gaps in the sequence."""
+
+    def __init__(self):
+        self.records = bytearray()
+        self.count = 0
+        self.lost = 0
+        self.next_seq = None
+        self.dropped_on_robot = 0
+
+    def add(self, data):
+        first_seq, dropped, records = telemetry.decode(data)
+        if self.next_seq is not None:
+            self.lost += (first_seq - self.next_seq) & 0xFFFF
+        self.next_seq = (first_seq + len(records)) & 0xFFFF
+        self.dropped_on_robot = dropped
+        self.records += data[telemetry.HEADER_SIZE:telemetry.HEADER_SIZE + len(records) * telemetry.RECORD_SIZE]
+        self.count += len(records)
+
+
+def npy_dtype():
+    codes = telemetry.RECORD_FORMAT.lstrip("<")
+    return [(name, _NPY_TYPES[code]) for name, code in zip(telemetry.FIELDS, codes)]
+
+
+def write_npy(path, records, count):
+    """Write packed records as a structured .npy (format version 1.0)."""
+    header = "{'descr': %r, 'fortran_order': False, 'shape': (%d,), }" % (npy_dtype(), count)
+    # Magic (6) + version (2) + header length (2) + header, padded to 64 bytes
+    pad = 64 - (10 + len(header) + 1) % 64
+    header = header + " " * pad + "\n"
+    with open(path, "wb") as f:
+        f.write(b"\x93NUMPY\x01\x00")
+        f.write(struct.pack("<H", len(header)))
+        f.write(header.encode("latin1"))
+        f.write(records)
+
+
+def listen(args):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind((args.bind, args.port))
+    sock.settimeout(0.5)
+    collector = Collector()
+    raw = open(args.raw, "wb") if args.raw else None
+    end = time.time() + args.duration if args.duration else None
+    print("Listening on %s:%d" % (args.bind, args.port))
+    try:
+        while end is None or time.time() < end:
+            try:
+                data = sock.recv(2048)
+            except socket.timeout:
+                continue
+            if raw:
+                raw.write(struct.pack("<H", len(data)) + data)
+            collector.add(data)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sock.close()
+        if raw:
+            raw.close()
+    return collector
+
+
+def decode_capture(args):
+    collector = Collector()
+    with open(args.capture, "rb") as f:
+        data = f.read()
+    pos = 0
+    while pos + 2 <= len(data):
+        (length,) = struct.unpack_from("<H", data, pos)
+        collector.add(data[pos + 2:pos + 2 + length])
+        pos += 2 + length
+    return collector
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("listen", help="collect datagrams from the network")
+    p.add_argument("--bind", default="0.0.0.0")
+    p.add_argument("--port", type=int, default=9999)
+    p.add_argument("--duration", type=float, help="stop after this many seconds")
+    p.add_argument("--raw", help="also keep a raw capture file")
+    p.add_argument("--out", required=True)
+    p = sub.add_parser("decode", help="convert a raw capture")
+    p.add_argument("capture")
+    p.add_argument("--out", required=True)
+    args = parser.parse_args()
+
+    collector = listen(args) if args.command == "listen" else decode_capture(args)
+    write_npy(args.out, bytes(collector.records), collector.count)
+    print("%d records written to %s (%d lost in transit, %d dropped on the robot)"
+          % (collector.count, args.out, collector.lost, collector.dropped_on_robot))
+
+
+if __name__ == "__main__":
+    main()
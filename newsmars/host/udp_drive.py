@@ -0,0 +1,238 @@
+"""
+Drive the robot over its UDP command port, or benchmark the port on loopback.
+
+Every datagram carries a sequence number, both track speeds (-100..100)
+and a lease: the robot stops when no newer command arrives within the
+lease, so a lost client cannot leave it driving. See udpdrive.py for the
+format; set DRIVE_UDP_PORT in main.py to enable the port.
+
+    python3 host/udp_drive.py 192.168.1.50 60 60 [--seconds 2] [--rate 50] [--lease 300]
+    python3 host/udp_drive.py --loopback [--commands 2000]
+
+--loopback starts the firmware in a separate process on the stand-ins and
+measures the UDP command round trip, the fire-and-forget command rate and,
+for comparison, an HTTP ?action= request to the same firmware. It also
+checks that duplicate, old and corrupt datagrams are rejected.
+"""
+import argparse
+import atexit
+import os
+import socket
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+import standins
+
+standins.install()
+import udpdrive
+
+
+class DriveClient:
+    """Sends drive commands with increasing sequence numbers."""
+
+    def __init__(self, host, port, timeout=0.2, first_seq=0):
+        self.addr = (host, port)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.settimeout(timeout)
+        self.buf = bytearray(udpdrive.COMMAND_SIZE)
+        self.seq = first_seq
+
+    def send(self, left, right, lease_ms=300, reply=False, seq=None):
+        """Send one command; seq overrides the next sequence number (for tests)."""
+        if seq is None:
+            self.seq = (self.seq + 1) & 0xFFFF
+            seq = self.seq
+        seq &= 0xFFFF
+        udpdrive.pack_command(self.buf, seq, left, right, lease_ms, udpdrive.FLAG_REPLY if reply else 0)
+        self.sock.sendto(self.buf, self.addr)
+        return seq
+
+    def status(self, seq):
+        """Wait for the status reply to seq; None on timeout."""
+        while True:
+            try:
+                data = self.sock.recv(64)
+            except socket.timeout:
+                return None
+            status = udpdrive.unpack_status(data)
+            if status is not None and status[0] == seq:
+                return status
+
+    def command(self, left, right, lease_ms=300, seq=None):
+        """Send a command and wait for its status reply."""
+        return self.status(self.send(left, right, lease_ms, True, seq))
+
+    def close(self):
+        self.sock.close()
+
+
+_FIRMWARE_CODE = """
+import io, sys
+sys.path.insert(0, %r)
+import standins
+standins.install()
+import main
+main.HTTP_PORT = %d
+main.STORE_FILE = None
+main.DRIVE_UDP_PORT = %d
+main.safety_enabled = False
+sys.stdout = io.StringIO()
+main.main()
+"""
+
+
+def free_port(kind):
+    s = socket.socket(socket.AF_INET, kind)
+    s.bind(("127.0.0.1", 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+
+def start_firmware():
+    """main.main() in a separate process; returns (http_port, udp_port) once it serves."""
+    http_port = free_port(socket.SOCK_STREAM)
+    udp_port = free_port(socket.SOCK_DGRAM)
+    proc = subprocess.Popen([sys.executable, "-c", _FIRMWARE_CODE % (HERE, http_port, udp_port)])
+    atexit.register(proc.kill)
+    deadline = time.time() + 10
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1", http_port)).close()
+            return http_port, udp_port
+        except OSError:
+            if time.time() > deadline:
+                raise
+            time.sleep(0.01)
+
+
+def http_command(port):
+    conn = socket.create_connection(("127.0.0.1", port))
+    conn.sendall(b"GET /?action=forward HTTP/1.1\r\nHost: robot\r\n\r\n")
+    while conn.recv(8192):
+        pass
+    conn.close()
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    pick = lambda q: samples[min(len(samples) - 1, int(len(samples) * q))] * 1e6
+    return pick(0.5), pick(0.9), pick(0.99), samples[-1] * 1e6
+
+
+def loopback(commands):
+    http_port, udp_port = start_firmware()
+    client = DriveClient("127.0.0.1", udp_port, timeout=1.0)
+
+    checks = []
+    status = client.command(50, 50)
+    checks.append(("command applied", status is not None and status[2] == udpdrive.RESULT_OK
+                   and status[4:6] == (50, 50)))
+    seq = client.seq
+    status = client.command(20, 20, seq=seq)
+    checks.append(("duplicate rejected", status is not None and status[2] == udpdrive.RESULT_STALE
+                   and status[4:6] == (50, 50)))
+    status = client.command(20, 20, seq=seq - 5)
+    checks.append(("old seq rejected", status is not None and status[2] == udpdrive.RESULT_STALE))
+    client.seq += 1
+    udpdrive.pack_command(client.buf, client.seq, 30, 30, 300, udpdrive.FLAG_REPLY)
+    client.buf[4] ^= 0x10
+    client.sock.sendto(client.buf, client.addr)
+    checks.append(("corrupt datagram ignored", client.status(client.seq) is None))
+
+    rtt = []
+    for _ in range(commands):
+        start = time.perf_counter()
+        if client.command(40, -40) is None:
+            print("lost a reply")
+            continue
+        rtt.append(time.perf_counter() - start)
+
+    # Fire and forget; then ask for a status to see how far the robot got. Datagrams
+    # the receive buffer has no room for are dropped, so the status request is retried.
+    start = time.perf_counter()
+    for i in range(commands):
+        client.send(i % 100, -(i % 100))
+    send_s = time.perf_counter() - start
+    status = None
+    client.sock.settimeout(0.02)
+    for tries in range(1, 51):
+        status = client.command(0, 0)
+        if status is not None:
+            break
+    burst_s = time.perf_counter() - start
+    client.sock.settimeout(1.0)
+
+    http = []
+    for _ in range(min(commands, 300)):
+        start = time.perf_counter()
+        http_command(http_port)
+        http.append(time.perf_counter() - start)
+
+    print("%-28s %10s %10s %10s %10s %10s" % ("", "cmd/s", "p50 us", "p90 us", "p99 us", "max us"))
+    print("%-28s %10.0f %10.0f %10.0f %10.0f %10.0f"
+          % (("UDP command + status",  len(rtt) / sum(rtt)) + percentiles(rtt)))
+    print("%-28s %10.0f %10.0f %10.0f %10.0f %10.0f"
+          % (("HTTP ?action=forward", len(http) / sum(http)) + percentiles(http)))
+    print("UDP fire and forget: %d commands sent in %.3f s, drained and stopped after %.3f s"
+          " (%.0f cmd/s, %d status tries)" % (commands, send_s, burst_s, commands / burst_s, tries))
+    checks.append(("stop after a burst", status is not None and status[1] == client.seq
+                   and status[4:6] == (0, 0)))
+    ok = True
+    for name, passed in checks:
+        print("%-28s %s" % (name, "ok" if passed else "FAILED"))
+        ok = ok and passed
+    client.close()
+    return 0 if ok else 1
+
+
+def drive(host, port, left, right, seconds, rate, lease_ms):
+    client = DriveClient(host, port)
+    interval = 1.0 / rate
+    end = time.time() + seconds
+    replies = lost = 0
+    while time.time() < end:
+        start = time.time()
+        # Every tenth command asks for a status reply
+        if client.seq % 10 == 0:
+            status = client.command(left, right, lease_ms)
+            if status is None:
+                lost += 1
+            else:
+                replies += 1
+                print("seq %d: result %d, safety %d, tracks %d/%d, distance %s mm"
+                      % (status[0], status[2], status[3], status[4], status[5],
+                         "-" if status[6] == udpdrive.NO_DISTANCE else status[6]))
+        else:
+            client.send(left, right, lease_ms)
+        time.sleep(max(0.0, interval - (time.time() - start)))
+    client.command(0, 0, lease_ms)
+    print("%d commands, %d status replies, %d lost" % (client.seq, replies, lost))
+    client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("host", nargs="?")
+    parser.add_argument("left", nargs="?", type=int, default=0)
+    parser.add_argument("right", nargs="?", type=int, default=0)
+    parser.add_argument("--port", type=int, default=4210)
+    parser.add_argument("--seconds", type=float, default=2.0)
+    parser.add_argument("--rate", type=float, default=50.0, help="commands per second")
+    parser.add_argument("--lease", type=int, default=300, help="lease per command in ms")
+    parser.add_argument("--loopback", action="store_true", help="benchmark against a local firmware")
+    parser.add_argument("--commands", type=int, default=2000)
+    args = parser.parse_args()
+
+    if args.loopback:
+        sys.exit(loopback(args.commands))
+    if not args.host:
+        parser.error("give the robot's address or --loopback")
+    drive(args.host, args.port, args.left, args.right, args.seconds, args.rate, args.lease)
+
+
+if __name__ == "__main__":
+    main()
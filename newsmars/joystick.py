@@ -0,0 +1,100 @@
+import time
+
+# Joystick commands from the web page: throttle (forward positive) and
+# steer (right positive), both -100..100, mixed into left and right track
+# speeds for main.drive_tracks().
+
+DEADZONE = 5
+TIMEOUT_MS = 500
+
+def _scale(value, limit, full):
+    # Rounds towards zero for both signs, so mirrored sticks give mirrored speeds
+    if value < 0:
+        return -(-value * limit // full)
+    return value * limit // full
+
+def mix(throttle, steer, limit):
+    """
+    Arcade mix of a stick position into track speeds.
+
+    Args:
+        throttle (int): -100..100, forward positive
+        steer (int): -100..100, right positive
+        limit (int): Speed of the faster track at full deflection
+
+    Returns:
+        tuple: (left, right) track speeds, -limit..limit
+    """
+    left = throttle + steer
+    right = throttle - steer
+    full = max(abs(left), abs(right), 100)
+    return _scale(left, limit, full), _scale(right, limit, full)
+
+class Joystick:
+    """
+    Holds the newest stick position. Requests call command() as often as the
+    browser sends; the control loop calls take() once per tick, so a burst
+    of requests between two ticks drives the motors once, with the newest
+    position. A stick held away from the centre must be repeated within
+    timeout_ms or take() stops the tracks.
+    """
+    def __init__(self, timeout_ms=TIMEOUT_MS, deadzone=DEADZONE):
+        self.timeout_ms = timeout_ms
+        self.deadzone = deadzone
+        self.throttle = 0
+        self.steer = 0
+        self.pending = False
+        self.until = None
+        self.left = 0
+        self.right = 0
+        self.received = 0
+        self.applied = 0
+
+    def command(self, throttle, steer, now):
+        """
+        Store a stick position, replacing any not applied yet.
+
+        Args:
+            throttle (int): -100..100, clamped
+            steer (int): -100..100, clamped
+            now (int): ticks_ms()
+        """
+        throttle = max(-100, min(100, throttle))
+        steer = max(-100, min(100, steer))
+        if -self.deadzone < throttle < self.deadzone:
+            throttle = 0
+        if -self.deadzone < steer < self.deadzone:
+            steer = 0
+        self.throttle = throttle
+        self.steer = steer
+        self.pending = True
+        self.received += 1
+        self.until = time.ticks_add(now, self.timeout_ms) if throttle or steer else None
+
+    def take(self, now, limit):
+        """
+        Called once per control tick.
+
+        Args:
+            now (int): ticks_ms()
+            limit (int): Speed of the faster track at full deflection
+
+        Returns:
+            bool: True if the tracks must change to self.left and self.right
+        """
+        if self.pending:
+            self.pending = False
+            self.applied += 1
+            self.left, self.right = mix(self.throttle, self.steer, limit)
+            return True
+        if self.until is not None and time.ticks_diff(now, self.until) >= 0:
+            self.until = None
+            self.left = 0
+            self.right = 0
+            return True
+        return False
+
+    def release(self):
+        """Forget the stick, e.g. when a button takes over."""
+        self.pending = False
+        self.until = None
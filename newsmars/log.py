@@ -0,0 +1,152 @@
+import time
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+OFF = 100
+
+_LEVEL_NAMES = {DEBUG: "DEBUG", INFO: "INFO", WARNING: "WARN", ERROR: "ERROR"}
+
+class Logger:
+    """
+    Levelled logger that keeps recent messages in a preallocated ring buffer.
+    Messages are stored as a format string plus up to two arguments and are
+    only formatted when they are echoed to the console or read back, so a
+    message that is just stored costs no string building.
+    """
+    def __init__(self, size=64, level=INFO, echo_level=WARNING):
+        """
+        Initialize the logger.
+
+        Args:
+            size (int): Number of messages kept in the ring buffer
+            level (int): Minimum level that is stored
+            echo_level (int): Minimum level that is also printed immediately
+        """
+        self.size = size
+        self.level = level
+        self.echo_level = echo_level
+        self.ticks = [0] * size
+        self.levels = bytearray(size)
+        self.fmts = [None] * size
+        self.args_a = [None] * size
+        self.args_b = [None] * size
+        self.skipped = [0] * size
+        self.head = 0
+        self.count = 0
+        # Per message: minimum interval, last time it was let through, and
+        # how many were dropped since
+        self.limits = {}
+        self.last = {}
+        self.dropped = {}
+
+    def limit(self, fmt, interval_ms):
+        """
+        Rate limit a message.
+
+        Args:
+            fmt (str): The format string of the message, as passed to log()
+            interval_ms (int): Minimum time between two stored copies
+        """
+        self.limits[fmt] = interval_ms
+        self.last[fmt] = time.ticks_add(time.ticks_ms(), -interval_ms)
+        self.dropped[fmt] = 0
+
+    def log(self, level, fmt, a=None, b=None):
+        """
+        Store a message and echo it if it is important enough.
+
+        Args:
+            level (int): DEBUG, INFO, WARNING or ERROR
+            fmt (str): Format string with up to two {} placeholders
+            a: First argument for fmt
+            b: Second argument for fmt
+        """
+        if level < self.level and level < self.echo_level:
+            return
+
+        now = time.ticks_ms()
+        skipped = 0
+        interval = self.limits.get(fmt)
+        if interval is not None:
+            if time.ticks_diff(now, self.last[fmt]) < interval:
+                self.dropped[fmt] += 1
+                return
+            self.last[fmt] = now
+            skipped = self.dropped[fmt]
+            self.dropped[fmt] = 0
+
+        if level >= self.level:
+            i = self.head
+            self.ticks[i] = now
+            self.levels[i] = level
+            self.fmts[i] = fmt
+            self.args_a[i] = a
+            self.args_b[i] = b
+            self.skipped[i] = skipped
+            self.head = (i + 1) % self.size
+            self.count += 1
+
+        if level >= self.echo_level:
+            print(self._format(now, level, fmt, a, b, skipped))
+
+    def debug(self, fmt, a=None, b=None):
+        self.log(DEBUG, fmt, a, b)
+
+    def info(self, fmt, a=None, b=None):
+        self.log(INFO, fmt, a, b)
+
+    def warning(self, fmt, a=None, b=None):
+        self.log(WARNING, fmt, a, b)
+
+    def error(self, fmt, a=None, b=None):
+        self.log(ERROR, fmt, a, b)
+
+    def _format(self, ticks, level, fmt, a, b, skipped):
+        line = "[{:>9}] {:<5} {}".format(ticks, _LEVEL_NAMES.get(level, level), fmt.format(a, b))
+        if skipped:
+            line += " (+{} suppressed)".format(skipped)
+        return line
+
+    def lines(self):
+        """
+        Format the stored messages, oldest first.
+
+        Yields:
+            str: One formatted line per message
+        """
+        stored = min(self.count, self.size)
+        start = (self.head - stored) % self.size
+        for n in range(stored):
+            i = (start + n) % self.size
+            yield self._format(self.ticks[i], self.levels[i], self.fmts[i],
+                               self.args_a[i], self.args_b[i], self.skipped[i])
+
+    def clear(self):
+        self.head = 0
+        self.count = 0
+        for i in range(self.size):
+            self.fmts[i] = self.args_a[i] = self.args_b[i] = None
+
+    def flush(self, path):
+        """
+        Append the stored messages to a file on flash and empty the buffer.
+
+        Args:
+            path (str): File to append to
+
+        Returns:
+            int: Number of lines written
+        """
+        written = 0
+        with open(path, "a") as f:
+            for line in self.lines():
+                f.write(line)
+                f.write("\n")
+                written += 1
+        self.clear()
+        return written
+
+# Shared logger for all modules
+logger = Logger()
@@ -1,34 +1,300 @@
+import time
+from bootprof import BootProfiler
+
+# Zo vroeg mogelijk, zodat de eerste fase de firmware boot en imports meet
+boot = BootProfiler("firmware")
+
+import gc
+import json
 import network
+import select
 import socket
-import time
 import machine
-from SimplyRobotics import KitronikSimplyRobotics
-from secrets import WIFI_SSID, WIFI_PASSWORD
+import log
+import profiler
+from log import logger
+from SimplyRobotics import KitronikSimplyRobotics, SimplePWMMotor
+from sonar import SonarArray, check_pins
+from telemetry import Telemetry
+from recorder import Recorder
+from store import Store
+import odometry
+import profiles
+from joystick import Joystick
+import scheduler
+from events import EventStream
+# boot.py heeft ota al geladen (ota.trial, ota.confirm). De modules van features die
+# standaard uit staan (mqtt, gridmap, planner, scanner, udpdrive, portal) laadt pas de
+# code die de feature aanzet: geen bytecode in RAM en geen importtijd als ze uit staan
+import ota
+# Zonder secrets.py komen de WiFi-gegevens uit de portal (in de store)
+try:
+    from secrets import WIFI_SSID, WIFI_PASSWORD
+except ImportError:
+    WIFI_SSID = WIFI_PASSWORD = None
+# Sleutel voor OTA-updates, zie OTA_ENABLED; zonder sleutel weigert /ota elke update
+try:
+    from secrets import OTA_KEY
+except ImportError:
+    OTA_KEY = None
+
+boot.mark("imports")
+
+# Drivers meten zonder de bibliotheken aan te passen
+if profiler.ENABLED:
+    profiler.wrap_method(SimplePWMMotor, "on", "motor_on")
+    profiler.wrap_method(SonarArray, "poll", "sonar_poll")
 
 # Configuratie
 DEFAULT_SPEED = 50
+# Bedrading en kalibratie (motorkanalen, richtingen, trim, PWM banden, servo
+# limieten), eenmalig ingelezen bij het opstarten; zie profiles.py.
+# Zonder bestand gelden de standaardwaarden hieronder.
+ROBOT_PROFILE_FILE = "profile.json"
 MOTOR_LEFT = 0
 MOTOR_RIGHT = 3
+HTTP_PORT = 80
+WIFI_TIMEOUT_MS = 20000
+# Zoveel pogingen van WIFI_TIMEOUT_MS; een fout wachtwoord stopt meteen
+WIFI_ATTEMPTS = 2
+# WiFi-gegevens die een oudere versie van de portal hier bewaarde; worden bij het
+# opstarten in de store overgenomen. De portal bewaart ze nu in de store
+WIFI_FILE = "wifi.json"
+# Lukt WiFi niet (of zijn er geen gegevens), dan een eigen access point met een
+# captive portal om WiFi-gegevens in te voeren; de bediening werkt daar ook, op
+# http://192.168.4.1. False = herstarten zoals vroeger. AP_SSID None = "smars-"
+# en het eind van machine.unique_id(); AP_PASSWORD None = open netwerk, anders
+# minstens 8 tekens
+AP_FALLBACK = True
+AP_SSID = None
+AP_PASSWORD = None
+DNS_PORT = 53
+# Motoren, servo's en steppers pas aanmaken bij eerste gebruik
+LAZY_INIT = True
+# WiFi laten verbinden terwijl de hardware initialiseert
+WIFI_CONCURRENT = True
+# Geen automatische GC tijdens een request; opruimen gebeurt tussen requests
+# zodra er minder dan GC_MIN_FREE bytes vrij zijn
+GC_DEFER = True
+GC_MIN_FREE = 24 * 1024
+# Per request gealloceerde bytes en GC pauzes bijhouden en periodiek printen
+GC_STATS = False
+GC_STATS_EVERY = 20
+# Logging: wat bewaard wordt, wat ook direct geprint wordt, en het bestand
+# waarin de buffer bewaard wordt voor een herstart (None = niet bewaren)
+LOG_LEVEL = log.INFO
+LOG_ECHO_LEVEL = log.INFO
+LOG_FILE = None
+# Hoe lang de hoofdlus maximaal op netwerkverkeer wacht
+CONTROL_TICK_MS = 20
+# Een HTTP-client die na accept() zo lang niets stuurt of afneemt verliest zijn
+# request; anders houdt hij de lus op en stoppen de UDP- en joystick-timeouts de
+# motoren niet
+CLIENT_TIMEOUT_S = 0.5
+# Afstandssensor (HC-SR04); GP16/17 zijn ook servo 6/7, dus die servo's niet gebruiken
+SENSOR_ENABLED = True
+SENSOR_TRIGGER_PIN = 17
+SENSOR_ECHO_PIN = 16
+# Zonder scanner meet de sensor via de sensorrij (sonar.py), zonder op de echo te
+# wachten: de eerste in de rij, met zoveel stilte tussen de pings als er geen rij is
+SENSOR_INTERVAL_MS = 100
+# Sensor op een servo laten zwaaien (None = vast naar voren; niet servo 6/7).
+# Hoeken in servograden, 90 is recht vooruit. Met een scanner meet de sensor
+# zo vaak als de servo toelaat in plaats van elke SENSOR_INTERVAL_MS, en ook
+# dan zonder op de echo te wachten.
+SCAN_SERVO = None
+SCAN_MIN_ANGLE = 30
+SCAN_MAX_ANGLE = 150
+SCAN_STEP = 15
+# Meerdere HC-SR04's (sonar.py): (naam, trigger, echo, hoek, groep) per sensor, hoek
+# in servograden (90 is vooruit). Sensoren in dezelfde groep pingen samen en moeten
+# elk een andere kant op kijken; de groepen om de beurt. De eerste sensor in de rij
+# (de sensor van SENSOR_ENABLED als die er is) geldt als de sensor vooruit. Pinnen
+# die een motor of een gebruikte servo al heeft worden geweigerd. Bijvoorbeeld:
+#   [("voor", 17, 16, 90, 0), ("achter", 27, 26, 270, 0),
+#    ("linksvoor", 0, 1, 135, 1), ("rechtsvoor", 21, 20, 45, 1)]
+SONAR_SENSORS = None
+SONAR_MAX_CM = 200
+# Stilte na elke groep zodat de galm van de ruimte uitsterft; 25 ms is genoeg voor
+# galm tot 30 ms, een kamer tot ongeveer 5 m (host/sim_sonar.py)
+SONAR_GUARD_MS = 25
+# Rijcommando's als UDP datagrams, zie udpdrive.py en host/udp_drive.py (None = uit)
+DRIVE_UDP_PORT = None
+# Joystick op de webpagina: zoveel commando's per seconde zolang hij vastgehouden
+# wordt (0 = geen joystick); zonder nieuw commando binnen de timeout stopt de robot
+JOYSTICK_RATE_HZ = 20
+JOYSTICK_TIMEOUT_MS = 500
+# JSON API onder /api/ voor scripts, met een batch van getimede stappen (zie scheduler.py)
+API_ENABLED = True
+API_MAX_STEPS = 32
+# Status als server-sent events op /events, hooguit een frame per EVENTS_INTERVAL_MS
+# (0 = uit) naar maximaal EVENTS_MAX_CLIENTS open verbindingen
+EVENTS_INTERVAL_MS = 200
+EVENTS_MAX_CLIENTS = 4
+# MQTT-broker (IP-adres, None = uit): telemetrie in batches naar smars/<id>/telemetry,
+# commando's (JSON zoals /api/drive, /api/servos en /api/batch) van smars/<id>/cmd en
+# smars/all/cmd, antwoorden op smars/<id>/state. <id> is MQTT_ROBOT_ID of, bij None,
+# machine.unique_id() in hex. Berichten wachten in een wachtrij van MQTT_QUEUE; is die
+# vol, dan vervalt het oudste
+MQTT_BROKER = None
+MQTT_PORT = 1883
+MQTT_ROBOT_ID = None
+MQTT_KEEPALIVE_S = 30
+MQTT_QUEUE = 16
+MQTT_TELEMETRY_QOS = 0
+# Telemetrie als UDP datagrams naar een collector (None = uit); met MQTT_BROKER
+# gaan de batches via MQTT
+TELEMETRY_HOST = None
+TELEMETRY_PORT = 9999
+TELEMETRY_INTERVAL_MS = 50
+TELEMETRY_SEND_MS = 500
+# Sessie opnemen (sensor, acties, motoren) voor afspelen op de host (None = uit)
+RECORD_FILE = None
+RECORD_MAX_BYTES = 256 * 1024
+RECORD_FLUSH_MS = 1000
+# Positie schatten uit de motoropdrachten; kalibratie uit de store, zonder ruwe
+# standaardwaarden. Een nieuw ODOMETRY_FILE (host/calibrate_odometry.py) wordt
+# bij het opstarten in de store overgenomen en daarna verwijderd
+ODOMETRY_ENABLED = True
+ODOMETRY_FILE = "odometry.json"
+# Toestand die een reset overleeft (snelheid, veiligheid, kalibratie, WiFi-gegevens)
+# als log op flash, zie store.py. Wijzigingen worden verzameld en hooguit elke
+# STORE_FLUSH_MS als een record geschreven; groeit het log voorbij STORE_MAX_BYTES,
+# dan wordt het samengevat in een nieuw bestand (afgestemd met host/bench_store.py).
+# None = alleen in RAM
+STORE_FILE = "state.log"
+STORE_MAX_BYTES = 512
+STORE_FLUSH_MS = 2000
+# Kaart (occupancy grid) bijwerken met elke afstandsmeting, op te halen via /map.
+# 100 x 100 cellen van 50 mm is 5 x 5 m in 10 KB RAM.
+MAP_ENABLED = False
+MAP_WIDTH = 100
+MAP_HEIGHT = 100
+MAP_CELL_MM = 50
+MAP_MAX_RANGE_CM = 200
+# Pad plannen over de kaart naar PLAN_GOAL (x, y in mm; None = niet plannen).
+# Een plannercel beslaat PLAN_SCALE x PLAN_SCALE kaartcellen en kost ~17 bytes:
+# 50 x 50 cellen is 42 KB. Elke PLAN_INTERVAL_MS worden nieuwe obstakels
+# overgenomen en wordt het pad hersteld (D* Lite) in plaats van opnieuw gezocht.
+PLAN_GOAL = None
+PLAN_SCALE = 2
+PLAN_INTERVAL_MS = 1000
+# Tijdmetingen van de belangrijkste functies, uit te lezen op /metrics
+PROFILE_ENABLED = True
+# Over-the-air update op /ota in chunks, zie ota.py en host/ota_push.py. Een chunk
+# die langer dan OTA_TIMEOUT_S stilvalt wordt afgebroken; de client gaat verder
+# vanaf wat binnen is. Staat uit: het access point is open, dus alleen aanzetten met
+# een OTA_KEY in secrets.py (of "ota_key" in de store); elk verzoek dat begint, een
+# chunk stuurt of de update installeert moet daarmee ondertekend zijn
+OTA_ENABLED = False
+OTA_TIMEOUT_S = 2
 
 # Globale variabelen
 robot = None
+# Pas geïmporteerd als DRIVE_UDP_PORT, het access point of OTA aan staat
+udpdrive = None
+portal = None
+scanner = None
+sonar = None
+odom = None
+telemetry = None
+recorder = None
+drive_server = None
+joystick = None
+batch = None
+events = None
+mqtt = None
+# Alleen in access point-modus: DNS-responder, gevonden netwerken en een geplande herstart
+dns = None
+ap_networks = []
+portal_redirect = None
+# Geplande herstart (nieuwe WiFi-gegevens of een update) en de reden
+reset_at_ms = None
+reset_reason = None
+updater = None
+store = None
+# "smars/<id>/", het begin van de eigen MQTT-topics
+mqtt_topic = None
+grid = None
+planner = None
 current_speed = DEFAULT_SPEED
 safety_enabled = True
+last_distance = None
+# Duur van de laatste lus-iteratie en van request tot motor, in us
+loop_us = 0
+command_us = 0
+# Geschatte positie in mm en richting in graden (0 = beginrichting, linksom positief),
+# bijgewerkt door de odometrie
+pose_x = 0
+pose_y = 0
+pose_heading = 0
+# Laatst gezette hoek per servo via de API, None = nog niet gezet
+servo_angles = [None] * 8
+
+# Het geladen robotprofiel; de odometrie neemt er de motoren en hun tabellen uit over
+robot_profile = None
+# Motorrichtingen (links, rechts) per actie, uit het profiel
+_drive_forward = ("r", "r")
+_drive_reverse = ("f", "f")
+_drive_left = ("r", "f")
+_drive_right = ("f", "r")
+
+def apply_profile(profile):
+    global robot_profile, MOTOR_LEFT, MOTOR_RIGHT, _drive_forward, _drive_reverse, _drive_left, _drive_right
+    robot_profile = profile
+    MOTOR_LEFT = profile.left
+    MOTOR_RIGHT = profile.right
+    _drive_forward = profile.forward
+    _drive_reverse = profile.reverse
+    _drive_left = profile.turn_left
+    _drive_right = profile.turn_right
 
 # Hardware initialisatie
 def init_hardware():
-    global robot
+    global robot, scanner, sonar
     try:
-        print("Hardware initialiseren...")
-        robot = KitronikSimplyRobotics()
-        print("Hardware gereed")
+        logger.info("Hardware initialiseren...")
+        profile, errors = profiles.load(ROBOT_PROFILE_FILE)
+        for error in errors:
+            logger.error("Profiel: {}", error)
+        apply_profile(profile)
+        robot = KitronikSimplyRobotics(lazy=LAZY_INIT, motorPins=profile.motor_pins,
+                                       servoPins=profile.servo_pins,
+                                       motorTables=profile.motor_tables(),
+                                       servoLimits=profile.servo_limits)
+        # Geen sensor op een pin die al van een motor of servo is
+        sensors = list(SONAR_SENSORS or ())
+        if SENSOR_ENABLED:
+            sensors.insert(0, ("sensor", SENSOR_TRIGGER_PIN, SENSOR_ECHO_PIN, 90, "sensor"))
+        errors = check_pins(sensors, robot.motorPins, robot.servoPins,
+                            () if SCAN_SERVO is None else (SCAN_SERVO,))
+        for error in errors:
+            logger.error("Pinnen: {}", error)
+        if errors:
+            sensors = []
+        if SENSOR_ENABLED and SCAN_SERVO is not None and not errors:
+            # Een eigen sensorrij zonder stilte: de servo wacht al tussen de pings
+            from scanner import Scanner
+            scanner = Scanner(SonarArray([sensors.pop(0)], SONAR_MAX_CM, 0), robot.servos[SCAN_SERVO],
+                              SCAN_MIN_ANGLE, SCAN_MAX_ANGLE, SCAN_STEP)
+        if sensors:
+            sonar = SonarArray(sensors, SONAR_MAX_CM, SONAR_GUARD_MS if SONAR_SENSORS else SENSOR_INTERVAL_MS)
+        logger.info("Hardware gereed")
         return True
     except Exception as e:
-        print(f"Fout bij hardware init: {e}")
+        logger.error("Fout bij hardware init: {}", e)
         return False
 
+_t_control_motors = profiler.Timer("control_motors")
+_t_drive_tracks = profiler.Timer("drive_tracks")
+_t_render_page = profiler.Timer("render_page")
+
 # Motoren aansturen met safety check
 def control_motors(action):
+    with _t_control_motors:
+        return _control_motors(action)
+
+def _control_motors(action):
     global robot, current_speed, safety_enabled
 
     if not robot:
@@ -36,71 +302,113 @@ def control_motors(action):
 
     try:
         if safety_enabled and action != "stop":
-            print("Beweging geblokkeerd door veiligheid.")
+            logger.warning("Beweging geblokkeerd door veiligheid.")
             return False
 
+        left = robot.motors[MOTOR_LEFT]
+        right = robot.motors[MOTOR_RIGHT]
+
         # Stop altijd eerst
-        robot.motors[MOTOR_LEFT].off()
-        robot.motors[MOTOR_RIGHT].off()
+        left.off()
+        right.off()
 
         if action == "forward":
-            robot.motors[MOTOR_LEFT].on("r", current_speed)
-            robot.motors[MOTOR_RIGHT].on("r", current_speed)
+            drive = _drive_forward
         elif action == "reverse":
-            robot.motors[MOTOR_LEFT].on("f", current_speed)
-            robot.motors[MOTOR_RIGHT].on("f", current_speed)
+            drive = _drive_reverse
         elif action == "left":
-            robot.motors[MOTOR_LEFT].on("r", current_speed)
-            robot.motors[MOTOR_RIGHT].on("f", current_speed)
+            drive = _drive_left
         elif action == "right":
-            robot.motors[MOTOR_LEFT].on("f", current_speed)
-            robot.motors[MOTOR_RIGHT].on("r", current_speed)
-        
+            drive = _drive_right
+        else:
+            return True
+
+        left.on(drive[0], current_speed)
+        right.on(drive[1], current_speed)
         return True
 
     except Exception as e:
-        print(f"Motorfout: {e}")
+        logger.error("Motorfout: {}", e)
         return False
 
-# HTML pagina met grid-layout zoals op jouw screenshot
-def create_html(speed, safety_on):
-    return f"""<!DOCTYPE html>
+# Beide rupsen los aansturen, -100..100 per rups, positief = vooruit
+def drive_tracks(left_speed, right_speed):
+    with _t_drive_tracks:
+        return _drive_tracks(left_speed, right_speed)
+
+def _drive_tracks(left_speed, right_speed):
+    if not robot:
+        return False
+
+    if recorder:
+        recorder.drive(left_speed, right_speed)
+
+    try:
+        if safety_enabled and (left_speed or right_speed):
+            logger.warning("Beweging geblokkeerd door veiligheid.")
+            return False
+
+        left = robot.motors[MOTOR_LEFT]
+        right = robot.motors[MOTOR_RIGHT]
+        _drive_track(left, 0, left_speed)
+        _drive_track(right, 1, right_speed)
+        if recorder:
+            recorder.motor(MOTOR_LEFT, left)
+            recorder.motor(MOTOR_RIGHT, right)
+        return True
+
+    except Exception as e:
+        logger.error("Motorfout: {}", e)
+        return False
+
+def _drive_track(motor, side, speed):
+    if speed > 0:
+        motor.on(_drive_forward[side], speed)
+    elif speed < 0:
+        motor.on(_drive_reverse[side], -speed)
+    else:
+        motor.off()
+
+# HTML pagina met grid-layout zoals op jouw screenshot.
+# Opgeknipt rond de variabele delen en eenmalig ge-encodeerd, zodat een
+# request de pagina kan versturen zonder nieuwe strings te maken.
+_PAGE_TOP = """<!DOCTYPE html>
 <html>
 <head>
 <title>Robot Control with Speed</title>
 <meta charset="UTF-8">
 <style>
-body {{
+body {
     font-family: Arial, sans-serif;
     background-color: #f5f5f5;
     display: flex;
     justify-content: center;
     align-items: center;
     min-height: 100vh;
-}}
-.container {{
+}
+.container {
     background: white;
     padding: 20px;
     border-radius: 15px;
     box-shadow: 0 0 10px rgba(0,0,0,0.1);
     text-align: center;
     width: 300px;
-}}
-.status {{
+}
+.status {
     background: #e9f1fb;
     padding: 10px;
     margin-bottom: 20px;
     border-radius: 8px;
     font-size: 18px;
-}}
-.grid {{
+}
+.grid {
     display: grid;
     grid-template-columns: repeat(3, 1fr);
     grid-gap: 10px;
     justify-items: center;
     margin: 20px 0;
-}}
-button {{
+}
+button {
     font-size: 18px;
     padding: 15px;
     width: 80px;
@@ -108,40 +416,42 @@ button {{
     border-radius: 10px;
     cursor: pointer;
     color: white;
-}}
-.speed-btn {{
+}
+.speed-btn {
     background-color: #007bff;
-}}
-.speed-btn:hover {{
+}
+.speed-btn:hover {
     background-color: #0056b3;
-}}
-.dir-btn {{
+}
+.dir-btn {
     background-color: #28a745;
-}}
-.dir-btn:hover {{
+}
+.dir-btn:hover {
     background-color: #1e7e34;
-}}
-.stop-btn {{
+}
+.stop-btn {
     background-color: #dc3545;
-}}
-.stop-btn:hover {{
+}
+.stop-btn:hover {
     background-color: #c82333;
-}}
-.footer {{
+}
+.footer {
     background: #f0f0f0;
     padding: 10px;
     margin-top: 20px;
     border-radius: 8px;
     font-size: 14px;
-}}
+}
 </style>
 </head>
 <body>
 <div class="container">
     <h2>🤖 Robot Control with Speed</h2>
     <div class="status">
-        Current Speed: {speed}%<br>
-        Safety: {"ON" if safety_on else "OFF"}
+        Current Speed: """.encode()
+_PAGE_SAFETY = """%<br>
+        Safety: """.encode()
+_PAGE_BUTTON = """
     </div>
     <form method="GET">
         <div>
@@ -161,9 +471,62 @@ button {{
         </div>
         <button type="submit" name="action" value="toggle_safety" style="
             background-color: #ffc107; color: black; margin-top: 10px; border-radius: 8px; padding: 10px 20px;">
-            {"Disable Safety" if safety_on else "Enable Safety"}
+            """.encode()
+# Pad dat (t, s) = gas en sturen, -100..100, naar /joy stuurt: hooguit een
+# request tegelijk, herhaald zolang hij vastgehouden wordt, 0,0 bij loslaten
+_PAGE_JOYSTICK = """
+    <div id="joy" style="width:200px; height:200px; margin:20px auto; border-radius:50%;
+        background-color:#e9f1fb; border:2px solid #007bff; position:relative; touch-action:none;">
+        <div id="knob" style="width:60px; height:60px; border-radius:50%; background-color:#28a745;
+            position:absolute; left:70px; top:70px;"></div>
+    </div>
+    <script>
+    (function() {
+        var pad = document.getElementById("joy"), knob = document.getElementById("knob");
+        var t = 0, s = 0, held = false, busy = false, sent = "0,0";
+        function place(x, y) {
+            knob.style.left = (70 + x * 70) + "px";
+            knob.style.top = (70 + y * 70) + "px";
+        }
+        function move(e) {
+            var r = pad.getBoundingClientRect();
+            var x = (e.clientX - r.left) / r.width * 2 - 1, y = (e.clientY - r.top) / r.height * 2 - 1;
+            var d = Math.sqrt(x * x + y * y);
+            if (d > 1) { x /= d; y /= d; }
+            t = Math.round(-y * 100);
+            s = Math.round(x * 100);
+            place(x, y);
+        }
+        function release() { held = false; t = 0; s = 0; place(0, 0); }
+        pad.onpointerdown = function(e) { held = true; pad.setPointerCapture(e.pointerId); move(e); };
+        pad.onpointermove = function(e) { if (held) move(e); };
+        pad.onpointerup = pad.onpointercancel = release;
+        setInterval(function() {
+            var command = t + "," + s;
+            if (busy || (!held && command == sent)) return;
+            busy = true;
+            sent = command;
+            fetch("/joy?t=" + t + "&s=" + s).then(function() { busy = false; }, function() { busy = false; });
+        }, JOYSTICK_INTERVAL_MS);
+    })();
+    </script>"""
+# Live status uit /events; de browser verbindt zelf opnieuw na een onderbreking
+_PAGE_EVENTS = """
+    <script>
+    if (window.EventSource) {
+        new EventSource("/events").onmessage = function(e) {
+            var s = JSON.parse(e.data);
+            document.getElementById("live").textContent = "Speed " + s.speed + "% | Safety "
+                + (s.safety ? "ON" : "OFF") + " | Tracks " + s.left + "/" + s.right + " | Distance "
+                + (s.distance === null ? "-" : s.distance + " cm") + " | Loop " + s.loop_us + " us";
+        };
+    }
+    </script>"""
+_PAGE_BOTTOM = ("""
         </button>
-    </form>
+    </form>""" + (_PAGE_JOYSTICK.replace("JOYSTICK_INTERVAL_MS", str(1000 // JOYSTICK_RATE_HZ))
+                  if JOYSTICK_RATE_HZ else "") + """
+    <div id="live" style="margin-top:10px; color:#555;"></div>""" + (_PAGE_EVENTS if EVENTS_INTERVAL_MS else "") + """
     <div class="footer">
         Kitronik Simply Robotics Configuration:<br>
         Motor: Variable Speed 0-100% | PWM: Auto<br>
@@ -171,110 +534,1223 @@ button {{
     </div>
 </div>
 </body>
-</html>"""
+</html>""").encode()
+_ON = b"ON"
+_OFF = b"OFF"
+_DISABLE = b"Disable Safety"
+_ENABLE = b"Enable Safety"
+_HTTP_OK = b"HTTP/1.1 200 OK\r\nContent-Type: text/html\r\nConnection: close\r\n\r\n"
+
+# Getallen als bytes, worden aangemaakt bij eerste gebruik
+_numbers = [None] * 101
+
+def _number(value):
+    text = _numbers[value]
+    if text is None:
+        text = str(value).encode()
+        _numbers[value] = text
+    return text
+
+@profiler.timed("create_html")
+def create_html(speed, safety_on):
+    return (_PAGE_TOP + _number(speed) + _PAGE_SAFETY + (_ON if safety_on else _OFF)
+            + _PAGE_BUTTON + (_DISABLE if safety_on else _ENABLE) + _PAGE_BOTTOM).decode()
 
-# WiFi connectie
-def connect_wifi():
+# Volledige response (header + pagina) in een vaste buffer; alleen opnieuw
+# opbouwen als snelheid of safety veranderd is
+_page_buf = bytearray(len(_HTTP_OK) + len(_PAGE_TOP) + len(_PAGE_SAFETY) + len(_PAGE_BUTTON)
+                      + len(_PAGE_BOTTOM) + 3 + len(_OFF) + len(_DISABLE))
+_page_view = memoryview(_page_buf)
+_page_len = 0
+_page_state = -1
+
+def _put(pos, data):
+    end = pos + len(data)
+    _page_view[pos:end] = data
+    return end
+
+def render_page(speed, safety_on):
+    global _page_len, _page_state
+
+    with _t_render_page:
+        state = speed * 2 + (1 if safety_on else 0)
+        if state != _page_state:
+            pos = _put(0, _HTTP_OK)
+            pos = _put(pos, _PAGE_TOP)
+            pos = _put(pos, _number(speed))
+            pos = _put(pos, _PAGE_SAFETY)
+            pos = _put(pos, _ON if safety_on else _OFF)
+            pos = _put(pos, _PAGE_BUTTON)
+            pos = _put(pos, _DISABLE if safety_on else _ENABLE)
+            _page_len = _put(pos, _PAGE_BOTTOM)
+            _page_state = state
+    return _page_len
+
+# WiFi verbinding starten, wacht niet op het resultaat
+# WiFi-gegevens (ssid, wachtwoord) uit de store of secrets.py, None als er geen zijn
+def wifi_credentials():
+    stored = store.get("wifi") if store else None
+    if stored:
+        return stored["ssid"], stored["password"]
+    if WIFI_SSID:
+        return WIFI_SSID, WIFI_PASSWORD
+    return None
+
+# Sleutel voor OTA-updates uit de store of secrets.py, None als er geen is
+def ota_key():
+    stored = store.get("ota_key") if store else None
+    return stored or OTA_KEY
+
+def start_wifi():
     wlan = network.WLAN(network.STA_IF)
     wlan.active(True)
 
-    if not wlan.isconnected():
-        print("Verbinding maken met WiFi...")
-        wlan.connect(WIFI_SSID, WIFI_PASSWORD)
-
-        timeout = 20
-        while not wlan.isconnected() and timeout > 0:
-            print(".", end="")
-            time.sleep(1)
-            timeout -= 1
-        print()
-
-    if wlan.isconnected():
-        ip = wlan.ifconfig()[0]
-        print(f"Verbonden: {ip}")
-        return ip
+    credentials = wifi_credentials()
+    if credentials and not wlan.isconnected():
+        logger.info("Verbinding maken met WiFi {}...", credentials[0])
+        wlan.connect(credentials[0], credentials[1])
+
+    return wlan
+
+_WRONG_PASSWORD = getattr(network, "STAT_WRONG_PASSWORD", -3)
+_WIFI_FAILED = (_WRONG_PASSWORD, getattr(network, "STAT_NO_AP_FOUND", -2),
+                getattr(network, "STAT_CONNECT_FAIL", -1))
+
+# WiFi connectie, WIFI_ATTEMPTS pogingen; None als het niet lukt
+def connect_wifi(wlan=None):
+    if wlan is None:
+        wlan = start_wifi()
+    credentials = wifi_credentials()
+    if not credentials:
+        logger.warning("Geen WiFi-gegevens")
+        return None
+
+    for attempt in range(WIFI_ATTEMPTS):
+        if attempt:
+            logger.warning("WiFi poging {} van {}", attempt + 1, WIFI_ATTEMPTS)
+            wlan.disconnect()
+            wlan.connect(credentials[0], credentials[1])
+        # Kort pollen zodat we niet tot een seconde te laat verder gaan
+        start = time.ticks_ms()
+        while not wlan.isconnected() and time.ticks_diff(time.ticks_ms(), start) < WIFI_TIMEOUT_MS:
+            if wlan.status() in _WIFI_FAILED:
+                break
+            time.sleep_ms(20)
+        if wlan.isconnected():
+            ip = wlan.ifconfig()[0]
+            logger.info("Verbonden: {}", ip)
+            return ip
+        if wlan.status() == _WRONG_PASSWORD:
+            logger.error("Fout WiFi-wachtwoord")
+            break
+
+    logger.error("WiFi verbinding mislukt")
+    return None
+
+# Eigen access point met DNS-responder voor de captive portal; geeft het IP-adres
+def start_access_point(wlan):
+    global dns, ap_networks, portal_redirect, portal
+    import portal
+
+    # Netwerken in de buurt voor de keuzelijst, zolang de station-interface nog aan staat
+    try:
+        ap_networks = [n[0].decode() for n in wlan.scan()[:8] if n[0]]
+    except (OSError, UnicodeError):
+        ap_networks = []
+    wlan.active(False)
+
+    ssid = AP_SSID or "smars-" + "".join("{:02x}".format(b) for b in machine.unique_id()[-2:])
+    ap = network.WLAN(network.AP_IF)
+    if AP_PASSWORD:
+        ap.config(essid=ssid, password=AP_PASSWORD)
+    else:
+        ap.config(essid=ssid, security=0)
+    ap.active(True)
+    start = time.ticks_ms()
+    while not ap.active() and time.ticks_diff(time.ticks_ms(), start) < WIFI_TIMEOUT_MS:
+        time.sleep_ms(20)
+    ip = ap.ifconfig()[0]
+
+    dns = portal.DNSResponder(ip, DNS_PORT)
+    dns.start()
+    portal_redirect = ("HTTP/1.1 302 Found\r\nLocation: http://{}/setup\r\nConnection: close\r\n\r\n"
+                       .format(ip)).encode()
+    logger.info("Access point {}: http://{}/setup", ssid, ip)
+    return ip
+
+# Webserver socket openen
+def start_server(ip):
+    addr = socket.getaddrinfo(ip, HTTP_PORT)[0][-1]
+    server = socket.socket()
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind(addr)
+    server.listen(1)
+    logger.info("Server draait op: http://{}", ip)
+    return server
+
+# Acties uit de query string; de strings worden hergebruikt zodat parsen niets alloceert
+_ACTIONS = (
+    (b"forward", "forward"),
+    (b"reverse", "reverse"),
+    (b"left", "left"),
+    (b"right", "right"),
+    (b"stop", "stop"),
+    (b"speed_up", "speed_up"),
+    (b"speed_down", "speed_down"),
+    (b"toggle_safety", "toggle_safety"),
+)
+_UNKNOWN_ACTION = "unknown"
+_KEY_ACTION = b"action"
+_GET_QUERY = b"GET /?"
+_GET_LOGS = b"GET /logs"
+_GET_METRICS = b"GET /metrics"
+_GET_MAP = b"GET /map"
+_GET_JOY = b"GET /joy"
+_GET_EVENTS = b"GET /events"
+_GET_SETUP = b"GET /setup"
+_POST_SETUP = b"POST /setup"
+_GET_OTA = b"GET /ota"
+_POST_OTA = b"POST /ota/"
+_POST_OTA_BEGIN = b"POST /ota/begin"
+_POST_OTA_CHUNK = b"POST /ota/chunk"
+_POST_OTA_COMMIT = b"POST /ota/commit"
+_KEY_THROTTLE = b"t"
+_KEY_STEER = b"s"
+_HTTP_TEXT = b"HTTP/1.1 200 OK\r\nContent-Type: text/plain\r\nConnection: close\r\n\r\n"
+_HTTP_METRICS = b"HTTP/1.1 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\nConnection: close\r\n\r\n"
+_HTTP_BINARY = b"HTTP/1.1 200 OK\r\nContent-Type: application/octet-stream\r\nConnection: close\r\n\r\n"
+_HTTP_NO_CONTENT = b"HTTP/1.1 204 No Content\r\nConnection: close\r\n\r\n"
+_HTTP_BAD_REQUEST = b"HTTP/1.1 400 Bad Request\r\nConnection: close\r\n\r\n"
+_HTTP_UNAVAILABLE = b"HTTP/1.1 503 Service Unavailable\r\nRetry-After: 5\r\nConnection: close\r\n\r\n"
+_GET_API = b"GET /api/"
+_POST_API = b"POST /api/"
+_GET_API_STATE = b"GET /api/state"
+_POST_API_DRIVE = b"POST /api/drive"
+_GET_API_SERVOS = b"GET /api/servos"
+_POST_API_SERVOS = b"POST /api/servos"
+_GET_API_BATCH = b"GET /api/batch"
+_POST_API_BATCH = b"POST /api/batch"
+_JSON_HEADERS = b"\r\nContent-Type: application/json\r\nConnection: close\r\n\r\n"
+_JSON_OK = b"HTTP/1.1 200 OK" + _JSON_HEADERS
+_JSON_BAD_REQUEST = b"HTTP/1.1 400 Bad Request" + _JSON_HEADERS
+_JSON_FORBIDDEN = b"HTTP/1.1 403 Forbidden" + _JSON_HEADERS
+_JSON_NOT_FOUND = b"HTTP/1.1 404 Not Found" + _JSON_HEADERS
+_JSON_CONFLICT = b"HTTP/1.1 409 Conflict" + _JSON_HEADERS
+_JSON_TOO_LARGE = b"HTTP/1.1 413 Payload Too Large" + _JSON_HEADERS
+_JSON_ERROR = b"HTTP/1.1 500 Internal Server Error" + _JSON_HEADERS
+_HEADER_END = b"\r\n\r\n"
+_CONTENT_LENGTH = b"content-length:"
+
+# Vaste buffer voor binnenkomende requests
+_req_buf = bytearray(1024)
+_req_view = memoryview(_req_buf)
+
+# GC statistieken: requests, bytes totaal, bytes max, collects, GC us totaal, GC us max
+gc_stats = [0, 0, 0, 0, 0, 0]
+
+def _equals(buf, start, end, pattern):
+    if end - start != len(pattern):
+        return False
+    for i in range(len(pattern)):
+        if buf[start + i] != pattern[i]:
+            return False
+    return True
+
+# Een client die binnen zijn timeout niets stuurt geeft OSError (ETIMEDOUT)
+def _recv_into(client, buf):
+    # MicroPython sockets hebben readinto(), CPython sockets recv_into()
+    try:
+        return client.readinto(buf)
+    except AttributeError:
+        return client.recv_into(buf)
+
+def _send_all(client, data):
+    try:
+        client.write(data)
+    except AttributeError:
+        client.sendall(data)
+
+_SPACE = 32
+_AMP = 38
+_EQUALS = 61
+_QUESTION = 63
+_MINUS = 45
+_ZERO = 48
+_NINE = 57
+
+# Vindt de actie in "GET /?action=...&..." zonder de request te decoderen
+def parse_action(buf, length):
+    if length < len(_GET_QUERY) or not _equals(buf, 0, len(_GET_QUERY), _GET_QUERY):
+        return None
+
+    action = None
+    pos = len(_GET_QUERY)
+    # Een spatie sluit het pad af
+    while pos < length and buf[pos] != _SPACE:
+        key_end = pos
+        while key_end < length and buf[key_end] != _EQUALS and buf[key_end] != _AMP and buf[key_end] != _SPACE:
+            key_end += 1
+        value_end = key_end
+        if key_end < length and buf[key_end] == _EQUALS:
+            value_end = key_end + 1
+            while value_end < length and buf[value_end] != _AMP and buf[value_end] != _SPACE:
+                value_end += 1
+            if _equals(buf, pos, key_end, _KEY_ACTION):
+                action = _UNKNOWN_ACTION
+                for pattern, name in _ACTIONS:
+                    if _equals(buf, key_end + 1, value_end, pattern):
+                        action = name
+                        break
+        pos = value_end
+        if pos < length and buf[pos] == _AMP:
+            pos += 1
+    return action
+
+# Geheel getal uit de query string na start ("t=-40&s=25 HTTP/1.1"), None als het
+# ontbreekt of geen getal is
+def query_int(buf, length, start, key):
+    pos = start
+    while pos < length and buf[pos] != _SPACE:
+        key_end = pos
+        while key_end < length and buf[key_end] != _EQUALS and buf[key_end] != _AMP and buf[key_end] != _SPACE:
+            key_end += 1
+        value_end = key_end
+        if key_end < length and buf[key_end] == _EQUALS:
+            value_end = key_end + 1
+            while value_end < length and buf[value_end] != _AMP and buf[value_end] != _SPACE:
+                value_end += 1
+            if _equals(buf, pos, key_end, key):
+                return _parse_int(buf, key_end + 1, value_end)
+        pos = value_end
+        if pos < length and buf[pos] == _AMP:
+            pos += 1
+    return None
+
+def _parse_int(buf, start, end):
+    negative = start < end and buf[start] == _MINUS
+    if negative:
+        start += 1
+    # Hooguit 4 cijfers, het getal blijft een small int
+    if start == end or end - start > 4:
+        return None
+    value = 0
+    for pos in range(start, end):
+        digit = buf[pos]
+        if digit < _ZERO or digit > _NINE:
+            return None
+        value = value * 10 + digit - _ZERO
+    return -value if negative else value
+
+def _starts(buf, length, prefix):
+    return length >= len(prefix) and _equals(buf, 0, len(prefix), prefix)
+
+# Begint de request met dit pad, gevolgd door een spatie of query string?
+def is_path(buf, length, request_path):
+    end = len(request_path)
+    if length <= end or not _equals(buf, 0, end, request_path):
+        return False
+    return buf[end] == _SPACE or buf[end] == _QUESTION
+
+def send_logs(client):
+    _send_all(client, _HTTP_TEXT)
+    for line in logger.lines():
+        _send_all(client, line.encode())
+        _send_all(client, b"\n")
+
+def send_metrics(client):
+    _send_all(client, _HTTP_METRICS)
+    for line in profiler.metrics():
+        _send_all(client, line.encode())
+
+# Kaart als header + cellen, zie gridmap.py; host/gridview.py toont hem
+def send_map(client):
+    _send_all(client, _HTTP_BINARY)
+    _send_all(client, grid.header())
+    _send_all(client, grid.cells)
+
+# Een knop of API-commando neemt het over: de lease van een UDP-client of de joystick
+# stopt de motoren niet meer en een lopende batch stopt
+def take_over():
+    if drive_server:
+        drive_server.lease_until = None
+    if joystick:
+        joystick.release()
+    if batch:
+        batch.cancel()
+
+def apply_action(action):
+    global current_speed, safety_enabled
+
+    if recorder:
+        recorder.action(action)
+    take_over()
+
+    if action == "toggle_safety":
+        safety_enabled = not safety_enabled
+        logger.info("Safety toggled: {}", safety_enabled)
+    elif action == "speed_up":
+        current_speed = min(100, current_speed + 10)
+        logger.info("Snelheid verhoogd naar: {}%", current_speed)
+    elif action == "speed_down":
+        current_speed = max(10, current_speed - 10)
+        logger.info("Snelheid verlaagd naar: {}%", current_speed)
+    else:
+        logger.debug("Actie uitvoeren: {}", action)
+        control_motors(action)
+        if recorder and robot:
+            recorder.motor(MOTOR_LEFT, robot.motors[MOTOR_LEFT])
+            recorder.motor(MOTOR_RIGHT, robot.motors[MOTOR_RIGHT])
+
+# Een client afhandelen: request lezen, actie uitvoeren, pagina terugsturen
+def serve_client(server):
+    global command_us
+
+    client, addr = server.accept()
+    client.settimeout(CLIENT_TIMEOUT_S)
+    keep = False
+    start = time.ticks_us()
+    if GC_DEFER:
+        gc.disable()
+    if GC_STATS:
+        alloc_before = gc.mem_alloc()
+    try:
+        logger.debug("Client verbonden: {}", addr[0])
+
+        length = _recv_into(client, _req_buf)
+        logger.debug("Request ontvangen")
+
+        if dns and serve_portal(client, length):
+            return
+        if is_path(_req_buf, length, _GET_LOGS):
+            send_logs(client)
+            return
+        if is_path(_req_buf, length, _GET_METRICS):
+            send_metrics(client)
+            return
+        if grid and is_path(_req_buf, length, _GET_MAP):
+            send_map(client)
+            return
+        if joystick and is_path(_req_buf, length, _GET_JOY):
+            serve_joystick(client, length)
+            return
+        if batch and (_starts(_req_buf, length, _GET_API) or _starts(_req_buf, length, _POST_API)):
+            serve_api(client, length)
+            return
+        if updater and (is_path(_req_buf, length, _GET_OTA) or _starts(_req_buf, length, _POST_OTA)):
+            serve_ota(client, length)
+            return
+        if events and is_path(_req_buf, length, _GET_EVENTS):
+            # De verbinding blijft open, events schrijft er voortaan de frames op
+            keep = events.add(client)
+            if not keep:
+                _send_all(client, _HTTP_UNAVAILABLE)
+            return
+
+        try:
+            action = parse_action(_req_buf, length)
+            if action is not None:
+                apply_action(action)
+                command_us = time.ticks_diff(time.ticks_us(), start)
+        except Exception as e:
+            logger.error("Fout bij parsen: {}", e)
+
+        length = render_page(current_speed, safety_enabled)
+        _send_all(client, _page_view[:length])
+        logger.debug("Response verzonden")
+    except OSError as e:
+        # Stil gebleven (CLIENT_TIMEOUT_S) of weggevallen client: het request vervalt
+        logger.debug("Client weggevallen: {}", e)
+    finally:
+        if not keep:
+            client.close()
+        if GC_STATS:
+            _count_alloc(gc.mem_alloc() - alloc_before)
+        if GC_DEFER:
+            gc.enable()
+
+# Captive portal in access point-modus: /setup en de controles van telefoons en
+# laptops; de rest (ook de bediening) gaat gewoon door. True als het request beantwoord is
+def serve_portal(client, length):
+    global reset_at_ms, reset_reason
+
+    if is_path(_req_buf, length, _GET_SETUP):
+        _send_all(client, _HTTP_OK)
+        _send_all(client, portal.setup_page(ap_networks, "Kies het WiFi-netwerk voor de robot"))
+        return True
+    if is_path(_req_buf, length, _POST_SETUP):
+        body = read_body(client, length)
+        form = portal.parse_form(body or b"")
+        ssid = form.get("ssid", "")
+        error = portal.check_credentials(ssid, form.get("password", ""))
+        if error:
+            message = error
+        else:
+            store.set("wifi", {"ssid": ssid, "password": form["password"]})
+            store.flush()
+            logger.info("WiFi-gegevens voor {} opgeslagen", ssid)
+            # Eerst het antwoord versturen, dan herstarten en met het nieuwe netwerk verbinden
+            reset_at_ms = time.ticks_add(time.ticks_ms(), 1000)
+            reset_reason = "Herstarten met de nieuwe WiFi-gegevens..."
+            message = "Opgeslagen, de robot verbindt nu met " + ssid
+        _send_all(client, _HTTP_OK)
+        _send_all(client, portal.setup_page(ap_networks, message, ssid))
+        return True
+    for probe in portal.PROBES:
+        if is_path(_req_buf, length, probe):
+            _send_all(client, portal_redirect)
+            return True
+    return False
+
+# Een statusframe voor alle abonnees van /events, een keer per interval opgebouwd
+_EVENT_FRAME = ('data: {"speed":%d,"safety":%s,"left":%d,"right":%d,"distance":%s,'
+                '"loop_us":%d,"command_us":%d,"pose":[%d,%d,%d]}\n\n')
+
+def event_frame():
+    left = right = 0
+    if robot:
+        left = track_speed(robot.motors[MOTOR_LEFT], 0)
+        right = track_speed(robot.motors[MOTOR_RIGHT], 1)
+    distance = "null" if last_distance is None else "%.1f" % last_distance
+    return (_EVENT_FRAME % (current_speed, "true" if safety_enabled else "false", left, right, distance,
+                            loop_us, command_us, pose_x, pose_y, pose_heading)).encode()
+
+# Stand van de joystick onthouden en meteen antwoorden; control_tick stuurt de
+# motoren met de nieuwste stand, dus een burst requests kost een motorcommando per tick
+def serve_joystick(client, length):
+    start = len(_GET_JOY) + 1
+    throttle = query_int(_req_buf, length, start, _KEY_THROTTLE)
+    steer = query_int(_req_buf, length, start, _KEY_STEER)
+    if throttle is None or steer is None:
+        _send_all(client, _HTTP_BAD_REQUEST)
+        return
+    if batch:
+        batch.cancel()
+    joystick.command(throttle, steer, time.ticks_ms())
+    _send_all(client, _HTTP_NO_CONTENT)
+
+# JSON API: kleine antwoorden voor scripts in plaats van de hele pagina. Alleen dit
+# pad alloceert per request (json), de knoppen en de joystick blijven zonder
+def serve_api(client, length):
+    try:
+        if is_path(_req_buf, length, _GET_API_STATE):
+            reply = api_state()
+        elif is_path(_req_buf, length, _GET_API_SERVOS):
+            reply = api_servos()
+        elif is_path(_req_buf, length, _GET_API_BATCH):
+            reply = api_batch()
+        elif (is_path(_req_buf, length, _POST_API_DRIVE) or is_path(_req_buf, length, _POST_API_SERVOS)
+              or is_path(_req_buf, length, _POST_API_BATCH)):
+            body = read_body(client, length)
+            if body is None:
+                send_json(client, _JSON_TOO_LARGE, {"error": "body too large"})
+                return
+            request = json.loads(body)
+            if not isinstance(request, dict):
+                raise ValueError("expected an object")
+            if is_path(_req_buf, length, _POST_API_DRIVE):
+                reply = api_drive(request)
+            elif is_path(_req_buf, length, _POST_API_SERVOS):
+                reply = api_set_servo(request)
+            else:
+                reply = api_load_batch(request)
+        else:
+            send_json(client, _JSON_NOT_FOUND, {"error": "unknown"})
+            return
+    except (ValueError, TypeError, KeyError) as e:
+        send_json(client, _JSON_BAD_REQUEST, {"error": str(e)})
+        return
+    send_reply(client, reply)
+
+# Een fout als string (409) of het antwoord (200)
+def send_reply(client, reply):
+    if isinstance(reply, str):
+        send_json(client, _JSON_CONFLICT, {"error": reply})
     else:
-        print("WiFi verbinding mislukt")
+        send_json(client, _JSON_OK, reply)
+
+def send_json(client, headers, value):
+    _send_all(client, headers)
+    _send_all(client, json.dumps(value).encode())
+
+# Over-the-air update, zie ota.py: GET /ota geeft de voortgang, POST /ota/begin de
+# bestanden met grootte en SHA-256, POST /ota/chunk de bytes en POST /ota/commit zet
+# de update op zijn plaats en herstart. De robot stopt zodra een update begint. Elke
+# POST draagt ?auth=<HMAC>, zie ota_request(); zonder geldige handtekening 403
+def serve_ota(client, length):
+    global reset_at_ms, reset_reason
+    # Buiten de try: een stille client laat het request vervallen, het is geen flashfout
+    body = None
+    if is_path(_req_buf, length, _POST_OTA_BEGIN):
+        body = read_body(client, length)
+        if body is None:
+            send_json(client, _JSON_TOO_LARGE, {"error": "body too large"})
+            return
+    query = None
+    if not is_path(_req_buf, length, _GET_OTA):
+        query, message = ota_request(length, body)
+        if not updater.allowed(ota_key(), query.get("auth"), message):
+            logger.warning("OTA-verzoek zonder geldige handtekening geweigerd")
+            send_json(client, _JSON_FORBIDDEN, {"error": "bad or missing auth"})
+            return
+    try:
+        if is_path(_req_buf, length, _GET_OTA):
+            reply = updater.status()
+        elif is_path(_req_buf, length, _POST_OTA_CHUNK):
+            reply = ota_chunk(client, length, query)
+            if reply is None:
+                return
+        elif is_path(_req_buf, length, _POST_OTA_BEGIN):
+            request = json.loads(body)
+            if not isinstance(request, dict):
+                raise ValueError("expected an object")
+            take_over()
+            drive_tracks(0, 0)
+            reply = updater.begin(request["files"])
+        elif is_path(_req_buf, length, _POST_OTA_COMMIT):
+            reply = updater.commit()
+            if not isinstance(reply, str):
+                logger.info("Update geinstalleerd: {}", reply["committed"])
+                # Eerst het antwoord versturen; de volgende boot is de proef
+                reset_at_ms = time.ticks_add(time.ticks_ms(), 1000)
+                reset_reason = "Herstarten met de update..."
+        else:
+            send_json(client, _JSON_NOT_FOUND, {"error": "unknown"})
+            return
+    except (ValueError, TypeError, KeyError) as e:
+        send_json(client, _JSON_BAD_REQUEST, {"error": str(e)})
+        return
+    except OSError as e:
+        send_json(client, _JSON_ERROR, {"error": "flash: {}".format(e)})
+        return
+    send_reply(client, reply)
+
+# Query van een POST naar /ota/<actie> als dict, en wat de afzender naast de nonce
+# ondertekent: de actie, bij chunk met bestand en offset, bij begin met de body. De
+# chunks zelf zijn gedekt door de SHA-256 in de ondertekende begin
+def ota_request(length, body):
+    end = _find(_req_buf, length, len(_POST_OTA), _SPACE)
+    start = _find(_req_buf, end, len(_POST_OTA), _QUESTION)
+    query = portal.parse_form(bytes(_req_view[start + 1:end])) if start < end else {}
+    message = bytes(_req_view[len(_POST_OTA):start])
+    if message == b"chunk":
+        message = "chunk {} {}".format(query.get("file"), query.get("offset")).encode()
+    elif body is not None:
+        message += b" " + body
+    return query, message
+
+# Een chunk: POST /ota/chunk?file=<naam>&offset=<bytes>&auth=<HMAC>, met de bytes als
+# body. Ze gaan per _req_buf naar flash, nooit het hele bestand in RAM. Breekt de
+# verbinding af, dan blijft wat binnen is staan (None: geen antwoord meer) en gaat de
+# client verder vanaf "received" in GET /ota
+def ota_chunk(client, length, query):
+    found = body_range(length)
+    if found is None:
+        raise ValueError("no body")
+    body, size = found
+    error = updater.open(query["file"], int(query["offset"]))
+    if error:
+        return error
+    received = min(length - body, size)
+    interrupted = False
+    try:
+        updater.write(_req_view[body:body + received])
+        client.settimeout(OTA_TIMEOUT_S)
+        while received < size:
+            count = _recv_into(client, _req_view[:min(len(_req_buf), size - received)])
+            if not count:
+                interrupted = True
+                break
+            updater.write(_req_view[:count])
+            received += count
+    except OSError as e:
+        logger.warning("OTA chunk afgebroken: {}", e)
+        interrupted = True
+    finally:
+        reply = updater.close()
+    return None if interrupted else reply
+
+# Positie van het eerste teken char vanaf start, of length
+def _find(buf, length, start, char):
+    while start < length and buf[start] != char:
+        start += 1
+    return start
+
+# Begin van de body van een POST in _req_buf en de Content-Length, None zonder einde van de headers
+def body_range(length):
+    head = bytes(_req_view[:length])
+    end = head.find(_HEADER_END)
+    if end < 0:
+        return None
+    size = 0
+    header = head[:end].lower().find(_CONTENT_LENGTH)
+    if header >= 0:
+        line_end = head.find(b"\r\n", header)
+        size = int(head[header + len(_CONTENT_LENGTH):line_end])
+    return end + len(_HEADER_END), size
+
+# Body van een POST; leest bij tot Content-Length binnen is. None als hij niet in _req_buf past
+# of de client de verbinding sluit; blijft de client stil, dan OSError uit _recv_into
+def read_body(client, length):
+    found = body_range(length)
+    if found is None:
+        return None
+    body, size = found
+    if body + size > len(_req_buf):
         return None
+    while length < body + size:
+        received = _recv_into(client, _req_view[length:body + size])
+        if not received:
+            return None
+        length += received
+    return bytes(_req_view[body:body + size])
+
+# Snelheid van een rups, -100..100, positief = vooruit
+def track_speed(motor, side):
+    if motor.direction == "-":
+        return 0
+    return motor.speed if motor.direction == _drive_forward[side] else -motor.speed
+
+def api_state():
+    left = right = 0
+    if robot:
+        left = track_speed(robot.motors[MOTOR_LEFT], 0)
+        right = track_speed(robot.motors[MOTOR_RIGHT], 1)
+    state = {"speed": current_speed, "safety": safety_enabled, "left": left, "right": right,
+             "distance": last_distance, "pose": [pose_x, pose_y, pose_heading],
+             "batch": batch.running(), "ms": time.ticks_ms()}
+    # Laatste meting per sensor van de sensorrij, in cm
+    if sonar:
+        state["sonar"] = {sonar.names[i]: sonar.distance(i) for i in range(len(sonar.names))}
+    return state
+
+# {"left": -100..100, "right": ...} en/of {"action": "forward"}, {"speed": 10..100}
+def api_drive(request):
+    global current_speed, command_us
+
+    start = time.ticks_us()
+    if "speed" in request:
+        speed = request["speed"]
+        if not isinstance(speed, int) or not 10 <= speed <= 100:
+            raise ValueError("speed must be 10..100")
+        current_speed = speed
+    if "action" in request:
+        action = request["action"]
+        for _, name in _ACTIONS:
+            if action == name:
+                break
+        else:
+            raise ValueError("unknown action")
+        moving = action in ("forward", "reverse", "left", "right")
+        if moving and safety_enabled:
+            return "safety on"
+        apply_action(action)
+    elif "left" in request or "right" in request:
+        left = request.get("left", 0)
+        right = request.get("right", 0)
+        if not isinstance(left, int) or not isinstance(right, int) or not -100 <= left <= 100 or not -100 <= right <= 100:
+            raise ValueError("track speeds must be -100..100")
+        take_over()
+        if not drive_tracks(left, right):
+            return "safety on"
+    command_us = time.ticks_diff(time.ticks_us(), start)
+    return api_state()
+
+# Servo's die de API mag zetten: niet die van de scanner, de sensor of een uitgang
+# die ook een rijmotor aanstuurt (GPn en GPn+16 zijn dezelfde PWM-uitgang)
+def free_servos():
+    if not robot:
+        return ()
+    outputs = []
+    for index in (MOTOR_LEFT, MOTOR_RIGHT):
+        for pin in robot.motorPins[index]:
+            outputs.append(pin & 15)
+    sensor_pins = [SENSOR_TRIGGER_PIN, SENSOR_ECHO_PIN] if SENSOR_ENABLED else []
+    for s in SONAR_SENSORS or ():
+        sensor_pins.extend(s[1:3])
+    free = []
+    for i in range(8):
+        pin = robot.servoPins[i]
+        if i != SCAN_SERVO and pin & 15 not in outputs and pin not in sensor_pins:
+            free.append(i)
+    return tuple(free)
+
+def set_servo(index, angle):
+    robot.servos[index].goToPosition(angle)
+    servo_angles[index] = angle
+
+def api_servos():
+    return {"free": list(free_servos()), "angles": servo_angles}
+
+# {"servo": 0..7, "angle": 0..180}
+def api_set_servo(request):
+    index = request["servo"]
+    angle = request["angle"]
+    if index not in free_servos():
+        raise ValueError("servo {} is not free".format(index))
+    if not isinstance(angle, int) or not 0 <= angle <= 180:
+        raise ValueError("angle must be 0..180")
+    set_servo(index, angle)
+    return api_servos()
+
+def api_batch():
+    return {"running": batch.running(), "next": batch.next, "steps": batch.count,
+            "ms": batch.duration_ms()}
+
+# {"steps": [[at_ms, "drive", left, right], [at_ms, "servo", servo, angle], ...]}, met
+# "at": ticks_ms() van de robot waarop de batch begint (standaard nu). Een vloot
+# (host/fleet.py) rekent "at" per robot om zodat alle robots tegelijk beginnen
+def api_load_batch(request):
+    take_over()
+    now = time.ticks_ms()
+    start = request.get("at", now)
+    if not isinstance(start, int) or not -scheduler.MAX_AT_MS <= time.ticks_diff(start, now) <= scheduler.MAX_AT_MS:
+        raise ValueError("at must be within {} ms of ms in /api/state".format(scheduler.MAX_AT_MS))
+    error = batch.load(request["steps"], start, free_servos())
+    if error:
+        raise ValueError(error)
+    logger.info("Batch: {} stappen in {} ms", batch.count, batch.duration_ms())
+    # Stappen op 0 ms meteen, dan meldt het antwoord of safety ze tegenhoudt
+    if not run_batch(now):
+        return "safety on"
+    return api_batch()
+
+# Stappen die aan de beurt zijn uitvoeren; False (en de batch stopt) als een
+# rijstap niet lukt, bijvoorbeeld door safety
+def run_batch(now):
+    while True:
+        i = batch.next_step(now)
+        if i < 0:
+            return True
+        if batch.kind[i] == scheduler.DRIVE:
+            if not drive_tracks(batch.a[i], batch.b[i]):
+                batch.cancel()
+                logger.warning("Batch gestopt bij stap {}", i)
+                return False
+        else:
+            set_servo(batch.a[i], batch.b[i])
+
+# Rijcommando's van de UDP-poort: alleen het nieuwste uit een burst wordt uitgevoerd
+def serve_drive():
+    global command_us
+
+    start = time.ticks_us()
+    result = drive_server.receive(time.ticks_ms())
+    if result < 0:
+        return
+    left = drive_server.left
+    right = drive_server.right
+    if result == udpdrive.RESULT_OK:
+        if batch:
+            batch.cancel()
+        if drive_tracks(left, right):
+            command_us = time.ticks_diff(time.ticks_us(), start)
+        else:
+            result = udpdrive.RESULT_BLOCKED
+            left = right = 0
+    drive_server.reply(result, safety_enabled, left, right, last_distance)
+
+def _count_alloc(allocated):
+    gc_stats[0] += 1
+    gc_stats[1] += allocated
+    if allocated > gc_stats[2]:
+        gc_stats[2] = allocated
+
+# Opruimen op een rustig moment: tussen twee requests
+def gc_idle():
+    if gc.mem_free() >= GC_MIN_FREE:
+        return
+    start = time.ticks_us()
+    gc.collect()
+    pause = time.ticks_diff(time.ticks_us(), start)
+    gc_stats[3] += 1
+    gc_stats[4] += pause
+    if pause > gc_stats[5]:
+        gc_stats[5] = pause
+
+# Periodiek werk tussen de requests door: positie, sensor, telemetrie, opname
+def control_tick(now):
+    global last_distance, next_sample_ms, next_send_ms, next_record_flush_ms, next_plan_ms
+    global next_joystick_ms, next_event_ms
+    global pose_x, pose_y, pose_heading
+
+    if reset_at_ms is not None and time.ticks_diff(now, reset_at_ms) >= 0:
+        restart(reset_reason)
+
+    # Geen nieuw UDP-commando binnen de lease: stoppen
+    if drive_server and drive_server.expired(now):
+        drive_tracks(0, 0)
+
+    if batch and batch.running():
+        run_batch(now)
+
+    # Nieuwste joystickstand, hooguit een per CONTROL_TICK_MS
+    if joystick and time.ticks_diff(now, next_joystick_ms) >= 0 and joystick.take(now, current_speed):
+        next_joystick_ms = time.ticks_add(now, CONTROL_TICK_MS)
+        drive_tracks(joystick.left, joystick.right)
+
+    if odom:
+        odom.update(robot.motors[MOTOR_LEFT], robot.motors[MOTOR_RIGHT], now)
+        pose_x = odom.x_mm()
+        pose_y = odom.y_mm()
+        pose_heading = odom.heading()
+
+    if scanner:
+        if scanner.step(now):
+            last_distance = scanner.last_distance
+            if recorder:
+                recorder.distance(last_distance)
+            if grid:
+                map_reading(scanner.last_angle, last_distance)
+
+    # Sensorrij: alleen de sensoren met een nieuwe meting, elk onder zijn eigen hoek
+    if sonar:
+        done = sonar.poll()
+        if done:
+            for i in done:
+                if i == 0 and not scanner:
+                    last_distance = sonar.distance(0)
+                    if recorder:
+                        recorder.distance(last_distance)
+                if grid:
+                    map_reading(sonar.angles[i], sonar.distance(i))
+
+    if planner and time.ticks_diff(now, next_plan_ms) >= 0:
+        next_plan_ms = time.ticks_add(now, PLAN_INTERVAL_MS)
+        update_plan()
+
+    if recorder and time.ticks_diff(now, next_record_flush_ms) >= 0:
+        next_record_flush_ms = time.ticks_add(now, RECORD_FLUSH_MS)
+        recorder.flush()
+
+    if events and events.count:
+        if time.ticks_diff(now, next_event_ms) >= 0:
+            next_event_ms = time.ticks_add(now, EVENTS_INTERVAL_MS)
+            events.publish(event_frame())
+        else:
+            events.pump()
+
+    if telemetry:
+        if time.ticks_diff(now, next_sample_ms) >= 0:
+            next_sample_ms = time.ticks_add(now, TELEMETRY_INTERVAL_MS)
+            telemetry.record(robot.motors[MOTOR_LEFT], robot.motors[MOTOR_RIGHT],
+                             last_distance, loop_us, command_us)
+        if time.ticks_diff(now, next_send_ms) >= 0:
+            next_send_ms = time.ticks_add(now, TELEMETRY_SEND_MS)
+            if mqtt:
+                publish_telemetry()
+            else:
+                telemetry.send()
+
+    # Verbinden, schrijven en lezen zonder te wachten; commando's komen binnen via mqtt_message
+    if mqtt:
+        mqtt.poll(now)
+        if mqtt.error:
+            logger.error("MQTT bericht: {}", mqtt.error)
+            mqtt.error = None
+
+    # Knoppen, API en MQTT veranderen snelheid en veiligheid; store schrijft alleen
+    # als er iets veranderd is, een reeks wijzigingen samen na STORE_FLUSH_MS
+    if store:
+        store.set("speed", current_speed)
+        store.set("safety", safety_enabled)
+        try:
+            store.flush(now)
+        except OSError as e:
+            # Opnieuw na STORE_FLUSH_MS
+            logger.error("Toestand bewaren mislukt: {}", e)
+
+# Telemetriebatches naar de wachtrij van mqtt. Zonder verbinding blijven ze in de
+# ring van telemetry, die net als de wachtrij het oudste laat vallen als hij vol is
+def publish_telemetry():
+    if not mqtt.connected():
+        return
+    while True:
+        size = telemetry.pack_batch()
+        if not size:
+            return
+        mqtt.publish(mqtt_topic + "telemetry", telemetry.packet_view[:size], MQTT_TELEMETRY_QOS)
+
+# Een commando van smars/<id>/cmd of smars/all/cmd: {"steps": [...]} is een batch,
+# {"servo": ..} een servo en de rest een rijcommando. Het antwoord, met het "id"
+# uit het commando als dat er was, gaat naar smars/<id>/state
+def mqtt_message(topic, payload):
+    request = None
+    try:
+        request = json.loads(payload)
+        if not isinstance(request, dict):
+            raise ValueError("expected an object")
+        if "steps" in request:
+            reply = api_load_batch(request)
+        elif "servo" in request:
+            reply = api_set_servo(request)
+        else:
+            reply = api_drive(request)
+    except (ValueError, TypeError, KeyError) as e:
+        reply = str(e)
+    if isinstance(reply, str):
+        reply = {"error": reply}
+    if isinstance(request, dict) and "id" in request:
+        reply["id"] = request["id"]
+    mqtt.publish(mqtt_topic + "state", json.dumps(reply))
+
+# Na elke (her)verbinding; de broker zet "offline" terug als de robot wegvalt (will)
+def mqtt_online():
+    logger.info("MQTT verbonden met {}", MQTT_BROKER)
+    mqtt.publish(mqtt_topic + "status", b"online", 1, True)
+
+def start_mqtt():
+    global mqtt, mqtt_topic
+    from mqtt import MQTTClient
+    robot_id = MQTT_ROBOT_ID or "".join("{:02x}".format(b) for b in machine.unique_id())
+    mqtt_topic = "smars/{}/".format(robot_id)
+    mqtt = MQTTClient("smars-" + robot_id, MQTT_BROKER, MQTT_PORT, MQTT_KEEPALIVE_S, MQTT_QUEUE,
+                      will=(mqtt_topic + "status", b"offline", True))
+    mqtt.on_message = mqtt_message
+    mqtt.on_connect = mqtt_online
+    mqtt.subscribe(mqtt_topic + "cmd", 1)
+    mqtt.subscribe("smars/all/cmd", 1)
+    logger.info("MQTT naar {} als {}", MQTT_BROKER, mqtt_topic)
+
+# Op requests wachten tot de volgende tick, of korter als een batchstap eerder aan
+# de beurt is: dan begint een gesynchroniseerde batch op de ms en niet tot een tick te laat.
+# Net zo voor de sensorrij en de scanner, die anders tot een tick na elke echo stil zouden liggen
+def poll_timeout(now):
+    timeout = CONTROL_TICK_MS
+    if batch:
+        due = batch.due_in(now)
+        if due is not None and due < timeout:
+            timeout = due
+    if sonar:
+        due = sonar.due_in()
+        if due < timeout:
+            timeout = due
+    if scanner:
+        due = scanner.due_in(now)
+        if due < timeout:
+            timeout = due
+    return timeout
+
+# Meting in de kaart zetten vanaf de huidige positie; angle in servograden
+def map_reading(angle, distance):
+    grid.add_reading(pose_x, pose_y, pose_heading + angle - 90, distance)
+
+next_joystick_ms = 0
+next_event_ms = 0
+next_sample_ms = 0
+next_send_ms = 0
+next_record_flush_ms = 0
+next_plan_ms = 0
+
+# Nieuwe obstakels uit de kaart overnemen en het pad vanaf de huidige positie herstellen;
+# het pad staat daarna in planner.path[:planner.path_length]
+def update_plan():
+    planner.sync()
+    start = planner.cell_at(pose_x, pose_y)
+    if start < 0:
+        logger.warning("Buiten de kaart, geen pad")
+        return
+    if planner.replan(start) == 0:
+        logger.warning("Geen pad naar het doel")
+
+# Waarmee poll() een socket aanduidt: het object zelf op MicroPython, de fd op CPython
+def poll_key(sock):
+    try:
+        return sock.fileno()
+    except AttributeError:
+        return sock
+
+def gc_report():
+    requests = gc_stats[0] or 1
+    return "GC: {} requests, gem. {} B/request, max {} B, {} collects, gem. {} us, max {} us".format(
+        gc_stats[0], gc_stats[1] // requests, gc_stats[2], gc_stats[3],
+        gc_stats[4] // (gc_stats[3] or 1), gc_stats[5])
+
+# Log bewaren en herstarten
+def restart(reason):
+    logger.error(reason)
+    save_log()
+    machine.reset()
+
+def save_log():
+    if recorder:
+        recorder.flush()
+    if store:
+        try:
+            store.flush()
+        except OSError as e:
+            logger.error("Toestand bewaren mislukt: {}", e)
+    if LOG_FILE:
+        try:
+            logger.flush(LOG_FILE)
+        except OSError as e:
+            logger.error("Log bewaren mislukt: {}", e)
+
+# Bewaarde toestand terugzetten, met een keer lezen van het log. Nieuwe bestanden
+# (kalibratie via mpremote, WiFi-gegevens van een oudere versie) eerst overnemen
+def open_store():
+    global store, current_speed, safety_enabled
+    store = Store(STORE_FILE, STORE_MAX_BYTES, STORE_FLUSH_MS)
+    if store.take_file("odometry", ODOMETRY_FILE):
+        logger.info("Kalibratie uit {} overgenomen", ODOMETRY_FILE)
+    if store.take_file("wifi", WIFI_FILE):
+        logger.info("WiFi-gegevens uit {} overgenomen", WIFI_FILE)
+    current_speed = store.get("speed", current_speed)
+    safety_enabled = store.get("safety", safety_enabled)
+    if store.records:
+        logger.info("Toestand hersteld: snelheid {}%, veiligheid {}", current_speed, safety_enabled)
 
 # Main programma
 def main():
-    global current_speed, safety_enabled
+    global loop_us, telemetry, recorder, grid, odom, planner, drive_server, joystick, batch, events, updater, store
+    global udpdrive, portal
+    logger.level = LOG_LEVEL
+    logger.echo_level = LOG_ECHO_LEVEL
+    logger.limit("Beweging geblokkeerd door veiligheid.", 1000)
+    logger.limit("Geen pad naar het doel", 10000)
+    profiler.enabled = PROFILE_ENABLED
+    logger.info("Robot Control starten...")
+    try:
+        open_store()
+    except OSError as e:
+        logger.error("Store: {}", e)
+        store = Store(None)
 
-    print("Robot Control starten...")
+    # Het associëren met het access point loopt op de achtergrond door
+    wlan = None
+    if WIFI_CONCURRENT:
+        wlan = start_wifi()
+        boot.mark("wifi_start")
 
     if not init_hardware():
-        print("Herstarten wegens hardware fout...")
-        machine.reset()
+        restart("Herstarten wegens hardware fout...")
+    boot.mark("hardware")
 
-    ip = connect_wifi()
-    if not ip:
-        print("Geen WiFi, herstarten...")
-        machine.reset()
+    ip = connect_wifi(wlan)
+    if ip:
+        boot.mark("wifi")
+    elif AP_FALLBACK:
+        ip = start_access_point(wlan or network.WLAN(network.STA_IF))
+        boot.mark("access_point")
+    else:
+        restart("Geen WiFi, herstarten...")
 
     try:
-        addr = socket.getaddrinfo(ip, 80)[0][-1]
-        server = socket.socket()
-        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        server.bind(addr)
-        server.listen(1)
-        print(f"Server draait op: http://{ip}")
+        server = start_server(ip)
     except Exception as e:
-        print(f"Server fout: {e}")
-        machine.reset()
+        logger.error("Server fout: {}", e)
+        restart("Herstarten wegens server fout...")
+    boot.mark("server")
+
+    if TELEMETRY_HOST or MQTT_BROKER:
+        telemetry = Telemetry()
+    if MQTT_BROKER:
+        start_mqtt()
+    elif TELEMETRY_HOST:
+        telemetry.start_udp(TELEMETRY_HOST, TELEMETRY_PORT)
+        logger.info("Telemetrie naar {}:{}", TELEMETRY_HOST, TELEMETRY_PORT)
 
+    if ODOMETRY_ENABLED:
+        odom = odometry.from_config(store.get("odometry"), robot_profile)
+
+    if MAP_ENABLED:
+        from gridmap import OccupancyGrid
+        if profiler.ENABLED:
+            profiler.wrap_method(OccupancyGrid, "add_reading", "map_update")
+        grid = OccupancyGrid(MAP_WIDTH, MAP_HEIGHT, MAP_CELL_MM, MAP_MAX_RANGE_CM)
+        logger.info("Kaart: {} bytes", len(grid.cells))
+        if PLAN_GOAL:
+            from planner import Planner
+            if profiler.ENABLED:
+                profiler.wrap_method(Planner, "replan", "plan_replan")
+            planner = Planner.for_grid(grid, PLAN_SCALE)
+            length = planner.start_incremental(planner.cell_at(pose_x, pose_y),
+                                               planner.cell_at(PLAN_GOAL[0], PLAN_GOAL[1]))
+            logger.info("Pad naar {}: {} cellen", PLAN_GOAL, length)
+
+    if RECORD_FILE:
+        recorder = Recorder(RECORD_FILE, RECORD_MAX_BYTES)
+        recorder.state(current_speed, safety_enabled)
+        logger.info("Sessie opnemen naar {}", RECORD_FILE)
+
+    poller = select.poll()
+    poller.register(server, select.POLLIN)
+    server_key = poll_key(server)
+    drive_key = None
+    if DRIVE_UDP_PORT:
+        import udpdrive
+        drive_server = udpdrive.DriveServer(DRIVE_UDP_PORT)
+        drive_server.start(ip)
+        poller.register(drive_server.sock, select.POLLIN)
+        drive_key = poll_key(drive_server.sock)
+        logger.info("Rijcommando's op UDP poort {}", DRIVE_UDP_PORT)
+    dns_key = None
+    if dns:
+        poller.register(dns.sock, select.POLLIN)
+        dns_key = poll_key(dns.sock)
+    if JOYSTICK_RATE_HZ:
+        joystick = Joystick(JOYSTICK_TIMEOUT_MS)
+    if API_ENABLED:
+        batch = scheduler.Batch(API_MAX_STEPS)
+    if EVENTS_INTERVAL_MS:
+        events = EventStream(EVENTS_MAX_CLIENTS)
+    if OTA_ENABLED:
+        # portal.parse_form leest de query van /ota/chunk
+        import portal
+        updater = ota.Updater()
+        if not ota_key():
+            logger.warning("OTA staat aan zonder OTA_KEY, elke update wordt geweigerd")
+    if ota.trial:
+        logger.info("Nieuwe versie op proef, bevestigen na de eerste ronde")
+    # ipoll() hergebruikt zijn resultaat, poll() maakt steeds een nieuwe lijst
+    ipoll = getattr(poller, "ipoll", poller.poll)
+    gc.collect()
+
+    first_response = True
     while True:
         try:
-            print("Wacht op verbinding...")
-            client, addr = server.accept()
-            print(f"Client verbonden: {addr}")
-
-            request = client.recv(1024).decode()
-            print("Request ontvangen")
-
-            if 'GET /?' in request:
-                try:
-                    params = request.split('GET /?')[1].split(' ')[0]
-                    pairs = params.split('&')
-
-                    for pair in pairs:
-                        if '=' in pair:
-                            key, value = pair.split('=', 1)
-                            if key == 'action':
-                                if value == 'toggle_safety':
-                                    safety_enabled = not safety_enabled
-                                    print(f"Safety toggled: {safety_enabled}")
-                                elif value == 'speed_up':
-                                    current_speed = min(100, current_speed + 10)
-                                    print(f"Snelheid verhoogd naar: {current_speed}%")
-                                elif value == 'speed_down':
-                                    current_speed = max(10, current_speed - 10)
-                                    print(f"Snelheid verlaagd naar: {current_speed}%")
-                                else:
-                                    print(f"Actie uitvoeren: {value}")
-                                    control_motors(value)
-                except Exception as e:
-                    print(f"Fout bij parsen: {e}")
-
-            html = create_html(current_speed, safety_enabled)
-            response = "HTTP/1.1 200 OK\r\nContent-Type: text/html\r\nConnection: close\r\n\r\n"
-            client.send(response.encode())
-            client.send(html.encode())
-            client.close()
-            print("Response verzonden")
+            for obj, event in ipoll(poll_timeout(time.ticks_ms())):
+                start = time.ticks_us()
+                if obj is server or obj == server_key:
+                    serve_client(server)
+                    if first_response:
+                        first_response = False
+                        boot.mark("first_response")
+                        logger.info("{}", boot.report())
+                    gc_idle()
+                    if GC_STATS and gc_stats[0] % GC_STATS_EVERY == 0:
+                        logger.info("{}", gc_report())
+                elif drive_key is not None and (obj is drive_server.sock or obj == drive_key):
+                    serve_drive()
+                elif dns_key is not None and (obj is dns.sock or obj == dns_key):
+                    dns.serve()
+                loop_us = time.ticks_diff(time.ticks_us(), start)
+            control_tick(time.ticks_ms())
+            # De eerste volledige ronde van een nieuwe versie is de gezondheidscheck; zonder
+            # die ronde zet boot.py na een reset de oude versie terug
+            if ota.trial:
+                ota.confirm()
+                logger.info("Update bevestigd")
 
         except KeyboardInterrupt:
-            print("Stoppen...")
+            logger.info("Stoppen...")
+            save_log()
             break
         except Exception as e:
-            print(f"Fout: {e}")
-            try:
-                client.close()
-            except:
-                pass
+            logger.error("Fout: {}", e)
 
     try:
         server.close()
+        if drive_server:
+            drive_server.close()
+        if dns:
+            dns.close()
+        if events:
+            events.close()
+        if mqtt:
+            # Bij een nette DISCONNECT stuurt de broker de will niet
+            mqtt.publish(mqtt_topic + "status", b"offline", 0, True)
+            mqtt.poll(time.ticks_ms())
+            mqtt.disconnect()
         if robot:
             robot.motors[MOTOR_LEFT].off()
             robot.motors[MOTOR_RIGHT].off()
@@ -0,0 +1,524 @@
+import errno
+import select
+import socket
+import time
+
+# A non-blocking MQTT 3.1.1 client for the control loop. umqtt.simple blocks
+# on every socket operation; this one only ever writes what the socket takes
+# and reads what has arrived, from poll().
+
+CONNECT = 0x10
+CONNACK = 0x20
+PUBLISH = 0x30
+PUBACK = 0x40
+SUBSCRIBE = 0x82
+SUBACK = 0x90
+PINGREQ = 0xC0
+PINGRESP = 0xD0
+DISCONNECT = 0xE0
+
+DISCONNECTED = 0
+CONNECTING = 1      # TCP connect in progress
+WAIT_CONNACK = 2    # CONNECT sent
+CONNECTED = 3
+
+_DUP = 0x08
+_RETAIN = 0x01
+_WOULD_BLOCK = (errno.EAGAIN, getattr(errno, "EWOULDBLOCK", errno.EAGAIN), errno.EINPROGRESS)
+
+def _length_size(length):
+    size = 1
+    while length > 127:
+        length >>= 7
+        size += 1
+    return size
+
+def encode_length(buf, pos, length):
+    """Write an MQTT remaining length at buf[pos]; returns the position after it."""
+    while True:
+        byte = length & 0x7F
+        length >>= 7
+        if length:
+            byte |= 0x80
+        buf[pos] = byte
+        pos += 1
+        if not length:
+            return pos
+
+def decode_length(buf, pos, end):
+    """(remaining length, position after it), or (-1, pos) if buf[pos:end] holds only part of it."""
+    length = 0
+    shift = 0
+    while pos < end:
+        byte = buf[pos]
+        pos += 1
+        length |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return length, pos
+        shift += 7
+        if shift > 21:
+            raise ValueError("bad remaining length")
+    return -1, pos
+
+class MQTTClient:
+    """
+    Publishes from a bounded queue and delivers subscribed messages to
+    on_message(topic, payload). publish() only queues: when the queue is
+    full the oldest message is dropped, so a slow or absent broker costs
+    messages, never loop time. poll() connects, writes what the socket
+    takes from an output buffer, reads and parses what arrived, sends
+    keepalive pings, and after a failure reconnects with exponential backoff.
+
+    QoS 1 messages go out one at a time: the next one waits for the PUBACK
+    of the previous, which is resent (with DUP) after retry_ms and after a
+    reconnect. Subscriptions are renewed on every connect. Incoming QoS 2
+    is not supported; subscribe with QoS 0 or 1.
+
+    A message is acknowledged and taken out of the input buffer whatever
+    on_message() does; an exception it raises is kept in error for the
+    caller to report, and does not end the connection.
+    """
+    def __init__(self, client_id, host, port=1883, keepalive_s=30, queue_size=16, out_size=1024,
+                 in_size=512, min_backoff_ms=500, max_backoff_ms=30000, retry_ms=2000,
+                 connect_timeout_ms=5000, will=None):
+        """
+        Args:
+            client_id (str): Unique per robot
+            host (str): Broker IP address (a name would need a blocking DNS lookup)
+            port (int): Broker port
+            keepalive_s (int): Ping interval; the broker drops the client after 1.5 times this
+            queue_size (int): Messages kept while waiting to be sent
+            out_size (int): Output buffer; a message larger than this is dropped
+            in_size (int): Input buffer; an incoming packet larger than this ends the connection
+            min_backoff_ms (int): First reconnect delay, doubled after each failure
+            max_backoff_ms (int): Longest reconnect delay
+            retry_ms (int): Resend an unacknowledged QoS 1 message after this long
+            connect_timeout_ms (int): Give up a connect (TCP plus CONNACK) after this long
+            will (tuple): (topic, payload, retain) the broker publishes if the robot vanishes
+        """
+        self.client_id = client_id.encode()
+        self.host = host
+        self.port = port
+        self.keepalive_s = keepalive_s
+        self.min_backoff_ms = min_backoff_ms
+        self.max_backoff_ms = max_backoff_ms
+        self.retry_ms = retry_ms
+        self.connect_timeout_ms = connect_timeout_ms
+        self.will = None
+        if will:
+            self.will = (will[0].encode(), bytes(will[1]), will[2])
+        self.on_message = None
+        self.on_connect = None
+        self.subscriptions = []
+        # Last exception raised by on_message, until the caller clears it
+        self.error = None
+
+        self.q_topic = [None] * queue_size
+        self.q_payload = [None] * queue_size
+        self.q_flags = [0] * queue_size
+        self.q_head = 0
+        self.q_len = 0
+
+        self.out = bytearray(out_size)
+        self.out_view = memoryview(self.out)
+        self.out_len = 0
+        self.inbuf = bytearray(in_size)
+        self.in_view = memoryview(self.inbuf)
+        self.in_len = 0
+
+        self.sock = None
+        self.poller = None
+        self.state = DISCONNECTED
+        self.next_attempt = 0
+        self.backoff_ms = min_backoff_ms
+        self.state_since = 0
+        self.last_out = 0
+        self.last_in = 0
+        self.ping_sent = False
+        self.packet_id = 0
+        # The QoS 1 message waiting for its PUBACK
+        self.inflight_id = 0
+        self.inflight_topic = None
+        self.inflight_payload = None
+        self.inflight_flags = 0
+        self.inflight_sent = 0
+
+        self.queued = 0
+        self.sent = 0
+        self.acked = 0
+        self.dropped = 0
+        self.received = 0
+        self.callback_errors = 0
+        self.connects = 0
+        self.failures = 0
+        self.retransmits = 0
+
+    def connected(self):
+        return self.state == CONNECTED
+
+    def subscribe(self, topic, qos=0):
+        """Subscribe now and after every reconnect."""
+        entry = (topic.encode(), min(qos, 1))
+        self.subscriptions.append(entry)
+        if self.state == CONNECTED:
+            self._put_subscribe(entry)
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        """
+        Queue a message; never blocks.
+
+        Args:
+            topic (str or bytes): Topic
+            payload (bytes, bytearray, memoryview or str): Copied into the queue
+            qos (int): 0 or 1
+            retain (bool): Broker keeps it for later subscribers
+
+        Returns:
+            bool: False if the queue was full and the oldest message was dropped
+        """
+        if isinstance(topic, str):
+            topic = topic.encode()
+        if isinstance(payload, str):
+            payload = payload.encode()
+        kept = True
+        size = len(self.q_topic)
+        if self.q_len == size:
+            self.q_topic[self.q_head] = None
+            self.q_payload[self.q_head] = None
+            self.q_head = (self.q_head + 1) % size
+            self.q_len -= 1
+            self.dropped += 1
+            kept = False
+        slot = (self.q_head + self.q_len) % size
+        self.q_topic[slot] = topic
+        self.q_payload[slot] = bytes(payload)
+        self.q_flags[slot] = (2 if qos else 0) | (_RETAIN if retain else 0)
+        self.q_len += 1
+        self.queued += 1
+        return kept
+
+    def poll(self, now):
+        """
+        Do whatever the connection needs without blocking; call it every loop.
+
+        Args:
+            now (int): ticks_ms()
+        """
+        try:
+            if self.state == DISCONNECTED:
+                if time.ticks_diff(now, self.next_attempt) >= 0:
+                    self._open(now)
+                return
+            if self.state == CONNECTING:
+                if not self._writable():
+                    if time.ticks_diff(now, self.state_since) >= self.connect_timeout_ms:
+                        self._fail(now)
+                    return
+                self._put_connect()
+                self.state = WAIT_CONNACK
+            self._flush(now)
+            self._read(now)
+            if self.state == WAIT_CONNACK:
+                if time.ticks_diff(now, self.state_since) >= self.connect_timeout_ms:
+                    self._fail(now)
+                return
+            if self.state != CONNECTED:
+                return
+            self._keepalive(now)
+            self._retransmit(now)
+            self._take_queue(now)
+            self._flush(now)
+        except (OSError, ValueError):
+            self._fail(now)
+
+    def disconnect(self):
+        """Say goodbye (the broker then skips the will) and close."""
+        if self.sock is None:
+            return
+        if self.state == CONNECTED and self._room(2):
+            self._put_fixed(DISCONNECT, 0)
+            try:
+                self._flush(time.ticks_ms())
+            except OSError:
+                pass
+        self._close()
+        self.state = DISCONNECTED
+
+    # Connection
+
+    def _open(self, now):
+        self.state_since = now
+        addr = socket.getaddrinfo(self.host, self.port)[0][-1]
+        self.sock = socket.socket()
+        self.sock.setblocking(False)
+        try:
+            self.sock.connect(addr)
+        except OSError as e:
+            if e.args[0] not in _WOULD_BLOCK:
+                raise
+        self.poller = select.poll()
+        self.poller.register(self.sock, select.POLLOUT)
+        self.out_len = 0
+        self.in_len = 0
+        self.ping_sent = False
+        self.state = CONNECTING
+
+    def _writable(self):
+        for _, event in self.poller.poll(0):
+            if event & (select.POLLERR | select.POLLHUP):
+                raise OSError(errno.ECONNREFUSED)
+            if event & select.POLLOUT:
+                return True
+        return False
+
+    def _connected(self, now):
+        self.state = CONNECTED
+        self.connects += 1
+        self.backoff_ms = self.min_backoff_ms
+        self.last_in = now
+        for entry in self.subscriptions:
+            self._put_subscribe(entry)
+        # A QoS 1 message the broker may not have seen is resent first
+        if self.inflight_id:
+            self.inflight_flags |= _DUP
+            self._put_publish(self.inflight_topic, self.inflight_payload, self.inflight_flags,
+                              self.inflight_id)
+            self.inflight_sent = now
+            self.retransmits += 1
+        if self.on_connect:
+            self.on_connect()
+
+    def _fail(self, now):
+        self._close()
+        self.failures += 1
+        self.state = DISCONNECTED
+        self.next_attempt = time.ticks_add(now, self.backoff_ms)
+        self.backoff_ms = min(self.backoff_ms * 2, self.max_backoff_ms)
+
+    def _close(self):
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+        self.sock = None
+        self.poller = None
+
+    def _keepalive(self, now):
+        idle_ms = time.ticks_diff(now, self.last_in)
+        if idle_ms >= self.keepalive_s * 1500:
+            raise OSError(errno.ETIMEDOUT)
+        if not self.ping_sent and (idle_ms >= self.keepalive_s * 500
+                                   or time.ticks_diff(now, self.last_out) >= self.keepalive_s * 1000):
+            if self._room(2):
+                self._put_fixed(PINGREQ, 0)
+                self.ping_sent = True
+
+    def _retransmit(self, now):
+        if self.inflight_id and time.ticks_diff(now, self.inflight_sent) >= self.retry_ms:
+            size = self._publish_size(self.inflight_topic, self.inflight_payload, 2)
+            if self._room(size):
+                self.inflight_flags |= _DUP
+                self._put_publish(self.inflight_topic, self.inflight_payload, self.inflight_flags,
+                                  self.inflight_id)
+                self.inflight_sent = now
+                self.retransmits += 1
+
+    def _take_queue(self, now):
+        """Move queued messages into the output buffer while they fit."""
+        size = len(self.q_topic)
+        while self.q_len:
+            i = self.q_head
+            topic = self.q_topic[i]
+            payload = self.q_payload[i]
+            flags = self.q_flags[i]
+            qos1 = flags & 2
+            if qos1 and self.inflight_id:
+                return
+            packet = self._publish_size(topic, payload, flags)
+            if packet > len(self.out):
+                self.dropped += 1
+            elif not self._room(packet):
+                return
+            elif qos1:
+                self.packet_id = self.packet_id % 0xFFFF + 1
+                self.inflight_id = self.packet_id
+                self.inflight_topic = topic
+                self.inflight_payload = payload
+                self.inflight_flags = flags
+                self.inflight_sent = now
+                self._put_publish(topic, payload, flags, self.inflight_id)
+            else:
+                self._put_publish(topic, payload, flags, 0)
+            self.q_topic[i] = None
+            self.q_payload[i] = None
+            self.q_head = (i + 1) % size
+            self.q_len -= 1
+
+    # Output buffer
+
+    def _room(self, size):
+        return self.out_len + size <= len(self.out)
+
+    def _put_fixed(self, kind, length):
+        self.out[self.out_len] = kind
+        self.out_len = encode_length(self.out, self.out_len + 1, length)
+
+    def _put(self, data):
+        end = self.out_len + len(data)
+        self.out_view[self.out_len:end] = data
+        self.out_len = end
+
+    def _put_string(self, data):
+        self.out[self.out_len] = len(data) >> 8
+        self.out[self.out_len + 1] = len(data) & 0xFF
+        self.out_len += 2
+        self._put(data)
+
+    def _put_id(self, packet_id):
+        self.out[self.out_len] = packet_id >> 8
+        self.out[self.out_len + 1] = packet_id & 0xFF
+        self.out_len += 2
+
+    def _publish_size(self, topic, payload, flags):
+        length = 2 + len(topic) + (2 if flags & 6 else 0) + len(payload)
+        return 1 + _length_size(length) + length
+
+    def _put_publish(self, topic, payload, flags, packet_id):
+        length = 2 + len(topic) + (2 if packet_id else 0) + len(payload)
+        self._put_fixed(PUBLISH | flags, length)
+        self._put_string(topic)
+        if packet_id:
+            self._put_id(packet_id)
+        self._put(payload)
+        self.sent += 1
+
+    def _put_connect(self):
+        flags = 0x02    # clean session
+        length = 10 + 2 + len(self.client_id)
+        if self.will:
+            topic, payload, retain = self.will
+            flags |= 0x04 | (0x20 if retain else 0)
+            length += 4 + len(topic) + len(payload)
+        self._put_fixed(CONNECT, length)
+        self._put_string(b"MQTT")
+        self._put(bytes((4, flags, self.keepalive_s >> 8, self.keepalive_s & 0xFF)))
+        self._put_string(self.client_id)
+        if self.will:
+            self._put_string(self.will[0])
+            self._put_string(self.will[1])
+
+    def _put_subscribe(self, entry):
+        topic, qos = entry
+        if not self._room(7 + len(topic)):
+            raise OSError(errno.ENOBUFS)
+        self.packet_id = self.packet_id % 0xFFFF + 1
+        self._put_fixed(SUBSCRIBE, 5 + len(topic))
+        self._put_id(self.packet_id)
+        self._put_string(topic)
+        self._put(bytes((qos,)))
+
+    def _flush(self, now):
+        if not self.out_len:
+            return
+        try:
+            try:
+                written = self.sock.write(self.out_view[:self.out_len])
+            except AttributeError:
+                written = self.sock.send(self.out_view[:self.out_len])
+        except OSError as e:
+            if e.args[0] in _WOULD_BLOCK:
+                return
+            raise
+        if not written:
+            return
+        self.last_out = now
+        remaining = self.out_len - written
+        if remaining:
+            self.out_view[:remaining] = self.out_view[written:self.out_len]
+        self.out_len = remaining
+
+    # Input
+
+    def _read(self, now):
+        while True:
+            received = 0
+            if self.in_len < len(self.inbuf):
+                received = self._receive()
+            if received:
+                self.in_len += received
+                self.last_in = now
+            self._parse(now)
+            if not received:
+                return
+
+    def _receive(self):
+        """Bytes read into inbuf, 0 if nothing is waiting."""
+        try:
+            try:
+                received = self.sock.readinto(self.in_view[self.in_len:])
+            except AttributeError:
+                received = self.sock.recv_into(self.in_view[self.in_len:])
+        except OSError as e:
+            if e.args[0] in _WOULD_BLOCK:
+                return 0
+            raise
+        # MicroPython returns None when nothing is waiting, 0 when the broker closed
+        if received is None:
+            return 0
+        if received == 0:
+            raise OSError(errno.ECONNRESET)
+        return received
+
+    def _parse(self, now):
+        """Handle every complete packet in inbuf and keep the rest."""
+        pos = 0
+        while pos < self.in_len:
+            length, body = decode_length(self.inbuf, pos + 1, self.in_len)
+            if length < 0:
+                break
+            if body - pos + length > len(self.inbuf):
+                raise OSError(errno.EMSGSIZE)
+            if body + length > self.in_len or not self._handle(self.inbuf[pos], body, length, now):
+                break
+            pos = body + length
+        if pos:
+            remaining = self.in_len - pos
+            self.in_view[:remaining] = self.in_view[pos:self.in_len]
+            self.in_len = remaining
+
+    def _handle(self, kind, body, length, now):
+        """Act on one packet; False to leave it for the next poll (no room to answer)."""
+        buf = self.inbuf
+        packet = kind & 0xF0
+        if packet == PUBLISH:
+            qos = (kind >> 1) & 3
+            if qos and not self._room(4):
+                return False
+            topic_len = (buf[body] << 8) | buf[body + 1]
+            topic_end = body + 2 + topic_len
+            payload_start = topic_end + (2 if qos else 0)
+            self.received += 1
+            if qos:
+                self._put_fixed(PUBACK, 2)
+                self._put(buf[topic_end:topic_end + 2])
+            if self.on_message:
+                # Raising out of here would leave the packet in inbuf, to be handled again every poll
+                try:
+                    self.on_message(bytes(buf[body + 2:topic_end]), bytes(buf[payload_start:body + length]))
+                except Exception as e:
+                    self.callback_errors += 1
+                    self.error = e
+        elif packet == PUBACK:
+            if (buf[body] << 8) | buf[body + 1] == self.inflight_id:
+                self.inflight_id = 0
+                self.inflight_topic = None
+                self.inflight_payload = None
+                self.acked += 1
+        elif packet == CONNACK:
+            if buf[body + 1] != 0:
+                raise OSError(errno.ECONNREFUSED)
+            self._connected(now)
+        elif packet == PINGRESP:
+            self.ping_sent = False
+        return True
@@ -0,0 +1,217 @@
+import json
+import time
+from array import array
+from gridmap import SIN, COS, TRIG_SHIFT
+
+# PWM frequency bands of the default profile: (first speed of the band, Hz).
+# A motor responds differently in each band, so calibration points are
+# only interpolated within a band. With a robot profile the bands are the
+# runs of equal Hz in the motor's frequency table, and points are
+# interpolated by the duty the profile gives each speed, which follows a
+# deadband or trim.
+BANDS = ((0, 20), (15, 50), (20, 100))
+
+# (speed %, mm/s) for the SMARS N20 motors on a charged battery; rough
+# figures, fit your own with host/calibrate_odometry.py
+DEFAULT_POINTS = ((0, 0), (10, 15), (14, 25), (15, 30), (19, 45), (20, 40), (50, 105), (100, 200))
+# Distance between the track centres in mm
+DEFAULT_TRACK_MM = 80
+
+# Headings are kept in 1/100 degree, positions in um, so everything fits
+# MicroPython's small ints for a few metres around the start
+CENTIDEGREES = 36000
+CD_PER_RADIAN = 5730
+MAX_STEP_MS = 50
+
+def band_of(speed, frequencies=None):
+    """
+    PWM band a speed falls in: its index in BANDS, or with a profile's
+    frequency table the first speed of its run of equal Hz.
+    """
+    if frequencies is not None:
+        while speed > 0 and frequencies[speed - 1] == frequencies[speed]:
+            speed -= 1
+        return speed
+    band = 0
+    for i in range(len(BANDS)):
+        if speed >= BANDS[i][0]:
+            band = i
+    return band
+
+def build_table(points, tables=None):
+    """
+    Velocity per whole speed percentage from calibration points.
+
+    Args:
+        points (list): (speed %, mm/s) pairs, any order
+        tables (tuple): (frequencies, duties) of the motor from the robot
+            profile (Profile.motor_tables()); None for the default bands
+
+    Returns:
+        array: 101 velocities in mm/s, index is the speed
+    """
+    points = sorted(points)
+    frequencies = duties = None
+    if tables:
+        frequencies, duties = tables
+    table = array("h", [0] * 101)
+    for speed in range(101):
+        band = band_of(speed, frequencies)
+        own = [p for p in points if band_of(p[0], frequencies) == band]
+        if duties is None:
+            value = _interpolate(own or points, speed)
+        else:
+            value = _interpolate(sorted((_duty_of(duties, s), v) for s, v in own or points), duties[speed])
+        table[speed] = int(round(value))
+    table[0] = 0
+    return table
+
+def _duty_of(duties, speed):
+    """Duty of a speed; speed 0 where the duty line starts (the deadband), not the 0 that stops the motor."""
+    if speed:
+        return duties[speed]
+    return 2 * duties[1] - duties[2]
+
+def _interpolate(points, speed):
+    if len(points) == 1:
+        s, v = points[0]
+        return v * speed / s if s else v
+    lower, upper = points[0], points[1]
+    for i in range(1, len(points)):
+        lower, upper = points[i - 1], points[i]
+        if speed <= upper[0]:
+            break
+    if upper[0] == lower[0]:
+        return upper[1]
+    return lower[1] + (upper[1] - lower[1]) * (speed - lower[0]) / (upper[0] - lower[0])
+
+class Odometry:
+    """
+    Dead reckoning from the commanded motor outputs.
+    update() reads the direction and speed each SimplePWMMotor remembers
+    from its last on(), looks the speed up in a calibrated velocity table
+    and integrates the differential-drive motion with integer maths only.
+    Pose is x/y in mm and heading in degrees, 0 along +x at the start and
+    counter-clockwise positive, the frame the occupancy grid uses.
+    """
+    def __init__(self, points=DEFAULT_POINTS, track_mm=DEFAULT_TRACK_MM, forward=("r", "r"),
+                 left_points=None, right_points=None, left_tables=None, right_tables=None):
+        """
+        Args:
+            points (list): (speed %, mm/s) calibration for both motors
+            track_mm (int): Distance between the track centres
+            forward (tuple): (left, right) motor directions that drive the robot
+                forward, Profile.forward; one letter for both sides ("r" on the SMARS)
+            left_points (list): Separate calibration for the left motor
+            right_points (list): Separate calibration for the right motor
+            left_tables (tuple): (frequencies, duties) the profile gives the left motor
+            right_tables (tuple): The same for the right motor
+        """
+        self.left_table = build_table(left_points or points, left_tables)
+        self.right_table = build_table(right_points or points, right_tables)
+        self.track_um = track_mm * 1000
+        if isinstance(forward, str):
+            forward = (forward, forward)
+        self.left_forward = forward[0]
+        self.right_forward = forward[1]
+        self.last_ms = None
+        self.reset()
+
+    def reset(self, x_mm=0, y_mm=0, heading=0):
+        self.x_um = x_mm * 1000
+        self.y_um = y_mm * 1000
+        self.heading_cd = (heading * 100) % CENTIDEGREES
+
+    def velocity(self, table, motor, forward):
+        """Signed mm/s of one motor, positive is forward."""
+        if motor.direction == "-":
+            return 0
+        v = table[int(motor.speed)]
+        return v if motor.direction == forward else -v
+
+    def update(self, left, right, now):
+        """
+        Integrate the motion since the previous update.
+
+        Args:
+            left (SimplePWMMotor): Left motor
+            right (SimplePWMMotor): Right motor
+            now (int): time.ticks_ms()
+        """
+        if self.last_ms is None:
+            self.last_ms = now
+            return
+        dt = time.ticks_diff(now, self.last_ms)
+        self.last_ms = now
+        left_v = self.velocity(self.left_table, left, self.left_forward)
+        right_v = self.velocity(self.right_table, right, self.right_forward)
+        if left_v == 0 and right_v == 0:
+            return
+        # Long gaps (a slow request) are integrated in short steps, which
+        # keeps the arc accurate and the products within small ints
+        while dt > 0:
+            step = dt if dt < MAX_STEP_MS else MAX_STEP_MS
+            dt -= step
+            # mm/s * ms = um
+            self._move(left_v * step, right_v * step)
+
+    def _move(self, left_um, right_um):
+        turn_cd = (right_um - left_um) * CD_PER_RADIAN // self.track_um
+        distance_um = (left_um + right_um) // 2
+        # Move along the heading halfway through the turn
+        degree = ((self.heading_cd + turn_cd // 2) % CENTIDEGREES) // 100
+        self.x_um += (distance_um * COS[degree]) >> TRIG_SHIFT
+        self.y_um += (distance_um * SIN[degree]) >> TRIG_SHIFT
+        self.heading_cd = (self.heading_cd + turn_cd) % CENTIDEGREES
+
+    def x_mm(self):
+        return self.x_um // 1000
+
+    def y_mm(self):
+        return self.y_um // 1000
+
+    def heading(self):
+        """Heading in whole degrees, 0 - 359."""
+        return self.heading_cd // 100
+
+def load(path, profile=None):
+    """
+    Odometry with the calibration written by host/calibrate_odometry.py.
+
+    Args:
+        path (str): JSON file with "points" and optionally "track_mm",
+            "forward", "left_points" and "right_points"
+        profile (Profile): Robot profile, see from_config()
+
+    Returns:
+        Odometry: Calibrated odometry, or the defaults if the file is missing
+    """
+    try:
+        with open(path) as f:
+            config = json.load(f)
+    except OSError:
+        config = None
+    return from_config(config, profile)
+
+def from_config(config, profile=None):
+    """
+    Odometry from a calibration as load() reads it from a file.
+
+    Args:
+        config (dict): The calibration, or None for the defaults
+        profile (Profile): Robot profile the motors are driven with: its drive
+            motors, forward directions and their frequency and duty tables.
+            Without it the calibration's "forward" and the default bands
+    """
+    if not config:
+        config = {}
+    forward = config.get("forward", "r")
+    left_tables = right_tables = None
+    if profile:
+        forward = profile.forward
+        tables = profile.motor_tables()
+        left_tables = tables[profile.left]
+        right_tables = tables[profile.right]
+    return Odometry(config.get("points", DEFAULT_POINTS), config.get("track_mm", DEFAULT_TRACK_MM),
+                    forward, config.get("left_points"), config.get("right_points"),
+                    left_tables, right_tables)
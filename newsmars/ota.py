@@ -0,0 +1,338 @@
+import binascii
+import hashlib
+import json
+import machine
+import os
+
+# Over-the-air update. New files are uploaded in chunks to STAGING_DIR, each
+# appended straight to flash, and checked against the SHA-256 given when the
+# update began. commit() swaps them in with a journal in STATE_FILE; boot.py
+# calls startup() before main.py runs, which finishes an interrupted swap and
+# puts the robot on trial: if main does not call confirm() within
+# HEALTH_TIMEOUT_MS the robot resets, and the next boot puts the old files back.
+#
+# STATE_FILE holds {"state": "swap" | "trial" | "rollback", "files": [...],
+# "added": [...], "boots": n}. "added" are the files that did not exist before;
+# a rollback removes them. The old version of the other files waits in BACKUP_DIR.
+#
+# Only a sender with the shared key may begin, send chunks or commit: each
+# request carries sign(key, nonce + " " + message), where the nonce is drawn
+# at every boot and shown in status(), so a request seen on the air cannot be
+# replayed after the robot restarts. The chunks themselves are covered by the
+# SHA-256s in the signed begin.
+
+STAGING_DIR = "ota_new"
+BACKUP_DIR = "ota_old"
+STATE_FILE = "ota_state.json"
+MANIFEST = "ota_files.json"
+# The recovery path itself is never replaced over the air; ota_* are the update's own files
+PROTECTED = ("boot.py", "ota.py", "ota.mpy")
+HEALTH_TIMEOUT_MS = 90000
+# Boots the new version gets to reach confirm() before it is rolled back
+TRIAL_BOOTS = 1
+MAX_NAME = 32
+
+# True from startup() until confirm() while a new version is on trial
+trial = False
+# What happened to the last update at this boot: None, "trial", "confirmed" or "rolled back"
+outcome = None
+_timer = None
+_buf = bytearray(512)
+
+def _size(path):
+    """Size of a file, -1 if it does not exist."""
+    try:
+        return os.stat(path)[6]
+    except OSError:
+        return -1
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+def _clear(directory):
+    """Create directory, or empty it if it exists."""
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        os.mkdir(directory)
+        return
+    for name in names:
+        os.remove(directory + "/" + name)
+
+def _load(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _save(path, value):
+    # Renamed over the old file, so a reset leaves either the old or the new contents
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(value, f)
+    os.rename(tmp, path)
+
+def sha256(path):
+    """SHA-256 of a file as lowercase hex, read in pieces of _buf."""
+    h = hashlib.sha256()
+    view = memoryview(_buf)
+    with open(path, "rb") as f:
+        while True:
+            n = f.readinto(_buf)
+            if not n:
+                break
+            h.update(view[:n])
+    return binascii.hexlify(h.digest()).decode()
+
+def sign(key, message):
+    """
+    HMAC-SHA256 of message with key, as lowercase hex. MicroPython has no
+    hmac module, so it is built from hashlib with a 64 byte block.
+
+    Args:
+        key (str): The shared key
+        message (bytes): What is signed
+    """
+    key = key.encode()
+    if len(key) > 64:
+        key = hashlib.sha256(key).digest()
+    key = key + bytes(64 - len(key))
+    inner = hashlib.sha256(bytes(b ^ 0x36 for b in key))
+    inner.update(message)
+    outer = hashlib.sha256(bytes(b ^ 0x5C for b in key))
+    outer.update(inner.digest())
+    return binascii.hexlify(outer.digest()).decode()
+
+def check_name(name):
+    if (not isinstance(name, str) or not 0 < len(name) <= MAX_NAME or "/" in name
+            or name.startswith(".") or name.startswith("ota_") or name in PROTECTED):
+        raise ValueError("bad file name: {}".format(name))
+
+class Updater:
+    """
+    Receives the files of an update into STAGING_DIR. Every request only
+    touches flash, never holds more than a chunk in RAM and can be repeated,
+    so an interrupted transfer resumes where the staged file ends, even
+    after a reset.
+    """
+    def __init__(self):
+        self.files = {}
+        self.file = None
+        self.name = None
+        self.left = 0
+        self.nonce = binascii.hexlify(os.urandom(8)).decode()
+        manifest = _load(MANIFEST)
+        if manifest:
+            self.files = manifest
+
+    def begin(self, files):
+        """
+        Start an update, or continue it if files is the update already staged.
+
+        Args:
+            files (dict): {name: {"size": bytes, "sha256": hex}} for every file
+        """
+        if not isinstance(files, dict) or not files:
+            raise ValueError("expected files")
+        wanted = {}
+        total = 0
+        for name, info in files.items():
+            check_name(name)
+            size = info["size"]
+            digest = info["sha256"]
+            if not isinstance(size, int) or size < 0 or not isinstance(digest, str) or len(digest) != 64:
+                raise ValueError("bad size or sha256 for {}".format(name))
+            wanted[name] = {"size": size, "sha256": digest.lower()}
+            total += size
+        if _load(STATE_FILE):
+            return "previous update not confirmed"
+        if wanted == self.files:
+            return self.status()
+        self.close()
+        self.files = {}
+        _remove(MANIFEST)
+        _clear(STAGING_DIR)
+        stat = os.statvfs("/")
+        if total > stat[0] * stat[4]:
+            return "not enough space"
+        _save(MANIFEST, wanted)
+        self.files = wanted
+        return self.status()
+
+    def status(self):
+        """Received bytes and expected size of every file, whether it is complete, the outcome of the last update and the nonce."""
+        files = {}
+        for name, info in self.files.items():
+            received = max(_size(STAGING_DIR + "/" + name), 0)
+            files[name] = {"received": received, "size": info["size"]}
+        return {"files": files, "complete": self.complete(), "update": outcome, "nonce": self.nonce}
+
+    def allowed(self, key, auth, message):
+        """
+        Whether auth is sign(key, nonce + " " + message). Without a key
+        nothing is allowed.
+
+        Args:
+            key (str): The shared key, None if none is set
+            auth (str): The signature the request carries
+            message (bytes): What the sender signed besides the nonce
+        """
+        if not key or not isinstance(auth, str):
+            return False
+        expected = sign(key, self.nonce.encode() + b" " + message)
+        # Every character is compared, so the time taken does not tell how much matched
+        diff = len(expected) ^ len(auth)
+        for a, b in zip(expected, auth):
+            diff |= ord(a) ^ ord(b)
+        return diff == 0
+
+    def complete(self):
+        if not self.files:
+            return False
+        for name, info in self.files.items():
+            if _size(STAGING_DIR + "/" + name) != info["size"]:
+                return False
+        return True
+
+    def open(self, name, offset):
+        """
+        Start receiving a chunk of name at offset, which must be where the
+        staged file ends; write() appends to it and close() finishes it.
+        Returns None, or an error string when offset is wrong.
+        """
+        self.close()
+        if name not in self.files:
+            raise ValueError("not in the update: {}".format(name))
+        staged = max(_size(STAGING_DIR + "/" + name), 0)
+        if offset != staged:
+            return "expected offset {}".format(staged)
+        self.name = name
+        self.left = self.files[name]["size"] - staged
+        self.file = open(STAGING_DIR + "/" + name, "ab")
+        return None
+
+    def write(self, data):
+        """Append data to the open file; False once it has all its bytes."""
+        if len(data) > self.left:
+            raise ValueError("more than {} bytes".format(self.files[self.name]["size"]))
+        self.file.write(data)
+        self.left -= len(data)
+        return self.left > 0
+
+    def close(self):
+        """
+        Close the open file. A complete file is checked against its SHA-256
+        and removed if it does not match, so it is sent again.
+
+        Returns:
+            dict: {"file", "received", "size"} of the file, None if none was open
+        """
+        if self.file is None:
+            return None
+        self.file.close()
+        self.file = None
+        name = self.name
+        path = STAGING_DIR + "/" + name
+        size = self.files[name]["size"]
+        if _size(path) == size and sha256(path) != self.files[name]["sha256"]:
+            os.remove(path)
+            raise ValueError("sha256 mismatch: {}".format(name))
+        return {"file": name, "received": max(_size(path), 0), "size": size}
+
+    def commit(self):
+        """
+        Check every staged file and swap the update in. The new files take
+        effect at the next boot, which is the trial.
+        """
+        self.close()
+        if not self.complete():
+            return "update incomplete"
+        for name, info in self.files.items():
+            path = STAGING_DIR + "/" + name
+            if sha256(path) != info["sha256"]:
+                os.remove(path)
+                return "sha256 mismatch: {}".format(name)
+        if _load(STATE_FILE):
+            return "previous update not confirmed"
+        _clear(BACKUP_DIR)
+        names = sorted(self.files)
+        added = [name for name in names if _size(name) < 0]
+        # From here on the update wins: a reset finishes the swap at the next boot
+        state = {"state": "swap", "files": names, "added": added, "boots": 0}
+        _save(STATE_FILE, state)
+        swap(state)
+        self.files = {}
+        return {"committed": names}
+
+def swap(state):
+    """Move the staged files in and the old ones to BACKUP_DIR; every step can be repeated."""
+    for name in state["files"]:
+        staged = STAGING_DIR + "/" + name
+        if _size(staged) < 0:
+            continue
+        backup = BACKUP_DIR + "/" + name
+        if name not in state["added"] and _size(backup) < 0 and _size(name) >= 0:
+            os.rename(name, backup)
+        os.rename(staged, name)
+    state["state"] = "trial"
+    _save(STATE_FILE, state)
+    _remove(MANIFEST)
+
+def rollback(state):
+    """Put the old files back and remove the added ones; every step can be repeated."""
+    if state["state"] != "rollback":
+        state["state"] = "rollback"
+        _save(STATE_FILE, state)
+    for name in state["files"]:
+        backup = BACKUP_DIR + "/" + name
+        if name in state["added"]:
+            _remove(name)
+        elif _size(backup) >= 0:
+            os.rename(backup, name)
+    os.remove(STATE_FILE)
+
+def startup():
+    """
+    From boot.py, before main.py is imported: finish an interrupted swap or
+    rollback and start the trial of a new version.
+
+    Returns:
+        str: None, "trial" or "rolled back"
+    """
+    global trial, outcome, _timer
+    state = _load(STATE_FILE)
+    if not state:
+        return None
+    if state["state"] == "swap":
+        swap(state)
+    if state["state"] == "rollback" or state["boots"] >= TRIAL_BOOTS:
+        rollback(state)
+        outcome = "rolled back"
+        return outcome
+    state["boots"] += 1
+    _save(STATE_FILE, state)
+    trial = True
+    outcome = "trial"
+    _timer = machine.Timer(mode=machine.Timer.ONE_SHOT, period=HEALTH_TIMEOUT_MS, callback=_expired)
+    return outcome
+
+def _expired(timer):
+    machine.reset()
+
+def confirm():
+    """The new version works: keep it. Called by main once it is up; False if nothing was on trial."""
+    global trial, outcome, _timer
+    if _timer:
+        _timer.deinit()
+        _timer = None
+    trial = False
+    if not _load(STATE_FILE):
+        return False
+    os.remove(STATE_FILE)
+    outcome = "confirmed"
+    _clear(BACKUP_DIR)
+    return True
@@ -0,0 +1,452 @@
+from array import array
+from gridmap import BLOCKED
+
+# Cost of a straight and a diagonal step; the octile heuristic below is
+# consistent with these
+STRAIGHT = 10
+DIAGONAL = 14
+# g/rhs value of cells without a known path; sums are clamped to it before
+# they are stored, so a path costing that much counts as none
+INF = 0xFFFF
+# Heap position of cells that are not queued
+NOT_QUEUED = 0xFFFF
+
+_DX = (1, 1, 0, -1, -1, -1, 0, 1)
+_DY = (0, 1, 1, 1, 0, -1, -1, -1)
+_COST = (STRAIGHT, DIAGONAL, STRAIGHT, DIAGONAL, STRAIGHT, DIAGONAL, STRAIGHT, DIAGONAL)
+
+class Heap:
+    """
+    Binary min-heap of cell indexes with a two-part key, in preallocated
+    arrays. pos[] maps every cell to its place in the heap, so a queued
+    cell's key can be changed or the cell removed in O(log n).
+    """
+    def __init__(self, capacity):
+        self.cells = array("H", [0] * capacity)
+        self.k1 = array("i", [0] * capacity)
+        self.k2 = array("H", [0] * capacity)
+        self.pos = array("H", [NOT_QUEUED] * capacity)
+        self.size = 0
+
+    def clear(self):
+        for i in range(self.size):
+            self.pos[self.cells[i]] = NOT_QUEUED
+        self.size = 0
+
+    def _less(self, i, j):
+        return self.k1[i] < self.k1[j] or (self.k1[i] == self.k1[j] and self.k2[i] < self.k2[j])
+
+    def _swap(self, i, j):
+        cells = self.cells
+        ci = cells[i]
+        cj = cells[j]
+        cells[i] = cj
+        cells[j] = ci
+        self.pos[cj] = i
+        self.pos[ci] = j
+        k = self.k1[i]
+        self.k1[i] = self.k1[j]
+        self.k1[j] = k
+        k = self.k2[i]
+        self.k2[i] = self.k2[j]
+        self.k2[j] = k
+
+    def _up(self, i):
+        while i > 0:
+            parent = (i - 1) >> 1
+            if not self._less(i, parent):
+                break
+            self._swap(i, parent)
+            i = parent
+
+    def _down(self, i):
+        size = self.size
+        while True:
+            child = 2 * i + 1
+            if child >= size:
+                break
+            if child + 1 < size and self._less(child + 1, child):
+                child += 1
+            if not self._less(child, i):
+                break
+            self._swap(i, child)
+            i = child
+
+    def update(self, cell, k1, k2):
+        """Queue a cell, or change its key if it is queued already."""
+        i = self.pos[cell]
+        if i == NOT_QUEUED:
+            i = self.size
+            self.size += 1
+            self.cells[i] = cell
+            self.pos[cell] = i
+        self.k1[i] = k1
+        self.k2[i] = k2
+        self._up(i)
+        self._down(self.pos[cell])
+
+    def remove(self, cell):
+        i = self.pos[cell]
+        if i == NOT_QUEUED:
+            return
+        last = self.size - 1
+        moved = self.cells[last]
+        if i != last:
+            self._swap(i, last)
+        self.size = last
+        self.pos[cell] = NOT_QUEUED
+        if i != last:
+            self._up(i)
+            self._down(self.pos[moved])
+
+    def pop(self):
+        cell = self.cells[0]
+        self.remove(cell)
+        return cell
+
+class Planner:
+    """
+    8-connected grid planner with A* for one-off paths and D* Lite for a
+    path that is repaired as cells change. Every per-cell array is
+    allocated up front (about 17 bytes per cell), searches allocate
+    nothing. Diagonal steps may not cut the corner of a blocked cell.
+    Cells are indexes y * width + x.
+    """
+    def __init__(self, width, height):
+        """
+        Args:
+            width (int): Cells along x
+            height (int): Cells along y; width * height must stay below 65535
+        """
+        n = width * height
+        self.width = width
+        self.height = height
+        self.blocked = bytearray(n)
+        self.g = array("H", [INF] * n)
+        self.rhs = array("H", [INF] * n)
+        self.heap = Heap(n)
+        self.path = array("H", [0] * n)
+        self.path_length = 0
+        self.expanded = 0
+        # D* Lite state
+        self.goal = -1
+        self.start = -1
+        self.last = -1
+        self.km = 0
+        self.grid = None
+        self.scale = 1
+
+    @classmethod
+    def for_grid(cls, grid, scale=2):
+        """
+        Planner over an OccupancyGrid, with scale x scale map cells per planner cell.
+        """
+        planner = cls(grid.width // scale, grid.height // scale)
+        planner.grid = grid
+        planner.scale = scale
+        planner.sync()
+        return planner
+
+    def cell(self, x, y):
+        return y * self.width + x
+
+    def cell_at(self, x_mm, y_mm):
+        """Planner cell of a world position on the map, -1 if off the map."""
+        cx, cy = self.grid.cell_of(x_mm, y_mm)
+        x = cx // self.scale
+        y = cy // self.scale
+        if 0 <= x < self.width and 0 <= y < self.height:
+            return self.cell(x, y)
+        return -1
+
+    def centre_mm(self, cell):
+        """World position of the centre of a planner cell."""
+        size = self.grid.cell_mm * self.scale
+        return (self.grid.origin_x + (cell % self.width) * size + size // 2,
+                self.grid.origin_y + (cell // self.width) * size + size // 2)
+
+    def sync(self):
+        """
+        Copy obstacles from the map, marking changed cells for replanning.
+        Only the planner cells over the map cells that crossed BLOCKED since
+        the last sync are looked at, unless the map asks for a full rescan.
+
+        Returns:
+            int: Number of planner cells that changed
+        """
+        grid = self.grid
+        changed = 0
+        count = grid.dirty_count
+        if grid.take_dirty():
+            for cell in range(self.width * self.height):
+                changed += self._sync_cell(cell)
+            return changed
+        dirty = grid.dirty
+        map_width = grid.width
+        scale = self.scale
+        for n in range(count):
+            x = dirty[n] % map_width // scale
+            y = dirty[n] // map_width // scale
+            if x < self.width and y < self.height:
+                changed += self._sync_cell(y * self.width + x)
+        return changed
+
+    def _sync_cell(self, cell):
+        """Block or free one planner cell after its map cells; 1 if it changed."""
+        cells = self.grid.cells
+        map_width = self.grid.width
+        scale = self.scale
+        row = (cell // self.width) * scale * map_width + (cell % self.width) * scale
+        blocked = 0
+        for j in range(scale):
+            for i in range(scale):
+                if cells[row + j * map_width + i] >= BLOCKED:
+                    blocked = 1
+        if self.blocked[cell] == blocked:
+            return 0
+        self.set_blocked(cell, blocked)
+        return 1
+
+    def heuristic(self, a, b):
+        dx = a % self.width - b % self.width
+        dy = a // self.width - b // self.width
+        if dx < 0:
+            dx = -dx
+        if dy < 0:
+            dy = -dy
+        if dx > dy:
+            return STRAIGHT * dx + (DIAGONAL - STRAIGHT) * dy
+        return STRAIGHT * dy + (DIAGONAL - STRAIGHT) * dx
+
+    def step_cost(self, cell, k):
+        """Cost of the step from cell in direction k, INF if it is not allowed."""
+        x = cell % self.width + _DX[k]
+        y = cell // self.width + _DY[k]
+        if x < 0 or x >= self.width or y < 0 or y >= self.height:
+            return INF
+        blocked = self.blocked
+        if blocked[cell] or blocked[y * self.width + x]:
+            return INF
+        if k & 1 and (blocked[cell + _DX[k]] or blocked[cell + _DY[k] * self.width]):
+            return INF
+        return _COST[k]
+
+    def neighbour(self, cell, k):
+        return cell + _DY[k] * self.width + _DX[k]
+
+    def neighbour_in_grid(self, cell, k):
+        x = cell % self.width + _DX[k]
+        y = cell // self.width + _DY[k]
+        if x < 0 or x >= self.width or y < 0 or y >= self.height:
+            return -1
+        return y * self.width + x
+
+    # A*
+
+    def plan(self, start, goal):
+        """
+        Shortest path with A*; the result is path[:path_length].
+
+        Returns:
+            int: Path length in cells including start and goal, 0 if there is none
+        """
+        g = self.g
+        heap = self.heap
+        for i in range(len(g)):
+            g[i] = INF
+        heap.clear()
+        self.goal = -1
+        self.expanded = 0
+        g[start] = 0
+        heap.update(start, self.heuristic(start, goal), INF)
+        while heap.size:
+            cell = heap.pop()
+            if cell == goal:
+                break
+            self.expanded += 1
+            base = g[cell]
+            for k in range(8):
+                cost = self.step_cost(cell, k)
+                if cost == INF:
+                    continue
+                nb = self.neighbour(cell, k)
+                value = min(INF, base + cost)
+                if value < g[nb]:
+                    g[nb] = value
+                    # Ties go to the deeper cell
+                    heap.update(nb, value + self.heuristic(nb, goal), INF - value)
+        return self._trace_back(start, goal)
+
+    def _trace_back(self, start, goal):
+        g = self.g
+        path = self.path
+        if g[goal] == INF:
+            self.path_length = 0
+            return 0
+        length = 0
+        cell = goal
+        path[0] = goal
+        while cell != start:
+            for k in range(8):
+                cost = self.step_cost(cell, k)
+                if cost != INF and g[self.neighbour(cell, k)] + cost == g[cell]:
+                    cell = self.neighbour(cell, k)
+                    break
+            length += 1
+            path[length] = cell
+        length += 1
+        for i in range(length // 2):
+            cell = path[i]
+            path[i] = path[length - 1 - i]
+            path[length - 1 - i] = cell
+        self.path_length = length
+        return length
+
+    # D* Lite
+
+    def _key(self, cell):
+        g = self.g[cell]
+        rhs = self.rhs[cell]
+        m = g if g < rhs else rhs
+        return m + self.heuristic(self.start, cell) + self.km, m
+
+    def _update_vertex(self, cell):
+        if cell != self.goal:
+            best = INF
+            g = self.g
+            for k in range(8):
+                cost = self.step_cost(cell, k)
+                if cost != INF:
+                    value = min(INF, g[self.neighbour(cell, k)] + cost)
+                    if value < best:
+                        best = value
+            self.rhs[cell] = best
+        self._queue(cell)
+
+    def _queue(self, cell):
+        if self.g[cell] != self.rhs[cell]:
+            k1, k2 = self._key(cell)
+            self.heap.update(cell, k1, k2)
+        else:
+            self.heap.remove(cell)
+
+    def _compute(self):
+        heap = self.heap
+        g = self.g
+        rhs = self.rhs
+        start = self.start
+        goal = self.goal
+        while heap.size:
+            k1, k2 = self._key(start)
+            if (heap.k1[0] > k1 or (heap.k1[0] == k1 and heap.k2[0] >= k2)) and rhs[start] == g[start]:
+                break
+            cell = heap.cells[0]
+            old1 = heap.k1[0]
+            old2 = heap.k2[0]
+            new1, new2 = self._key(cell)
+            self.expanded += 1
+            if old1 < new1 or (old1 == new1 and old2 < new2):
+                heap.update(cell, new1, new2)
+            elif g[cell] > rhs[cell]:
+                # Cheaper path found: neighbours can only improve through this cell
+                value = rhs[cell]
+                g[cell] = value
+                heap.remove(cell)
+                for k in range(8):
+                    cost = self.step_cost(cell, k)
+                    if cost != INF:
+                        nb = self.neighbour(cell, k)
+                        total = min(INF, value + cost)
+                        if nb != goal and total < rhs[nb]:
+                            rhs[nb] = total
+                            self._queue(nb)
+            else:
+                # Path got longer: only neighbours whose best path ran through
+                # this cell need their rhs recomputed
+                old = g[cell]
+                g[cell] = INF
+                self._update_vertex(cell)
+                for k in range(8):
+                    cost = self.step_cost(cell, k)
+                    if cost != INF:
+                        nb = self.neighbour(cell, k)
+                        if rhs[nb] == old + cost:
+                            self._update_vertex(nb)
+
+    def start_incremental(self, start, goal):
+        """
+        Plan from start to goal with D* Lite; later changes are repaired by replan().
+
+        Returns:
+            int: Path length in cells, 0 if there is none
+        """
+        g = self.g
+        rhs = self.rhs
+        for i in range(len(g)):
+            g[i] = INF
+            rhs[i] = INF
+        self.heap.clear()
+        self.goal = goal
+        self.start = start
+        self.last = start
+        self.km = 0
+        self.expanded = 0
+        rhs[goal] = 0
+        k1, k2 = self._key(goal)
+        self.heap.update(goal, k1, k2)
+        self._compute()
+        return self._follow()
+
+    def set_blocked(self, cell, blocked):
+        """Change a cell; an incremental plan is repaired on the next replan()."""
+        self.blocked[cell] = 1 if blocked else 0
+        if self.goal < 0:
+            return
+        self._update_vertex(cell)
+        for k in range(8):
+            nb = self.neighbour_in_grid(cell, k)
+            if nb >= 0:
+                self._update_vertex(nb)
+
+    def replan(self, start):
+        """
+        Repair the incremental plan after cell changes and/or a move to start.
+
+        Returns:
+            int: Path length in cells, 0 if there is none
+        """
+        self.km += self.heuristic(self.last, start)
+        self.last = start
+        self.start = start
+        self.expanded = 0
+        self._compute()
+        return self._follow()
+
+    def _follow(self):
+        g = self.g
+        path = self.path
+        cell = self.start
+        if g[cell] == INF:
+            self.path_length = 0
+            return 0
+        path[0] = cell
+        length = 1
+        while cell != self.goal and length < len(path):
+            best = INF
+            best_cell = -1
+            for k in range(8):
+                cost = self.step_cost(cell, k)
+                if cost != INF:
+                    nb = self.neighbour(cell, k)
+                    value = g[nb] + cost
+                    if value < best:
+                        best = value
+                        best_cell = nb
+            if best_cell < 0:
+                self.path_length = 0
+                return 0
+            cell = best_cell
+            path[length] = cell
+            length += 1
+        self.path_length = length
+        return length
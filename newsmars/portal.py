@@ -0,0 +1,170 @@
+import socket
+import struct
+
+# Access point mode: a captive portal to enter Wi-Fi credentials (main keeps
+# them in the store) and a DNS responder that sends every name to the robot.
+
+# Requests phones and laptops make to find out whether a network has a captive
+# portal; answering them with a redirect opens the setup page by itself
+PROBES = (b"GET /generate_204", b"GET /gen_204", b"GET /hotspot-detect.html",
+          b"GET /library/test/success.html", b"GET /connecttest.txt", b"GET /ncsi.txt",
+          b"GET /redirect", b"GET /canonical.html", b"GET /success.txt")
+
+_TYPE_A = b"\x00\x01"
+
+def check_credentials(ssid, password):
+    """What is wrong with credentials entered on the portal, or None."""
+    if not 1 <= len(ssid.encode()) <= 32:
+        return "De netwerknaam moet 1 tot 32 tekens zijn"
+    if password and not 8 <= len(password.encode()) <= 63:
+        return "Het wachtwoord moet leeg zijn of 8 tot 63 tekens"
+    return None
+
+def _unquote(value):
+    """Decode one application/x-www-form-urlencoded value."""
+    value = value.replace(b"+", b" ")
+    out = bytearray()
+    i = 0
+    while i < len(value):
+        if value[i] == 37 and i + 2 < len(value):    # %XX
+            try:
+                out.append(int(value[i + 1:i + 3], 16))
+                i += 3
+                continue
+            except ValueError:
+                pass
+        out.append(value[i])
+        i += 1
+    return bytes(out).decode()
+
+def parse_form(body):
+    """dict of the fields of a form POST body (bytes)."""
+    form = {}
+    for field in body.split(b"&"):
+        key, _, value = field.partition(b"=")
+        if key:
+            form[_unquote(key)] = _unquote(value)
+    return form
+
+def _escape(text):
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;").replace('"', "&quot;")
+
+_PAGE = """<!DOCTYPE html>
+<html>
+<head>
+<title>Robot WiFi</title>
+<meta charset="UTF-8">
+<meta name="viewport" content="width=device-width, initial-scale=1">
+<style>
+body { font-family: Arial, sans-serif; background-color: #f5f5f5; display: flex; justify-content: center; }
+.container { background: white; padding: 20px; border-radius: 15px; width: 300px; margin-top: 20px; }
+input { width: 100%; padding: 8px; margin: 6px 0 12px; box-sizing: border-box; }
+button { width: 100%; padding: 10px; }
+</style>
+</head>
+<body>
+<div class="container">
+<h2>Robot WiFi</h2>
+<p>%MESSAGE%</p>
+<form method="POST" action="/setup">
+<label>Netwerk<input name="ssid" list="networks" value="%SSID%" required></label>
+<datalist id="networks">%NETWORKS%</datalist>
+<label>Wachtwoord<input name="password" type="password"></label>
+<button type="submit">Opslaan en verbinden</button>
+</form>
+<p><a href="/">Robot besturen</a></p>
+</div>
+</body>
+</html>
+"""
+
+def setup_page(networks, message="", ssid=""):
+    """
+    The setup form.
+
+    Args:
+        networks (list): Network names for the suggestion list
+        message (str): Shown above the form
+        ssid (str): Prefilled network name
+    """
+    options = "".join('<option value="{}">'.format(_escape(n)) for n in networks)
+    return (_PAGE.replace("%MESSAGE%", _escape(message)).replace("%SSID%", _escape(ssid))
+            .replace("%NETWORKS%", options)).encode()
+
+class DNSResponder:
+    """
+    Answers every DNS query for an A record with the access point's own
+    address, so any name a phone looks up leads to the robot; other record
+    types get an empty answer. serve() answers what is waiting and never
+    blocks. Only runs in access point mode, where the allocation per query
+    (MicroPython has no recvfrom_into()) does not matter.
+    """
+    def __init__(self, ip, port=53, ttl=60):
+        """
+        Args:
+            ip (str): Address every name resolves to
+            port (int): UDP port to listen on
+            ttl (int): Seconds clients may cache the answer
+        """
+        self.port = port
+        # Answer record: pointer to the name in the question, type A, class IN, TTL, 4 bytes
+        self.record = (b"\xc0\x0c\x00\x01\x00\x01" + struct.pack(">IH", ttl, 4)
+                       + bytes(int(part) for part in ip.split(".")))
+        self.sock = None
+        self.answered = 0
+        self.ignored = 0
+
+    def start(self):
+        addr = socket.getaddrinfo("0.0.0.0", self.port)[0][-1]
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(addr)
+        self.sock.setblocking(False)
+
+    def close(self):
+        if self.sock:
+            self.sock.close()
+            self.sock = None
+
+    def serve(self):
+        """Answer every waiting query."""
+        while True:
+            try:
+                query, addr = self.sock.recvfrom(512)
+            except OSError:
+                return
+            reply = self.reply(query)
+            if reply is None:
+                self.ignored += 1
+                continue
+            try:
+                self.sock.sendto(reply, addr)
+                self.answered += 1
+            except OSError:
+                pass
+
+    def reply(self, query):
+        """
+        The response to one query, or None if it is not a standard query with one question.
+
+        Args:
+            query (bytes): The datagram as received
+        """
+        if len(query) < 17 or query[2] & 0xF8 or query[4:6] != b"\x00\x01":
+            return None
+        # The name is a row of labels ending in a zero byte; type and class follow
+        pos = 12
+        while query[pos]:
+            if query[pos] & 0xC0:
+                return None
+            pos += query[pos] + 1
+            if pos >= len(query):
+                return None
+        end = pos + 5
+        if end > len(query):
+            return None
+        answer = query[pos + 1:pos + 3] == _TYPE_A
+        # Same id, response with recursion desired copied and available, one question
+        header = (query[0:2] + bytes((0x80 | (query[2] & 0x01), 0x80)) + b"\x00\x01"
+                  + (b"\x00\x01" if answer else b"\x00\x00") + b"\x00\x00\x00\x00")
+        return header + query[12:end] + (self.record if answer else b"")
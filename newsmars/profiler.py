@@ -0,0 +1,171 @@
+import time
+from array import array
+
+# Set to False to compile the instrumentation out: timed() then returns the
+# function unchanged and Timer does nothing. Must be set before other
+# modules import profiler.
+ENABLED = True
+# Runtime switch, checked on every measurement
+enabled = True
+
+MAX_SECTIONS = 16
+# Histogram bucket upper bounds in microseconds; the last bucket is +Inf
+BUCKETS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 25000, 50000, 100000)
+_NBUCKETS = len(BUCKETS) + 1
+# Largest small int on MicroPython; bigger values would be heap allocated
+_NO_MIN = 0x3FFFFFFF
+
+# Clock, replaceable for tests
+ticks_us = time.ticks_us
+ticks_diff = time.ticks_diff
+
+names = []
+counts = array("I", [0] * MAX_SECTIONS)
+mins = array("I", [_NO_MIN] * MAX_SECTIONS)
+maxs = array("I", [0] * MAX_SECTIONS)
+# The total is split in whole seconds and the microsecond remainder so
+# neither ever leaves the small-int range
+total_s = array("I", [0] * MAX_SECTIONS)
+total_us = array("I", [0] * MAX_SECTIONS)
+histogram = array("I", [0] * (MAX_SECTIONS * _NBUCKETS))
+
+def section(name):
+    """
+    Look up or register a timed section.
+
+    Args:
+        name (str): Section name, used as the Prometheus label
+
+    Returns:
+        int: Section id for record()
+    """
+    for i in range(len(names)):
+        if names[i] == name:
+            return i
+    if len(names) == MAX_SECTIONS:
+        raise ValueError("Too many profiler sections")
+    names.append(name)
+    return len(names) - 1
+
+def record(sid, elapsed):
+    """
+    Add one measurement to a section.
+
+    Args:
+        sid (int): Section id from section()
+        elapsed (int): Duration in microseconds
+    """
+    counts[sid] += 1
+    if elapsed < mins[sid]:
+        mins[sid] = elapsed
+    if elapsed > maxs[sid]:
+        maxs[sid] = elapsed
+    us = total_us[sid] + elapsed
+    if us >= 1000000:
+        total_s[sid] += us // 1000000
+        us %= 1000000
+    total_us[sid] = us
+    bucket = 0
+    while bucket < len(BUCKETS) and elapsed > BUCKETS[bucket]:
+        bucket += 1
+    histogram[sid * _NBUCKETS + bucket] += 1
+
+def reset():
+    for i in range(MAX_SECTIONS):
+        counts[i] = maxs[i] = total_s[i] = total_us[i] = 0
+        mins[i] = _NO_MIN
+    for i in range(len(histogram)):
+        histogram[i] = 0
+
+def timed(name):
+    """
+    Decorator that times every call of a function. The wrapper takes
+    positional arguments only.
+
+    Args:
+        name (str): Section name
+    """
+    def decorator(fn):
+        if not ENABLED:
+            return fn
+        sid = section(name)
+
+        def wrapper(*args):
+            if not enabled:
+                return fn(*args)
+            start = ticks_us()
+            try:
+                return fn(*args)
+            finally:
+                record(sid, ticks_diff(ticks_us(), start))
+        return wrapper
+    return decorator
+
+def wrap_method(cls, attr, name):
+    """
+    Time a method of a class without editing the class, e.g.
+    wrap_method(SimplePWMMotor, "on", "motor_on").
+    """
+    setattr(cls, attr, timed(name)(getattr(cls, attr)))
+
+class Timer:
+    """
+    Context manager that times a block. Create it once and reuse it; it is
+    not re-entrant.
+
+        _t = Timer("render")
+        with _t:
+            ...
+    """
+    def __init__(self, name):
+        self.sid = section(name) if ENABLED else -1
+        self.start = 0
+
+    def __enter__(self):
+        if ENABLED and enabled:
+            self.start = ticks_us()
+        else:
+            self.start = -1
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.start != -1:
+            record(self.sid, ticks_diff(ticks_us(), self.start))
+        return False
+
+def stats(sid):
+    """
+    Summary of one section.
+
+    Returns:
+        tuple: (count, min_us, max_us, mean_us)
+    """
+    n = counts[sid]
+    if n == 0:
+        return 0, 0, 0, 0
+    return n, mins[sid], maxs[sid], (total_s[sid] * 1000000 + total_us[sid]) / n
+
+def metrics(prefix="smars"):
+    """
+    The measurements in Prometheus text exposition format.
+
+    Yields:
+        str: One line at a time, newline included
+    """
+    metric = prefix + "_section_duration_us"
+    yield "# HELP {} Duration of instrumented code sections.\n".format(metric)
+    yield "# TYPE {} histogram\n".format(metric)
+    for sid in range(len(names)):
+        label = 'section="{}"'.format(names[sid])
+        cumulative = 0
+        for bucket in range(_NBUCKETS):
+            cumulative += histogram[sid * _NBUCKETS + bucket]
+            le = str(BUCKETS[bucket]) if bucket < len(BUCKETS) else "+Inf"
+            yield '{}_bucket{{{},le="{}"}} {}\n'.format(metric, label, le, cumulative)
+        yield "{}_sum{{{}}} {}\n".format(metric, label, total_s[sid] * 1000000 + total_us[sid])
+        yield "{}_count{{{}}} {}\n".format(metric, label, counts[sid])
+    for kind, values in (("min", mins), ("max", maxs)):
+        yield "# TYPE {}_{} gauge\n".format(metric, kind)
+        for sid in range(len(names)):
+            value = values[sid] if counts[sid] else 0
+            yield '{}_{}{{section="{}"}} {}\n'.format(metric, kind, names[sid], value)
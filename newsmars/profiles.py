@@ -0,0 +1,206 @@
+import json
+from array import array
+
+# Robot profile: how this robot is wired and how its motors and servos
+# behave. Stored as JSON on flash; every key is optional and falls back to
+# DEFAULT, which matches a SMARS on the Simply Robotics board.
+#
+#   drive       which motors are the left and right track, and which
+#               direction letter drives each of them forward
+#   motors      per motor: trim (% of duty, evens out unequal motors) and
+#               deadband (% duty below which the motor doesn't turn;
+#               speeds 1-100 are spread over deadband-100). Optionally
+#               bands: [first speed, Hz, deadband] triples from
+#               host/calibrate_pwm.py, which replace pwm_bands and
+#               deadband for that motor (the deadband depends on Hz)
+#   pwm_bands   [first speed, Hz] pairs: PWM frequency per speed range
+#   motor_pins  [forward, reverse] GPIO per motor
+#   servo_pins  GPIO per servo
+#   servos      per servo: pulse length in uS at 0 and 180 degrees
+DEFAULT = {
+    "name": "smars",
+    "drive": {"left": 0, "right": 3, "left_forward": "r", "right_forward": "r"},
+    "motors": [{"trim": 100, "deadband": 0}] * 4,
+    "pwm_bands": [[0, 20], [15, 50], [20, 100]],
+    "motor_pins": [[2, 5], [4, 3], [6, 9], [8, 7]],
+    "servo_pins": [15, 14, 13, 12, 19, 18, 17, 16],
+    "servos": [{"min_us": 500, "max_us": 2500}] * 8,
+}
+
+MOTORS = 4
+SERVOS = 8
+# GPIOs brought out on the Pico
+MAX_PIN = 28
+
+def _reverse(direction):
+    return "f" if direction == "r" else "r"
+
+def validate(profile):
+    """
+    Check a profile (merged with DEFAULT).
+
+    Returns:
+        list: Problems as strings, empty if the profile is usable
+    """
+    errors = []
+    drive = profile["drive"]
+    for side in ("left", "right"):
+        if drive.get(side) not in range(MOTORS):
+            errors.append("drive.{} must be a motor 0-{}".format(side, MOTORS - 1))
+        if drive.get(side + "_forward") not in ("f", "r"):
+            errors.append("drive.{}_forward must be \"f\" or \"r\"".format(side))
+    if drive.get("left") == drive.get("right"):
+        errors.append("drive.left and drive.right are the same motor")
+
+    motors = profile["motors"]
+    if len(motors) != MOTORS:
+        errors.append("motors needs {} entries".format(MOTORS))
+    for i in range(min(len(motors), MOTORS)):
+        trim = motors[i].get("trim", 100)
+        deadband = motors[i].get("deadband", 0)
+        if not 0 < trim <= 100:
+            errors.append("motors[{}].trim must be 1-100".format(i))
+        if not 0 <= deadband < 100:
+            errors.append("motors[{}].deadband must be 0-99".format(i))
+        if "bands" in motors[i]:
+            _check_bands(errors, "motors[{}].bands".format(i), motors[i]["bands"], 3)
+
+    _check_bands(errors, "pwm_bands", profile["pwm_bands"], 2)
+
+    pins = []
+    if len(profile["motor_pins"]) != MOTORS:
+        errors.append("motor_pins needs {} pairs".format(MOTORS))
+    for pair in profile["motor_pins"]:
+        pins.extend(pair)
+    if len(profile["servo_pins"]) != SERVOS:
+        errors.append("servo_pins needs {} pins".format(SERVOS))
+    pins.extend(profile["servo_pins"])
+    seen = []
+    for pin in pins:
+        if pin not in range(MAX_PIN + 1):
+            errors.append("GP{} does not exist".format(pin))
+        elif pin in seen:
+            errors.append("GP{} is used twice".format(pin))
+        seen.append(pin)
+
+    servos = profile["servos"]
+    if len(servos) != SERVOS:
+        errors.append("servos needs {} entries".format(SERVOS))
+    for i in range(min(len(servos), SERVOS)):
+        low = servos[i].get("min_us", 500)
+        high = servos[i].get("max_us", 2500)
+        if not 500 <= low < high <= 2500:
+            errors.append("servos[{}] needs 500 <= min_us < max_us <= 2500".format(i))
+    return errors
+
+def _check_bands(errors, name, bands, size):
+    if not bands or bands[0][0] != 0:
+        errors.append("{} must start at speed 0".format(name))
+    for i in range(len(bands)):
+        band = bands[i]
+        # Frequencies go into 16-bit tables
+        if len(band) != size or not 10 <= band[1] <= 65535 or (size == 3 and not 0 <= band[2] < 100):
+            errors.append("{}[{}] must be [speed, 10-65535 Hz{}]".format(
+                name, i, ", deadband 0-99" if size == 3 else ""))
+        elif i and band[0] <= bands[i - 1][0]:
+            errors.append("{} must be in increasing speed order".format(name))
+
+class Profile:
+    """
+    A validated profile, turned into the tables the drivers use: per motor
+    a PWM frequency and a duty for every whole speed 0-100, direction pairs
+    for each drive action and pulse limits per servo. Built once at boot so
+    commanding a motor is two array lookups.
+    """
+    def __init__(self, profile):
+        self.name = profile["name"]
+        drive = profile["drive"]
+        self.left = drive["left"]
+        self.right = drive["right"]
+        left = drive["left_forward"]
+        right = drive["right_forward"]
+        # (left, right) motor directions per action
+        self.forward = (left, right)
+        self.reverse = (_reverse(left), _reverse(right))
+        self.turn_left = (left, _reverse(right))
+        self.turn_right = (_reverse(left), right)
+
+        self.motor_pins = [tuple(pair) for pair in profile["motor_pins"]]
+        self.servo_pins = list(profile["servo_pins"])
+        self.servo_limits = [(s.get("min_us", 500), s.get("max_us", 2500)) for s in profile["servos"]]
+
+        frequencies = frequency_table(profile["pwm_bands"])
+        self.frequencies = []
+        self.duties = []
+        for motor in profile["motors"]:
+            if "bands" in motor:
+                tables = band_tables(motor["bands"], motor.get("trim", 100))
+            else:
+                tables = (frequencies, duty_table(motor.get("trim", 100), motor.get("deadband", 0)))
+            self.frequencies.append(tables[0])
+            self.duties.append(tables[1])
+
+    def motor_tables(self):
+        return [(self.frequencies[i], self.duties[i]) for i in range(MOTORS)]
+
+def frequency_table(bands):
+    table = array("H", [0] * 101)
+    for speed in range(101):
+        for start, hz in bands:
+            if speed >= start:
+                table[speed] = hz
+    return table
+
+def _duty(speed, trim, deadband):
+    effective = deadband + (100 - deadband) * speed / 100
+    return int(effective * trim / 100 * 655.35)
+
+def duty_table(trim, deadband):
+    table = array("H", [0] * 101)
+    for speed in range(1, 101):
+        table[speed] = _duty(speed, trim, deadband)
+    return table
+
+def band_tables(bands, trim):
+    """Frequency and duty tables for [first speed, Hz, deadband] bands."""
+    frequencies = array("H", [0] * 101)
+    duties = array("H", [0] * 101)
+    for speed in range(101):
+        for start, hz, deadband in bands:
+            if speed >= start:
+                frequencies[speed] = hz
+                duties[speed] = _duty(speed, trim, deadband) if speed else 0
+    return frequencies, duties
+
+def merge(data):
+    """DEFAULT with the top-level keys of data replaced."""
+    profile = dict(DEFAULT)
+    profile.update(data)
+    return profile
+
+def load(path):
+    """
+    Read and validate a profile file.
+
+    Args:
+        path (str): JSON file on flash
+
+    Returns:
+        tuple: (Profile, errors); the default profile if the file is
+            missing, unreadable or invalid, with the reasons in errors
+    """
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except OSError:
+        return Profile(DEFAULT), []
+    except ValueError as e:
+        return Profile(DEFAULT), ["{}: {}".format(path, e)]
+    profile = merge(data)
+    try:
+        errors = validate(profile)
+    except (AttributeError, KeyError, TypeError) as e:
+        errors = ["{}: malformed profile ({})".format(path, e)]
+    if errors:
+        return Profile(DEFAULT), errors
+    return Profile(profile), []
@@ -29,6 +29,15 @@ class HCSR04:
         Returns:
             float: Distance in centimeters, or None if measurement failed
         """
+        self.ping()
+        return self.read_echo()
+
+    def ping(self):
+        """
+        Send the trigger pulse that starts a measurement.
+        The sound burst leaves the sensor right after this returns, so a
+        servo carrying the sensor may start moving before read_echo().
+        """
         # Clear trigger
         self.trigger.off()
         time.sleep_us(2)
@@ -37,7 +46,14 @@ class HCSR04:
         self.trigger.on()
         time.sleep_us(10)
         self.trigger.off()
+
+    def read_echo(self):
+        """
+        Wait for the echo of the last ping().
         
+        Returns:
+            float: Distance in centimeters, or None if measurement failed
+        """
         try:
             # Get pulse duration with timeout of 30ms
             duration = time_pulse_us(self.echo, 1, 30000)
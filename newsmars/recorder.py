@@ -0,0 +1,126 @@
+import struct
+import time
+
+# Session log: a header followed by fixed 8-byte records, little endian:
+#   t_ms    uint32  ticks_ms()
+#   kind    uint8   one of the REC_* values
+#   arg8    uint8
+#   arg16   uint16
+MAGIC = b"SMRC"
+VERSION = 1
+HEADER_FORMAT = "<4sBBH"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+RECORD_FORMAT = "<IBBH"
+RECORD_SIZE = struct.calcsize(RECORD_FORMAT)
+
+# arg8 = safety (0/1), arg16 = speed; written when recording starts
+REC_STATE = 0
+# arg16 = distance in mm, NO_DISTANCE if the sensor gave no reading
+REC_DISTANCE = 1
+# arg8 = index in ACTIONS, UNKNOWN_ACTION for anything else
+REC_ACTION = 2
+# arg8 = motor number, arg16 = direction code << 8 | speed
+REC_MOTOR = 3
+# Track speeds -100..100 as drive_tracks() got them, plus DRIVE_OFFSET:
+# arg8 = left, arg16 = right
+REC_DRIVE = 4
+DRIVE_OFFSET = 100
+
+NO_DISTANCE = 0xFFFF
+UNKNOWN_ACTION = 0xFF
+ACTIONS = ("forward", "reverse", "left", "right", "stop", "speed_up", "speed_down", "toggle_safety")
+DIRECTIONS = ("-", "f", "r")
+
+class Recorder:
+    """
+    Records sensor readings, incoming actions and motor outputs to a compact
+    binary log on flash, so a session can be replayed on the host.
+    Records are collected in a preallocated buffer and only written to
+    flash by flush(), which the main loop calls between requests.
+    """
+    def __init__(self, path, max_bytes=256 * 1024, buffer_records=64):
+        """
+        Start a new recording, replacing any previous one at path.
+
+        Args:
+            path (str): Log file on flash
+            max_bytes (int): Stop recording once the file reaches this size
+            buffer_records (int): Records held in RAM between flushes
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.buf = bytearray(buffer_records * RECORD_SIZE)
+        self.view = memoryview(self.buf)
+        self.used = 0
+        self.written = HEADER_SIZE
+        self.dropped = 0
+        self.codes = {}
+        for i in range(len(ACTIONS)):
+            self.codes[ACTIONS[i]] = i
+        self.direction_codes = {"-": 0, "f": 1, "r": 2}
+        with open(path, "wb") as f:
+            f.write(struct.pack(HEADER_FORMAT, MAGIC, VERSION, 0, 0))
+
+    def _add(self, kind, arg8, arg16):
+        if self.used + RECORD_SIZE > len(self.buf) or self.written + self.used >= self.max_bytes:
+            self.dropped += 1
+            return
+        struct.pack_into(RECORD_FORMAT, self.buf, self.used, time.ticks_ms(), kind, arg8, arg16)
+        self.used += RECORD_SIZE
+
+    def state(self, speed, safety):
+        self._add(REC_STATE, 1 if safety else 0, speed)
+
+    def distance(self, distance_cm):
+        if distance_cm is None:
+            self._add(REC_DISTANCE, 0, NO_DISTANCE)
+        else:
+            self._add(REC_DISTANCE, 0, min(int(distance_cm * 10), NO_DISTANCE - 1))
+
+    def action(self, name):
+        self._add(REC_ACTION, self.codes.get(name, UNKNOWN_ACTION), 0)
+
+    def drive(self, left, right):
+        self._add(REC_DRIVE, left + DRIVE_OFFSET, right + DRIVE_OFFSET)
+
+    def motor(self, number, motor):
+        self._add(REC_MOTOR, number, (self.direction_codes[motor.direction] << 8) | int(motor.speed))
+
+    def pending(self):
+        return self.used
+
+    def flush(self):
+        """
+        Append the buffered records to the log file.
+
+        Returns:
+            int: Number of bytes written
+        """
+        if self.used == 0:
+            return 0
+        with open(self.path, "ab") as f:
+            f.write(self.view[:self.used])
+        written = self.used
+        self.written += written
+        self.used = 0
+        return written
+
+def read_log(data):
+    """
+    Parse a session log.
+
+    Args:
+        data (bytes): Contents of a log file
+
+    Returns:
+        list: (t_ms, kind, arg8, arg16) tuples in recording order
+    """
+    magic, version, _, _ = struct.unpack_from(HEADER_FORMAT, data, 0)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("Not a session log")
+    records = []
+    pos = HEADER_SIZE
+    while pos + RECORD_SIZE <= len(data):
+        records.append(struct.unpack_from(RECORD_FORMAT, data, pos))
+        pos += RECORD_SIZE
+    return records
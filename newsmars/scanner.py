@@ -0,0 +1,186 @@
+import time
+from array import array
+
+# Range table value for angles without an echo (nothing within sensor range)
+NO_ECHO = 0xFFFF
+
+# Servo travel time model: a fixed settle time plus time per degree moved.
+# An SG90 turns about 60 degrees in 100 ms unloaded.
+SETTLE_MS = 5
+MS_PER_DEGREE = 2
+
+class Scanner:
+    """
+    HC-SR04 on a servo, sweeping back and forth over a range of angles.
+    Servo motion is pipelined with the pings: right after the trigger pulse
+    the servo is sent to the next angle, so the echo time overlaps the
+    servo travel. The echo is timed by the pin interrupts of a
+    sonar.SonarArray, so step() never waits, neither for the servo nor for
+    the echo; call it from the main loop, due_in() tells when it has work.
+    Angles are servo degrees; 90 is straight ahead.
+    """
+    def __init__(self, sonar, servo, min_angle=30, max_angle=150, step=15,
+                 settle_ms=SETTLE_MS, ms_per_degree=MS_PER_DEGREE):
+        """
+        Args:
+            sonar (SonarArray): The sensor mounted on the servo, alone in
+                its array with no guard time
+            servo (PWMServo): Servo carrying the sensor, e.g. robot.servos[0]
+            min_angle (int): First angle of a sweep (default: 30)
+            max_angle (int): Last angle of a sweep (default: 150)
+            step (int): Degrees between readings (default: 15); the sweep
+                needs at least two angles
+            settle_ms (int): Fixed settle time after every move
+            ms_per_degree (int): Servo travel time per degree
+        """
+        self.sonar = sonar
+        self.servo = servo
+        self.angles = array("h", range(min_angle, max_angle + 1, step))
+        self.ranges = array("H", [NO_ECHO] * len(self.angles))
+        self.settle_ms = settle_ms
+        self.ms_per_degree = ms_per_degree
+        self.index = 0
+        self.following = 0
+        self.direction = 1
+        # From the ping until its echo is collected; moved_ms is when the servo left
+        self.pinging = False
+        self.moved_ms = 0
+        self.sweeps = 0
+        self.sweep_ms = 0
+        self.last_angle = 90
+        self.last_distance = None
+        self.sweep_start = None
+        self.servo.goToPosition(self.angles[0])
+        self.ready_ms = time.ticks_add(time.ticks_ms(), self.travel_ms(180))
+
+    def travel_ms(self, degrees):
+        return self.settle_ms + degrees * self.ms_per_degree
+
+    def step(self, now):
+        """
+        Ping once the servo has settled, or collect the echo of the ping.
+
+        Args:
+            now (int): time.ticks_ms()
+
+        Returns:
+            bool: True if a reading was completed (see last_angle, last_distance)
+        """
+        index = self.index
+        if not self.pinging:
+            if time.ticks_diff(now, self.ready_ms) < 0:
+                return False
+            self.sonar.poll()
+            if not self.sonar.listening():
+                return False
+            following = index + self.direction
+            if following < 0 or following >= len(self.angles):
+                self.direction = -self.direction
+                following = index + self.direction
+            self.servo.goToPosition(self.angles[following])
+            self.moved_ms = time.ticks_ms()
+            self.ready_ms = time.ticks_add(self.moved_ms,
+                                           self.travel_ms(abs(self.angles[following] - self.angles[index])))
+            self.following = following
+            self.pinging = True
+            return False
+
+        if self.sonar.poll() is None:
+            return False
+        self.pinging = False
+        self.ranges[index] = self.sonar.ranges[0]
+        self.last_angle = self.angles[index]
+        self.last_distance = self.sonar.distance(0)
+        self.index = self.following
+        moved = self.moved_ms
+
+        # A reading at either end finishes one pass over all angles and starts the next
+        if index == 0 or index == len(self.angles) - 1:
+            if self.sweep_start is not None:
+                self.sweeps += 1
+                self.sweep_ms = time.ticks_diff(moved, self.sweep_start)
+            self.sweep_start = moved
+        return True
+
+    def sweep(self):
+        """
+        Block until a full pass over all angles is done.
+
+        Returns:
+            array: The range table, mm per angle in self.angles
+        """
+        sweeps = self.sweeps
+        while self.sweeps == sweeps:
+            wait = self.due_in(time.ticks_ms())
+            if wait > 0:
+                time.sleep_ms(wait)
+            self.step(time.ticks_ms())
+        return self.ranges
+
+    def due_in(self, now):
+        """
+        ms until step() has work, for the main loop's wait: the echo while
+        a ping is out, otherwise the servo settling.
+        """
+        if self.pinging:
+            return self.sonar.due_in()
+        wait = time.ticks_diff(self.ready_ms, now)
+        return wait if wait > 0 else 0
+
+    def range_at(self, angle):
+        """
+        Last distance measured at the table angle closest to angle.
+
+        Returns:
+            float: Distance in cm, None if there was no echo
+        """
+        best = 0
+        for i in range(len(self.angles)):
+            if abs(self.angles[i] - angle) < abs(self.angles[best] - angle):
+                best = i
+        value = self.ranges[best]
+        return None if value == NO_ECHO else value / 10
+
+    def nearest(self):
+        """
+        Closest reading in the table.
+
+        Returns:
+            tuple: (angle, distance in cm), or None if nothing echoed
+        """
+        best = -1
+        for i in range(len(self.ranges)):
+            if self.ranges[i] != NO_ECHO and (best < 0 or self.ranges[i] < self.ranges[best]):
+                best = i
+        if best < 0:
+            return None
+        return self.angles[best], self.ranges[best] / 10
+
+    def widest_free(self, clear_cm):
+        """
+        Widest run of neighbouring angles that are all at least clear_cm free.
+
+        Args:
+            clear_cm (float): Distance that counts as free
+
+        Returns:
+            tuple: (centre angle, width in degrees), or None if nothing is free
+        """
+        clear_mm = int(clear_cm * 10)
+        best_start = -1
+        best_len = 0
+        start = -1
+        for i in range(len(self.ranges) + 1):
+            free = i < len(self.ranges) and self.ranges[i] >= clear_mm
+            if free and start < 0:
+                start = i
+            elif not free and start >= 0:
+                if i - start > best_len:
+                    best_start = start
+                    best_len = i - start
+                start = -1
+        if best_start < 0:
+            return None
+        first = self.angles[best_start]
+        last = self.angles[best_start + best_len - 1]
+        return (first + last) // 2, last - first
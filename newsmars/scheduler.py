@@ -0,0 +1,135 @@
+import time
+
+# Timed drive and servo steps from /api/batch, run by the control loop.
+# A step is [at_ms, "drive", left, right] or [at_ms, "servo", servo, angle],
+# at_ms counted from the start of the batch.
+
+DRIVE = 0
+SERVO = 1
+MAX_STEPS = 32
+MAX_AT_MS = 60000
+
+_KINDS = {"drive": DRIVE, "servo": SERVO}
+
+def _is_int(value, low, high):
+    # bool is an int subclass, but true/false are no speeds or angles
+    return isinstance(value, int) and not isinstance(value, bool) and low <= value <= high
+
+def check_step(step, last_at, servos):
+    """
+    What is wrong with one step, or None.
+
+    Args:
+        step: Decoded JSON value
+        last_at (int): at_ms of the step before it
+        servos (tuple): Servo numbers steps may use
+    """
+    if not isinstance(step, list) or len(step) != 4:
+        return "expected [at_ms, kind, a, b]"
+    at, kind, a, b = step
+    if not _is_int(at, last_at, MAX_AT_MS):
+        return "at_ms must be {}..{} and not decrease".format(last_at, MAX_AT_MS)
+    if kind not in _KINDS:
+        return "kind must be drive or servo"
+    if _KINDS[kind] == DRIVE:
+        if not _is_int(a, -100, 100) or not _is_int(b, -100, 100):
+            return "track speeds must be -100..100"
+    elif not _is_int(a, 0, 7) or a not in servos:
+        return "servo {} is not free".format(a)
+    elif not _is_int(b, 0, 180):
+        return "angle must be 0..180"
+    return None
+
+class Batch:
+    """
+    One batch of steps. The steps go into lists allocated once, so only
+    parsing the request allocates. next_step() hands out the steps that are
+    due, in order; the caller runs them. Every step is timed from the start
+    of the batch, so a late control tick does not delay the steps after it.
+    """
+    def __init__(self, max_steps=MAX_STEPS):
+        self.at = [0] * max_steps
+        self.kind = [0] * max_steps
+        self.a = [0] * max_steps
+        self.b = [0] * max_steps
+        self.count = 0
+        self.next = 0
+        self.start = None
+        self.loaded = 0
+        self.cancelled = 0
+
+    def load(self, steps, now, servos=()):
+        """
+        Replace the batch with steps and start it at now.
+
+        Args:
+            steps (list): Decoded JSON list of steps
+            now (int): ticks_ms() the batch starts at; a later one delays the first step
+            servos (tuple): Servo numbers steps may use
+
+        Returns:
+            str: What is wrong with steps (nothing is loaded), or None
+        """
+        self.cancel()
+        if not isinstance(steps, list) or not steps:
+            return "steps must be a non-empty list"
+        if len(steps) > len(self.at):
+            return "at most {} steps".format(len(self.at))
+        last_at = 0
+        for i in range(len(steps)):
+            error = check_step(steps[i], last_at, servos)
+            if error:
+                return "step {}: {}".format(i, error)
+            last_at = steps[i][0]
+
+        for i in range(len(steps)):
+            at, kind, a, b = steps[i]
+            self.at[i] = at
+            self.kind[i] = _KINDS[kind]
+            self.a[i] = a
+            self.b[i] = b
+        self.count = len(steps)
+        self.next = 0
+        self.start = now
+        self.loaded += 1
+        return None
+
+    def running(self):
+        return self.start is not None
+
+    def duration_ms(self):
+        return self.at[self.count - 1] if self.count else 0
+
+    def next_step(self, now):
+        """
+        Index of the next step if it is due, else -1.
+
+        Args:
+            now (int): ticks_ms()
+        """
+        if self.start is None:
+            return -1
+        i = self.next
+        if time.ticks_diff(now, time.ticks_add(self.start, self.at[i])) < 0:
+            return -1
+        self.next = i + 1
+        if self.next >= self.count:
+            self.start = None
+        return i
+
+    def due_in(self, now):
+        """
+        ms until the next step is due, 0 if it is already; None when not running.
+
+        Args:
+            now (int): ticks_ms()
+        """
+        if self.start is None:
+            return None
+        return max(0, time.ticks_diff(time.ticks_add(self.start, self.at[self.next]), now))
+
+    def cancel(self):
+        """Stop handing out steps; the motors keep what the last step set."""
+        if self.start is not None:
+            self.start = None
+            self.cancelled += 1
@@ -4,6 +4,10 @@
 WIFI_SSID = "Your_Network_Name"
 WIFI_PASSWORD = "Your_WiFi_Password"
 
+# Key for over-the-air updates (OTA_ENABLED in main.py), the same as
+# host/ota_push.py --key. Without it the robot refuses every update.
+# OTA_KEY = "a long random string"
+
 # Example:
 # WIFI_SSID = "MyHomeWiFi"
 # WIFI_PASSWORD = "MySecretPassword123"
@@ -0,0 +1,212 @@
+import time
+from array import array
+from machine import Pin
+from scanner import NO_ECHO
+
+# Several HC-SR04s taking turns. Sensors are fired a group at a time: the
+# sensors in a group look in different directions and may ping together,
+# the groups take turns so sensors that could hear each other never listen
+# at the same time. Every sensor in its own group is plain round-robin.
+#
+# The echoes are timed by pin interrupts, so poll() never waits for one:
+# it fires the next group once every echo of the current group is in (or
+# timed out) and guard_ms has passed for the last sound to die down.
+
+# ns of echo per mm of distance, there and back at 343 m/s
+NS_PER_MM = 5831
+# From trigger to the echo pin going high: the burst of eight 40 kHz cycles
+BURST_US = 500
+# An HC-SR04 that hears nothing keeps its echo pin high this long; it
+# cannot be fired again before that
+HOLD_US = 40000
+
+def check_pins(sensors, motor_pins, servo_pins, servos_in_use=(), max_pin=28):
+    """
+    Check that the sensors' pins are free on the Simply Robotics board: not
+    a motor output (they drive the motor driver whether the motor is used
+    or not), not the pin of a servo in use, and not used twice.
+
+    Args:
+        sensors (list): (name, trigger pin, echo pin, ...) per sensor
+        motor_pins (list): (forward, reverse) per motor, e.g. robot.motorPins
+        servo_pins (list): Pin per servo, e.g. robot.servoPins
+        servos_in_use (tuple): Indices of the servos the program drives
+
+    Returns:
+        list: Problems as strings, empty if the pins are usable
+    """
+    owner = {}
+    for i in range(len(motor_pins)):
+        for pin in motor_pins[i]:
+            owner[pin] = "motor {}".format(i)
+    for i in servos_in_use:
+        owner[servo_pins[i]] = "servo {}".format(i)
+    errors = []
+    for sensor in sensors:
+        name = sensor[0]
+        for role, pin in (("trigger", sensor[1]), ("echo", sensor[2])):
+            if pin not in range(max_pin + 1):
+                errors.append("{} {}: GP{} does not exist".format(name, role, pin))
+            elif pin in owner:
+                errors.append("{} {}: GP{} is used by {}".format(name, role, pin, owner[pin]))
+            else:
+                owner[pin] = name
+    return errors
+
+class SonarArray:
+    """
+    HC-SR04s fired in turns by group, with the latest reading of every
+    sensor in ranges (mm, NO_ECHO if nothing within max_cm). Call poll()
+    from the main loop; it returns at once.
+    """
+    def __init__(self, sensors, max_cm=200, guard_ms=25):
+        """
+        Args:
+            sensors (list): (name, trigger pin, echo pin, angle, group) per
+                sensor. angle is in servo degrees, 90 is straight ahead;
+                sensors with the same group ping together
+            max_cm (int): Echoes from further away count as no echo; also
+                how long poll() waits for an echo
+            guard_ms (int): Quiet time after a group before the next one
+        """
+        count = len(sensors)
+        self.names = [s[0] for s in sensors]
+        self.angles = array("h", [s[3] for s in sensors])
+        self.triggers = [Pin(s[1], Pin.OUT, value=0) for s in sensors]
+        self.echoes = [Pin(s[2], Pin.IN) for s in sensors]
+        self.groups = []
+        labels = []
+        for i in range(count):
+            if sensors[i][4] in labels:
+                self.groups[labels.index(sensors[i][4])].append(i)
+            else:
+                labels.append(sensors[i][4])
+                self.groups.append([i])
+        self.ranges = array("H", [NO_ECHO] * count)
+        # ticks_ms of every sensor's last reading, and readings per sensor
+        self.updated = array("i", [0] * count)
+        self.counts = array("I", [0] * count)
+        self.samples = 0
+        self.max_mm = max_cm * 10
+        self.timeout_us = BURST_US + self.max_mm * NS_PER_MM // 1000
+        self.guard_us = guard_ms * 1000
+        # Written by the echo interrupts: edge times, and 1 after the rising
+        # edge of the current ping, 2 once the falling edge followed
+        self._rise = array("i", [0] * count)
+        self._fall = array("i", [0] * count)
+        self._seen = bytearray(count)
+        self._group = 0
+        self._fired = None
+        self._next_us = time.ticks_us()
+        for i in range(count):
+            self.echoes[i].irq(self._edge(i), Pin.IRQ_RISING | Pin.IRQ_FALLING, hard=True)
+
+    def _edge(self, i):
+        rise = self._rise
+        fall = self._fall
+        seen = self._seen
+
+        # Hard interrupt: no allocation, ticks are small ints
+        def edge(pin):
+            if pin.value():
+                rise[i] = time.ticks_us()
+                seen[i] = 1
+            elif seen[i] == 1:
+                fall[i] = time.ticks_us()
+                seen[i] = 2
+        return edge
+
+    def poll(self):
+        """
+        Fire the next group when it is due and collect the echoes of the
+        current one.
+
+        Returns:
+            list: Indices of the sensors with a new reading, None if none
+        """
+        now = time.ticks_us()
+        group = self.groups[self._group]
+        if self._fired is None:
+            if time.ticks_diff(now, self._next_us) < 0:
+                return None
+            # A sensor still listening to its previous ping would ignore the trigger
+            for i in group:
+                if self.echoes[i].value() and time.ticks_diff(now, self._next_us) < HOLD_US:
+                    return None
+            for i in group:
+                self._seen[i] = 0
+                self.triggers[i].on()
+            time.sleep_us(10)
+            for i in group:
+                self.triggers[i].off()
+            self._fired = time.ticks_us()
+            return None
+
+        waited = time.ticks_diff(now, self._fired)
+        if waited < self.timeout_us:
+            for i in group:
+                if self._seen[i] != 2:
+                    return None
+        ms = time.ticks_ms()
+        for i in group:
+            mm = NO_ECHO
+            if self._seen[i] == 2:
+                mm = time.ticks_diff(self._fall[i], self._rise[i]) * 1000 // NS_PER_MM
+                if mm > self.max_mm:
+                    mm = NO_ECHO
+            self.ranges[i] = mm
+            self.updated[i] = ms
+            self.counts[i] += 1
+        self.samples += len(group)
+        self._fired = None
+        self._next_us = time.ticks_add(now, self.guard_us)
+        self._group = (self._group + 1) % len(self.groups)
+        return group
+
+    def listening(self):
+        """True from firing a group until poll() has collected its echoes."""
+        return self._fired is not None
+
+    def due_in(self):
+        """
+        ms until poll() has work, for the main loop's wait: the end of the
+        guard time, or when the echoes are expected from the group's last
+        readings. At least 1 while echoes are outstanding.
+        """
+        now = time.ticks_us()
+        if self._fired is None:
+            wait = time.ticks_diff(self._next_us, now)
+            return (wait + 999) // 1000 if wait > 0 else 0
+        expected = BURST_US
+        for i in self.groups[self._group]:
+            mm = self.ranges[i]
+            echo = self.timeout_us if mm == NO_ECHO else BURST_US + mm * NS_PER_MM // 1000
+            if echo > expected:
+                expected = echo
+        wait = time.ticks_diff(time.ticks_add(self._fired, expected), now)
+        return wait // 1000 + 1 if wait > 0 else 1
+
+    def distance(self, i):
+        """
+        Latest reading of sensor i.
+
+        Returns:
+            float: Distance in cm, None if there was no echo
+        """
+        value = self.ranges[i]
+        return None if value == NO_ECHO else value / 10
+
+    def nearest(self):
+        """
+        Closest latest reading over all sensors.
+
+        Returns:
+            tuple: (sensor name, distance in cm), or None if nothing echoed
+        """
+        best = -1
+        for i in range(len(self.ranges)):
+            if self.ranges[i] != NO_ECHO and (best < 0 or self.ranges[i] < self.ranges[best]):
+                best = i
+        if best < 0:
+            return None
+        return self.names[best], self.ranges[best] / 10
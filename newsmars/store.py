@@ -0,0 +1,174 @@
+import binascii
+import json
+import os
+import struct
+import time
+
+# Key-value store on flash for what has to survive a reset. Changes are kept
+# in RAM and written together by flush(), as one record appended to a log;
+# once the log would grow past max_bytes it is compacted: all values go into
+# a single record in a new file, which is renamed over the log. When the
+# values alone come near max_bytes, the limit is twice the last compacted
+# record instead, so a compaction always leaves room for appends rather than
+# rewriting every value at every flush. Opening the store reads the whole
+# log in one go.
+#
+# Record, little endian:
+#   length  uint16  bytes of the payload
+#   crc     uint32  CRC-32 of the payload
+#   payload         JSON object with the keys that changed
+# A record that is cut short or fails its CRC (a reset while appending) ends
+# the log; the next flush() compacts it away before appending anything.
+
+HEADER_FORMAT = "<HI"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+MAX_PAYLOAD = 0xFFFF
+
+_MISSING = object()
+
+class Store:
+    """
+    Values by key, restored from the log when the store is opened. set()
+    only changes RAM; flush() writes what changed since the last flush as
+    one record, at most once per flush_ms when given the time, so a burst
+    of changes costs one write. With path None nothing is written.
+    """
+    def __init__(self, path, max_bytes=512, flush_ms=2000):
+        """
+        Args:
+            path (str): Log file on flash, or None to keep the values in RAM only
+            max_bytes (int): Compact the log instead of growing it past this
+                size, or past twice the last compacted record if that is larger
+            flush_ms (int): How long flush(now) leaves a change in RAM
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.flush_ms = flush_ms
+        self.values = {}
+        self.dirty = []
+        self.dirty_since = None
+        # Bytes of valid records in the log, and whether garbage follows them
+        self.size = 0
+        # Bytes of the record the last compaction wrote, the first one in the log
+        self.compacted = 0
+        self.damaged = False
+        self.records = 0
+        self.appends = 0
+        self.compactions = 0
+        self.bytes_written = 0
+        if path:
+            self._read()
+
+    def _read(self):
+        try:
+            with open(self.path, "rb") as f:
+                data = f.read()
+        except OSError:
+            return
+        view = memoryview(data)
+        pos = 0
+        while pos + HEADER_SIZE <= len(data):
+            length, crc = struct.unpack_from(HEADER_FORMAT, data, pos)
+            end = pos + HEADER_SIZE + length
+            if end > len(data) or binascii.crc32(view[pos + HEADER_SIZE:end]) & 0xFFFFFFFF != crc:
+                break
+            try:
+                self.values.update(json.loads(data[pos + HEADER_SIZE:end]))
+            except (ValueError, TypeError):
+                break
+            if not self.records:
+                self.compacted = end
+            self.records += 1
+            pos = end
+        self.size = pos
+        self.damaged = pos != len(data)
+
+    def get(self, key, default=None):
+        return self.values.get(key, default)
+
+    def set(self, key, value):
+        """Change a value in RAM; it is written by the next flush()."""
+        if self.values.get(key, _MISSING) == value:
+            return
+        self.values[key] = value
+        if key not in self.dirty:
+            self.dirty.append(key)
+
+    def flush(self, now=None):
+        """
+        Write the changed values. With now (ticks_ms), only once flush_ms
+        has passed since the first call that found them, so a burst of
+        changes becomes one record; without, at once (before a reset).
+        Returns True if a record was written.
+        """
+        if not self.dirty:
+            return False
+        if now is not None:
+            if self.dirty_since is None:
+                self.dirty_since = now
+            if time.ticks_diff(now, self.dirty_since) < self.flush_ms:
+                return False
+        if self.path:
+            changed = {}
+            for key in self.dirty:
+                changed[key] = self.values[key]
+            payload = json.dumps(changed).encode()
+            try:
+                limit = max(self.max_bytes, 2 * self.compacted)
+                if self.damaged or self.size + HEADER_SIZE + len(payload) > limit:
+                    self.compact()
+                else:
+                    self._append(payload)
+            except OSError:
+                # Try again after flush_ms; whatever reached flash is dropped by the next compact()
+                self.damaged = True
+                self.dirty_since = now
+                raise
+        self.dirty = []
+        self.dirty_since = None
+        return True
+
+    def _record(self, payload):
+        if len(payload) > MAX_PAYLOAD:
+            raise ValueError("record too large")
+        return struct.pack(HEADER_FORMAT, len(payload), binascii.crc32(payload) & 0xFFFFFFFF) + payload
+
+    def _append(self, payload):
+        record = self._record(payload)
+        with open(self.path, "ab") as f:
+            f.write(record)
+        self.size += len(record)
+        self.records += 1
+        self.appends += 1
+        self.bytes_written += len(record)
+
+    def compact(self):
+        """Replace the log by one record with every value; a reset halfway leaves the old log."""
+        record = self._record(json.dumps(self.values).encode())
+        tmp = self.path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(record)
+        os.rename(tmp, self.path)
+        self.size = len(record)
+        self.compacted = len(record)
+        self.damaged = False
+        self.records = 1
+        self.compactions += 1
+        self.bytes_written += len(record)
+
+    def take_file(self, key, path):
+        """
+        Move a JSON file into key: the file is removed once its contents are
+        safely in the log. For files copied to the robot by hand or left by
+        an older version. Returns True if there was one.
+        """
+        try:
+            with open(path) as f:
+                value = json.load(f)
+        except (OSError, ValueError):
+            return False
+        self.set(key, value)
+        self.flush()
+        if self.path:
+            os.remove(path)
+        return True
@@ -0,0 +1,152 @@
+import socket
+import struct
+import time
+
+# One sample, 16 bytes, little endian:
+#   t_ms         uint32  ticks_ms() when sampled
+#   seq          uint16  sample number, wraps
+#   left_dir     int8    1 = "f", -1 = "r", 0 = off
+#   left_speed   uint8   0-100
+#   right_dir    int8
+#   right_speed  uint8
+#   distance_mm  uint16  NO_DISTANCE if the sensor gave no reading
+#   loop_us      uint16  duration of the last main loop iteration, capped
+#   cmd_us       uint16  request-to-motor time of the last command, capped
+RECORD_FORMAT = "<IHbBbBHHH"
+RECORD_SIZE = struct.calcsize(RECORD_FORMAT)
+FIELDS = ("t_ms", "seq", "left_dir", "left_speed", "right_dir", "right_speed",
+          "distance_mm", "loop_us", "cmd_us")
+
+# Datagram header: magic, version, number of records, seq of the first
+# record, total records dropped because the buffer overflowed
+HEADER_FORMAT = "<2sBBHI"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+MAGIC = b"TM"
+VERSION = 1
+
+NO_DISTANCE = 0xFFFF
+_CAP = 0xFFFF
+_DIRECTIONS = {"f": 1, "r": -1, "-": 0}
+
+def decode(data):
+    """
+    Split a datagram back into records.
+
+    Args:
+        data (bytes): One datagram as sent by Telemetry.send()
+
+    Returns:
+        tuple: (first_seq, dropped, list of record tuples)
+    """
+    magic, version, count, first_seq, dropped = struct.unpack_from(HEADER_FORMAT, data, 0)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("Not a telemetry datagram")
+    records = [struct.unpack_from(RECORD_FORMAT, data, HEADER_SIZE + i * RECORD_SIZE)
+               for i in range(count)]
+    return first_seq, dropped, records
+
+class Telemetry:
+    """
+    Samples robot state into fixed-size packed records in a preallocated ring
+    buffer and streams them in batches as UDP datagrams.
+    """
+    def __init__(self, capacity=128, batch=32):
+        """
+        Initialize the telemetry buffer.
+
+        Args:
+            capacity (int): Number of records kept while waiting to be sent
+            batch (int): Maximum number of records per datagram (max 255)
+        """
+        self.capacity = capacity
+        self.batch = batch
+        self.ring = bytearray(capacity * RECORD_SIZE)
+        self.ring_view = memoryview(self.ring)
+        self.packet = bytearray(HEADER_SIZE + batch * RECORD_SIZE)
+        self.packet_view = memoryview(self.packet)
+        self.head = 0       # slot the next record goes into
+        self.pending = 0    # records not sent yet
+        self.seq = 0
+        self.dropped = 0
+        self.sock = None
+        self.addr = None
+
+    def start_udp(self, host, port):
+        """
+        Stream batches to a collector.
+
+        Args:
+            host (str): IP address of the collector
+            port (int): UDP port of the collector
+        """
+        self.addr = socket.getaddrinfo(host, port)[0][-1]
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setblocking(False)
+
+    def record(self, left, right, distance_cm, loop_us, cmd_us):
+        """
+        Store one sample, overwriting the oldest unsent one when full.
+
+        Args:
+            left: Left SimplePWMMotor
+            right: Right SimplePWMMotor
+            distance_cm (float): Last distance reading, or None
+            loop_us (int): Duration of the last loop iteration
+            cmd_us (int): Request-to-motor time of the last command
+        """
+        if distance_cm is None:
+            distance_mm = NO_DISTANCE
+        else:
+            distance_mm = min(int(distance_cm * 10), NO_DISTANCE - 1)
+        struct.pack_into(RECORD_FORMAT, self.ring, self.head * RECORD_SIZE,
+                         time.ticks_ms(), self.seq,
+                         _DIRECTIONS[left.direction], left.speed,
+                         _DIRECTIONS[right.direction], right.speed,
+                         distance_mm, min(loop_us, _CAP), min(cmd_us, _CAP))
+        self.seq = (self.seq + 1) & 0xFFFF
+        self.head = (self.head + 1) % self.capacity
+        if self.pending == self.capacity:
+            self.dropped += 1
+        else:
+            self.pending += 1
+
+    def pack_batch(self):
+        """
+        Move up to one batch of the oldest pending records into the packet buffer.
+
+        Returns:
+            int: Number of bytes of self.packet in use, 0 if nothing was pending
+        """
+        count = min(self.pending, self.batch)
+        if count == 0:
+            return 0
+        first = (self.head - self.pending) % self.capacity
+        first_seq = (self.seq - self.pending) & 0xFFFF
+        struct.pack_into(HEADER_FORMAT, self.packet, 0, MAGIC, VERSION, count, first_seq, self.dropped)
+        pos = HEADER_SIZE
+        for n in range(count):
+            start = ((first + n) % self.capacity) * RECORD_SIZE
+            self.packet_view[pos:pos + RECORD_SIZE] = self.ring_view[start:start + RECORD_SIZE]
+            pos += RECORD_SIZE
+        self.pending -= count
+        return pos
+
+    def send(self):
+        """
+        Send every pending record, one datagram per batch. Never blocks; a
+        datagram the network stack will not take right now is dropped.
+
+        Returns:
+            int: Number of datagrams sent
+        """
+        if self.sock is None:
+            return 0
+        sent = 0
+        while self.pending:
+            length = self.pack_batch()
+            try:
+                self.sock.sendto(self.packet_view[:length], self.addr)
+                sent += 1
+            except OSError:
+                pass
+        return sent
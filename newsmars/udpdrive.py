@@ -0,0 +1,201 @@
+import socket
+import struct
+import time
+
+# Drive command, one per datagram, 12 bytes, little endian:
+#   magic     2s      b"DR"
+#   seq       uint16  command number, wraps; only newer commands are applied
+#   left      int8    -100..100, left track speed, positive drives forward
+#   right     int8    -100..100, right track speed
+#   lease_ms  uint16  stop the motors this long after the command unless a
+#                     newer one arrives; capped at MAX_LEASE_MS
+#   flags     uint8   FLAG_REPLY: answer with a status datagram
+#   reserved  uint8   0
+#   check     uint16  fletcher16() of the first 10 bytes
+COMMAND_FORMAT = "<2sHbbHBBH"
+COMMAND_SIZE = struct.calcsize(COMMAND_FORMAT)
+COMMAND_MAGIC = b"DR"
+
+# Status reply, 14 bytes, little endian:
+#   magic        2s      b"DS"
+#   seq          uint16  seq of the command answered
+#   last_seq     uint16  newest command applied so far
+#   result       uint8   one of the RESULT_* values
+#   safety       uint8   1 while safety blocks movement
+#   left, right  int8    track speeds now applied
+#   distance_mm  uint16  last distance reading, NO_DISTANCE if none
+#   check        uint16  fletcher16() of the first 12 bytes
+STATUS_FORMAT = "<2sHHBBbbHH"
+STATUS_SIZE = struct.calcsize(STATUS_FORMAT)
+STATUS_MAGIC = b"DS"
+
+FLAG_REPLY = 1
+RESULT_OK = 0
+RESULT_BLOCKED = 1     # safety is on, the motors were not started
+RESULT_STALE = 2       # seq not newer than the last applied command
+
+NO_DISTANCE = 0xFFFF
+MAX_LEASE_MS = 1000
+# After this long without a command any seq is accepted, so a restarted client can start at 0
+RESET_MS = 2000
+
+def fletcher16(data, length):
+    """Fletcher-16 checksum of data[:length]; catches swapped and zeroed bytes a plain sum misses."""
+    a = 0
+    b = 0
+    for i in range(length):
+        a = (a + data[i]) % 255
+        b = (b + a) % 255
+    return (b << 8) | a
+
+def newer(seq, last):
+    """Is seq after last, allowing for wrap-around?"""
+    return 0 < ((seq - last) & 0xFFFF) < 0x8000
+
+def pack_command(buf, seq, left, right, lease_ms, flags=0):
+    """Fill buf (COMMAND_SIZE bytes) with a command datagram."""
+    struct.pack_into(COMMAND_FORMAT, buf, 0, COMMAND_MAGIC, seq & 0xFFFF, left, right,
+                     lease_ms, flags, 0, 0)
+    struct.pack_into("<H", buf, COMMAND_SIZE - 2, fletcher16(buf, COMMAND_SIZE - 2))
+
+def unpack_status(data):
+    """
+    Parse a status reply.
+
+    Returns:
+        tuple: (seq, last_seq, result, safety, left, right, distance_mm), or
+            None if data is not a valid status datagram
+    """
+    if len(data) != STATUS_SIZE:
+        return None
+    fields = struct.unpack(STATUS_FORMAT, data)
+    if fields[0] != STATUS_MAGIC or fields[-1] != fletcher16(data, STATUS_SIZE - 2):
+        return None
+    return fields[1:-1]
+
+class DriveServer:
+    """
+    Receives drive commands on a UDP port. receive() drains every queued
+    datagram and keeps only the newest valid command, so a burst is applied
+    once; the caller applies it and may answer with reply(). A command
+    holds the motors for its lease; expired() tells the control loop when
+    to stop them. MicroPython sockets have no recvfrom_into(), so every
+    datagram costs a small allocation; replies reuse one buffer.
+    """
+    def __init__(self, port, reset_ms=RESET_MS):
+        """
+        Args:
+            port (int): UDP port to listen on
+            reset_ms (int): Silence after which any seq is accepted again
+        """
+        self.port = port
+        self.reset_ms = reset_ms
+        self.sock = None
+        self.status = bytearray(STATUS_SIZE)
+        self.seq = 0
+        self.last_ms = None
+        self.left = 0
+        self.right = 0
+        self.lease_until = None
+        # Where the newest command came from, if it asked for a reply
+        self.reply_to = None
+        self.reply_seq = 0
+        self.received = 0
+        self.applied = 0
+        self.stale = 0
+        self.bad = 0
+
+    def start(self, ip="0.0.0.0"):
+        addr = socket.getaddrinfo(ip, self.port)[0][-1]
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(addr)
+        self.sock.setblocking(False)
+
+    def close(self):
+        if self.sock:
+            self.sock.close()
+            self.sock = None
+
+    def receive(self, now):
+        """
+        Read every queued datagram.
+
+        Args:
+            now (int): ticks_ms()
+
+        Returns:
+            int: RESULT_OK if a newer command was accepted (left, right and
+                the lease are updated), RESULT_STALE if only old or
+                duplicate commands arrived, -1 if nothing valid arrived
+        """
+        result = -1
+        self.reply_to = None
+        while True:
+            try:
+                data, addr = self.sock.recvfrom(COMMAND_SIZE + 1)
+            except OSError:
+                break
+            self.received += 1
+            if len(data) != COMMAND_SIZE:
+                self.bad += 1
+                continue
+            magic, seq, left, right, lease_ms, flags, _, check = struct.unpack(COMMAND_FORMAT, data)
+            if (magic != COMMAND_MAGIC or check != fletcher16(data, COMMAND_SIZE - 2)
+                    or not -100 <= left <= 100 or not -100 <= right <= 100):
+                self.bad += 1
+                continue
+            fresh = self.last_ms is None or time.ticks_diff(now, self.last_ms) >= self.reset_ms
+            if not fresh and not newer(seq, self.seq):
+                self.stale += 1
+                if result < 0:
+                    result = RESULT_STALE
+                    self.reply_to = addr if flags & FLAG_REPLY else None
+                    self.reply_seq = seq
+                continue
+            self.seq = seq
+            self.last_ms = now
+            self.left = left
+            self.right = right
+            self.lease_until = time.ticks_add(now, min(lease_ms, MAX_LEASE_MS))
+            self.reply_to = addr if flags & FLAG_REPLY else None
+            self.reply_seq = seq
+            result = RESULT_OK
+        if result == RESULT_OK:
+            self.applied += 1
+        return result
+
+    def expired(self, now):
+        """True once when the lease of the last command has run out."""
+        if self.lease_until is None or time.ticks_diff(now, self.lease_until) < 0:
+            return False
+        self.lease_until = None
+        self.left = 0
+        self.right = 0
+        return True
+
+    def reply(self, result, safety, left, right, distance_cm):
+        """
+        Answer the newest command if it asked for a reply; never blocks.
+
+        Args:
+            result (int): RESULT_* value
+            safety (bool): Safety blocks movement
+            left (int): Left track speed now applied, -100..100
+            right (int): Right track speed now applied
+            distance_cm (float): Last distance reading, or None
+        """
+        if self.reply_to is None:
+            return
+        if distance_cm is None:
+            distance_mm = NO_DISTANCE
+        else:
+            distance_mm = min(int(distance_cm * 10), NO_DISTANCE - 1)
+        struct.pack_into(STATUS_FORMAT, self.status, 0, STATUS_MAGIC, self.reply_seq, self.seq,
+                         result, 1 if safety else 0, left, right, distance_mm, 0)
+        struct.pack_into("<H", self.status, STATUS_SIZE - 2, fletcher16(self.status, STATUS_SIZE - 2))
+        try:
+            self.sock.sendto(self.status, self.reply_to)
+        except OSError:
+            pass
+        self.reply_to = None